@@ -4,6 +4,7 @@
 
 import collections
 import functools
+import hashlib
 import logging
 
 from google.appengine.ext import ndb
@@ -20,7 +21,7 @@ from proto import common_pb2
 from proto import build_pb2  # pylint: disable=unused-import
 from proto import rpc_pb2  # pylint: disable=unused-import
 from proto import rpc_prpc_pb2
-from proto import step_pb2  # pylint: disable=unused-import
+from proto import step_pb2
 
 import buildtags
 import config
@@ -39,6 +40,13 @@ import validation
 # Lowercase because metadata is stored in lowercase.
 BUILD_TOKEN_HEADER = 'x-build-token'
 
+# Expiration of serialized build_pb2.Build messages cached in memcache.
+BUILD_PROTO_CACHE_EXPIRATION_SEC = 10 * 60
+
+# Serialized build_pb2.Build messages larger than this are not cached.
+# Memcache values are limited to 1MB.
+MAX_CACHED_BUILD_PROTO_SIZE = 512 * 1024
+
 
 class StatusError(errors.Error):
 
@@ -131,26 +139,118 @@ def bucket_id_string(builder_id):
   return config.format_bucket_id(builder_id.project, builder_id.bucket)
 
 
+@ndb.tasklet
 def builds_to_protos_async(builds, build_mask=None):
   """Converts model.Build instances to build_pb2.Build messages.
 
   Like model.builds_to_protos_async, but accepts a build mask and mutates
   model.Build entities in addition to build_pb2.Build.
+
+  Serialized build_pb2.Build messages are cached in memcache, keyed by build
+  version and build_mask, see _build_proto_cache_key.
   """
+  ctx = ndb.get_context()
+  mask_fingerprint = _mask_fingerprint(build_mask)
+  # Compute cache keys before trimming, since trimming may remove
+  # proto.update_time.
+  cache_keys = [_build_proto_cache_key(b, mask_fingerprint) for b, _ in builds]
+  cached = yield [ctx.memcache_get(k) for k in cache_keys]
+
+  misses = []
+  miss_cache_keys = []
+  for (b, dest), cache_key, serialized in zip(builds, cache_keys, cached):
+    if serialized is None:
+      misses.append((b, dest))
+      miss_cache_keys.append(cache_key)
+    else:
+      dest.ParseFromString(serialized)
+  if not misses:
+    return
+
   # Trim model.Build.proto before deep-copying into destination.
   if build_mask:  # pragma: no branch
-    for b, _ in builds:
+    for b, _ in misses:
       build_mask.trim(b.proto)
 
+  yield _builds_to_protos_async(misses, build_mask)
+
+  set_futs = []
+  for (_, dest), cache_key in zip(misses, miss_cache_keys):
+    if build_mask:  # pragma: no branch
+      build_mask.trim(dest)
+    serialized = dest.SerializeToString()
+    if len(serialized) <= MAX_CACHED_BUILD_PROTO_SIZE:
+      set_futs.append(
+          ctx.memcache_set(
+              cache_key, serialized, time=BUILD_PROTO_CACHE_EXPIRATION_SEC
+          )
+      )
+  yield set_futs
+
+
+def _builds_to_protos_async(builds, build_mask):
+  """Calls model.builds_to_protos_async with flags derived from build_mask."""
   includes = lambda path: build_mask and build_mask.includes(path)
+  load_steps = includes('steps')
 
   return model.builds_to_protos_async(
       builds,
       load_tags=includes('tags'),
       load_output_properties=includes('output.properties'),
       load_input_properties=includes('input.properties'),
-      load_steps=includes('steps'),
+      load_steps=load_steps,
       load_infra=includes('infra'),
+      load_step_index_only=bool(
+          load_steps and not _includes_step_details(build_mask)
+      ),
+  )
+
+
+def _build_proto_cache_key(build, mask_fingerprint):
+  """Returns a memcache key for a serialized build_pb2.Build.
+
+  The key includes model.Build.version and proto.update_time, which change on
+  every put of the build. All code that mutates build child entities must put
+  the build in the same transaction, otherwise a cached value may be stale
+  for up to BUILD_PROTO_CACHE_EXPIRATION_SEC.
+  """
+  return 'build_proto/v1/%d/%d/%d/%s' % (
+      build.key.id(),
+      build.version or 0,
+      build.proto.update_time.ToMicroseconds(),
+      mask_fingerprint,
+  )
+
+
+def _mask_fingerprint(mask):
+  """Returns a string that identifies the set of paths in a protoutil.Mask."""
+  if not mask:
+    return 'none'
+
+  paths = []
+
+  def visit(m, prefix):
+    if not m.children:
+      paths.append(prefix)
+    for name, child in sorted(m.children.iteritems()):
+      visit(child, '%s.%s' % (prefix, name) if prefix else name)
+
+  visit(mask, '')
+  return hashlib.sha1('\n'.join(paths)).hexdigest()
+
+
+def _includes_step_details(build_mask):
+  """Returns True if build_mask includes step fields other than the index.
+
+  See model.BuildSteps.INDEX_FIELDS.
+  """
+  step_mask = build_mask.submask('steps.*')
+  if not step_mask:  # pragma: no cover
+    return True
+  return any(
+      step_mask.includes(f.name)
+      for f in step_pb2.Step.DESCRIPTOR.fields
+      if f.name not in model.BuildSteps.INDEX_FIELDS
   )
 
 
@@ -297,18 +397,27 @@ def update_build_async(req, _res, ctx, _mask):
   now = utils.utcnow()
   logging.debug('updating build %d', req.build.id)
 
-  # Validate the request.
-  build_steps = model.BuildSteps.make(req.build)
-  validation.validate_update_build_request(req, build_steps)
-
   update_paths = set(req.update_mask.paths)
 
+  # Check permissions before reading anything about the build.
   if not (yield user.can_update_build_async()):
     raise StatusError(
         prpc.StatusCode.PERMISSION_DENIED, '%s not permitted to update build' %
         auth.get_current_identity().to_bytes()
     )
 
+  # Validate the request.
+  build_steps = None
+  if 'build.steps' in update_paths and req.build.id:
+    # Reuse compressed chunks of steps that did not change since the previous
+    # update. The base may be stale: chunks are reused only if their contents
+    # match exactly.
+    prev_steps = yield model.BuildSteps.key_for(
+        ndb.Key(model.Build, req.build.id)
+    ).get_async()
+    build_steps = model.BuildSteps.make(req.build, base=prev_steps)
+  validation.validate_update_build_request(req, build_steps)
+
   @ndb.tasklet
   def get_async():
     build = yield model.Build.get_by_id_async(req.build.id)
@@ -448,10 +557,14 @@ def schedule_build_multi(batch):
       Response objects will be mutated.
   """
   # Validate requests.
+  # Builds in a batch often share tags, so share the validator.
+  tag_validator = buildtags.TagValidator('new')
   valid_items = []
   for rr in batch:
     try:
-      validation.validate_schedule_build_request(rr.request)
+      validation.validate_schedule_build_request(
+          rr.request, tag_validator=tag_validator
+      )
     except validation.Error as ex:
       rr.response.error.code = prpc.StatusCode.INVALID_ARGUMENT.value
       rr.response.error.message = ex.message
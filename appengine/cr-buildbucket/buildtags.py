@@ -124,19 +124,45 @@ def validate_tags(tags, mode, builder=None):
   builder is the value of model.Build.proto.builder.builder.
   If specified, tags "builder:<v>" must have v equal to the builder.
   Relevant only in 'new' mode.
+
+  To validate many tag lists at once, use TagValidator.
   """
-  assert mode in ('new', 'append', 'search'), mode
-  if tags is None:
-    return
-  if not isinstance(tags, list):
-    raise errors.InvalidInputError('tags must be a list')
-  seen_builder_tag = None
-  seen_gitiles_commit = False
-  for t in tags:  # pragma: no branch
-    if not isinstance(t, basestring):
+  TagValidator(mode).validate(tags, builder=builder)
+
+
+class TagValidator(object):
+  """Validates many tag lists in the same mode.
+
+  Results of per-tag checks, such as buildset validation, are cached, so a
+  tag shared by many lists, e.g. a buildset of a batch of builds for the same
+  CL, is parsed and validated once. Checks involving multiple tags of the same
+  list or the builder are still performed for each list.
+
+  Not thread-safe.
+  """
+
+  def __init__(self, mode):
+    assert mode in ('new', 'append', 'search'), mode
+    self.mode = mode
+    # Maps a valid tag to a tuple (key, value, is_gitiles_commit_buildset).
+    self._parsed = {}
+
+  def parse(self, tag):
+    """Returns a tuple (key, value, is_gitiles_commit_buildset) for a tag.
+
+    Raises errors.InvalidInputError if the tag is invalid on its own.
+    """
+    if not isinstance(tag, basestring):
       raise errors.InvalidInputError(
-          'Invalid tag "%s": must be a string' % (t,)
+          'Invalid tag "%s": must be a string' % (tag,)
       )
+    parsed = self._parsed.get(tag)
+    if parsed is None:
+      parsed = self._parse_uncached(tag)
+      self._parsed[tag] = parsed
+    return parsed
+
+  def _parse_uncached(self, t):
     if ':' not in t:
       raise errors.InvalidInputError(
           'Invalid tag "%s": does not contain ":"' % t
@@ -144,23 +170,41 @@ def validate_tags(tags, mode, builder=None):
     if t[0] == ':':
       raise errors.InvalidInputError('Invalid tag "%s": starts with ":"' % t)
     k, v = t.split(':', 1)
+    is_gitiles_commit = False
     if k == BUILDSET_KEY:
       try:
         validate_buildset(v)
       except errors.InvalidInputError as ex:
         raise errors.InvalidInputError('Invalid tag "%s": %s' % (t, ex))
-      if RE_BUILDSET_GITILES_COMMIT.match(v):  # pragma: no branch
+      is_gitiles_commit = bool(RE_BUILDSET_GITILES_COMMIT.match(v))
+    if k == BUILDER_KEY and self.mode == 'append':
+      raise errors.InvalidInputError(
+          'Tag "builder" cannot be added to an existing build'
+      )
+    if self.mode != 'search' and k in RESERVED_KEYS:
+      raise errors.InvalidInputError('Tag "%s" is reserved' % k)
+    return k, v, is_gitiles_commit
+
+  def validate(self, tags, builder=None):
+    """Validates a list of tags.
+
+    See validate_tags for the meaning of builder.
+    """
+    if tags is None:
+      return
+    if not isinstance(tags, list):
+      raise errors.InvalidInputError('tags must be a list')
+    seen_builder_tag = None
+    seen_gitiles_commit = False
+    for t in tags:  # pragma: no branch
+      k, v, is_gitiles_commit = self.parse(t)
+      if is_gitiles_commit:
         if seen_gitiles_commit:
           raise errors.InvalidInputError(
               'More than one commits/gitiles buildset'
           )
         seen_gitiles_commit = True
-    if k == BUILDER_KEY:
-      if mode == 'append':
-        raise errors.InvalidInputError(
-            'Tag "builder" cannot be added to an existing build'
-        )
-      if mode == 'new':  # pragma: no branch
+      if k == BUILDER_KEY and self.mode == 'new':
         if builder is not None and v != builder:
           raise errors.InvalidInputError(
               'Tag "%s" conflicts with builder name "%s"' % (t, builder)
@@ -171,8 +215,6 @@ def validate_tags(tags, mode, builder=None):
           raise errors.InvalidInputError(
               'Tag "%s" conflicts with tag "%s"' % (t, seen_builder_tag)
           )
-    if mode != 'search' and k in RESERVED_KEYS:
-      raise errors.InvalidInputError('Tag "%s" is reserved' % k)
 
 
 def validate_buildset(bs):
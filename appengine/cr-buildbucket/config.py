@@ -28,7 +28,13 @@ from proto import project_config_pb2
 from proto import service_config_pb2
 import errors
 
-CURRENT_BUCKET_SCHEMA_VERSION = 5
+CURRENT_BUCKET_SCHEMA_VERSION = 6
+# First bucket schema version in which complete builder configs are stored in
+# Builder entities. Older Bucket entities inline complete builder configs.
+BUILDER_ENTITIES_SCHEMA_VERSION = 6
+# How many Builder entities are written in one datastore commit. Keeps each
+# commit well below the limits of 500 entities and 10 MiB.
+BUILDER_WRITE_BATCH_SIZE = 100
 ACL_SET_NAME_RE = re.compile('^[a-z0-9_]+$')
 
 
@@ -234,6 +240,9 @@ class Bucket(ndb.Model):
   # Bucket revision matches its config revision.
   revision = ndb.StringProperty(required=True)
   # Binary equivalent of config_content.
+  # Since BUILDER_ENTITIES_SCHEMA_VERSION, builders in config.swarming.builders
+  # have only name set and complete builder configs are stored in Builder
+  # entities.
   config = datastore_utils.ProtobufProperty(project_config_pb2.Bucket)
 
   def _pre_put_hook(self):
@@ -252,6 +261,41 @@ class Bucket(ndb.Model):
     return format_bucket_id(self.project_id, self.bucket_name)
 
 
+class Builder(ndb.Model):
+  """Stores a flattened builder configuration.
+
+  Builder entities are updated in cron_update_buckets() from project configs,
+  only if the flattened builder config changed.
+
+  Entity key:
+    Parent is Bucket. Id is a builder name.
+  """
+
+  @classmethod
+  def _get_kind(cls):
+    return 'Bucket.Builder'
+
+  # Flattened builder config.
+  config = datastore_utils.ProtobufProperty(project_config_pb2.Builder)
+  # Hash of config. Computed automatically on put, see compute_hash.
+  config_hash = ndb.StringProperty(required=True, indexed=False)
+
+  def _pre_put_hook(self):
+    assert self.config.name == self.key.id()
+    self.config_hash = self.compute_hash(self.config)
+
+  @staticmethod
+  def compute_hash(cfg):
+    """Returns a hash of a project_config_pb2.Builder."""
+    return 'sha256:%s' % hashlib.sha256(cfg.SerializeToString()).hexdigest()
+
+  @staticmethod
+  def make_key(project_id, bucket_name, builder_name):
+    return ndb.Key(
+        Project, project_id, Bucket, bucket_name, Builder, builder_name
+    )
+
+
 def short_bucket_name(bucket_name):
   """Returns bucket name without "luci.<project_id>." prefix."""
   parts = bucket_name.split('.', 2)
@@ -332,6 +376,68 @@ def get_bucket(bucket_id):
   return get_bucket_async(bucket_id).get_result()
 
 
+@ndb.non_transactional
+@ndb.tasklet
+def get_builders_async(builder_ids):
+  """Returns builder configs.
+
+  Args:
+    builder_ids: an iterable of (bucket_id, builder_name) tuples.
+
+  Returns:
+    {(bucket_id, builder_name): project_config_pb2.Builder} dict.
+    If a builder does not exist, the value is None.
+  """
+  builder_ids = list(builder_ids)
+  keys = [
+      Builder.make_key(*(parse_bucket_id(bucket_id) + (builder_name,)))
+      for bucket_id, builder_name in builder_ids
+  ]
+  builders = yield ndb.get_multi_async(keys)
+  ret = {
+      bid: b.config if b else None for bid, b in zip(builder_ids, builders)
+  }
+
+  # Buckets that were not migrated to BUILDER_ENTITIES_SCHEMA_VERSION yet have
+  # no Builder entities, but inline complete builder configs.
+  missing_bucket_ids = sorted({
+      bucket_id for (bucket_id, _), cfg in ret.iteritems() if cfg is None
+  })
+  if missing_bucket_ids:
+    buckets = yield ndb.get_multi_async([
+        Bucket.make_key(*parse_bucket_id(bid)) for bid in missing_bucket_ids
+    ])
+    inline = {}
+    for bucket_id, bucket in zip(missing_bucket_ids, buckets):
+      if (bucket and
+          bucket.entity_schema_version < BUILDER_ENTITIES_SCHEMA_VERSION):
+        for b in bucket.config.swarming.builders:
+          inline[(bucket_id, b.name)] = b
+    for bid, cfg in ret.iteritems():
+      if cfg is None:
+        ret[bid] = inline.get(bid)
+  raise ndb.Return(ret)
+
+
+@ndb.non_transactional
+@ndb.tasklet
+def get_bucket_builders_async(bucket_id, bucket_cfg):
+  """Returns complete configs of builders in the bucket.
+
+  bucket_cfg is the bucket config returned by get_bucket_async or
+  get_buckets_async. The configs are returned in the order of
+  bucket_cfg.swarming.builders.
+
+  Returns:
+    A list of project_config_pb2.Builder.
+  """
+  names = [b.name for b in bucket_cfg.swarming.builders]
+  builders = yield get_builders_async((bucket_id, n) for n in names)
+  raise ndb.Return(
+      [builders[(bucket_id, n)] for n in names if builders[(bucket_id, n)]]
+  )
+
+
 def _normalize_acls(acls):
   """Normalizes a RepeatedCompositeContainer of Acl messages."""
   for a in acls:
@@ -346,18 +452,92 @@ def _normalize_acls(acls):
       del acls[i]
 
 
+def put_builders(project_id, bucket_name, builder_cfgs):
+  """Synchronizes Builder entities of a bucket with builder_cfgs.
+
+  Puts only builders whose config changed and deletes builders that are not
+  in builder_cfgs.
+
+  Args:
+    project_id: id of the project of the bucket.
+    bucket_name: short bucket name.
+    builder_cfgs: a list of flattened project_config_pb2.Builder messages.
+
+  Returns:
+    A tuple (put_count, delete_count).
+  """
+  bucket_key = Bucket.make_key(project_id, bucket_name)
+  existing = {
+      b.key.id(): b for b in Builder.query(ancestor=bucket_key).fetch()
+  }
+
+  to_put = []
+  for cfg in builder_cfgs:
+    cur = existing.pop(cfg.name, None)
+    if cur and cur.config_hash == Builder.compute_hash(cfg):
+      continue
+    to_put.append(
+        Builder(
+            key=Builder.make_key(project_id, bucket_name, cfg.name),
+            config=cfg,
+        )
+    )
+  to_delete = [b.key for b in existing.itervalues()]
+
+  for i in xrange(0, len(to_put), BUILDER_WRITE_BATCH_SIZE):
+    ndb.put_multi(to_put[i:i + BUILDER_WRITE_BATCH_SIZE])
+  for i in xrange(0, len(to_delete), BUILDER_WRITE_BATCH_SIZE):
+    ndb.delete_multi(to_delete[i:i + BUILDER_WRITE_BATCH_SIZE])
+  return len(to_put), len(to_delete)
+
+
 def put_bucket(project_id, revision, bucket_cfg):
+  """Puts a Bucket entity and Builder entities of its builders.
+
+  Builder entities are put first, only if they changed. See put_builders.
+  Not transactional: a bucket may have more builders than a transaction can
+  write. The Bucket entity is put last, so a failed update is retried by the
+  next cron run.
+  """
   # New Bucket format uses short bucket names, e.g. "try" instead of
   # "luci.chromium.try".
   # Use short name in both entity key and config contents.
   short_bucket_cfg = copy.deepcopy(bucket_cfg)
   short_bucket_cfg.name = short_bucket_name(short_bucket_cfg.name)
-  Bucket(
-      key=Bucket.make_key(project_id, short_bucket_cfg.name),
-      entity_schema_version=CURRENT_BUCKET_SCHEMA_VERSION,
-      revision=revision,
-      config=short_bucket_cfg,
-  ).put()
+
+  # Store complete builder configs separately, keep only names in the bucket.
+  builder_cfgs = list(short_bucket_cfg.swarming.builders)
+  put_count, delete_count = put_builders(
+      project_id, short_bucket_cfg.name, builder_cfgs
+  )
+  if builder_cfgs:
+    short_bucket_cfg.swarming.ClearField('builders')
+    for b in builder_cfgs:
+      short_bucket_cfg.swarming.builders.add(name=b.name)
+
+  # pylint: disable=no-value-for-parameter
+  @ndb.transactional
+  def update_bucket():
+    bucket_key = Bucket.make_key(project_id, short_bucket_cfg.name)
+    bucket = bucket_key.get()
+    if (bucket and
+        bucket.entity_schema_version == CURRENT_BUCKET_SCHEMA_VERSION and
+        bucket.revision == revision):
+      return False
+    Bucket(
+        key=bucket_key,
+        entity_schema_version=CURRENT_BUCKET_SCHEMA_VERSION,
+        revision=revision,
+        config=short_bucket_cfg,
+    ).put()
+    return True
+
+  if not update_bucket():
+    return
+  logging.info(
+      'Updated bucket %s/%s to revision %s: %d builders updated, %d deleted',
+      project_id, short_bucket_cfg.name, revision, put_count, delete_count
+  )
 
 
 def cron_update_buckets():
@@ -442,25 +622,19 @@ def cron_update_buckets():
               b, defaults, builder_mixins_by_name
           )
 
-      # pylint: disable=no-value-for-parameter
-      @ndb.transactional(xg=True)
-      def update_bucket():
-        bucket = bucket_key.get()
-        if (bucket and
-            bucket.entity_schema_version == CURRENT_BUCKET_SCHEMA_VERSION and
-            bucket.revision == revision):  # pragma: no coverage
-          return
-
-        put_bucket(project_id, revision, bucket_cfg)
-        logging.info('Updated bucket %s to revision %s', bucket_key, revision)
-
-      update_bucket()
+      # Not transactional: a bucket may have more builders than a
+      # transaction can write. The Bucket entity is put last, so a failed
+      # update is retried by the next cron run.
+      put_bucket(project_id, revision, bucket_cfg)
 
-  # Delete non-existing buckets.
+  # Delete non-existing buckets and their builders.
   to_delete_flat = sum([list(n) for n in to_delete.itervalues()], [])
   if to_delete_flat:
     logging.warning('Deleting buckets: %s', ', '.join(map(str, to_delete_flat)))
-    ndb.delete_multi(to_delete_flat)
+    builder_keys = []
+    for key in to_delete_flat:
+      builder_keys.extend(Builder.query(ancestor=key).fetch(keys_only=True))
+    ndb.delete_multi(to_delete_flat + builder_keys)
 
 
 def get_buildbucket_cfg_url(project_id):
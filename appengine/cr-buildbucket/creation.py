@@ -410,16 +410,21 @@ def add_many_async(build_requests):
   # Fetch and index configs.
   bucket_ids = {br.bucket_id for br in build_requests}
   bucket_cfgs = yield config.get_buckets_async(bucket_ids)
-  builder_cfgs = {}  # {bucket_id: {builder_name: cfg}}
+  builder_names = {}  # {bucket_id: {builder_name}}
   for bucket_id, bucket_cfg in bucket_cfgs.iteritems():
-    builder_cfgs[bucket_id] = {b.name: b for b in bucket_cfg.swarming.builders}
+    builder_names[bucket_id] = {b.name for b in bucket_cfg.swarming.builders}
+  # Fetch only configs of requested builders.
+  builder_cfgs = yield config.get_builders_async({
+      (r.bucket_id, r.schedule_build_request.builder.builder)
+      for r in build_requests
+      if r.schedule_build_request.builder.builder in builder_names[r.bucket_id]
+  })
 
   # Prepare NewBuild objects.
   new_builds = []
   for r in build_requests:
     builder = r.schedule_build_request.builder.builder
-    bucket_builder_cfgs = builder_cfgs[r.bucket_id]
-    builder_cfg = bucket_builder_cfgs.get(builder)
+    builder_cfg = builder_cfgs.get((r.bucket_id, builder))
 
     # Apply builder config overrides, if any.
     # Exists for backward compatibility, runs only in V1 code path.
@@ -428,7 +433,7 @@ def add_many_async(build_requests):
       r.override_builder_cfg(builder_cfg)
 
     nb = NewBuild(r, builder_cfg)
-    if bucket_builder_cfgs and not builder_cfg:
+    if builder_names[r.bucket_id] and not builder_cfg:
       nb.exception = errors.BuilderNotFoundError(
           'builder "%s" not found in bucket "%s"' % (builder, r.bucket_id)
       )
@@ -64,4 +64,7 @@ def _fix_build_async(build_key):  # pragma: no cover
     )
 
   if to_put:
+    # Put the build too: it bumps build.version, which invalidates serialized
+    # build protos cached by api.py.
+    to_put.append(build)
     yield ndb.put_multi_async(to_put)
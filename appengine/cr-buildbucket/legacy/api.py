@@ -214,11 +214,16 @@ def validate_known_build_parameters(params):
         swarmingcfg.validate_recipe_property(k, v, ctx)
 
 
-def put_request_message_to_build_request(put_request):
+def put_request_message_to_build_request(put_request, tag_validator=None):
   """Converts PutRequest to BuildRequest.
 
+  tag_validator is an optional buildtags.TagValidator in 'new' mode, shared
+  by all requests of a batch.
+
   Raises errors.InvalidInputError if the put_request is invalid.
   """
+  tag_validator = tag_validator or buildtags.TagValidator('new')
+
   lease_expiration_date = parse_datetime(put_request.lease_expiration_ts)
   errors.validate_lease_expiration_date(lease_expiration_date)
 
@@ -230,7 +235,7 @@ def put_request_message_to_build_request(put_request):
   builder = parameters.pop(api_common.BUILDER_PARAMETER, '') or ''
 
   # Validate tags.
-  buildtags.validate_tags(put_request.tags, 'new', builder=builder)
+  tag_validator.validate(put_request.tags, builder=builder)
 
   # Read properties. Remove them from parameters.
   props = parameters.pop(api_common.PROPERTIES_PARAMETER, None)
@@ -320,7 +325,9 @@ def put_request_message_to_build_request(put_request):
 
   # Validate the resulting v2 request before continuing.
   with _wrap_validation_error():
-    validation.validate_schedule_build_request(sbr, legacy=True)
+    validation.validate_schedule_build_request(
+        sbr, legacy=True, tag_validator=tag_validator
+    )
 
   return creation.BuildRequest(
       schedule_build_request=sbr,
@@ -569,9 +576,12 @@ class BuildBucketApi(remote.Service):
 
     # Try to convert each PutRequest to BuildRequest.
     build_reqs = []  # [(index, creation.BuildRequest])
+    tag_validator = buildtags.TagValidator('new')
     for i, b in enumerate(request.builds):
       try:
-        build_reqs.append((i, put_request_message_to_build_request(b)))
+        build_reqs.append(
+            (i, put_request_message_to_build_request(b, tag_validator))
+        )
       except errors.Error as ex:
         res.results[i].error = exception_to_error_message(ex)
 
@@ -1067,6 +1077,13 @@ class BuildBucketApi(remote.Service):
     project_id, _ = config.parse_bucket_id(bucket_id)
     rev, bucket_cfg = config.get_bucket(bucket_id)
     assert bucket_cfg  # access check would have failed.
+    if bucket_cfg.swarming.builders:
+      # Bucket entities store only builder names.
+      builders = config.get_bucket_builders_async(bucket_id,
+                                                  bucket_cfg).get_result()
+      bucket_cfg = copy.deepcopy(bucket_cfg)
+      bucket_cfg.swarming.ClearField('builders')
+      bucket_cfg.swarming.builders.extend(builders)
     return BucketMessage(
         name=request.bucket,
         project_id=project_id,
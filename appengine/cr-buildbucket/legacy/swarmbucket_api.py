@@ -145,9 +145,16 @@ class SwarmbucketApi(remote.Service):
 
     res = GetBuildersResponseMessage()
     buckets = config.get_buckets_async(bucket_ids).get_result()
+    buckets = {
+        bucket_id: cfg
+        for bucket_id, cfg in buckets.iteritems()
+        if cfg and cfg.swarming.builders
+    }
+    builder_futs = {
+        bucket_id: config.get_bucket_builders_async(bucket_id, cfg)
+        for bucket_id, cfg in buckets.iteritems()
+    }
     for bucket_id, cfg in buckets.iteritems():
-      if not cfg or not cfg.swarming.builders:
-        continue
 
       def to_dims(b):
         return flatten_swarmingcfg.format_dimensions(
@@ -166,7 +173,7 @@ class SwarmbucketApi(remote.Service):
                       ),
                       swarming_hostname=builder.swarming_host,
                       swarming_dimensions=to_dims(builder)
-                  ) for builder in cfg.swarming.builders
+                  ) for builder in builder_futs[bucket_id].get_result()
               ],
               swarming_hostname=cfg.swarming.hostname,
           )
@@ -190,14 +197,10 @@ class SwarmbucketApi(remote.Service):
 
       # Find builder config.
       builder_id = build_request.schedule_build_request.builder
-      builder_cfg = None
       bucket_id = config.format_bucket_id(builder_id.project, builder_id.bucket)
-      _, bucket_cfg = config.get_bucket_async(bucket_id).get_result()
-      assert bucket_cfg, 'if there is no bucket, access check would fail'
-      for cfg in bucket_cfg.swarming.builders:  # pragma: no branch
-        if cfg.name == builder_id.builder:
-          builder_cfg = cfg
-          break
+      builder_key = (bucket_id, builder_id.builder)
+      builder_cfg = config.get_builders_async([builder_key]
+                                             ).get_result()[builder_key]
       if not builder_cfg:
         raise endpoints.NotFoundException(
             'Builder %s/%s/%s not found' %
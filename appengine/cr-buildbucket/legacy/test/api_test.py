@@ -1047,6 +1047,37 @@ class V1ApiTest(testing.EndpointsTestCase):
         }
     )
 
+  @mock.patch('config.get_buildbucket_cfg_url', autospec=True)
+  def test_get_bucket_with_builders(self, get_buildbucket_cfg_url):
+    get_buildbucket_cfg_url.return_value = 'https://example.com/buildbucket.cfg'
+
+    bucket_cfg = test_util.parse_bucket_cfg(
+        '''
+        name: "luci.chromium.try"
+        acls {
+          role: READER
+          identity: "anonymous:anonymous"
+        }
+        swarming {
+          hostname: "swarming.example.com"
+          builders {
+            name: "linux"
+            dimensions: "os:Linux"
+          }
+          builders {
+            name: "mac"
+            dimensions: "os:Mac"
+          }
+        }
+        '''
+    )
+    config.put_bucket('chromium', 'deadbeef', bucket_cfg)
+    res = self.call_api('get_bucket', {'bucket': 'luci.chromium.try'}).json_body
+    bucket_cfg.name = 'try'
+    self.assertEqual(
+        res['config_file_content'], text_format.MessageToString(bucket_cfg)
+    )
+
   @mock.patch('components.auth.is_admin', autospec=True)
   def test_get_bucket_not_found(self, is_admin):
     is_admin.return_value = True
@@ -5,6 +5,7 @@
 import collections
 import contextlib
 import datetime
+import hashlib
 import itertools
 import random
 import zlib
@@ -210,6 +211,12 @@ class Build(ndb.Model):
 
   is_luci = ndb.BooleanProperty()
 
+  # Incremented on each put. Together with proto.update_time identifies
+  # the version of the build and its child entities, so it can be used in cache
+  # keys. Code that mutates child entities, e.g. BuildSteps, must put the Build
+  # in the same transaction.
+  version = ndb.IntegerProperty(indexed=False)
+
   @property
   def is_ended(self):  # pragma: no cover
     return self.proto.status not in (
@@ -271,6 +278,7 @@ class Build(ndb.Model):
 
     self.update_v1_status_fields()
     self.proto.update_time.FromDatetime(utils.utcnow())
+    self.version = (self.version or 0) + 1
 
     is_started = self.proto.status == common_pb2.STARTED
     is_ended = self.is_ended
@@ -386,59 +394,186 @@ class BuildOutputProperties(BuildProperties):
 
 
 class BuildSteps(BuildDetailEntity):
-  """Stores buildbucket.v2.Build.steps."""
+  """Stores buildbucket.v2.Build.steps.
+
+  Steps are stored in one of the formats defined by FORMAT_* constants, see
+  step_format. Entities written by write_steps always use FORMAT_COLUMNAR.
+  """
 
-  # max length of step_container_bytes attribute.
+  # max length of stored steps, see stored_size.
   MAX_STEPS_LEN = 1e6
 
+  # The entire list of steps is stored in step_container_bytes.
+  FORMAT_CONTAINER = 1
+  # Step names and statuses are stored in step_index_bytes, complete steps are
+  # stored in compressed chunks of STEP_CHUNK_SIZE steps in step_chunks.
+  FORMAT_COLUMNAR = 2
+
+  # Maximum number of steps in one chunk of FORMAT_COLUMNAR.
+  STEP_CHUNK_SIZE = 32
+
+  # Step fields stored in step_index_bytes of FORMAT_COLUMNAR.
+  INDEX_FIELDS = ('name', 'status')
+
+  # Storage format, one of FORMAT_* constants.
+  # None is equivalent to FORMAT_CONTAINER: entities created before this
+  # property was introduced.
+  step_format = ndb.IntegerProperty(indexed=False)
+
+  # FORMAT_CONTAINER only.
   # buildbucket.v2.Build binary protobuf message with only "steps" field set.
   # zlib-compressed if step_container_bytes_zipped is True.
   step_container_bytes = ndb.BlobProperty(name='steps')
 
+  # FORMAT_CONTAINER only.
   # Whether step_container_bytes are zlib-compressed.
   # We don't reuse ndb compression because we want to enforce the size limit
   # at the API level after compression.
   step_container_bytes_zipped = ndb.BooleanProperty(indexed=False)
 
+  # FORMAT_COLUMNAR only.
+  # zlib-compressed buildbucket.v2.Build binary protobuf message with only
+  # "steps" field set, where steps have only INDEX_FIELDS set.
+  step_index_bytes = ndb.BlobProperty()
+
+  # FORMAT_COLUMNAR only.
+  # Each chunk is a zlib-compressed buildbucket.v2.Build binary protobuf
+  # message with only "steps" field set, containing up to STEP_CHUNK_SIZE
+  # consecutive steps. Only the last chunk may have fewer steps.
+  step_chunks = ndb.BlobProperty(repeated=True)
+
+  # FORMAT_COLUMNAR only.
+  # SHA1 hex digests of uncompressed step_chunks, in the same order.
+  # Used to reuse compressed chunks that did not change.
+  step_chunk_digests = ndb.StringProperty(repeated=True, indexed=False)
+
   def _pre_put_hook(self):
     """Checks BuildSteps invariants before putting."""
     super(BuildSteps, self)._pre_put_hook()
-    assert self.step_container_bytes is not None
-    assert len(self.step_container_bytes) <= self.MAX_STEPS_LEN
+    if self.step_format == self.FORMAT_COLUMNAR:
+      assert self.step_index_bytes is not None
+      assert len(self.step_chunks) == len(self.step_chunk_digests)
+    else:
+      assert self.step_container_bytes is not None
+    assert self.stored_size <= self.MAX_STEPS_LEN
+
+  @property
+  def is_columnar(self):
+    return self.step_format == self.FORMAT_COLUMNAR
+
+  @property
+  def stored_size(self):
+    """Returns the number of bytes occupied by the stored steps."""
+    if self.is_columnar:
+      return (
+          len(self.step_index_bytes) + sum(len(c) for c in self.step_chunks)
+      )
+    return len(self.step_container_bytes or '')
 
   @classmethod
-  def make(cls, build_proto):
+  def make(cls, build_proto, base=None):
     """Creates BuildSteps for the build_proto.
 
+    If base is a BuildSteps of the same build, its compressed chunks are reused
+    for steps that did not change. It is safe to use a stale base.
+
     Does not verify step size.
     """
     assert build_proto.id
     build_key = ndb.Key(Build, build_proto.id)
     ret = cls(key=cls.key_for(build_key))
+    if base and base.is_columnar:
+      ret.step_format = base.step_format
+      ret.step_chunks = base.step_chunks
+      ret.step_chunk_digests = base.step_chunk_digests
     ret.write_steps(build_proto)
     return ret
 
   def write_steps(self, build_proto):
-    """Serializes build_proto.steps into self."""
-    container = build_pb2.Build(steps=build_proto.steps)
-    container_bytes = container.SerializeToString()
-
-    # Compress only if necessary.
-    zipped = len(container_bytes) > self.MAX_STEPS_LEN
-    if zipped:
-      container_bytes = zlib.compress(container_bytes)
+    """Serializes build_proto.steps into self.
 
-    self.step_container_bytes = container_bytes
-    self.step_container_bytes_zipped = zipped
+    Compressed chunks of steps that did not change since the last
+    write_steps call are not recompressed.
+    """
+    reusable = {}
+    if self.is_columnar:
+      reusable = dict(zip(self.step_chunk_digests, self.step_chunks))
+    chunks, digests = self._make_chunks(build_proto.steps, reusable)
+    self._set_columnar(self._make_index(build_proto.steps), chunks, digests)
 
   def read_steps(self, build_proto):
     """Deserializes steps into build_proto.steps."""
+    build_proto.ClearField('steps')
+    if self.is_columnar:
+      # Steps in a repeated field are concatenated when merged.
+      for chunk in self.step_chunks:
+        build_proto.MergeFromString(zlib.decompress(chunk))
+      return
+
     container_bytes = self.step_container_bytes
     if self.step_container_bytes_zipped:
       container_bytes = zlib.decompress(container_bytes)
-    build_proto.ClearField('steps')
     build_proto.MergeFromString(container_bytes)
 
+  def read_step_index(self, build_proto):
+    """Deserializes steps into build_proto.steps, only with INDEX_FIELDS.
+
+    For FORMAT_COLUMNAR, does not decompress or parse complete steps. Note that
+    the chunks are still fetched from the datastore with the entity.
+    """
+    if self.is_columnar:
+      index = self._parse_index()
+    else:
+      container = build_pb2.Build()
+      self.read_steps(container)
+      index = self._make_index(container.steps)
+    build_proto.ClearField('steps')
+    build_proto.MergeFrom(index)
+
+  def _parse_index(self):
+    index = build_pb2.Build()
+    index.ParseFromString(zlib.decompress(self.step_index_bytes))
+    return index
+
+  def _set_columnar(self, index, chunks, digests):
+    self.step_format = self.FORMAT_COLUMNAR
+    self.step_index_bytes = zlib.compress(index.SerializeToString())
+    self.step_chunks = chunks
+    self.step_chunk_digests = digests
+    self.step_container_bytes = None
+    self.step_container_bytes_zipped = None
+
+  @classmethod
+  def _make_index(cls, steps):
+    """Returns a build_pb2.Build with steps having only INDEX_FIELDS."""
+    index = build_pb2.Build()
+    for s in steps:
+      index.steps.add(name=s.name, status=s.status)
+    return index
+
+  @classmethod
+  def _make_chunks(cls, steps, reusable):
+    """Splits steps into compressed chunks.
+
+    reusable is a dict {digest: compressed_chunk} of chunks that can be
+    reused instead of compressing again.
+
+    Returns a tuple (chunks, digests).
+    """
+    chunks = []
+    digests = []
+    for i in xrange(0, len(steps), cls.STEP_CHUNK_SIZE):
+      chunk_bytes = build_pb2.Build(
+          steps=steps[i:i + cls.STEP_CHUNK_SIZE]
+      ).SerializeToString()
+      digest = hashlib.sha1(chunk_bytes).hexdigest()
+      chunk = reusable.get(digest)
+      if chunk is None:
+        chunk = zlib.compress(chunk_bytes)
+      chunks.append(chunk)
+      digests.append(digest)
+    return chunks, digests
+
   @classmethod
   @ndb.tasklet
   def cancel_incomplete_steps_async(cls, build_id, end_ts):
@@ -609,8 +744,11 @@ class BuildBundle(BuildBundleBase):
   def put(self):
     return self.put_async().get_result()
 
-  def to_proto(self, dest, load_tags):
-    """Writes build to the dest Build proto. Returns dest."""
+  def to_proto(self, dest, load_tags, step_index_only=False):
+    """Writes build to the dest Build proto. Returns dest.
+
+    If step_index_only is True, steps have only BuildSteps.INDEX_FIELDS set.
+    """
     if dest is not self.build.proto:  # pragma: no branch
       dest.CopyFrom(self.build.proto)
     dest.id = self.build.key.id()  # old builds do not have id field
@@ -622,7 +760,10 @@ class BuildBundle(BuildBundleBase):
       dest.infra.ParseFromString(self.infra.infra)
 
     if self.steps:
-      self.steps.read_steps(dest)
+      if step_index_only:
+        self.steps.read_step_index(dest)
+      else:
+        self.steps.read_steps(dest)
 
     if self.input_properties:
       dest.input.properties.ParseFromString(self.input_properties.properties)
@@ -677,7 +818,8 @@ def create_build_ids(dtime, count, randomness=True):
   build_id = int(_id_time_segment(dtime))
   build_id = build_id | ((random.getrandbits(16) << 4) if randomness else 0)
   # Subtract so that ids are descending.
-  return [build_id - i * (1 << 4) for i in xrange(count)]
+  step = 1 << 4
+  return range(build_id, build_id - count * step, -step)
 
 
 def build_id_range(create_time_low, create_time_high):
@@ -705,11 +847,15 @@ def builds_to_protos_async(
     load_output_properties,
     load_steps,
     load_infra,
+    load_step_index_only=False,
 ):
   """Converts Build objects to build_pb2.Build messages.
 
   builds must be a list of (model.Build, build_pb2.Build) tuples,
   where the build_pb2.Build is the destination.
+
+  If load_step_index_only is True, loaded steps have only
+  BuildSteps.INDEX_FIELDS set.
   """
 
   bundle_futs = [(
@@ -725,4 +871,6 @@ def builds_to_protos_async(
 
   for dest, bundle_fut in bundle_futs:
     bundle = yield bundle_fut
-    bundle.to_proto(dest, load_tags=load_tags)
+    bundle.to_proto(
+        dest, load_tags=load_tags, step_index_only=load_step_index_only
+    )
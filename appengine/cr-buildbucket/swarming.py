@@ -26,10 +26,12 @@ import base64
 import collections
 import copy
 import datetime
+import hashlib
 import json
 import logging
 import posixpath
 import re
+import threading
 import uuid
 
 from google.appengine.api import app_identity
@@ -43,6 +45,7 @@ import webapp2
 from components import decorators
 from components import net
 from components import utils
+import gae_ts_mon
 
 from legacy import api_common
 from proto import common_pb2
@@ -76,6 +79,21 @@ _KITCHEN_CHECKOUT = 'kitchen-checkout'
 # USER_PACKAGE_DIR and USER_PACKAGE_DIR/bin are prepended to $PATH.
 USER_PACKAGE_DIR = 'cipd_bin_packages'
 
+# Maximum number of task templates cached in process memory.
+_MAX_TASK_TEMPLATES = 1000
+
+# LRU cache of task templates, see _compute_task_slices.
+# Maps a key returned by _task_template_key to JSON-encoded task slices without
+# the command, least recently used first. Protected by _task_templates_lock.
+_task_templates = collections.OrderedDict()
+_task_templates_lock = threading.Lock()
+
+TASK_TEMPLATE_LOOKUP_COUNT = gae_ts_mon.CounterMetric(
+    'buildbucket/swarming/task_template_lookups',
+    'Number of swarming task template cache lookups',
+    [gae_ts_mon.BooleanField('hit')],
+)
+
 ################################################################################
 # Creation/cancellation of tasks.
 
@@ -213,7 +231,59 @@ def _compute_tags(build, settings):
 
 
 def _compute_task_slices(build, settings):
-  """Compute swarming task slices."""
+  """Compute swarming task slices.
+
+  Everything except the command comes from a task template, cached per
+  builder configuration and settings. See _task_template_key.
+  """
+  key = _task_template_key(build, settings)
+  with _task_templates_lock:
+    template = _task_templates.pop(key, None)
+    if template is not None:
+      # Mark as most recently used.
+      _task_templates[key] = template
+  TASK_TEMPLATE_LOOKUP_COUNT.increment({'hit': template is not None})
+  if template is None:
+    template = json.dumps(_compute_task_slices_template(build, settings))
+    with _task_templates_lock:
+      _task_templates[key] = template
+      while len(_task_templates) > _MAX_TASK_TEMPLATES:
+        _task_templates.popitem(last=False)
+
+  task_slices = json.loads(template)
+  command = _compute_command(build, settings)
+  for s in task_slices:
+    s['properties']['command'] = list(command)
+  return task_slices
+
+
+def _task_template_key(build, settings):
+  """Returns a key of the task template for the build.
+
+  The key covers all inputs of _compute_task_slices_template. They are derived
+  from the builder config and global settings, so builds of the same builder
+  usually share a template.
+  """
+  bp = build.proto
+  parts = [
+      settings.swarming.SerializeToString(),
+      config.builder_id_string(bp.builder),
+      str(bp.canary),
+      str(build.experimental),
+      bp.exe.SerializeToString(),
+      bp.infra.swarming.SerializeToString(),
+      bp.scheduling_timeout.SerializeToString(),
+      bp.execution_timeout.SerializeToString(),
+  ]
+  h = hashlib.sha1()
+  for p in parts:
+    # Prefix with length to avoid ambiguity.
+    h.update('%d\n%s' % (len(p), p))
+  return h.hexdigest()
+
+
+def _compute_task_slices_template(build, settings):
+  """Computes swarming task slices without the command."""
 
   # {expiration_secs: [{'key': key, 'value': value}]}
   dims = collections.defaultdict(list)
@@ -250,8 +320,6 @@ def _compute_task_slices(build, settings):
               'key': 'BUILDBUCKET_EXPERIMENTAL',
               'value': str(build.experimental).upper(),
           }],
-          'command':
-              _compute_command(build, settings),
       },
   }
 
@@ -18,6 +18,7 @@ import mock
 from proto import build_pb2
 from proto import common_pb2
 from proto import rpc_pb2
+from proto import step_pb2
 from test import test_util
 import api
 import bbutil
@@ -164,6 +165,88 @@ class GetBuildTests(BaseTestCase):
         )
     )
 
+  def test_steps(self):
+    build = test_util.build(id=54)
+    build.put()
+    steps = [
+        step_pb2.Step(
+            name='a', status=common_pb2.SUCCESS, summary_markdown='summary'
+        ),
+    ]
+    model.BuildSteps.make(build_pb2.Build(id=54, steps=steps)).put()
+
+    req = rpc_pb2.GetBuildRequest(id=54, fields=dict(paths=['steps']))
+    res = self.call(self.api.GetBuild, req)
+    self.assertEqual(list(res.steps), steps)
+
+  @mock.patch('model.BuildSteps.read_steps', autospec=True)
+  def test_step_index(self, read_steps):
+    build = test_util.build(id=54)
+    build.put()
+    steps = [
+        step_pb2.Step(
+            name='a', status=common_pb2.SUCCESS, summary_markdown='summary'
+        ),
+    ]
+    model.BuildSteps.make(build_pb2.Build(id=54, steps=steps)).put()
+
+    req = rpc_pb2.GetBuildRequest(
+        id=54, fields=dict(paths=['steps.*.name', 'steps.*.status'])
+    )
+    res = self.call(self.api.GetBuild, req)
+    self.assertEqual(
+        list(res.steps), [step_pb2.Step(name='a', status=common_pb2.SUCCESS)]
+    )
+    self.assertFalse(read_steps.called)
+
+  def test_cache(self):
+    build = test_util.build(id=54, status=common_pb2.STARTED)
+    build.put()
+    req = rpc_pb2.GetBuildRequest(id=54)
+
+    with mock.patch(
+        'model.builds_to_protos_async',
+        wraps=model.builds_to_protos_async,
+    ) as builds_to_protos_async:
+      res = self.call(self.api.GetBuild, req)
+      self.assertEqual(res.status, common_pb2.STARTED)
+      self.assertEqual(builds_to_protos_async.call_count, 1)
+
+      res = self.call(self.api.GetBuild, req)
+      self.assertEqual(res.status, common_pb2.STARTED)
+      self.assertEqual(builds_to_protos_async.call_count, 1)
+
+      # A different field mask is cached separately.
+      req_with_tags = rpc_pb2.GetBuildRequest(
+          id=54, fields=dict(paths=['id', 'tags'])
+      )
+      res = self.call(self.api.GetBuild, req_with_tags)
+      self.assertFalse(res.HasField('status'))
+      self.assertEqual(builds_to_protos_async.call_count, 2)
+
+      # Putting the build invalidates the cache, even if update_time stays the
+      # same.
+      build = build.key.get()
+      build.proto.status = common_pb2.SUCCESS
+      build.proto.end_time.FromDatetime(self.now)
+      build.put()
+      res = self.call(self.api.GetBuild, req)
+      self.assertEqual(res.status, common_pb2.SUCCESS)
+      self.assertEqual(builds_to_protos_async.call_count, 3)
+
+  @mock.patch('api.MAX_CACHED_BUILD_PROTO_SIZE', 1)
+  def test_cache_too_large(self):
+    test_util.build(id=54).put()
+    req = rpc_pb2.GetBuildRequest(id=54)
+
+    with mock.patch(
+        'model.builds_to_protos_async',
+        wraps=model.builds_to_protos_async,
+    ) as builds_to_protos_async:
+      self.call(self.api.GetBuild, req)
+      self.call(self.api.GetBuild, req)
+      self.assertEqual(builds_to_protos_async.call_count, 2)
+
   def test_not_found_by_id(self):
     req = rpc_pb2.GetBuildRequest(id=54)
     self.call(self.api.GetBuild, req, expected_code=prpc.StatusCode.NOT_FOUND)
@@ -265,6 +348,27 @@ class UpdateBuildTests(BaseTestCase):
     persisted.read_steps(persisted_container)
     self.assertEqual(persisted_container.steps, build_proto.steps)
 
+  def test_update_steps_reuses_chunks(self):
+    build = test_util.build(id=123, status=common_pb2.STARTED)
+    build.put()
+    steps = [
+        dict(name='a', status=common_pb2.SUCCESS),
+        dict(name='b', status=common_pb2.STARTED),
+    ]
+    prev = model.BuildSteps.make(build_pb2.Build(id=123, steps=steps[:1]))
+    prev.put()
+
+    build_proto = build_pb2.Build(id=123, steps=steps)
+    req, ctx = self._mk_update_req(build_proto, paths=['build.steps'])
+    with mock.patch('model.BuildSteps.STEP_CHUNK_SIZE', 1):
+      self.call(self.api.UpdateBuild, req, ctx=ctx)
+
+    persisted = model.BuildSteps.key_for(build.key).get()
+    self.assertEqual(persisted.step_chunks[0], prev.step_chunks[0])
+    persisted_container = build_pb2.Build()
+    persisted.read_steps(persisted_container)
+    self.assertEqual(persisted_container.steps, build_proto.steps)
+
   def test_update_steps_of_scheduled_build(self):
     test_util.build(id=123, status=common_pb2.SCHEDULED).put()
 
@@ -473,6 +577,21 @@ class UpdateBuildTests(BaseTestCase):
         expected_details='anonymous:anonymous not permitted to update build',
     )
 
+  def test_invalid_user_steps_not_read(self):
+    test_util.build(id=123, status=common_pb2.STARTED).put()
+    self.can_update_build_async.return_value = future(False)
+
+    build = build_pb2.Build(id=123, steps=[dict(name='a')])
+    req, ctx = self._mk_update_req(build, paths=['build.steps'])
+    with mock.patch('model.BuildSteps.make', autospec=True) as make:
+      self.call(
+          self.api.UpdateBuild,
+          req,
+          ctx=ctx,
+          expected_code=prpc.StatusCode.PERMISSION_DENIED,
+      )
+      self.assertFalse(make.called)
+
 
 class ScheduleBuildTests(BaseTestCase):
 
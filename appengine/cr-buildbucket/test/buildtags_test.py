@@ -2,8 +2,12 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import logging
+import time
 import unittest
 
+import mock
+
 import buildtags
 import errors
 
@@ -101,3 +105,72 @@ class ValidateTagsTests(unittest.TestCase):
           ),
       ]
       buildtags.validate_tags(tags, 'new')
+
+
+class TagValidatorTests(unittest.TestCase):
+
+  def test_parse(self):
+    validator = buildtags.TagValidator('new')
+    self.assertEqual(validator.parse('a:b:c'), ('a', 'b:c', False))
+    self.assertEqual(
+        validator.parse(
+            'buildset:commit/gitiles/chromium.googlesource.com/chromium/src'
+            '/+/aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
+        )[2],
+        True,
+    )
+
+  def test_invalid_tag_not_cached(self):
+    validator = buildtags.TagValidator('new')
+    for _ in xrange(2):
+      with self.assertRaises(errors.InvalidInputError):
+        validator.validate(['build_address:1'])
+
+  def test_builder_checked_per_list(self):
+    validator = buildtags.TagValidator('new')
+    validator.validate(['builder:a'], builder='a')
+    with self.assertRaises(errors.InvalidInputError):
+      validator.validate(['builder:a'], builder='b')
+
+  @mock.patch('buildtags.validate_buildset', autospec=True)
+  def test_batch(self, validate_buildset):
+    # Simulates validation of a batch of 1000 builds for the same CL.
+    validator = buildtags.TagValidator('new')
+    common = [
+        'buildset:patch/gerrit/chromium-review.googlesource.com/123/4',
+        'user_agent:cq',
+    ]
+    for i in xrange(1000):
+      tags = common + ['builder:b%d' % (i % 10), 'attempt:%d' % i]
+      validator.validate(tags, builder='b%d' % (i % 10))
+    self.assertEqual(validate_buildset.call_count, 1)
+    self.assertEqual(len(validator._parsed), 2 + 10 + 1000)
+
+  def test_benchmark(self):
+    # Times validation of the tags of a 1000-build batch, validating each build
+    # on its own against sharing one TagValidator across the batch.
+    common = [
+        'buildset:patch/gerrit/chromium-review.googlesource.com/123/4',
+        'buildset:commit/gitiles/chromium.googlesource.com/chromium/src/+/%s' %
+        ('a' * 40),
+        'user_agent:cq',
+    ] + ['cq_tag_%d:value' % i for i in xrange(20)]
+    batch = [(common + ['builder:b%d' % (i % 10), 'attempt:%d' % i],
+              'b%d' % (i % 10)) for i in xrange(1000)]
+
+    started = time.time()
+    for tags, builder in batch:
+      buildtags.validate_tags(tags, 'new', builder=builder)
+    per_build = time.time() - started
+
+    started = time.time()
+    validator = buildtags.TagValidator('new')
+    for tags, builder in batch:
+      validator.validate(tags, builder=builder)
+    shared = time.time() - started
+
+    logging.info(
+        'Validated tags of %d builds in %.1fms one build at a time, and in '
+        '%.1fms with a shared TagValidator', len(batch), per_build * 1000,
+        shared * 1000
+    )
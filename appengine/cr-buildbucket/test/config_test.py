@@ -32,6 +32,17 @@ def short_bucket_cfg(cfg):
   return cfg
 
 
+def stored_bucket_cfg(cfg):
+  """Returns a bucket config as stored in Bucket entity."""
+  cfg = short_bucket_cfg(cfg)
+  names = [b.name for b in cfg.swarming.builders]
+  if names:
+    cfg.swarming.ClearField('builders')
+    for n in names:
+      cfg.swarming.builders.add(name=n)
+  return cfg
+
+
 LUCI_CHROMIUM_TRY = test_util.parse_bucket_cfg(
     '''
     name: "luci.chromium.try"
@@ -148,10 +159,124 @@ class ConfigTest(testing.AppengineTestCase):
     config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
     rev, cfg = config.get_bucket('chromium/try')
     self.assertEqual(rev, 'deadbeef')
-    self.assertEqual(cfg, short_bucket_cfg(LUCI_CHROMIUM_TRY))
+    self.assertEqual(cfg, stored_bucket_cfg(LUCI_CHROMIUM_TRY))
 
     self.assertIsNone(config.get_bucket('chromium/nonexistent')[0])
 
+  def test_get_builders_async(self):
+    config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
+    actual = config.get_builders_async([
+        ('chromium/try', 'linux'),
+        ('chromium/try', 'nonexistent'),
+    ]).get_result()
+    self.assertEqual(
+        actual, {
+            ('chromium/try', 'linux'): LUCI_CHROMIUM_TRY.swarming.builders[0],
+            ('chromium/try', 'nonexistent'): None,
+        }
+    )
+
+  def test_get_builders_async_not_migrated(self):
+    # A bucket stored before BUILDER_ENTITIES_SCHEMA_VERSION, with inline
+    # builder configs and no Builder entities.
+    bucket_cfg = copy.deepcopy(LUCI_CHROMIUM_TRY)
+    bucket_cfg.name = 'try'
+    config.Bucket(
+        key=config.Bucket.make_key('chromium', 'try'),
+        entity_schema_version=config.BUILDER_ENTITIES_SCHEMA_VERSION - 1,
+        revision='deadbeef',
+        config=bucket_cfg,
+    ).put()
+    actual = config.get_builders_async([
+        ('chromium/try', 'linux'),
+        ('chromium/try', 'nonexistent'),
+        ('chromium/nonexistent', 'linux'),
+    ]).get_result()
+    self.assertEqual(
+        actual, {
+            ('chromium/try', 'linux'): LUCI_CHROMIUM_TRY.swarming.builders[0],
+            ('chromium/try', 'nonexistent'): None,
+            ('chromium/nonexistent', 'linux'): None,
+        }
+    )
+
+    _, stored = config.get_bucket('chromium/try')
+    actual = config.get_bucket_builders_async('chromium/try',
+                                              stored).get_result()
+    self.assertEqual(actual, list(LUCI_CHROMIUM_TRY.swarming.builders))
+
+  def test_put_bucket_failed(self):
+    bucket_cfg = copy.deepcopy(LUCI_CHROMIUM_TRY)
+    bucket_cfg.swarming.builders.add(name='mac')
+    config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
+
+    with mock.patch('config.Bucket._pre_put_hook', side_effect=Exception):
+      with self.assertRaises(Exception):
+        config.put_bucket('chromium', 'deadbeef2', bucket_cfg)
+
+    # The bucket keeps its revision, so that the next cron run retries.
+    self.assertEqual(config.get_bucket('chromium/try')[0], 'deadbeef')
+    self.assertIsNotNone(
+        config.Builder.make_key('chromium', 'try', 'mac').get()
+    )
+
+  @mock.patch('config.BUILDER_WRITE_BATCH_SIZE', 2)
+  def test_put_bucket_many_builders(self):
+    bucket_cfg = copy.deepcopy(LUCI_CHROMIUM_TRY)
+    for i in xrange(4):
+      bucket_cfg.swarming.builders.add(name='builder%d' % i)
+
+    put_multi = ndb.put_multi
+    batches = []
+
+    def put_multi_outside_transaction(entities):
+      self.assertFalse(ndb.in_transaction())
+      batches.append(len(entities))
+      return put_multi(entities)
+
+    with mock.patch('config.ndb.put_multi', put_multi_outside_transaction):
+      config.put_bucket('chromium', 'deadbeef', bucket_cfg)
+    self.assertEqual(batches, [2, 2, 1])
+    self.assertEqual(len(config.Builder.query().fetch()), 5)
+    self.assertEqual(config.get_bucket('chromium/try')[0], 'deadbeef')
+
+  def test_put_bucket_up_to_date(self):
+    config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
+    with mock.patch('config.Bucket._pre_put_hook') as pre_put_hook:
+      config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
+    self.assertFalse(pre_put_hook.called)
+
+  def test_get_bucket_builders_async(self):
+    bucket_cfg = copy.deepcopy(LUCI_CHROMIUM_TRY)
+    bucket_cfg.swarming.builders.add(name='mac')
+    config.put_bucket('chromium', 'deadbeef', bucket_cfg)
+    _, stored = config.get_bucket('chromium/try')
+    # Simulate a builder deleted concurrently.
+    config.Builder.make_key('chromium', 'try', 'mac').delete()
+    actual = config.get_bucket_builders_async('chromium/try',
+                                              stored).get_result()
+    self.assertEqual(actual, [LUCI_CHROMIUM_TRY.swarming.builders[0]])
+
+  def test_put_builders(self):
+    linux = project_config_pb2.Builder(name='linux', dimensions=['os:Linux'])
+    mac = project_config_pb2.Builder(name='mac', dimensions=['os:Mac'])
+    win = project_config_pb2.Builder(name='win', dimensions=['os:Windows'])
+    self.assertEqual(
+        config.put_builders('chromium', 'try', [linux, mac]), (2, 0)
+    )
+
+    mac.dimensions.append('cpu:x86-64')
+    self.assertEqual(config.put_builders('chromium', 'try', [mac, win]), (2, 1))
+
+    actual = config.Builder.query().fetch()
+    self.assertEqual([b.config for b in actual], [mac, win])
+    self.assertEqual(
+        [b.config_hash for b in actual],
+        [config.Builder.compute_hash(mac),
+         config.Builder.compute_hash(win)],
+    )
+    self.assertEqual(config.put_builders('chromium', 'try', [mac, win]), (0, 0))
+
   def test_get_buckets_async(self):
     config.put_bucket('chromium', 'deadbeef', MASTER_TRYSERVER_CHROMIUM_LINUX)
     config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
@@ -161,9 +286,9 @@ class ConfigTest(testing.AppengineTestCase):
         'chromium/master.tryserver.chromium.linux':
             MASTER_TRYSERVER_CHROMIUM_LINUX,
         'chromium/try':
-            short_bucket_cfg(LUCI_CHROMIUM_TRY),
+            stored_bucket_cfg(LUCI_CHROMIUM_TRY),
         'dart/try':
-            short_bucket_cfg(LUCI_DART_TRY),
+            stored_bucket_cfg(LUCI_DART_TRY),
     }
     self.assertEqual(actual, expected)
 
@@ -172,7 +297,7 @@ class ConfigTest(testing.AppengineTestCase):
     config.put_bucket('chromium', 'deadbeef', MASTER_TRYSERVER_CHROMIUM_WIN)
     bid = 'chromium/try'
     actual = config.get_buckets_async([bid]).get_result()
-    expected = {'chromium/try': short_bucket_cfg(LUCI_CHROMIUM_TRY)}
+    expected = {'chromium/try': stored_bucket_cfg(LUCI_CHROMIUM_TRY)}
     self.assertEqual(actual, expected)
 
   def test_get_buckets_async_with_bucket_ids_not_found(self):
@@ -335,14 +460,14 @@ class ConfigTest(testing.AppengineTestCase):
             id='try',
             entity_schema_version=config.CURRENT_BUCKET_SCHEMA_VERSION,
             revision='deadbeef',
-            config=short_bucket_cfg(LUCI_CHROMIUM_TRY),
+            config=stored_bucket_cfg(LUCI_CHROMIUM_TRY),
         ),
         config.Bucket(
             parent=ndb.Key(config.Project, 'dart'),
             id='try',
             entity_schema_version=config.CURRENT_BUCKET_SCHEMA_VERSION,
             revision='deadbeef',
-            config=short_bucket_cfg(LUCI_DART_TRY),
+            config=stored_bucket_cfg(LUCI_DART_TRY),
         ),
         config.Bucket(
             parent=ndb.Key(config.Project, 'v8'),
@@ -354,6 +479,79 @@ class ConfigTest(testing.AppengineTestCase):
     ]
     self.assertEqual(actual, expected)
 
+    actual = config.Builder.query().fetch()
+    actual = sorted(actual, key=lambda b: b.key)
+    self.assertEqual([b.key for b in actual], [
+        config.Builder.make_key('chromium', 'try', 'linux'),
+        config.Builder.make_key('dart', 'try', 'linux'),
+    ])
+    self.assertEqual(actual[0].config, LUCI_CHROMIUM_TRY.swarming.builders[0])
+    self.assertEqual(actual[1].config, LUCI_DART_TRY.swarming.builders[0])
+
+  @mock.patch('components.config.get_project_configs', autospec=True)
+  def test_cron_update_buckets_puts_changed_builders(self, get_project_configs):
+    bucket_cfg = copy.deepcopy(LUCI_CHROMIUM_TRY)
+    bucket_cfg.swarming.builders.add(name='mac')
+    bucket_cfg.swarming.builders.add(name='win')
+    config.put_bucket('chromium', 'deadbeef', bucket_cfg)
+
+    # In the new revision, "mac" changes, "win" is removed.
+    get_project_configs.return_value = {
+        'chromium': (
+            'new!',
+            parse_cfg(
+                '''
+                buckets {
+                  name: "luci.chromium.try"
+                  swarming {
+                    builders {
+                      name: "linux"
+                      swarming_host: "swarming.example.com"
+                      task_template_canary_percentage { value: 10 }
+                      dimensions: "os:Linux"
+                      dimensions: "pool:luci.chromium.try"
+                      recipe {
+                        cipd_package: "infra/recipe_bundle"
+                        cipd_version: "refs/heads/master"
+                        name: "x"
+                      }
+                    }
+                    builders {
+                      name: "mac"
+                      dimensions: "os:Mac"
+                    }
+                  }
+                }
+                '''
+            ),
+            None,
+        ),
+    }
+
+    with mock.patch('google.appengine.ext.ndb.put_multi',
+                    wraps=ndb.put_multi) as put_multi:
+      config.cron_update_buckets()
+      put_multi.assert_called_once_with([mock.ANY])
+      self.assertEqual(put_multi.call_args[0][0][0].key.id(), 'mac')
+
+    actual = config.Builder.query().fetch()
+    self.assertEqual([b.key.id() for b in actual], ['linux', 'mac'])
+    _, stored = config.get_bucket('chromium/try')
+    self.assertEqual([b.name for b in stored.swarming.builders],
+                     ['linux', 'mac'])
+
+  @mock.patch('components.config.get_project_configs', autospec=True)
+  def test_cron_update_buckets_deletes_builders(self, get_project_configs):
+    config.put_bucket('chromium', 'deadbeef', LUCI_CHROMIUM_TRY)
+    get_project_configs.return_value = {
+        'chromium': ('new!', parse_cfg(''), None),
+    }
+
+    config.cron_update_buckets()
+
+    self.assertEqual(config.Bucket.query().fetch(), [])
+    self.assertEqual(config.Builder.query().fetch(), [])
+
   @mock.patch('components.config.get_project_configs', autospec=True)
   def test_cron_update_buckets_with_existing(self, get_project_configs):
     chromium_buildbucket_cfg = parse_cfg(
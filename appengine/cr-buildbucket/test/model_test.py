@@ -4,6 +4,7 @@
 
 import datetime
 import unittest
+import zlib
 import mock
 
 from google.appengine.ext import ndb
@@ -27,6 +28,14 @@ class BuildTest(testing.AppengineTestCase):
     build.regenerate_lease_key()
     self.assertNotEqual(build.lease_key, 0)
 
+  def test_version(self):
+    build = test_util.build()
+    self.assertIsNone(build.version)
+    build.put()
+    self.assertEqual(build.version, 1)
+    build.put()
+    self.assertEqual(build.key.get().version, 2)
+
   def test_put_with_bad_tags(self):
     build = test_util.build()
     build.tags.append('x')
@@ -41,6 +50,12 @@ class BuildTest(testing.AppengineTestCase):
       ids.extend(model.create_build_ids(now, 5))
     self.assertEqual(ids, sorted(ids, reverse=True))
 
+  def test_create_build_ids_batch(self):
+    ids = model.create_build_ids(datetime.datetime(2015, 2, 24), 1000)
+    self.assertEqual(len(ids), 1000)
+    self.assertEqual(len(set(ids)), 1000)
+    self.assertEqual({a - b for a, b in zip(ids, ids[1:])}, {1 << 4})
+
   def test_build_id_range(self):
     time_low = datetime.datetime(2015, 1, 1)
     time_high = time_low + datetime.timedelta(seconds=10)
@@ -215,19 +230,92 @@ class ToBuildProtosTests(testing.AppengineTestCase):
 
 class BuildStepsTest(testing.AppengineTestCase):
 
+  def mk_steps(self, count, status=common_pb2.SUCCESS):
+    return [
+        step_pb2.Step(
+            name='step%d' % i,
+            status=status,
+            summary_markdown='summary of step %d' % i,
+        ) for i in xrange(count)
+    ]
+
   @mock.patch('model.BuildSteps.MAX_STEPS_LEN', 1000)
   def test_large(self):
     container = build_pb2.Build(steps=[dict(name='x' * 1000)])
     entity = model.BuildSteps()
     entity.write_steps(container)
-    self.assertTrue(entity.step_container_bytes_zipped)
+    self.assertEqual(entity.step_format, model.BuildSteps.FORMAT_COLUMNAR)
+    self.assertLess(entity.stored_size, 1000)
+    entity.put()
+
+    entity = entity.key.get()
+    actual = build_pb2.Build()
+    entity.read_steps(actual)
+    self.assertEqual(actual, container)
+
+  def test_read_container_format(self):
+    container = build_pb2.Build(steps=self.mk_steps(3))
+    entity = model.BuildSteps(
+        key=model.BuildSteps.key_for(ndb.Key(model.Build, 1)),
+        step_container_bytes=zlib.compress(container.SerializeToString()),
+        step_container_bytes_zipped=True,
+    )
     entity.put()
 
     entity = entity.key.get()
+    self.assertIsNone(entity.step_format)
     actual = build_pb2.Build()
     entity.read_steps(actual)
     self.assertEqual(actual, container)
 
+    actual = build_pb2.Build()
+    entity.read_step_index(actual)
+    self.assertEqual(
+        list(actual.steps), [
+            step_pb2.Step(name='step0', status=common_pb2.SUCCESS),
+            step_pb2.Step(name='step1', status=common_pb2.SUCCESS),
+            step_pb2.Step(name='step2', status=common_pb2.SUCCESS),
+        ]
+    )
+
+  @mock.patch('model.BuildSteps.STEP_CHUNK_SIZE', 2)
+  def test_columnar(self):
+    container = build_pb2.Build(id=1, steps=self.mk_steps(5))
+    entity = model.BuildSteps.make(container)
+    self.assertEqual(len(entity.step_chunks), 3)
+    entity.put()
+
+    entity = entity.key.get()
+    actual = build_pb2.Build(steps=self.mk_steps(1))
+    entity.read_steps(actual)
+    self.assertEqual(list(actual.steps), list(container.steps))
+
+    actual = build_pb2.Build()
+    entity.read_step_index(actual)
+    self.assertEqual([s.name for s in actual.steps],
+                     ['step0', 'step1', 'step2', 'step3', 'step4'])
+    self.assertFalse(any(s.summary_markdown for s in actual.steps))
+
+  @mock.patch('model.BuildSteps.STEP_CHUNK_SIZE', 2)
+  def test_patch_reuses_chunks(self):
+    steps = self.mk_steps(5)
+    base = model.BuildSteps.make(build_pb2.Build(id=1, steps=steps))
+
+    steps[3].summary_markdown = 'changed'
+    container = build_pb2.Build(id=1, steps=steps)
+    with mock.patch('zlib.compress', wraps=zlib.compress) as compress:
+      entity = model.BuildSteps.make(container, base=base)
+      # One chunk and the index.
+      self.assertEqual(compress.call_count, 2)
+
+    self.assertIs(entity.step_chunks[0], base.step_chunks[0])
+    self.assertIsNot(entity.step_chunks[1], base.step_chunks[1])
+    self.assertIs(entity.step_chunks[2], base.step_chunks[2])
+
+    actual = build_pb2.Build()
+    entity.read_steps(actual)
+    self.assertEqual(list(actual.steps), steps)
+
   @ndb.transactional
   def cancel_incomplete_steps(self, build_id, end_ts):
     model.BuildSteps.cancel_incomplete_steps_async(
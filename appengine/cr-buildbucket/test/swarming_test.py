@@ -23,6 +23,7 @@ from components import net
 from components import utils
 from testing_utils import testing
 from webob import exc
+import gae_ts_mon
 import mock
 import webapp2
 
@@ -611,6 +612,68 @@ class TaskDefTest(BaseTest):
     ], test_util.ununicode(actual['task_slices'][0]['properties']['command']))
 
 
+  def test_task_template_cache(self):
+    gae_ts_mon.reset_for_unittest(disable=True)
+    swarming._task_templates.clear()
+    builds = [
+        self._test_build(id=1, number=1),
+        self._test_build(id=2, number=2),
+        self._test_build(id=3, number=3, canary=True),
+    ]
+    actual = [self.compute_task_def(b) for b in builds]
+    self.assertEqual(
+        swarming.TASK_TEMPLATE_LOOKUP_COUNT.get({'hit': True}), 1
+    )
+    self.assertEqual(
+        swarming.TASK_TEMPLATE_LOOKUP_COUNT.get({'hit': False}), 2
+    )
+    self.assertEqual(len(swarming._task_templates), 2)
+
+    # Templates do not change the encoded output.
+    for b, task_def in zip(builds, actual):
+      expected = swarming._compute_task_slices_template(b, self.settings)
+      for s in expected:
+        s['properties']['command'] = swarming._compute_command(
+            b, self.settings
+        )
+      self.assertEqual(
+          json.dumps(task_def['task_slices'], sort_keys=True),
+          json.dumps(expected, sort_keys=True),
+      )
+
+    # Slices do not share mutable state.
+    actual[0]['task_slices'][0]['properties']['command'].append('x')
+    self.assertNotIn(
+        'x', actual[1]['task_slices'][0]['properties']['command']
+    )
+
+  @mock.patch('swarming._MAX_TASK_TEMPLATES', 2)
+  def test_task_template_cache_overflow(self):
+    gae_ts_mon.reset_for_unittest(disable=True)
+    swarming._task_templates.clear()
+    self.compute_task_def(self._test_build(id=1))
+    self.compute_task_def(self._test_build(id=2, canary=True))
+    # Use the first template again, so that it is not the least recently
+    # used one.
+    self.compute_task_def(self._test_build(id=3))
+    self.compute_task_def(
+        self._test_build(id=4, input=dict(experimental=True))
+    )
+    self.assertEqual(len(swarming._task_templates), 2)
+    self.assertEqual(
+        swarming.TASK_TEMPLATE_LOOKUP_COUNT.get({'hit': True}), 1
+    )
+
+    # The first template survived the eviction, the canary one did not.
+    self.compute_task_def(self._test_build(id=5))
+    self.assertEqual(
+        swarming.TASK_TEMPLATE_LOOKUP_COUNT.get({'hit': True}), 2
+    )
+    self.compute_task_def(self._test_build(id=6, canary=True))
+    self.assertEqual(
+        swarming.TASK_TEMPLATE_LOOKUP_COUNT.get({'hit': True}), 2
+    )
+
   def test_experimental(self):
     build = self._test_build(input=dict(experimental=True))
     actual = self.compute_task_def(build)
@@ -110,10 +110,12 @@ def validate_gitiles_commit(commit, require_ref=True):
       _validate_hex_sha1(commit.id)
 
 
-def validate_tags(string_pairs, mode):
+def validate_tags(string_pairs, mode, tag_validator=None):
   """Validates a list of common.StringPair tags.
 
   For mode, see buildtags.validate_tags docstring.
+  If tag_validator is specified, it must be a buildtags.TagValidator for the
+  same mode. Pass the same validator to validate tags of many builds.
   """
   for p in string_pairs:
     if ':' in p.key:
@@ -121,7 +123,9 @@ def validate_tags(string_pairs, mode):
 
   with _handle_invalid_input_error():
     tags = ['%s:%s' % (p.key, p.value) for p in string_pairs]
-    buildtags.validate_tags(tags, mode)
+    tag_validator = tag_validator or buildtags.TagValidator(mode)
+    assert tag_validator.mode == mode, (tag_validator.mode, mode)
+    tag_validator.validate(tags)
 
 
 ################################################################################
@@ -205,7 +209,12 @@ def validate_requested_dimension(dim, expiration_support=True):
       _enter_err('nanos', 'must be 0')
 
 
-def validate_schedule_build_request(req, legacy=False):
+def validate_schedule_build_request(req, legacy=False, tag_validator=None):
+  """Validates rpc_pb2.ScheduleBuildRequest.
+
+  tag_validator is an optional buildtags.TagValidator in 'new' mode, shared
+  by all requests of a batch.
+  """
   if '/' in req.request_id:  # pragma: no cover
     _enter_err('request_id', 'must not contain /')
 
@@ -240,7 +249,7 @@ def validate_schedule_build_request(req, legacy=False):
   )
 
   with _enter('tags'):
-    validate_tags(req.tags, 'new')
+    validate_tags(req.tags, 'new', tag_validator=tag_validator)
 
   # TODO(crbug.com/926538): add support for dimension expiration
   _check_repeated(
@@ -347,7 +356,7 @@ def validate_update_build_request(req, build_steps=None):
       with _enter('steps'):
         build_steps = build_steps or model.BuildSteps.make(req.build)
         limit = model.BuildSteps.MAX_STEPS_LEN
-        if len(build_steps.step_container_bytes) > limit:
+        if build_steps.stored_size > limit:
           _err('too big to accept')
 
         validate_steps(req.build.steps)
@@ -66,6 +66,7 @@ from infra_libs.ts_mon.common.helpers import ScopedMeasureTime
 
 from infra_libs.ts_mon.common.interface import close
 from infra_libs.ts_mon.common.interface import flush
+from infra_libs.ts_mon.common.interface import register_aggregated_metrics
 from infra_libs.ts_mon.common.interface import register_global_metrics
 from infra_libs.ts_mon.common.interface import register_global_metrics_callback
 
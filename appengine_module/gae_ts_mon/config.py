@@ -7,6 +7,7 @@ import datetime
 import functools
 import logging
 import os
+import random
 import sys
 import time
 import threading
@@ -44,6 +45,40 @@ def _reset_cumulative_metrics():
       metric.reset()
 
 
+class _RequestMetrics(object):
+  """Records http_metrics of the handled requests.
+
+  Requests to an endpoint with a sample interval N are recorded with
+  probability 1/N, and each recorded request counts as N requests.
+  If batch_size > 0, requests are recorded in thread-local batches, which are
+  merged into the metrics before each flush.
+  """
+
+  def __init__(self, sample_intervals=None, batch_size=0, random_fn=None):
+    self._sample_intervals = sample_intervals or {}
+    self._random_fn = random_fn or random.random
+    self._batcher = None
+    if batch_size > 0:
+      self._batcher = http_metrics.ServerMetricsBatcher(batch_size)
+
+  def update(self, endpoint_name, response_status_code, elapsed_ms, **kwargs):
+    weight = self._sample_intervals.get(endpoint_name, 1)
+    if weight > 1 and self._random_fn() * weight >= 1:
+      return
+    update = http_metrics.update_http_server_metrics
+    if self._batcher is not None:
+      update = self._batcher.update
+    update(endpoint_name, response_status_code, elapsed_ms, weight=weight,
+           **kwargs)
+
+  def merge(self):
+    if self._batcher is not None:
+      self._batcher.merge()
+
+
+_request_metrics = _RequestMetrics()
+
+
 _flush_metrics_lock = threading.Lock()
 
 
@@ -97,10 +132,14 @@ def _flush_metrics(time_now):
   entity.last_updated = datetime_now
   entity_deferred = entity.put_async()
 
+  _request_metrics.merge()
+  shared.push_aggregated_metrics(entity.task_num)
+
   interface.flush()
 
   for metric in interface.state.global_metrics.itervalues():
     metric.reset()
+  shared.clear_aggregated_metrics_sums()
 
   entity_deferred.get_result()
   return True
@@ -130,7 +169,8 @@ def _internal_callback():
 
 
 def initialize(app=None, is_enabled_fn=None, cron_module='default',
-               is_local_unittest=None):
+               is_local_unittest=None, request_sample_intervals=None,
+               request_metrics_batch_size=0):
   """Instruments webapp2 `app` with gae_ts_mon metrics.
 
   Instruments all the endpoints in `app` with basic metrics.
@@ -144,7 +184,16 @@ def initialize(app=None, is_enabled_fn=None, cron_module='default',
       /internal/cron/ts_mon/send endpoint. This allows moving the cron job
       to any module the user wants.
     is_local_unittest (bool or None): whether we are running in a unittest.
+    request_sample_intervals (dict or None): {endpoint name: N} to record
+      metrics of only about 1 in N requests to the endpoint, each counted as N
+      requests.  Endpoint names are webapp2 route templates,
+      '/_ah/spi/<Service>.<method>' for Cloud Endpoints and '<module>.<view>'
+      for Django views.
+    request_metrics_batch_size (int): if positive, request metrics are buffered
+      per thread and merged into the metrics every that many requests and
+      before each flush.  This reduces the per-request overhead.
   """
+  global _request_metrics
   if is_local_unittest is None:  # pragma: no cover
     # Since gae_ts_mon.initialize is called at module-scope by appengine apps,
     # AppengineTestCase.setUp() won't have run yet and none of the appengine
@@ -155,6 +204,10 @@ def initialize(app=None, is_enabled_fn=None, cron_module='default',
   if is_enabled_fn is not None:
     interface.state.flush_enabled_fn = is_enabled_fn
 
+  _request_metrics = _RequestMetrics(
+      sample_intervals=request_sample_intervals,
+      batch_size=request_metrics_batch_size)
+
   if app is not None:
     instrument_wsgi_application(app)
     if is_local_unittest or modules.get_current_module_name() == cron_module:
@@ -235,7 +288,7 @@ def _instrumented_dispatcher(dispatcher, request, response, time_fn=time.time):
     # explosion in possible field values.
     name = request.route.template if request.route is not None else ''
 
-    http_metrics.update_http_server_metrics(
+    _request_metrics.update(
         name, response_status, elapsed_ms,
         request_size=request.content_length,
         response_size=response.content_length,
@@ -289,8 +342,7 @@ def instrument_endpoint(time_fn=time.time):
         if flush_thread:
           flush_thread.join()
         elapsed_ms = int((time_fn() - start_time) * 1000)
-        http_metrics.update_http_server_metrics(
-            endpoint_name, response_status, elapsed_ms)
+        _request_metrics.update(endpoint_name, response_status, elapsed_ms)
     return decorated
   return decorator
 
@@ -346,7 +398,7 @@ class DjangoMiddleware(object):
     if hasattr(response, 'content'):
       response_size = len(response.content)
 
-    http_metrics.update_http_server_metrics(
+    _request_metrics.update(
         state['name'],
         response.status_code,
         duration_secs * 1000,
@@ -357,4 +409,7 @@ class DjangoMiddleware(object):
 
 
 def reset_for_unittest(disable=False):
+  global _request_metrics
+  _request_metrics = _RequestMetrics()
   interface.reset_for_unittest(disable=disable)
+  shared.reset_for_unittest()
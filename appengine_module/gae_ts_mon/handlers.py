@@ -81,6 +81,7 @@ class SendHandler(webapp2.RequestHandler):
       _assign_task_num()
 
     interface.invoke_global_callbacks()
+    shared.collect_aggregated_metrics()
 
 
 class TSMonJSHandler(webapp2.RequestHandler):
@@ -223,7 +224,10 @@ class TSMonJSHandler(webapp2.RequestHandler):
           dist_value = distribution.Distribution(bucketer=metric.bucketer)
           dist_value.sum = value.get('sum', 0)
           dist_value.count = value.get('count', 0)
-          dist_value.buckets.update(value.get('buckets', {}))
+          buckets = value.get('buckets', {})
+          dist_value.bucket_counts = [
+              buckets.get(i, 0)
+              for i in xrange(metric.bucketer.total_buckets)]
           metric.set(dist_value, fields=fields)
         else:
           metric.set(value, fields=fields)
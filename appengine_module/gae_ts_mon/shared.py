@@ -3,11 +3,18 @@
 # found in the LICENSE file.
 
 import contextlib
+import itertools
+import json
+import logging
+import time
+import uuid
 
 from google.appengine.api import modules
 from google.appengine.api import namespace_manager
 from google.appengine.ext import ndb
 
+from infra_libs.ts_mon.common import distribution
+from infra_libs.ts_mon.common import interface
 from infra_libs.ts_mon.common import metrics
 
 REGION = 'appengine'
@@ -20,6 +27,9 @@ INSTANCE_NAMESPACE = 'ts_mon_instance_namespace'
 INSTANCE_EXPIRE_SEC = 30 * 60
 INSTANCE_EXPECTED_TO_HAVE_TASK_NUM_SEC = 5 * 60
 INTERNAL_CALLBACK_NAME = '__gae_ts_mon_callback'
+# Number of AggregatedMetricsShard entities per module.  Instances push into
+# different shards to avoid contention on a single entity group.
+AGGREGATION_SHARDS = 16
 
 
 appengine_default_version = metrics.StringMetric(
@@ -75,3 +85,195 @@ def instance_namespace_context():
 def get_instance_entity():
   with instance_namespace_context():
     return Instance.get_or_insert(instance_key_id())
+
+
+class AggregatedMetricsShard(ndb.Model):
+  """Sums of aggregated metric values pushed by instances of a module.
+
+  See interface.register_aggregated_metrics.  The key is <module>.<shard>.
+  `values` is {metric name: {JSON list of field values: value}}, where the
+  value of a distribution is a dict with keys "sum", "count" and "buckets".
+  The sums only grow, so they are sent as cumulative values starting at the
+  time the cell was first pushed, in `start_times` {metric name: {JSON list of
+  field values: time}}.  Cells pushed before `start_times` existed start at
+  `start_time`, when the shard was created.
+  `pushes` is {instance id: [push id, time]}, the last push applied for each
+  instance, so that retrying a push is a no-op if it was already applied.
+  """
+
+  @classmethod
+  def _get_kind(cls):
+    return 'TSMonAggregatedMetricsShard'
+
+  module = ndb.StringProperty()
+  values = ndb.JsonProperty(compressed=True)
+  start_time = ndb.FloatProperty()
+  start_times = ndb.JsonProperty(compressed=True)
+  pushes = ndb.JsonProperty(compressed=True)
+
+
+# Modules whose sums were set by collect_aggregated_metrics() since the last
+# clear_aggregated_metrics_sums().
+_collected_modules = set()
+
+# (shard key, module, push id, deltas) of the values taken by push_aggregated_metrics()
+# which were not pushed yet, or None.
+_pending_push = None
+
+
+def aggregated_target_fields(module):
+  """Returns the target fields of the sums of aggregated metrics."""
+  return {
+      'task_num': 0,
+      'hostname': '',
+      'job_name': module,
+  }
+
+
+def _to_json_value(value):
+  if isinstance(value, distribution.Distribution):
+    return {
+        'sum': value.sum,
+        'count': value.count,
+        'buckets': list(value.bucket_counts),
+    }
+  return value
+
+
+def _from_json_value(metric, value):
+  if isinstance(metric, metrics.CumulativeDistributionMetric):
+    dist = distribution.Distribution(metric.bucketer)
+    dist.sum = value['sum']
+    dist.count = value['count']
+    dist.bucket_counts = list(value['buckets'])
+    return dist
+  return value
+
+
+def _add_json_values(a, b):
+  if not a:
+    return b
+  if isinstance(a, dict):
+    return {
+        'sum': a['sum'] + b['sum'],
+        'count': a['count'] + b['count'],
+        'buckets': [x + y for x, y in itertools.izip_longest(
+            a['buckets'], b['buckets'], fillvalue=0)],
+    }
+  return a + b
+
+
+@ndb.transactional
+def _add_to_shard(key, module, instance_id, push_id, deltas, time_now):
+  shard = key.get()
+  if shard is None:
+    shard = AggregatedMetricsShard(
+        key=key, module=module, values={}, start_time=time_now)
+  pushes = shard.pushes or {}
+  if pushes.get(instance_id, [None])[0] == push_id:
+    # A previous attempt was committed, although it seemed to fail.
+    return
+  start_times = shard.start_times or {}
+  for name, cells in deltas.iteritems():
+    sums = shard.values.setdefault(name, {})
+    cell_start_times = start_times.setdefault(name, {})
+    for fields, value in cells.iteritems():
+      if fields not in cell_start_times:
+        cell_start_times[fields] = (
+            shard.start_time if fields in sums else time_now)
+      sums[fields] = _add_json_values(sums.get(fields), value)
+  # Forget the instances which stopped pushing.
+  pushes = {
+      instance: push for instance, push in pushes.iteritems()
+      if push[1] > time_now - INSTANCE_EXPIRE_SEC
+  }
+  pushes[instance_id] = [push_id, time_now]
+  shard.start_times = start_times
+  shard.pushes = pushes
+  shard.put()
+
+
+def push_aggregated_metrics(task_num, time_fn=time.time):
+  """Moves the values of aggregated metrics of this instance to a shard.
+
+  If the shard can't be updated, the same values are pushed again with the same
+  push id by the next flush, before any new values.  The shard remembers the
+  last push id of each instance, so values are never added twice, even if the
+  transaction was committed despite the error.
+  """
+  global _pending_push
+  if _pending_push is None:
+    store = interface.state.store
+    deltas = {}
+    for name in interface.state.aggregated_metrics:
+      cells = store.take(name, None)
+      if cells:
+        deltas[name] = {
+            json.dumps(fields): _to_json_value(value)
+            for fields, value in cells.iteritems()
+        }
+    if not deltas:
+      return
+    module = interface.state.target.job_name
+    with instance_namespace_context():
+      key = ndb.Key(
+          AggregatedMetricsShard,
+          '%s.%d' % (module, task_num % AGGREGATION_SHARDS))
+    _pending_push = (key, module, uuid.uuid4().hex, deltas)
+
+  key, module, push_id, deltas = _pending_push
+  try:
+    _add_to_shard(key, module, instance_key_id(), push_id, deltas, time_fn())
+  except Exception:
+    logging.exception('Failed to push aggregated metrics, will retry.')
+    return
+  _pending_push = None
+
+
+def collect_aggregated_metrics():
+  """Sets the sums of aggregated metrics pushed by all instances.
+
+  Called by the cron job.  The sums are sent by the next flush of this instance
+  and cleared after it, like global metrics.
+  """
+  with instance_namespace_context():
+    shards = AggregatedMetricsShard.query().fetch()
+
+  # {(module, metric name, fields): value}.
+  sums = {}
+  # {(module, metric name, fields): the earliest start time}.
+  start_times = {}
+  for shard in shards:
+    shard_start_times = shard.start_times or {}
+    for name, cells in shard.values.iteritems():
+      cell_start_times = shard_start_times.get(name, {})
+      for fields, value in cells.iteritems():
+        key = (shard.module, name, fields)
+        sums[key] = _add_json_values(sums.get(key), value)
+        start_time = cell_start_times.get(fields, shard.start_time)
+        start_times[key] = min(start_times.get(key, start_time), start_time)
+
+  for key, value in sums.iteritems():
+    module, name, fields = key
+    metric = interface.state.aggregated_metrics.get(name)
+    if metric is None:
+      # Not aggregated by this version of the app.
+      continue
+    interface.state.store.set(
+        name, tuple(json.loads(fields)), aggregated_target_fields(module),
+        _from_json_value(metric, value), start_time=start_times[key])
+    _collected_modules.add(module)
+
+
+def clear_aggregated_metrics_sums():
+  """Clears the sums set by collect_aggregated_metrics()."""
+  while _collected_modules:
+    target_fields = aggregated_target_fields(_collected_modules.pop())
+    for name in interface.state.aggregated_metrics:
+      interface.state.store.take(name, target_fields)
+
+
+def reset_for_unittest():
+  global _pending_push
+  _pending_push = None
+  _collected_modules.clear()
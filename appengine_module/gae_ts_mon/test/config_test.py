@@ -5,6 +5,7 @@
 import copy
 import datetime
 import functools
+import logging
 import os
 import time
 import unittest
@@ -252,6 +253,68 @@ class InstrumentTest(test_case.TestCase):
     self.assertEqual(
         len('success!'), http_metrics.server_response_bytes.get(fields).sum)
 
+  def test_sampled(self):
+    class Handler(webapp2.RequestHandler):
+      def get(self):
+        self.response.write('success!')
+
+    app = webapp2.WSGIApplication([('/', Handler), ('/other', Handler)])
+    config.instrument_wsgi_application(app)
+    random_values = [0.05, 0.15, 0.95, 0.5]
+    request_metrics = config._RequestMetrics(
+        sample_intervals={'^/$': 10}, random_fn=random_values.pop)
+    with mock.patch.object(config, '_request_metrics', request_metrics):
+      for _ in xrange(4):
+        app.get_response('/')
+      app.get_response('/other')
+
+    # Only the request with a random value below 1/10 is recorded.
+    fields = {'name': '^/$', 'status': 200, 'is_robot': False}
+    self.assertEqual(10, http_metrics.server_response_status.get(fields))
+    self.assertEqual(10, http_metrics.server_durations.get(fields).count)
+    fields = {'name': '^/other$', 'status': 200, 'is_robot': False}
+    self.assertEqual(1, http_metrics.server_response_status.get(fields))
+
+  def test_batched(self):
+    class Handler(webapp2.RequestHandler):
+      def get(self):
+        self.response.write('success!')
+
+    app = webapp2.WSGIApplication([('/', Handler)])
+    config.instrument_wsgi_application(app)
+    request_metrics = config._RequestMetrics(batch_size=100)
+    with mock.patch.object(config, '_request_metrics', request_metrics):
+      app.get_response('/')
+      fields = {'name': '^/$', 'status': 200, 'is_robot': False}
+      self.assertIsNone(http_metrics.server_response_status.get(fields))
+      request_metrics.merge()
+    self.assertEqual(1, http_metrics.server_response_status.get(fields))
+
+  def test_benchmark(self):
+    class Handler(webapp2.RequestHandler):
+      def get(self):
+        self.response.write('success!')
+
+    requests = 500
+    durations = {}
+    for name, request_metrics in (
+        ('uninstrumented', None),
+        ('instrumented', config._RequestMetrics()),
+        ('batched', config._RequestMetrics(batch_size=100)),
+        ('sampled', config._RequestMetrics(
+            sample_intervals={'^/$': 10}, batch_size=100))):
+      app = webapp2.WSGIApplication([('/', Handler)])
+      if request_metrics is not None:
+        config.instrument_wsgi_application(app)
+      with mock.patch.object(config, '_request_metrics', request_metrics):
+        start = time.time()
+        for _ in xrange(requests):
+          app.get_response('/')
+        durations[name] = time.time() - start
+    logging.info('Dispatch time per request: %s', ', '.join(
+        '%s %.1fus' % (name, d * 1e6 / requests)
+        for name, d in sorted(durations.iteritems())))
+
   def test_abort(self):
     class Handler(webapp2.RequestHandler):
       def get(self):
@@ -5,10 +5,15 @@
 import unittest
 
 import gae_ts_mon
+import mock
 
 from test_support import test_case
 
+from infra_libs.ts_mon import config
 from infra_libs.ts_mon import shared
+from infra_libs.ts_mon.common import interface
+from infra_libs.ts_mon.common import metrics
+from infra_libs.ts_mon.common import targets
 
 
 class SharedTest(test_case.TestCase):
@@ -22,3 +27,127 @@ class SharedTest(test_case.TestCase):
 
     # Make sure it does not pollute the default namespace.
     self.assertIsNone(shared.Instance.get_by_id(entity.key.id()))
+
+
+class AggregatedMetricsTest(test_case.TestCase):
+  def setUp(self):
+    super(AggregatedMetricsTest, self).setUp()
+
+    config.reset_for_unittest()
+    target = targets.TaskTarget(
+        'test_service', 'test_job', 'test_region', 'test_host')
+    self.mock_state = interface.State(target=target)
+    mock.patch('infra_libs.ts_mon.common.interface.state',
+        new=self.mock_state).start()
+
+    self.counter = metrics.CounterMetric(
+        'test/counter', 'desc', [metrics.StringField('f')])
+    self.dist = metrics.CumulativeDistributionMetric('test/dist', 'desc', None)
+    interface.register_aggregated_metrics([self.counter, self.dist])
+
+  def tearDown(self):
+    mock.patch.stopall()
+    config.reset_for_unittest()
+    super(AggregatedMetricsTest, self).tearDown()
+
+  def test_push_and_collect(self):
+    self.counter.increment_by(2, {'f': 'a'})
+    self.dist.add(5)
+    shared.push_aggregated_metrics(1, time_fn=lambda: 1000)
+    self.assertIsNone(self.counter.get({'f': 'a'}))
+
+    self.counter.increment_by(3, {'f': 'a'})
+    self.counter.increment({'f': 'b'})
+    self.dist.add(7)
+    shared.push_aggregated_metrics(
+        1 + shared.AGGREGATION_SHARDS, time_fn=lambda: 2000)
+    self.counter.increment({'f': 'a'})
+    shared.push_aggregated_metrics(2, time_fn=lambda: 3000)
+
+    with shared.instance_namespace_context():
+      self.assertEqual(2, shared.AggregatedMetricsShard.query().count())
+
+    shared.collect_aggregated_metrics()
+    target_fields = shared.aggregated_target_fields('test_job')
+    self.assertEqual(6, self.counter.get({'f': 'a'}, target_fields))
+    self.assertEqual(1, self.counter.get({'f': 'b'}, target_fields))
+    dist = self.dist.get(target_fields=target_fields)
+    self.assertEqual(12, dist.sum)
+    self.assertEqual(2, dist.count)
+    self.assertIsNone(self.counter.start_time)
+
+    # The values of this instance are not sent, only the sums.
+    self.counter.increment({'f': 'a'})
+    protos = list(interface._generate_proto())
+    self.assertEqual(1, len(protos))
+    collections = protos[0].metrics_collection
+    self.assertEqual(1, len(collections))
+    self.assertEqual(0, collections[0].task.task_num)
+    self.assertEqual('', collections[0].task.host_name)
+
+    # Each cell starts when it was first pushed.
+    start_times = {}
+    for data_set in collections[0].metrics_data_set:
+      for data in data_set.data:
+        key = (data_set.metric_name,
+               data.field[0].string_value if data.field else None)
+        start_times[key] = data.start_timestamp.seconds
+    self.assertEqual({
+        ('/chrome/infra/test/counter', 'a'): 1000,
+        ('/chrome/infra/test/counter', 'b'): 2000,
+        ('/chrome/infra/test/dist', None): 1000,
+    }, start_times)
+
+    shared.clear_aggregated_metrics_sums()
+    self.assertIsNone(self.counter.get({'f': 'a'}, target_fields))
+    self.assertEqual(1, self.counter.get({'f': 'a'}))
+
+  def test_push_nothing(self):
+    shared.push_aggregated_metrics(1)
+    with shared.instance_namespace_context():
+      self.assertEqual(0, shared.AggregatedMetricsShard.query().count())
+
+  def test_push_failure(self):
+    self.counter.increment_by(2, {'f': 'a'})
+    self.dist.add(5)
+    with mock.patch('infra_libs.ts_mon.shared._add_to_shard',
+                    side_effect=Exception):
+      shared.push_aggregated_metrics(1)
+    self.counter.increment({'f': 'a'})
+
+    # The values which failed to be pushed are retried first.
+    shared.push_aggregated_metrics(1)
+    self.assertEqual(1, self.counter.get({'f': 'a'}))
+    shared.collect_aggregated_metrics()
+    target_fields = shared.aggregated_target_fields('test_job')
+    self.assertEqual(2, self.counter.get({'f': 'a'}, target_fields))
+    self.assertEqual(5, self.dist.get(target_fields=target_fields).sum)
+
+    shared.push_aggregated_metrics(1)
+    self.assertIsNone(self.counter.get({'f': 'a'}))
+    shared.collect_aggregated_metrics()
+    self.assertEqual(3, self.counter.get({'f': 'a'}, target_fields))
+
+  def test_push_committed_despite_failure(self):
+    add_to_shard = shared._add_to_shard
+    def add_then_fail(*args):
+      add_to_shard(*args)
+      raise Exception('timeout')
+
+    self.counter.increment_by(2, {'f': 'a'})
+    with mock.patch('infra_libs.ts_mon.shared._add_to_shard',
+                    side_effect=add_then_fail):
+      shared.push_aggregated_metrics(1)
+    # The retry is a no-op, the values are not added twice.
+    shared.push_aggregated_metrics(1)
+    shared.collect_aggregated_metrics()
+    self.assertEqual(2, self.counter.get(
+        {'f': 'a'}, shared.aggregated_target_fields('test_job')))
+
+  def test_collect_unknown_metric(self):
+    self.counter.increment({'f': 'a'})
+    shared.push_aggregated_metrics(1)
+    interface.state.aggregated_metrics = {}
+    shared.collect_aggregated_metrics()
+    self.assertEqual(
+        [], list(interface.state.store.get_all()))
@@ -15,15 +15,18 @@ tree, and it doesn't care what its current directory is.
 """
 
 import collections
+import errno
 import json
 import logging
 import os
 import re
+import tempfile
 
 import requests
 
 from infra.libs.deps2submodules.deps_utils import EvalDepsContent, ExtractUrl
 from infra.libs.deps2submodules.gitlinks import Gitlinks
+from infra.libs.deps2submodules.gitlinks import TreeCache
 from infra.libs.git2 import CalledProcessError
 
 # TODO: move to git2/data and import here
@@ -41,6 +44,91 @@ SubmodData = collections.namedtuple('SubmodData', 'url,revision')
 LOGGER = logging.getLogger(__name__)
 
 
+class DepsCache(object):
+  """Persistent, content-addressed cache of DEPS evaluation results.
+
+  Maps the hash of a DEPS blob to its evaluated submodules (the ``_gitmodules``
+  of a Deps2Submodules), and a (url, ref) pair to the hash it resolved to.
+  Stored as JSON in a file, so that a restarted process does not evaluate and
+  resolve history it has already seen again.
+
+  The results depend on the path prefix and the extra submodules, so the
+  cache is discarded when loaded with a different ``fingerprint``.
+  """
+
+  MAX_DEPS = 4096
+  MAX_REFS = 16384
+
+  def __init__(self, path, fingerprint=None):
+    """
+    @param path: the JSON file; it need not exist yet.
+    @param fingerprint: JSON-serializable value identifying the settings.
+    """
+    self._path = path
+    self._fingerprint = fingerprint
+    self.gitmodules = collections.OrderedDict()
+    self.known_refs = {}
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise  # pragma: no cover
+      return
+    except ValueError:
+      LOGGER.warn('Ignoring corrupt DEPS cache %s', path)
+      return
+    if data.get('fingerprint') != fingerprint:
+      LOGGER.info('Ignoring DEPS cache %s made with other settings', path)
+      return
+    for deps_hash, (content, submodules) in data['gitmodules']:
+      self.gitmodules[str(deps_hash)] = (str(content), collections.OrderedDict(
+          (str(name), SubmodData(url=str(url), revision=str(revision)))
+          for name, url, revision in submodules))
+    for url, ref, sha1 in data['known_refs']:
+      self.known_refs[(str(url), str(ref))] = str(sha1)
+
+  def GetGitmodules(self, deps_hash):
+    gitmodules = self.gitmodules.pop(deps_hash, None)
+    if gitmodules is not None:
+      self.gitmodules[deps_hash] = gitmodules
+    return gitmodules
+
+  def PutGitmodules(self, deps_hash, gitmodules):
+    self.gitmodules.pop(deps_hash, None)
+    self.gitmodules[deps_hash] = gitmodules
+    while len(self.gitmodules) > self.MAX_DEPS:
+      self.gitmodules.popitem(last=False)
+
+  def Save(self):
+    """Atomically writes the cache to its file."""
+    if len(self.known_refs) > self.MAX_REFS:
+      # Forget everything rather than arbitrary entries: refs move on anyway.
+      self.known_refs.clear()
+    data = {
+        'fingerprint': self._fingerprint,
+        'gitmodules': [
+            (deps_hash, (content, [(name, d.url, d.revision)
+                                   for name, d in submodules.iteritems()]))
+            for deps_hash, (content, submodules) in self.gitmodules.iteritems()
+        ],
+        # Failed lookups are not saved, so that they are retried after a
+        # restart.
+        'known_refs': sorted(
+            (url, ref, sha1)
+            for (url, ref), sha1 in self.known_refs.iteritems() if sha1),
+    }
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(self._path)))
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+      os.rename(tmp_path, self._path)
+    except Exception:  # pragma: no cover
+      os.remove(tmp_path)
+      raise
+
+
 class Deps2Submodules(object):
   """Parsed/structured representation of DEPS, that can render as submodules.
 
@@ -50,11 +138,14 @@ class Deps2Submodules(object):
   """
 
   def __init__(self, deps_contents, refs_resolver,
-               path_prefix, extra_submodules=None, _known_refs=None):
+               path_prefix, extra_submodules=None, _known_refs=None,
+               cache=None, _tree_cache=None):
     """Creates a new instance.
 
     @param deps_contents: the (textual) contents of the main DEPS file
     @param refs_resolver: object with a Resolve method for looking up Git refs
+    @param cache: an optional DepsCache, shared with instances made by
+        withUpdatedDeps
 
     TODO: add a (recurse-)DEPS content retriever
     """
@@ -62,19 +153,26 @@ class Deps2Submodules(object):
     self._resolver = refs_resolver
     self._path_prefix = path_prefix
     self._named_deps = extra_submodules or []
-    # a cache of unlimited size(!)
-    self._known_refs = dict(_known_refs) if _known_refs else {}
+    self._cache = cache
+    if cache is not None:
+      self._known_refs = cache.known_refs
+    else:
+      # a cache of unlimited size(!)
+      self._known_refs = dict(_known_refs) if _known_refs else {}
     self._gitmodules = None  # to be computed by Evaluate()
+    # Trees rebuilt by UpdateSubmodules, reused for unchanged directories.
+    self._tree_cache = _tree_cache if _tree_cache is not None else TreeCache()
 
   def withUpdatedDeps(self, deps_contents):
     """Creates a new instance with new deps file content.
 
     But is otherwise a clone of the current instance.  This is useful
     in order to let the new instance preserve the benefit of its "known
-    refs" cache.
+    refs" cache: only deps whose (url, revision) is new are resolved again.
     """
     return Deps2Submodules(deps_contents, self._resolver, self._path_prefix,
-                           self._named_deps, self._known_refs)
+                           self._named_deps, self._known_refs, self._cache,
+                           self._tree_cache)
 
   def _Sanitize(self, submods):
     """Resolves conflicts in submodule data.
@@ -242,7 +340,7 @@ class Deps2Submodules(object):
           '\turl = %s' % url])
     return '\n'.join(result_lines) + '\n'
 
-  def Evaluate(self):
+  def Evaluate(self, deps_hash=None):
     """Analyzes dependencies, resolving refs and eliminating conflicts.
 
     The result of the analysis is retained in member variable _gitmodules, in
@@ -251,7 +349,16 @@ class Deps2Submodules(object):
     of a dict of path => SubmodData.  (Reminder: the dict is actually an
     OrderedDict; but remember that the "order" refers to order of insertion, not
     lexicographical order!)
+
+    @param deps_hash: the hash of the DEPS blob.  If given, the result is
+        looked up in and stored to the cache.
     """
+    use_cache = self._cache is not None and deps_hash
+    if use_cache:
+      self._gitmodules = self._cache.GetGitmodules(deps_hash)
+      if self._gitmodules is not None:
+        return
+
     # Collect deps info from content of original DEPS file
     submods = self._CollateCurrentDeps(EvalDepsContent(self._deps_contents))
     # Add "hard-coded" (psuedo-)deps passed in explicitly
@@ -268,6 +375,8 @@ class Deps2Submodules(object):
     # easier to reason about.
     gitmodules_file_content = self._RenderConfig(submodules)
     self._gitmodules = (gitmodules_file_content, submodules)
+    if use_cache:
+      self._cache.PutGitmodules(deps_hash, self._gitmodules)
 
   def UpdateSubmodules(self, repo, origin_commit):
     """Writes a current version of .gitmodules file, and updates gitlinks.
@@ -284,7 +393,8 @@ class Deps2Submodules(object):
     repo.run('update-index',
              '--add', '--cacheinfo', '100644', hsh, '.gitmodules')
 
-    return Gitlinks(repo, hsh, submodule_data, origin_commit).BuildRootTree()
+    return Gitlinks(repo, hsh, submodule_data, origin_commit,
+                    self._tree_cache).BuildRootTree()
 
 
 class GitRefResolver(object):
@@ -31,23 +31,88 @@ trees that we have rebuilt, that need to be added to (or replaced) in their
 parents.
 
 
+Tree objects are encoded and hashed in memory, and the new ones written to the
+repo together at the end.  A tree cache shared between Gitlinks objects maps
+an original subdirectory tree plus its additions to the rebuilt tree, so that
+subdirectories which did not change since the previous commit are not rebuilt
+at all.
+
 If this technique of cobbling together all the necessary internal Git objects
 "by hand" is unfamiliar, it is worth studying the following chapter of the Git
 book: https://git-scm.com/book/en/v2/Git-Internals-Git-Objects.
 """
 
 import collections
-import itertools
 import posixpath
 
 
 # Each item in the stack is a PendingTree object.
 PendingTree = collections.namedtuple('PendingTree', 'path,to_do')
 
+TREE_MODE = '40000'
+
+
+def ParseTree(raw):
+  """Parses the raw content of a Git tree object.
+
+  Returns a dict of name => (mode, hash), where mode is a string like '100644'
+  and hash is a 40-hex-char string.
+  """
+  entries = {}
+  pos = 0
+  while pos < len(raw):
+    space = raw.index(' ', pos)
+    nul = raw.index('\0', space)
+    entries[raw[space+1:nul]] = (
+        raw[pos:space], raw[nul+1:nul+21].encode('hex'))
+    pos = nul + 21
+  return entries
+
+
+def EncodeTree(entries):
+  """Encodes a Git tree object, like `git mktree` does.
+
+  Args:
+    entries: a dict of name => (mode, hash), as returned by ParseTree.
+
+  Returns the raw content of the tree object.
+  """
+  # Git sorts trees as if their names ended with a slash.
+  def _key(item):
+    name, (mode, _) = item
+    return name + '/' if mode == TREE_MODE else name
+  return ''.join(
+      '%s %s\0%s' % (mode, name, hsh.decode('hex'))
+      for name, (mode, hsh) in sorted(entries.iteritems(), key=_key))
+
+
+class TreeCache(object):
+  """Rebuilt trees, by original tree hash and added entries.
+
+  Keeps at most max_size entries, evicting the least recently used.
+  """
+
+  def __init__(self, max_size=4096):
+    self._max_size = max_size
+    self._trees = collections.OrderedDict()
+
+  def get(self, key):
+    hsh = self._trees.pop(key, None)
+    if hsh is not None:
+      self._trees[key] = hsh
+    return hsh
+
+  def put(self, key, hsh):
+    self._trees.pop(key, None)
+    self._trees[key] = hsh
+    while len(self._trees) > self._max_size:
+      self._trees.popitem(last=False)
+
 
 class Gitlinks(object):
 
-  def __init__(self, repo, gitmodules_file_hash, submodules, origin_commit):
+  def __init__(self, repo, gitmodules_file_hash, submodules, origin_commit,
+               tree_cache=None):
     """Instantiates the Gitlink tree builder.
 
     Args:
@@ -61,16 +126,25 @@ class Gitlinks(object):
           the file system path to a submodule, and SubmodData is a
           collections.namedtuple with fields `url` and `revision`, which are
           both strings (revision is a 40-character SHA-1 hash).
-      origin_commit: string containing a Git tree-ish that may be used with
-          an ls-tree command (in the target repo), representing the repo content
-          before any gitlinks or the .gitmodule file have been added to it.
+      origin_commit: string containing a Git tree-ish (in the target repo),
+          representing the repo content before any gitlinks or the .gitmodule
+          file have been added to it.
+      tree_cache: an optional TreeCache, to be shared by the Gitlinks objects
+          building trees into the same repo.
     """
     self._repo = repo
     self._gitmodules_file_hash = gitmodules_file_hash
     self._submodules = submodules
     self._origin_commit = origin_commit
+    self._tree_cache = tree_cache if tree_cache is not None else TreeCache()
     self._stack = [
         PendingTree('./', [_Blob(self._gitmodules_file_hash, '.gitmodules')])]
+    # The new tree objects, as (content, 'tree') tuples, and the TreeCache
+    # entries to add once they are written.
+    self._new_trees = []
+    self._new_cache_entries = []
+    # Original trees, by path.
+    self._origin_trees = {}
 
 
   def BuildRootTree(self):
@@ -115,6 +189,9 @@ class Gitlinks(object):
           self._PushMulti(sub_dir, path, data)
 
     root_hash = self._PopRemainingSubdirs()
+    self._repo.intern_many(self._new_trees)
+    for key, hsh in self._new_cache_entries:
+      self._tree_cache.put(key, hsh)
     return root_hash
 
 
@@ -176,6 +253,26 @@ class Gitlinks(object):
         return tree_hash
 
 
+  def _OriginTree(self, path):
+    """Returns the hash of the original tree at a "./"-prefixed path, or None.
+
+    Paths which do not exist, or are not directories, yield None.
+    """
+    if path not in self._origin_trees:
+      if path == './':
+        hsh = self._repo.object_info(self._origin_commit + '^{tree}')[0]
+      else:
+        parent, name = path[:-1].rsplit('/', 1)
+        hsh = self._OriginTree(parent + '/')
+        if hsh is not None:
+          entry = self._ReadTree(hsh).get(name)
+          hsh = entry[1] if entry and entry[0] == TREE_MODE else None
+      self._origin_trees[path] = hsh
+    return self._origin_trees[path]
+
+  def _ReadTree(self, hsh):
+    return ParseTree(self._repo.read_object(hsh)[2])
+
   def _Bake(self, pending_tree):
     """Builds a Git tree object with added content (somewhere, recursively).
 
@@ -188,28 +285,21 @@ class Gitlinks(object):
       built, along with the to-do list of things to be added (_Blob, _Tree,
       and/or _Gitlink objects).
     """
-    def _parse(line):
-      parts = line.split('\t')
-      metadata, path = parts
-      return (posixpath.basename(path), metadata)
-
-    # Read the existing tree, convert it to a dict of name:metadata (after
-    # stripping parent directory names).
-    text = self._repo.run('ls-tree', self._origin_commit, pending_tree.path)
-    entries = {k:v for (k, v) in itertools.imap(_parse, text.splitlines())}
-
-    # Add new gitlinks and replace recomputed tree objects.
-    for add in pending_tree.to_do:
-      name, metadata = add.format()
-      entries[name] = metadata
-
-    # Reassemble as lines of text, for input to mktree.
-    def _accumulate(lst, item):
-      name, metadata = item
-      lst.append('%s\t%s' % (metadata, name))
-      return lst
-    lines = reduce(_accumulate, entries.iteritems(), [])
-    tree_hash = self._repo.run('mktree', indata='\n'.join(lines)).rstrip('\n')
+    origin_hash = self._OriginTree(pending_tree.path)
+    additions = tuple(sorted(add.format() for add in pending_tree.to_do))
+    key = (origin_hash, additions)
+    tree_hash = self._tree_cache.get(key)
+    if tree_hash is not None:
+      return tree_hash
+
+    # Start from the existing tree, add new gitlinks and replace recomputed
+    # tree objects.
+    entries = self._ReadTree(origin_hash) if origin_hash else {}
+    entries.update(additions)
+    content = EncodeTree(entries)
+    tree_hash = self._repo.hash_object(content, 'tree')
+    self._new_trees.append((content, 'tree'))
+    self._new_cache_entries.append((key, tree_hash))
     return tree_hash
 
 
@@ -219,7 +309,7 @@ class _Gitlink(object):
     self._name = posixpath.basename(name)
 
   def format(self):
-    return (self._name, '160000 commit %s' % (self._hsh,))
+    return (self._name, ('160000', self._hsh))
 
 
 class _Tree(object):
@@ -229,7 +319,7 @@ class _Tree(object):
     self._name = posixpath.basename(name[:-1])
 
   def format(self):
-    return (self._name, '040000 tree %s' % (self._hsh,))
+    return (self._name, (TREE_MODE, self._hsh))
 
 
 class _Blob(object):
@@ -238,4 +328,4 @@ class _Blob(object):
     self._name = name
 
   def format(self):
-    return (self._name, '100644 blob %s' % (self._hsh,))
+    return (self._name, ('100644', self._hsh))
@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import os
+import shutil
+import tempfile
 import textwrap
 import unittest
 
@@ -13,6 +16,17 @@ from infra.libs.git2.testing_support import TestRepo
 import mock
 
 
+class CountingResolver(object):
+  def __init__(self):
+    self.calls = []
+
+  def Resolve(self, url, ref):
+    self.calls.append((url, ref))
+    if ref == 'missing':
+      return None
+    return ('%040x' % len(self.calls))
+
+
 def _pretty_print(internal_result):
   return (internal_result[0].splitlines(), internal_result[1])
 
@@ -259,3 +273,96 @@ class Deps2SubmodulesTest(unittest.TestCase):
                                           FakeResolver(), 'fount/')
     with self.assertRaises(Exception):
       cut.Evaluate()
+
+
+class DepsCacheTest(unittest.TestCase):
+  DEPS = textwrap.dedent("""\
+      deps = {
+        "fount/one": "https://example.com/xyz/abc@refs/heads/rogue",
+        "fount/two": "https://example.com/xyz/def",
+      }
+      """)
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'cache.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testUpdatedDepsResolvesOnlyChanged(self):
+    resolver = CountingResolver()
+    cut = deps2submodules.Deps2Submodules(self.DEPS, resolver, 'fount/')
+    cut.Evaluate()
+    self.assertEqual(2, len(resolver.calls))
+
+    cut = cut.withUpdatedDeps(self.DEPS.replace('rogue', 'other'))
+    cut.Evaluate()
+    self.assertEqual(resolver.calls[2:],
+                     [('https://example.com/xyz/abc', 'refs/heads/other')])
+
+  def testPersistence(self):
+    resolver = CountingResolver()
+    cache = deps2submodules.DepsCache(self.path, fingerprint=['fount/'])
+    cut = deps2submodules.Deps2Submodules(self.DEPS, resolver, 'fount/',
+                                          cache=cache)
+    cut.Evaluate('a' * 40)
+    expected = cut._gitmodules
+    cut = cut.withUpdatedDeps(self.DEPS + 'vars = {}\n')
+    cut.Evaluate('b' * 40)
+    self.assertEqual(2, len(resolver.calls))
+    cache.Save()
+
+    # A new process evaluates neither the same DEPS...
+    resolver = CountingResolver()
+    cache = deps2submodules.DepsCache(self.path, fingerprint=['fount/'])
+    cut = deps2submodules.Deps2Submodules(None, resolver, 'fount/',
+                                          cache=cache)
+    cut.Evaluate('a' * 40)
+    self.assertEqual(expected, cut._gitmodules)
+    # ...nor the refs it has already resolved.
+    cut = cut.withUpdatedDeps(self.DEPS + 'vars = {"x": 1}\n')
+    cut.Evaluate('c' * 40)
+    self.assertEqual(expected, cut._gitmodules)
+    self.assertEqual([], resolver.calls)
+
+  def testFailedLookupsNotSaved(self):
+    cache = deps2submodules.DepsCache(self.path)
+    cut = deps2submodules.Deps2Submodules(
+        self.DEPS.replace('xyz/def', 'xyz/def@missing'), CountingResolver(),
+        'fount/', cache=cache)
+    with self.assertRaises(Exception):
+      cut.Evaluate('a' * 40)
+    cache.Save()
+    self.assertEqual(
+        1, len(deps2submodules.DepsCache(self.path).known_refs))
+
+  def testOtherFingerprint(self):
+    cache = deps2submodules.DepsCache(self.path, fingerprint=['fount/'])
+    cut = deps2submodules.Deps2Submodules(self.DEPS, CountingResolver(),
+                                          'fount/', cache=cache)
+    cut.Evaluate('a' * 40)
+    cache.Save()
+    cache = deps2submodules.DepsCache(self.path, fingerprint=['other/'])
+    self.assertIsNone(cache.GetGitmodules('a' * 40))
+    self.assertEqual({}, cache.known_refs)
+
+  def testCorrupt(self):
+    with open(self.path, 'w') as f:
+      f.write('{')
+    cache = deps2submodules.DepsCache(self.path)
+    self.assertIsNone(cache.GetGitmodules('a' * 40))
+
+  def testBounded(self):
+    cache = deps2submodules.DepsCache(self.path)
+    cache.MAX_DEPS = 2
+    cache.MAX_REFS = 1
+    for c in 'abc':
+      cache.PutGitmodules(c * 40, ('', {}))
+    cache.GetGitmodules('b' * 40)
+    cache.PutGitmodules('d' * 40, ('', {}))
+    self.assertEqual(['b' * 40, 'd' * 40], cache.gitmodules.keys())
+    cache.known_refs[('u', 'r1')] = 'x' * 40
+    cache.known_refs[('u', 'r2')] = 'y' * 40
+    cache.Save()
+    self.assertEqual({}, deps2submodules.DepsCache(self.path).known_refs)
@@ -53,3 +53,61 @@ class GitlinksTest(unittest.TestCase):
                                submods,
                                commit1.data.tree).BuildRootTree()
     return repo.run('ls-tree', '-r', result).splitlines()
+
+  def testEncodeTreeMatchesMktree(self):
+    repo = TestRepo('repo', TestClock())
+    blob = repo.intern('blob')
+    tree = repo.run('mktree', indata='').strip()
+    gitlink = 'f719efd430d52bcfc8566a43b2eb655688d38871'
+    # Trees sort as if their names ended with '/', so 'a' goes after 'a-b'
+    # and 'a.b' but before 'a0', while the file 'c' goes first.
+    entries = {
+        'a': (gitlinks.TREE_MODE, tree),
+        'a-b': ('100644', blob),
+        'a.b': ('100755', blob),
+        'a0': ('120000', blob),
+        'c': ('100644', blob),
+        'c.d': (gitlinks.TREE_MODE, tree),
+        'sub': ('160000', gitlink),
+    }
+    mktree_input = '\n'.join(
+        '%s %s %s\t%s' % (mode, {gitlinks.TREE_MODE: 'tree',
+                                 '160000': 'commit'}.get(mode, 'blob'),
+                          hsh, name)
+        for name, (mode, hsh) in entries.iteritems())
+    expected = repo.run('mktree', '--missing', indata=mktree_input).strip()
+
+    content = gitlinks.EncodeTree(entries)
+    self.assertEqual(expected, repo.hash_object(content, 'tree'))
+    self.assertEqual(entries, gitlinks.ParseTree(content))
+
+  def testTreeCache(self):
+    repo = TestRepo('repo', TestClock())
+    commit = repo['refs/heads/master'].make_commit('first', {
+        'abc': {'file1': 'hello, world'},
+        'ghi': {'file2': 'good-bye, whirled'},
+    })
+    gitmodules = GitFile('.gitmodules').intern(repo)
+    submods = {
+        'abc/def': SubmodData(
+            revision='8510665149157c2bc901848c3e0b746954e9cbd9', url='unused'),
+        'ghi/jkl': SubmodData(
+            revision='54f9d6da5c91d556e6b54340b1327573073030af', url='unused'),
+    }
+    cache = gitlinks.TreeCache()
+    first = gitlinks.Gitlinks(repo, gitmodules, submods, commit.hsh,
+                              cache).BuildRootTree()
+
+    # Only the root and the changed directory are rebuilt.
+    submods['ghi/jkl'] = SubmodData(
+        revision='fe7900bcbd294970da3296db5cf2020b4391a639', url='unused')
+    links = gitlinks.Gitlinks(repo, gitmodules, submods, commit.hsh, cache)
+    second = links.BuildRootTree()
+    self.assertEqual(2, len(links._new_trees))
+    self.assertNotEqual(first, second)
+    self.assertEqual(
+        repo.run('rev-parse', '%s:abc' % first),
+        repo.run('rev-parse', '%s:abc' % second))
+    uncached = gitlinks.Gitlinks(repo, gitmodules, submods, commit.hsh)
+    self.assertEqual(uncached.BuildRootTree(), second)
+    repo.run('fsck')
@@ -0,0 +1,125 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+from infra.libs.git2.util import CalledProcessError
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CatFile(object):
+  """A long-lived `git cat-file --batch` (or `--batch-check`) co-process.
+
+  Reading objects through it costs a pipe round trip instead of a fork/exec of
+  git per object. Requests are serialized with a lock, so a CatFile may be
+  shared by threads. If git dies, it is restarted on the next request.
+  """
+
+  # How many times a request is sent to a freshly started git if the previous
+  # one died while serving it.
+  RETRIES = 1
+
+  def __init__(self, cwd, check_only=False, env=None):
+    """
+    Args:
+      cwd (str) - the path of the git repo.
+      check_only (bool) - only get the type and size of objects, not their
+        contents (i.e. use --batch-check).
+      env (dict) - the environment of the git process, os.environ if None.
+    """
+    self._cwd = cwd
+    self._check_only = check_only
+    self._env = env
+    self._lock = threading.Lock()
+    self._proc = None
+    self._returncode = None
+
+  def _start(self):
+    cmd = ('git', 'cat-file',
+           '--batch-check' if self._check_only else '--batch')
+    LOGGER.debug('Starting %r in %s', cmd, self._cwd)
+    kwargs = {}
+    if sys.platform != 'win32':  # pragma: no cover
+      kwargs['preexec_fn'] = os.setpgrp
+    with open(os.devnull, 'w') as devnull:
+      self._proc = subprocess.Popen(
+          cmd, cwd=self._cwd, env=self._env, stdin=subprocess.PIPE,
+          stdout=subprocess.PIPE, stderr=devnull, **kwargs)
+
+  def _request(self, name):
+    """Sends one request, returns None if git died while serving it."""
+    if self._proc is None or self._proc.poll() is not None:
+      self._start()
+    try:
+      self._proc.stdin.write(name + '\n')
+      self._proc.stdin.flush()
+      header = self._proc.stdout.readline()
+      if not header.endswith('\n'):
+        return None
+      parts = header.split()
+      if len(parts) != 3:
+        # '<name> missing' or '<name> ambiguous'.
+        return False
+      hsh, typ, size = parts[0], parts[1], int(parts[2])
+      if self._check_only:
+        return hsh, typ, size
+      content = self._proc.stdout.read(size + 1)
+      if len(content) != size + 1:
+        return None
+      return hsh, typ, content[:-1]
+    except IOError:
+      return None
+
+  def get(self, name):
+    """Looks up an object by name.
+
+    Args:
+      name (str) - anything git rev-parse understands that names a single
+        object, e.g. a hash, a ref, 'HEAD~2' or '<commit>:<path>'.
+
+    Returns:
+      (hash, type, content) or, for --batch-check, (hash, type, size). None if
+      there is no such object.
+
+    Raises:
+      CalledProcessError if git keeps dying.
+    """
+    assert '\n' not in name, name
+    with self._lock:
+      for _ in xrange(self.RETRIES + 1):
+        ret = self._request(name)
+        if ret is not None:
+          return ret or None
+        LOGGER.warning('git cat-file died while reading %r, restarting', name)
+        self._stop()
+      raise CalledProcessError(
+          self._returncode, ('git', 'cat-file', name), None, None)
+
+  def _stop(self):
+    if self._proc is None:
+      return
+    proc, self._proc = self._proc, None
+    try:
+      proc.stdin.close()
+    except IOError:  # pragma: no cover
+      pass
+    if proc.poll() is None:
+      try:
+        proc.kill()
+      except OSError:  # pragma: no cover
+        pass
+    proc.wait()
+    proc.stdout.close()
+    self._returncode = proc.returncode
+
+  def close(self):
+    """Stops git. It is restarted if the CatFile is used again."""
+    with self._lock:
+      self._stop()
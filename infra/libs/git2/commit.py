@@ -6,7 +6,6 @@ import logging
 
 from infra.libs.decorators import cached_property
 
-from infra.libs.git2.util import CalledProcessError
 from infra.libs.git2.util import INVALID
 from infra.libs.git2.data import CommitData
 
@@ -48,11 +47,10 @@ class Commit(object):
   @cached_property
   def data(self):
     """Get a structured data representation of this commit."""
-    try:
-      raw_data = self.repo.run('cat-file', 'commit', self.hsh)
-    except CalledProcessError:
+    obj = self.repo.read_object(self.hsh + '^{commit}')
+    if obj is None:
       return INVALID
-    return CommitData.from_raw(raw_data)
+    return CommitData.from_raw(obj[2])
 
   @cached_property
   def parent(self):
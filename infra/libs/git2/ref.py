@@ -2,7 +2,6 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
-from infra.libs.git2.util import CalledProcessError
 from infra.libs.git2.util import INVALID
 
 class Ref(object):
@@ -67,11 +66,10 @@ class Ref(object):
     """Get the Commit at the tip of this Ref."""
     if self._ref is INVALID:
       return INVALID
-    try:
-      return self._repo.get_commit(
-        self._repo.run('rev-parse', self._ref).strip())
-    except CalledProcessError:
+    info = self._repo.object_info(self._ref)
+    if info is None:
       return INVALID
+    return self._repo.get_commit(info[0])
 
   # Methods
   def to(self, other, path=None, first_parent=False):
@@ -4,17 +4,21 @@
 
 import collections
 import errno
+import hashlib
 import logging
 import os
 import shutil
 import signal
+import struct
 import subprocess
 import sys
 import tempfile
 import threading
 import time
 import urlparse
+import zlib
 
+from infra.libs.git2.cat_file import CatFile
 from infra.libs.git2.commit import Commit
 from infra.libs.git2.ref import Ref
 from infra.libs.git2.util import CalledProcessError, INVALID
@@ -29,6 +33,13 @@ class Repo(object):
   """
   MAX_CACHE_SIZE = 1024
 
+  # Like git's fetch.unpackLimit: intern_many() writes fewer new objects than
+  # this as loose objects, and more as a pack.
+  UNPACK_LIMIT = 100
+
+  # Pack object type ids, see Documentation/technical/pack-format.txt.
+  PACK_TYPES = {'commit': 1, 'tree': 2, 'blob': 3, 'tag': 4}
+
   DEFAULT_REFS = (
     'refs/*config',        # e.g. refs/meta/config, refs/infra/config
     'refs/*config/main',   # e.g. refs/gsubtreed-config/main
@@ -57,9 +68,12 @@ class Repo(object):
     self._url = url
     self._repo_path = None
     self._commit_cache = collections.OrderedDict()
+    self._commit_cache_lock = threading.Lock()
     self._log = LOGGER.getChild('Repo')
     self._queued_refs = {}
     self._whitelist_refs = sorted(whitelist_refs)
+    self._cat_file = None
+    self._cat_file_check = None
 
   def __hash__(self):
     return hash((self._url, self._repo_path))
@@ -175,6 +189,7 @@ class Repo(object):
       ensure_config(rpath)
       self._log.debug('%r already initialized', self)
 
+    self.close()
     self._repo_path = rpath
 
   # Representation
@@ -192,21 +207,56 @@ class Repo(object):
 
     If the ``Commit`` does not exist in this ``Repo``, return INVALID and do
     not cache the result.
+
+    May be called from several threads.
     """
-    if hsh in self._commit_cache:
+    with self._commit_cache_lock:
+      r = self._commit_cache.pop(hsh, None)
+    if r is not None:
       self._log.debug('Hit %s', hsh)
-      r = self._commit_cache.pop(hsh)
     else:
       self._log.debug('Miss %s', hsh)
-      if len(self._commit_cache) >= self.MAX_CACHE_SIZE:
-        self._commit_cache.popitem(last=False)
       r = Commit(self, hsh)
       if r.data is INVALID:
         return INVALID
 
-    self._commit_cache[hsh] = r
+    with self._commit_cache_lock:
+      if len(self._commit_cache) >= self.MAX_CACHE_SIZE:
+        self._commit_cache.popitem(last=False)
+      self._commit_cache[hsh] = r
     return r
 
+  def read_object(self, name):
+    """Reads an object through a long-lived `git cat-file --batch` process.
+
+    Args:
+      name (str) - anything which names a single object, e.g. a hash, a ref or
+        '<commit>:<path>'.
+
+    Returns:
+      (hash, type, content) of the object, or None if it does not exist.
+    """
+    if self._cat_file is None:
+      assert self._repo_path is not None
+      self._cat_file = CatFile(self._repo_path)
+    return self._cat_file.get(name)
+
+  def object_info(self, name):
+    """Like read_object, but returns (hash, type, size) without the content."""
+    if self._cat_file_check is None:
+      assert self._repo_path is not None
+      self._cat_file_check = CatFile(self._repo_path, check_only=True)
+    return self._cat_file_check.get(name)
+
+  def close(self):
+    """Stops the git processes used to read objects.
+
+    They are restarted when needed, so the Repo remains usable.
+    """
+    for cat_file in (self._cat_file, self._cat_file_check):
+      if cat_file is not None:
+        cat_file.close()
+
   def refglob(self, *globstrings):
     """Yield every Ref in this repo which matches a ``globstring`` according to
     the rules of git-for-each-ref.
@@ -248,7 +298,7 @@ class Repo(object):
     kwargs.setdefault('stderr', subprocess.PIPE)
     kwargs.setdefault('stdout', subprocess.PIPE)
     indata = kwargs.pop('indata', None)
-    if indata:
+    if indata is not None:
       assert 'stdin' not in kwargs
       kwargs['stdin'] = subprocess.PIPE
 
@@ -309,9 +359,101 @@ class Repo(object):
       sys.stderr.write(errout)
     return output
 
+  @staticmethod
+  def hash_object(data, typ='blob'):
+    """Returns the hash an object would have, without writing it."""
+    data = str(data)
+    return hashlib.sha1('%s %d\0%s' % (typ, len(data), data)).hexdigest()
+
   def intern(self, data, typ='blob'):
-    return self.run(
-        'hash-object', '-w', '-t', typ, '--stdin', indata=str(data)).strip()
+    """Writes an object to the repo, unless it already has it.
+
+    Returns the hash of the object.
+    """
+    return self.intern_many([(data, typ)])[0]
+
+  def intern_many(self, objects):
+    """Writes objects to the repo, skipping those it already has.
+
+    Many new objects are streamed to a single `git index-pack --strict` as one
+    pack, instead of being written one file per object.  Otherwise new blobs
+    are written directly, and other objects are streamed as a pack to a single
+    `git unpack-objects --strict`, which writes them as loose objects.  Both
+    check that the objects are well formed.
+
+    Args:
+      objects (iterable) - (data, type) pairs.
+
+    Returns:
+      The list of hashes of the objects.
+    """
+    hashes = []
+    new = collections.OrderedDict()
+    for data, typ in objects:
+      data = str(data)
+      hsh = self.hash_object(data, typ)
+      hashes.append(hsh)
+      if hsh not in new and self.object_info(hsh) is None:
+        new[hsh] = (data, typ)
+
+    if len(new) >= self.UNPACK_LIMIT:
+      self._write_pack(new.values(), 'index-pack', '--strict', '--stdin')
+    else:
+      others = []
+      for hsh, (data, typ) in new.iteritems():
+        if typ == 'blob':
+          self._write_loose_object(hsh, '%s %d\0%s' % (typ, len(data), data))
+        else:
+          others.append((data, typ))
+      if others:
+        self._write_pack(others, 'unpack-objects', '-q', '--strict')
+    return hashes
+
+  def _write_pack(self, objects, *cmd):
+    """Streams (data, type) objects as a pack of undeltified objects to cmd.
+
+    Like hash-object, cmd should check that the objects are well formed.
+    """
+    with tempfile.TemporaryFile() as f:
+      digest = hashlib.sha1()
+      def write(chunk):
+        digest.update(chunk)
+        f.write(chunk)
+
+      write(struct.pack('>4sLL', 'PACK', 2, len(objects)))
+      for data, typ in objects:
+        # Type and size, as a little-endian base 128 varint after the type.
+        size = len(data)
+        header = [(self.PACK_TYPES[typ] << 4) | (size & 0x0f)]
+        size >>= 4
+        while size:
+          header[-1] |= 0x80
+          header.append(size & 0x7f)
+          size >>= 7
+        write(''.join(chr(b) for b in header))
+        write(zlib.compress(data))
+      f.write(digest.digest())
+      f.seek(0)
+      self.run(*cmd, stdin=f)
+
+  def _write_loose_object(self, hsh, raw):
+    """Writes a loose blob like `git hash-object -w` does."""
+    path = os.path.join(self._repo_path, 'objects', hsh[:2], hsh[2:])
+    try:
+      os.makedirs(os.path.dirname(path))
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise  # pragma: no cover
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='tmp_obj_')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(zlib.compress(raw))
+      os.chmod(tmp_path, 0444)
+      os.rename(tmp_path, path)
+    except Exception:  # pragma: no cover
+      os.remove(tmp_path)
+      raise
 
   def fetch(self, timeout=None):
     """Update all local repo state to match remote.
@@ -323,6 +465,8 @@ class Repo(object):
     self._queued_refs = {}
     LOGGER.debug('fetching %r', self)
     self.run('fetch', stdout=sys.stdout, stderr=sys.stderr, timeout=timeout)
+    # Make sure new packs are seen.
+    self.close()
 
   def fast_forward_push(self, refs_and_commits,
                         include_err=False, timeout=None):
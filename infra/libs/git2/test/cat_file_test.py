@@ -0,0 +1,97 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import logging
+import threading
+import time
+
+from infra.libs import git2
+from infra.libs.git2 import cat_file
+from infra.libs.git2.test import test_util
+
+
+class TestCatFile(test_util.TestBasis):
+  def testGet(self):
+    r = self.mkRepo()
+    c = cat_file.CatFile(r.repo_path)
+    hsh, typ, content = c.get('refs/heads/branch_O')
+    self.assertEqual(hsh, self.repo['O'])
+    self.assertEqual(typ, 'commit')
+    self.assertEqual(content, r.run('cat-file', 'commit', hsh))
+    c.close()
+
+  def testCheckOnly(self):
+    r = self.mkRepo()
+    c = cat_file.CatFile(r.repo_path, check_only=True)
+    hsh, typ, size = c.get('%s^{tree}' % self.repo['O'])
+    self.assertEqual(hsh, r.run('rev-parse', '%s^{tree}' % self.repo['O'])
+                     .strip())
+    self.assertEqual(typ, 'tree')
+    self.assertEqual(size, int(r.run('cat-file', '-s', hsh)))
+    c.close()
+
+  def testMissing(self):
+    r = self.mkRepo()
+    c = cat_file.CatFile(r.repo_path)
+    self.assertIsNone(c.get('refs/heads/doesnt_exist'))
+    self.assertIsNone(c.get('deadbeefdeadbeefdeadbeefdeadbeefdeadbeef'))
+    self.assertEqual(c.get(self.repo['O'])[0], self.repo['O'])
+    c.close()
+
+  def testRestartsDeadGit(self):
+    r = self.mkRepo()
+    c = cat_file.CatFile(r.repo_path)
+    self.assertEqual(c.get(self.repo['O'])[0], self.repo['O'])
+    c._proc.kill()  # pylint: disable=protected-access
+    c._proc.wait()  # pylint: disable=protected-access
+    self.assertEqual(c.get(self.repo['S'])[0], self.repo['S'])
+    c.close()
+    self.assertEqual(c.get(self.repo['F'])[0], self.repo['F'])
+    c.close()
+
+  def testGitKeepsDying(self):
+    r = self.mkRepo()
+    orig_popen = cat_file.subprocess.Popen
+    def mocked_Popen(_cmd, *args, **kwargs):
+      return orig_popen(('git', 'cat-file', '--bogus'), *args, **kwargs)
+    self.mock(cat_file.subprocess, 'Popen', mocked_Popen)
+    c = cat_file.CatFile(r.repo_path)
+    with self.assertRaises(git2.CalledProcessError):
+      c.get(self.repo['O'])
+
+  def testThreads(self):
+    r = self.mkRepo()
+    c = cat_file.CatFile(r.repo_path)
+    names = 'AFOSZ'
+    results = []
+    def read():
+      for name in names * 20:
+        results.append(c.get(self.repo[name])[0] == self.repo[name])
+    threads = [threading.Thread(target=read) for _ in xrange(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(results, [True] * 400)
+    c.close()
+
+  def testBenchmark(self):
+    r = self.mkRepo()
+    hashes = r.run('rev-list', '--all').split() * 10
+
+    started = time.time()
+    for hsh in hashes:
+      r.run('cat-file', 'commit', hsh)
+    per_call = len(hashes) / (time.time() - started)
+
+    c = cat_file.CatFile(r.repo_path)
+    started = time.time()
+    for hsh in hashes:
+      c.get(hsh)
+    batched = len(hashes) / (time.time() - started)
+    c.close()
+
+    logging.info('Read %d commits: %.0f commits/sec with a git per commit, '
+                 '%.0f commits/sec with git cat-file --batch',
+                 len(hashes), per_call, batched)
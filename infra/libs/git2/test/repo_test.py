@@ -8,6 +8,8 @@ import os
 import shutil
 import sys
 
+import mock
+
 from infra.libs import git2
 from infra.libs.git2 import repo
 from infra.libs.git2.test import test_util
@@ -169,7 +171,7 @@ class TestRepo(test_util.TestBasis):
           *args, **kwargs)
     self.mock(repo.subprocess, 'Popen', mocked_Popen)
     # TODO: Flakiness alert. Depends on real time.
-    with self.assertRaises(repo.CalledProcessError):
+    with self.assertRaises(git2.CalledProcessError):
       self.runFastForwardPush(timeout=0.1)
 
   def testEmptyFastForward(self):
@@ -291,6 +293,94 @@ class TestRepo(test_util.TestBasis):
     self.assertIs(r.get_commit('deadbeefdeadbeefdeadbeefdeadbeefdeadbeef'),
                   git2.INVALID)
 
+  def testReadObject(self):
+    r = self.mkRepo()
+    hsh, typ, content = r.read_object('refs/heads/branch_O')
+    self.assertEqual(hsh, self.repo['O'])
+    self.assertEqual(typ, 'commit')
+    self.assertEqual(content, r.run('cat-file', 'commit', hsh))
+    self.assertIsNone(r.read_object('refs/heads/doesnt_exist'))
+
+    hsh, typ, size = r.object_info('refs/heads/branch_O^{tree}')
+    self.assertEqual(typ, 'tree')
+    self.assertEqual(size, int(r.run('cat-file', '-s', hsh)))
+    self.assertIsNone(r.object_info('refs/heads/doesnt_exist'))
+
+    r.close()
+    self.assertEqual(r.read_object(self.repo['S'])[0], self.repo['S'])
+    r.close()
+
+  def testIntern(self):
+    r = self.mkRepo()
+    data = 'some new content\n'
+    hsh = r.intern(data)
+    self.assertEqual(
+        hsh, r.run('hash-object', '-t', 'blob', '--stdin', indata=data).strip())
+    self.assertEqual(r.run('cat-file', 'blob', hsh), data)
+    # Existing objects are not written again.
+    self.assertEqual(r.intern(data), hsh)
+    r.run('fsck')
+
+  def testInternMany(self):
+    r = self.mkRepo()
+    r.UNPACK_LIMIT = 3
+    pack_dir = os.path.join(r.repo_path, 'objects', 'pack')
+    packs = set(os.listdir(pack_dir))
+
+    loose = [('loose %d\n' % i, 'blob') for i in xrange(2)]
+    hashes = r.intern_many(loose)
+    self.assertEqual(hashes, [r.hash_object(d, t) for d, t in loose])
+    self.assertEqual(packs, set(os.listdir(pack_dir)))
+
+    packed = [('packed %d\n' % i, 'blob') for i in xrange(3)]
+    packed.append(('x' * 5000, 'blob'))
+    packed.append(packed[0])
+    commit = r['refs/heads/branch_O'].commit
+    packed.append((commit.data.alter(message_lines=['packed']), 'commit'))
+    hashes = r.intern_many(packed + loose)
+    self.assertEqual(hashes, [r.hash_object(d, t) for d, t in packed + loose])
+    new_packs = set(os.listdir(pack_dir)) - packs
+    self.assertEqual(2, len(new_packs))  # .pack and .idx
+    for (data, _), hsh in zip(packed, hashes):
+      self.assertEqual(r.read_object(hsh)[2], str(data))
+    r.run('fsck')
+
+  def testInternManyLoose(self):
+    r = self.mkRepo()
+    pack_dir = os.path.join(r.repo_path, 'objects', 'pack')
+    packs = set(os.listdir(pack_dir))
+
+    blob = ('loose blob\n', 'blob')
+    tree = ('100644 file\0' + r.hash_object(*blob).decode('hex'), 'tree')
+    commit = r['refs/heads/branch_O'].commit
+    objects = [blob, tree, ('', 'tree'),
+               (commit.data.alter(message_lines=['loose']), 'commit')]
+    with mock.patch.object(r, 'run', wraps=r.run) as run:
+      hashes = r.intern_many(objects)
+    # Trees and commits were written by a single git process.
+    self.assertEqual(
+        [c[0][0] for c in run.call_args_list], ['unpack-objects'])
+    self.assertEqual(hashes, [r.hash_object(d, t) for d, t in objects])
+    self.assertEqual(packs, set(os.listdir(pack_dir)))
+    for (data, _), hsh in zip(objects, hashes):
+      self.assertEqual(r.read_object(hsh)[2], str(data))
+    r.run('fsck')
+
+  def testInternMalformed(self):
+    r = self.mkRepo()
+    r.UNPACK_LIMIT = 2
+    bad = ('not a commit\n', 'commit')
+    with self.assertRaises(git2.CalledProcessError):
+      r.intern(*bad)
+    with self.assertRaises(git2.CalledProcessError):
+      r.intern_many([('blob\n', 'blob'), bad])
+    self.assertIsNone(r.object_info(r.hash_object(*bad)))
+
+  def testInternEmptyTree(self):
+    r = self.mkRepo()
+    self.assertEqual(r.intern('', 'tree'), r.hash_object('', 'tree'))
+    r.run('fsck')
+
   def testNotes(self):
     env = os.environ.copy()
     env.update(self.repo.get_git_commit_env())
@@ -18,6 +18,7 @@ from infra.libs import git2
 from infra.libs.service_utils import outer_loop
 from infra.services.bugdroid import bugdroid
 from infra.services.bugdroid import creds_service
+from infra.services.bugdroid import poller_state
 from infra_libs import logs
 from infra_libs import ts_mon
 
@@ -132,6 +133,9 @@ def main(args):  # pragma: no cover
       sleep_timeout=lambda: 60.0,
       **loop_opts)
 
+  # Fold the poller state log into its snapshot before it gets uploaded.
+  poller_state.CloseStores()
+
   # In case local json file is used, do not upload
   if not opts.configfile and not opts.dryrun:
     update_data(_create_http(opts.credentials_db))
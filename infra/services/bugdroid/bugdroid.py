@@ -20,13 +20,19 @@ from infra.services.bugdroid import gerrit_poller
 from infra.services.bugdroid import gitiles_poller
 from infra.services.bugdroid import log_parser
 from infra.services.bugdroid import monorail_client
+from infra.services.bugdroid import poll
 from infra.services.bugdroid import poller_handlers
+from infra.services.bugdroid import poller_state
 from infra.services.bugdroid import scm_helper
 
 import infra_libs.logs
 from infra_libs import ts_mon
 
 
+# How many pollers may poll at the same time.
+POLL_WORKERS = 16
+
+
 class BugdroidGitPollerHandler(poller_handlers.BasePollerHandler):
   """Handler for updating bugs with information from commits."""
 
@@ -81,30 +87,43 @@ class BugdroidGitPollerHandler(poller_handlers.BasePollerHandler):
       comment = self._CreateMessage(log_entry)
       self.logger.debug(comment)
 
+      # Prepare every issue, then save them all at once.
+      updates = []
+      # (project, exception or None) of every bug.
+      results = []
       for project, bugs in project_bugs.iteritems():
         for bug in bugs:
           try:
             issue = self.monorail_client.get_issue(project, bug)
-            issue.set_comment(comment[:24 * 1024])
-            branch = scm_helper.GetBranch(log_entry)
-            # Apply merge labels if this commit landed on a branch.
-            if branch and not (log_entry.scm in ['git', 'gerrit'] and
-                               scm_helper.GetBranch(log_entry, full=True) in
-                               self.no_merge):
-              self._ApplyMergeMergedLabel(issue, branch)
-            self.logger.debug('Attempting to save issue: %d', issue.id)
-            if not self.test_mode:
-              self.monorail_client.update_issue(
-                  project, issue, log_parser.should_send_email(log_entry.msg))
-            else:
-              self.logger.debug('Test mode, skipping')
-          except Exception:
-            self.bug_comments_metric.increment(
-                {'project': project, 'status': 'failure'})
-            raise
-          else:
-            self.bug_comments_metric.increment(
-                {'project': project, 'status': 'success'})
+          except Exception as e:
+            results.append((project, e))
+            continue
+          issue.set_comment(comment[:24 * 1024])
+          branch = scm_helper.GetBranch(log_entry)
+          # Apply merge labels if this commit landed on a branch.
+          if branch and not (log_entry.scm in ['git', 'gerrit'] and
+                             scm_helper.GetBranch(log_entry, full=True) in
+                             self.no_merge):
+            self._ApplyMergeMergedLabel(issue, branch)
+          self.logger.debug('Attempting to save issue: %d', issue.id)
+          updates.append((project, issue))
+
+      if not self.test_mode:
+        update_errors = self.monorail_client.update_issues(
+            updates, log_parser.should_send_email(log_entry.msg))
+      else:
+        self.logger.debug('Test mode, skipping')
+        update_errors = [None] * len(updates)
+      results.extend((project, error)
+                     for (project, _), error in zip(updates, update_errors))
+
+      for project, error in results:
+        self.bug_comments_metric.increment(
+            {'project': project,
+             'status': 'failure' if error else 'success'})
+      for _, error in results:
+        if error:
+          raise error
 
   def _CreateMessage(self, log_entry):
     msg = ''
@@ -241,9 +260,8 @@ class Bugdroid(object):
   def Execute(self):
     for poller in self.pollers:
       poller.logger.info('Starting Poller "%s".', poller.poller_id)
-      poller.start()
-    for poller in self.pollers:
-      poller.join()
+    poll.PollScheduler(self.pollers, workers=POLL_WORKERS).run()
+    poller_state.GetStore(self.datadir).Sync()
 
 
 def inner_loop(opts):
@@ -19,91 +19,32 @@ Sample Usage:
   p.start()
 """
 
-import collections
-import json
+import datetime
 import logging
+import multiprocessing.pool
 import os
 import sys
 
 from infra.services.bugdroid import gob_helper
 from infra.services.bugdroid import poller_handlers
+from infra.services.bugdroid import poller_state
 from infra.services.bugdroid.poll import Poller
+from infra_libs import ts_mon
 
 
 DEFAULT_LOGGER = logging.getLogger(__name__)
 DEFAULT_LOGGER.addHandler(logging.NullHandler())
 
-
-class FileDict(collections.MutableMapping):
-  """A JSON file-backed dictionary for poller metadata."""
-
-  def __init__(self, backing_file, *args, **kwargs):
-    self.logger = DEFAULT_LOGGER
-    self.__backingstore = backing_file
-    self.logger.debug('Using backing store: %s', self.__backingstore)
-    self.__store = None
-    self._LoadStore()
-    # Call update on the __store, rather than on self, so it doesn't try to
-    # write out each key as it's added.
-    self.__store.update(dict(*args, **kwargs))
-    # Now write it out in case anything changed.
-    self._SaveStore()
-
-  def __getitem__(self, key):
-    return self.__store[key]
-
-  def __setitem__(self, key, value):
-    if self.__store[key] != value:
-      self.__store[key] = value
-      self._SaveStore()
-
-  def __delitem__(self, key):
-    del self.__store[key]
-    self._SaveStore()
-
-  def __iter__(self):
-    return iter(self.__store)
-
-  def __len__(self):
-    return len(self.__store)
-
-  # TODO(mmoss): Generalize backend storage to allow, for instance, either
-  # local files or cloud storage objects (for running on appengine).
-  def _OpenStore(self, mode):
-    if not os.path.exists(self.__backingstore):
-      # Automatically create a JSON stub file if it doesn't exist.
-      self.logger.debug('Creating backing store: %s', self.__backingstore)
-      fp = open(self.__backingstore, 'w')
-      fp.write('{}')
-      fp.close()
-    fp = open(self.__backingstore, mode)
-    return fp
-
-  def _LoadStore(self):
-    fp = self._OpenStore('r')
-    tmp = json.load(fp=fp)
-    fp.close()
-    self.__store = tmp or {}
-
-  def _SaveStore(self):
-    fp = self._OpenStore('w')
-    json.dump(self.__store, fp)
-    fp.close()
-
-  def BatchUpdate(self, commits):
-    """Update method that avoids writing the file on every item change."""
-    dirty = False
-    for key, value in commits.iteritems():
-      if (key not in self.__store) or (self.__store.get(key) != value):
-        self.__store[key] = value
-        dirty = True
-    if dirty:
-      self._SaveStore()
+# How many refs' logs may be fetched from gitiles at the same time.
+REF_WORKERS = 4
 
 
 class GitilesPoller(Poller):
   """Poller for monitoring changes to a git repository using the gitiles web UI.
 
+  The logs of the refs which changed are fetched concurrently, then their
+  commits are processed ref by ref, in order.
+
   Args:
     git_url: The url of the repository to poll.
     poller_id: ID for the poller instance.
@@ -113,13 +54,23 @@ class GitilesPoller(Poller):
       start polling at for each remote ref (i.e. parents of these commits on
       these branches have already been processed). If the commit is empty, any
       previously stored commit for that branch will be cleared.
+    ref_workers: How many refs' logs may be fetched at the same time.
+    state_store: The poller_state.StateStore in which to keep the last
+      processed commits. Defaults to the process-wide store of datadir.
   """
 
+  commit_lag_metric = ts_mon.CumulativeDistributionMetric(
+      'bugdroid/commit_lag',
+      'Seconds between when a commit was committed and when bugdroid '
+      'processed it',
+      [ts_mon.StringField('project')])
+
   def __init__(self, git_url, poller_id, refs_regex=None,
                start_commits=None, interval_in_minutes=3,
                setup_refresh_interval_minutes=0, logger=None, run_once=False,
                with_paths=True, with_diffs=False, paths_regex=None,
-               filter_regex=None, datadir=None):
+               filter_regex=None, datadir=None, ref_workers=REF_WORKERS,
+               state_store=None):
     Poller.__init__(self, interval_in_minutes, setup_refresh_interval_minutes,
                     run_once)
     self.logger = logger or DEFAULT_LOGGER
@@ -131,9 +82,13 @@ class GitilesPoller(Poller):
     self.with_diffs = with_diffs
     self.paths_regex = paths_regex
     self.filter_regex = filter_regex
+    self.ref_workers = ref_workers
 
+    # Older versions kept each poller's state in its own JSON file.
     fn = os.path.join(datadir or '', '%s.json' % self.poller_id)
-    self.last_commits = FileDict(fn)
+    self.last_commits = poller_state.StateDict(
+        state_store or poller_state.GetStore(datadir), self.poller_id,
+        legacy_file=fn)
     self.start_commits = start_commits or {}
 
     # An empty start commit means any previous setting should be cleared.
@@ -188,6 +143,34 @@ class GitilesPoller(Poller):
             {'poller': 'gitiles', 'project': self.poller_id,
              'status': 'success'})
 
+    lag = datetime.datetime.utcnow() - log_entry.committer_datetime
+    self.commit_lag_metric.add(
+        max(0, lag.total_seconds()),
+        {'project': self.poller_id})
+
+  def _GetLogs(self, refs, filter_refs, maxentries):
+    """Fetches the new log entries of each ref, concurrently.
+
+    Returns:
+      A dict of ref to the (entries, nextcommit) of gitiles.GetLogEntries.
+    """
+    def get_log(key):
+      return key, self.gitiles.GetLogEntries(
+          key, ancestor=self.last_commits[key], limit=maxentries,
+          with_paths=self.with_paths, with_diffs=self.with_diffs,
+          filter_paths=self.paths_regex, filter_ref=filter_refs.get(key))
+
+    if len(refs) <= 1 or self.ref_workers <= 1:
+      return dict(map(get_log, refs))
+    # The gitiles http checks connections out of a pool for each request, so
+    # it can be shared by threads.
+    pool = multiprocessing.pool.ThreadPool(min(self.ref_workers, len(refs)))
+    try:
+      return dict(pool.map(get_log, refs))
+    finally:
+      pool.close()
+      pool.join()
+
   def _ProcessRefs(self, refs, filter_refs=None, store_only=False):
     """Detect changes to watched branches and process new commits.
 
@@ -202,17 +185,19 @@ class GitilesPoller(Poller):
     filter_refs = filter_refs or {}
     maxentries = 1000 if self.with_paths else 3000
     # Check for changes to watched branches.
+    changed = []
     for key in refs.iterkeys():
       if refs[key] == self.last_commits[key]:
         continue
       self.logger.debug('"%s" branch changed: %s -> %s', key,
                         self.last_commits[key], refs[key])
-      # Find commits between the stored commit and the current one. If the
-      # stored commit is newer, or not an ancestor, this should be empty.
-      entries, nextcommit = self.gitiles.GetLogEntries(
-          key, ancestor=self.last_commits[key], limit=maxentries,
-          with_paths=self.with_paths, with_diffs=self.with_diffs,
-          filter_paths=self.paths_regex, filter_ref=filter_refs.get(key))
+      changed.append(key)
+    # Find commits between the stored commit and the current one. If the
+    # stored commit is newer, or not an ancestor, this should be empty.
+    logs = self._GetLogs(changed, filter_refs, maxentries)
+
+    for key in changed:
+      entries, nextcommit = logs[key]
       if not entries:
         continue
       if store_only:
@@ -113,6 +113,10 @@ class GitLogEntry(object):
     # used as strings in bug messages.
     return self.__update_date
 
+  @property
+  def committer_datetime(self):
+    return self.__committer_date
+
   def _parse_date(self, timestamp):
     parsers = [
         GitilesHelper.ParseTimeStamp,
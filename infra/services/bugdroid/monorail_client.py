@@ -82,6 +82,9 @@ class SSLErrorLoggingHttp(object):
 
 class MonorailClient(object):
 
+  # How many comments are inserted by a single batch request.
+  MAX_BATCH_SIZE = 50
+
   def __init__(self, credential_store, client=None):
     self._credentials = None
 
@@ -105,10 +108,7 @@ class MonorailClient(object):
     http = SSLErrorLoggingHttp(http)
     return apiclient.http.HttpRequest(http, *args, **kwargs)
 
-  def update_issue(self, project_name, issue, send_email=True):
-    if not issue.dirty:
-      return issue
-
+  def _insert_comment_request(self, project_name, issue, send_email):
     body = {'id': issue.id, 'updates': {}}
     if issue.labels_added:
       body['updates']['labels'] = list(issue.labels_added)
@@ -134,14 +134,67 @@ class MonorailClient(object):
             'Response body:\n%r', resp, content)
         raise
     req.postproc = request_postproc
+    return req
 
-    req.execute(num_retries=5)
-
+  @staticmethod
+  def _saved(issue):
     # Clear the issue comment once it's been saved (shouldn't be re-used)
     issue.comment = ''
     issue.dirty = False
+
+  def update_issue(self, project_name, issue, send_email=True):
+    if not issue.dirty:
+      return issue
+
+    req = self._insert_comment_request(project_name, issue, send_email)
+    req.execute(num_retries=5)
+
+    self._saved(issue)
     return issue
 
+  def update_issues(self, updates, send_email=True):
+    """Saves several issues, batching their comments into few requests.
+
+    Updates which fail as part of a batch are retried one by one.
+
+    Args:
+      updates: list of (project_name, Issue) to save.
+
+    Returns:
+      A list with, for each update, None if it was saved or the exception which
+      prevented it.
+    """
+    errors = [None] * len(updates)
+    pending = [i for i, (_, issue) in enumerate(updates) if issue.dirty]
+    for start in xrange(0, len(pending), self.MAX_BATCH_SIZE):
+      chunk = pending[start:start + self.MAX_BATCH_SIZE]
+      failed = set(chunk)
+      if len(chunk) > 1:
+        def callback(request_id, _response, exception):
+          if exception is None:
+            failed.discard(int(request_id))
+        batch = self.client.new_batch_http_request(callback=callback)
+        for i in chunk:
+          project_name, issue = updates[i]
+          batch.add(
+              self._insert_comment_request(project_name, issue, send_email),
+              request_id=str(i))
+        try:
+          batch.execute()
+        except Exception:
+          logging.exception('Batch update of %d issues failed.', len(chunk))
+
+      for i in chunk:
+        project_name, issue = updates[i]
+        if i not in failed:
+          self._saved(issue)
+          continue
+        try:
+          self.update_issue(project_name, issue, send_email)
+        except Exception as e:
+          errors[i] = e
+    return errors
+
   def get_issue(self, project_name, issue_id):
     """Retrieve a set of issues in a project."""
     entry = self.client.issues().get(
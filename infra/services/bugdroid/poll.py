@@ -3,7 +3,9 @@
 # found in the LICENSE file.
 
 import datetime
+import heapq
 import logging
+import random
 import threading
 import time
 
@@ -43,17 +45,21 @@ class Poller(threading.Thread):
   def setup(self):  # pylint: disable=R0201
     return True
 
+  def poll(self):
+    """Polls once, refreshing the setup first if it is due."""
+    if self.setup_refresh and self.setup_refresh < datetime.datetime.now():
+      LOGGER.info('Re-running Poller setup')
+      self.setup()
+      self.setup_refresh = (
+          datetime.datetime.now() +
+          datetime.timedelta(minutes=self.refresh_interval))
+
+    self.execute()
+
   def run(self):
     try:
       while True:
-        if self.setup_refresh and self.setup_refresh < datetime.datetime.now():
-          LOGGER.info('Re-running Poller setup')
-          self.setup()
-          self.setup_refresh = (
-              datetime.datetime.now() +
-              datetime.timedelta(minutes=self.refresh_interval))
-
-        self.execute()
+        self.poll()
 
         if self.run_once:
           return
@@ -65,3 +71,97 @@ class Poller(threading.Thread):
   def start(self):
     if self.setup():
       super(Poller, self).start()
+
+
+class PollScheduler(object):
+  """Runs the polls of many pollers on a bounded pool of worker threads.
+
+  Instead of a thread sleeping between the polls of each poller, polls are
+  queued by the time they are next due. Each poll is rescheduled a jittered
+  interval after it finishes, so that pollers don't all wake up at once, and a
+  poller is never polled concurrently with itself. Pollers which run_once are
+  polled once, as soon as a worker is free.
+
+  Args:
+    pollers: The Pollers to schedule. Their setup() is run first, and pollers
+      for which it fails are dropped.
+    workers: How many polls may run at the same time.
+    jitter: Fraction of a poller's interval by which its polls are randomly
+      moved earlier or later.
+  """
+
+  poll_lag_metric = ts_mon.CumulativeDistributionMetric(
+      'bugdroid/poll_lag',
+      'Seconds between when a poll was due and when it started',
+      [ts_mon.StringField('poller')])
+
+  def __init__(self, pollers, workers=8, jitter=0.1):
+    self.pollers = pollers
+    self.workers = workers
+    self.jitter = jitter
+    self._cond = threading.Condition()
+    self._queue = []
+    self._running = 0
+    self._stopped = False
+
+  def _Schedule(self, poller, due):
+    """Queues a poll of poller at due. Needs self._cond."""
+    # The id breaks ties without comparing pollers.
+    heapq.heappush(self._queue, (due, id(poller), poller))
+    self._cond.notify()
+
+  def _Jittered(self, interval):
+    return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+  def _Worker(self):
+    while True:
+      with self._cond:
+        while True:
+          if self._stopped or (not self._queue and not self._running):
+            self._cond.notify_all()
+            return
+          now = time.time()
+          if self._queue and self._queue[0][0] <= now:
+            due, _, poller = heapq.heappop(self._queue)
+            self._running += 1
+            break
+          self._cond.wait(self._queue[0][0] - now if self._queue else None)
+
+      poller_id = getattr(poller, 'poller_id', poller.name)
+      self.poll_lag_metric.add(max(0, now - due), {'poller': poller_id})
+      try:
+        poller.poll()
+      except Exception:
+        LOGGER.exception('Unhandled exception polling %s.', poller_id)
+
+      with self._cond:
+        self._running -= 1
+        if not poller.run_once:
+          self._Schedule(poller, time.time() + self._Jittered(poller.interval))
+        self._cond.notify_all()
+
+  def run(self):
+    """Polls until stop() is called, or every poller which runs once has."""
+    now = time.time()
+    with self._cond:
+      for poller in self.pollers:
+        if not poller.setup():
+          continue
+        if poller.run_once:
+          self._Schedule(poller, now)
+        else:
+          # Spread the first polls over the jitter window.
+          self._Schedule(poller, now + poller.interval * self.jitter *
+                         random.random())
+    threads = [threading.Thread(target=self._Worker, name='poll-%d' % i)
+               for i in xrange(min(self.workers, len(self._queue)))]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+  def stop(self):
+    with self._cond:
+      self._stopped = True
+      self._cond.notify_all()
@@ -0,0 +1,213 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Persistent poller state, shared by all the pollers of a process.
+
+Changes are appended to a write-ahead log, one JSON record per update, rather
+than rewriting a whole JSON file for every changed key. Every so often the log
+is compacted into a snapshot, which is written to a temporary file and renamed
+into place, so that a crash never leaves a half-written state behind.
+
+Sample Usage:
+  store = poller_state.GetStore(datadir)
+  last_commits = poller_state.StateDict(store, 'chromium_src_poller')
+  last_commits['refs/heads/master'] = 'deadbeef'
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+
+DEFAULT_LOGGER = logging.getLogger(__name__)
+DEFAULT_LOGGER.addHandler(logging.NullHandler())
+
+SNAPSHOT_FILE = 'poller_state.json'
+LOG_FILE = 'poller_state.log'
+
+
+class StateStore(object):
+  """Namespaced key/value state backed by a snapshot and a write-ahead log.
+
+  Args:
+    datadir: Directory holding the snapshot and log files.
+    fsync_interval: Seconds between fsyncs of the log. Records are always
+      flushed to the OS as they are written, so they survive a crash of the
+      process; fsyncs, which protect against a crash of the machine, are
+      batched across all the updates made within the interval.
+    compact_records: How many records the log may hold before it is compacted
+      into the snapshot.
+  """
+
+  def __init__(self, datadir, fsync_interval=1.0, compact_records=1000):
+    self.logger = DEFAULT_LOGGER
+    self.snapshot_path = os.path.join(datadir, SNAPSHOT_FILE)
+    self.log_path = os.path.join(datadir, LOG_FILE)
+    self.fsync_interval = fsync_interval
+    self.compact_records = compact_records
+    self._lock = threading.Lock()
+    self._namespaces = {}
+    self._log = None
+    self._log_records = 0
+    self._last_fsync = time.time()
+    self._unsynced = False
+    self._Load()
+
+  def _Load(self):
+    if os.path.exists(self.snapshot_path):
+      with open(self.snapshot_path) as fp:
+        self._namespaces = json.load(fp)
+    if os.path.exists(self.log_path):
+      with open(self.log_path) as fp:
+        for line in fp:
+          try:
+            namespace, updates, deletions = json.loads(line)
+          except ValueError:
+            # A record torn by a crash can only be the last one.
+            self.logger.warning('Ignoring truncated record in %s',
+                                self.log_path)
+            break
+          self._Apply(namespace, updates, deletions)
+          self._log_records += 1
+    self.logger.debug('Loaded %d pollers from %s (%d log records)',
+                      len(self._namespaces), self.snapshot_path,
+                      self._log_records)
+    # Start from a clean log, so that a torn record isn't followed by new ones.
+    self._Compact()
+
+  def _Apply(self, namespace, updates, deletions):
+    state = self._namespaces.setdefault(namespace, {})
+    state.update(updates)
+    for key in deletions:
+      state.pop(key, None)
+
+  def _Compact(self):
+    """Writes the snapshot and truncates the log. Needs self._lock."""
+    tmp_path = '%s.tmp' % self.snapshot_path
+    with open(tmp_path, 'w') as fp:
+      json.dump(self._namespaces, fp)
+      fp.flush()
+      os.fsync(fp.fileno())
+    os.rename(tmp_path, self.snapshot_path)
+    # If we crash before the log is truncated, replaying it over the new
+    # snapshot is harmless: records hold values, not deltas.
+    if self._log:
+      self._log.close()
+    self._log = open(self.log_path, 'w')
+    self._log_records = 0
+    self._unsynced = False
+    self._last_fsync = time.time()
+
+  def Has(self, namespace):
+    return namespace in self._namespaces
+
+  def Get(self, namespace):
+    """Returns the (read-only) state dict of namespace."""
+    return self._namespaces.get(namespace, {})
+
+  def Update(self, namespace, updates=None, deletions=()):
+    """Durably applies a batch of changes to namespace as a single record."""
+    updates = updates or {}
+    deletions = list(deletions)
+    with self._lock:
+      self._Apply(namespace, updates, deletions)
+      self._log.write(json.dumps([namespace, updates, deletions]) + '\n')
+      self._log.flush()
+      self._log_records += 1
+      self._unsynced = True
+      if self._log_records >= self.compact_records:
+        self._Compact()
+      elif time.time() - self._last_fsync >= self.fsync_interval:
+        self._Sync()
+
+  def _Sync(self):
+    if self._unsynced:
+      os.fsync(self._log.fileno())
+      self._unsynced = False
+    self._last_fsync = time.time()
+
+  def Sync(self):
+    """Forces pending log records to disk."""
+    with self._lock:
+      self._Sync()
+
+  def Close(self):
+    """Compacts the log and closes the store."""
+    with self._lock:
+      self._Compact()
+      self._log.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def GetStore(datadir):
+  """Returns the process-wide StateStore of datadir."""
+  path = os.path.realpath(datadir or '.')
+  with _stores_lock:
+    if path not in _stores:
+      _stores[path] = StateStore(path)
+    return _stores[path]
+
+
+def CloseStores():
+  """Closes all process-wide stores."""
+  with _stores_lock:
+    for store in _stores.itervalues():
+      store.Close()
+    _stores.clear()
+
+
+class StateDict(collections.MutableMapping):
+  """A dictionary of one poller's state in a StateStore.
+
+  Args:
+    store: The StateStore holding the state.
+    namespace: The key of this state in the store, e.g. the poller id.
+    legacy_file: A JSON file of the state written by an older bugdroid. It is
+      imported the first time the namespace is used.
+  """
+
+  def __init__(self, store, namespace, legacy_file=None):
+    self.logger = DEFAULT_LOGGER
+    self.store = store
+    self.namespace = namespace
+    if not store.Has(namespace):
+      state = {}
+      if legacy_file and os.path.exists(legacy_file):
+        self.logger.info('Importing poller state from %s', legacy_file)
+        with open(legacy_file) as fp:
+          state = json.load(fp) or {}
+      store.Update(namespace, state)
+
+  def __getitem__(self, key):
+    return self.store.Get(self.namespace)[key]
+
+  def __setitem__(self, key, value):
+    state = self.store.Get(self.namespace)
+    if key not in state or state[key] != value:
+      self.store.Update(self.namespace, {key: value})
+
+  def __delitem__(self, key):
+    if key not in self:
+      raise KeyError(key)
+    self.store.Update(self.namespace, deletions=[key])
+
+  def __iter__(self):
+    return iter(self.store.Get(self.namespace))
+
+  def __len__(self):
+    return len(self.store.Get(self.namespace))
+
+  def BatchUpdate(self, commits):
+    """Update method that writes all changed items as a single record."""
+    state = self.store.Get(self.namespace)
+    changed = {key: value for key, value in commits.iteritems()
+               if key not in state or state[key] != value}
+    if changed:
+      self.store.Update(self.namespace, changed)
@@ -14,6 +14,7 @@ from infra.services.bugdroid import gerrit_poller
 from infra.services.bugdroid import gitiles_poller
 from infra.services.bugdroid import gob_helper
 from infra.services.bugdroid import monorail_client
+from infra.services.bugdroid import poller_state
 from infra.services.bugdroid.proto import repo_config_pb2
 from infra_libs import ts_mon
 from google.protobuf import text_format
@@ -24,6 +25,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
   def setUp(self):
     self.monorail_client = mock.create_autospec(
         monorail_client.MonorailClient, spec_set=True, instance=True)
+    self.monorail_client.update_issues.side_effect = (
+        lambda updates, send_email=True: [None] * len(updates))
     self.logger = mock.create_autospec(
         logging.Logger, spec_set=True, instance=True)
     ts_mon.reset_for_unittest()
@@ -57,7 +60,7 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', '{}')
     self.assertFalse(self.monorail_client.get_issue.called)
-    self.assertFalse(self.monorail_client.update_issue.called)
+    self.assertFalse(self.monorail_client.update_issues.called)
 
   def test_process_log_entry_shorten_links(self):
     handler = self._make_handler(shorten_links=True)
@@ -70,8 +73,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', "{'foo': [1234]}")
     self.monorail_client.get_issue.assert_called_once_with('foo', 1234)
-    self.monorail_client.update_issue.assert_called_once_with(
-        'foo', issue, True)
+    self.monorail_client.update_issues.assert_called_once_with(
+        [('foo', issue)], True)
     self.assertEqual(
         'The following revision refers to this bug:\n'
         '  https://example.googlesource.com/foo/+/abcdef\n\n'
@@ -98,8 +101,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', "{'foo': [1234]}")
     self.monorail_client.get_issue.assert_called_once_with('foo', 1234)
-    self.monorail_client.update_issue.assert_called_once_with(
-        'foo', issue, True)
+    self.monorail_client.update_issues.assert_called_once_with(
+        [('foo', issue)], True)
     self.assertEqual(
         'The following revision refers to this bug:\n'
         '  https://example.googlesource.com/foo/+/abcdef\n\n'
@@ -127,7 +130,7 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', "{'foo': [1234]}")
     self.monorail_client.get_issue.assert_called_once_with('foo', 1234)
-    self.assertFalse(self.monorail_client.update_issue.called)
+    self.assertFalse(self.monorail_client.update_issues.called)
     self.assertEqual(1,
         bugdroid.BugdroidGitPollerHandler.bug_comments_metric.get(
             {'project': 'foo', 'status': 'success'}))
@@ -140,7 +143,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
 
     issue = monorail_client.Issue(1234, [])
     self.monorail_client.get_issue.return_value = issue
-    self.monorail_client.update_issue.side_effect = MyException
+    self.monorail_client.update_issues.side_effect = None
+    self.monorail_client.update_issues.return_value = [MyException()]
 
     with self.assertRaises(MyException):
       handler.ProcessLogEntry(self._make_commit('Message\nBug: 1234'))
@@ -160,8 +164,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', "{'bar': [1234]}")
     self.monorail_client.get_issue.assert_called_once_with('bar', 1234)
-    self.monorail_client.update_issue.assert_called_once_with(
-        'bar', issue, True)
+    self.monorail_client.update_issues.assert_called_once_with(
+        [('bar', issue)], True)
     self.assertEqual(
         'The following revision refers to this bug:\n'
         '  https://example.googlesource.com/foo/+/abcdef\n\n'
@@ -186,8 +190,8 @@ class BugdroidGitPollerHandlerTest(unittest.TestCase):
     self.logger.info.assert_called_once_with(
         'Processing commit %s : bugs %s', 'abcdef', "{'foo': [1234]}")
     self.monorail_client.get_issue.assert_called_once_with('foo', 1234)
-    self.monorail_client.update_issue.assert_called_once_with(
-        'foo', issue, True)
+    self.monorail_client.update_issues.assert_called_once_with(
+        [('foo', issue)], True)
     self.assertEqual(
         'The following revision refers to this bug:\n'
         '  https://example.googlesource.com/foo/+/abcdef\n\n'
@@ -256,6 +260,7 @@ class BugdroidTest(unittest.TestCase):
   def tearDown(self):
     mock.patch.stopall()
 
+    poller_state.CloseStores()
     infra_libs.rmtree(self.temp_dir)
 
   def test_construction(self):
@@ -349,13 +354,15 @@ class BugdroidTest(unittest.TestCase):
     mock_poller = mock_poller_ctor.return_value
     mock_poller.poller_id = 'id'
     mock_poller.logger = mock.Mock()
+    mock_poller.run_once = True
+    mock_poller.interval = 60
 
     b = bugdroid.Bugdroid(self.config_file, None, True, self.temp_dir)
     self.assertEquals(mock_poller, b.pollers[0])
 
     b.Execute()
-    mock_poller.start.assert_called_once_with()
-    mock_poller.join.assert_called_once_with()
+    mock_poller.setup.assert_called_once_with()
+    mock_poller.poll.assert_called_once_with()
 
 
 class InnerLoopTest(unittest.TestCase):
@@ -12,6 +12,7 @@ import unittest
 from infra.services.bugdroid import gitiles_poller
 from infra.services.bugdroid import gob_helper
 from infra.services.bugdroid import poller_handlers
+from infra.services.bugdroid import poller_state
 
 from infra_libs import ts_mon
 import infra_libs
@@ -58,7 +59,7 @@ class GitilesPollerTest(unittest.TestCase):
 
   def tearDown(self):
     mock.patch.stopall()
-
+    poller_state.CloseStores()
     infra_libs.rmtree(self.temp_dir)
 
   def test_success(self):
@@ -120,3 +121,26 @@ class GitilesPollerTest(unittest.TestCase):
         {'poller': 'gitiles', 'project': 'foo', 'status': 'error'}))
     self.assertIsNone(self.poller.commits_metric.get(
         {'poller': 'gitiles', 'project': 'foo', 'status': 'success'}))
+
+  def test_fetches_refs_concurrently(self):
+    self.poller.last_commits['refs/heads/branch'] = 'old branch commit'
+    self.gitiles.GetRefs.return_value = ({
+        'refs/heads/master': 'abcdef',
+        'refs/heads/branch': '123456',
+    }, {})
+    logs = {
+        'refs/heads/master': ([LOG_ENTRY_1], None),
+        'refs/heads/branch': ([LOG_ENTRY_2], None),
+    }
+    self.gitiles.GetLogEntries.side_effect = lambda ref, **_kwargs: logs[ref]
+
+    self.poller.execute()
+
+    self.assertEquals(2, self.gitiles.GetLogEntries.call_count)
+    self.assertItemsEqual(
+        [mock.call(LOG_ENTRY_1), mock.call(LOG_ENTRY_2)],
+        self.handler.ProcessLogEntry.call_args_list)
+    self.assertEquals('abcdef', self.poller.last_commits['refs/heads/master'])
+    self.assertEquals('123456', self.poller.last_commits['refs/heads/branch'])
+    self.assertEquals(2, self.poller.commit_lag_metric.get(
+        {'project': 'foo'}).count)
@@ -128,3 +128,84 @@ class MonorailClientTest(unittest.TestCase):
     mock_debug.assert_called_once_with(
         'Error decoding UTF-8 HTTP response.  Response headers:\n%r\n'
         'Response body:\n%r', {'foo': 'bar'}, 'blah blah')
+
+  def _fake_batch(self, failing_ids=()):
+    """Makes new_batch_http_request return a batch failing some requests."""
+    batch = mock.Mock()
+    requests = []
+    batch.add.side_effect = lambda req, request_id: requests.append(request_id)
+    def new_batch_http_request(callback):
+      def execute():
+        for request_id in requests:
+          callback(request_id, {},
+                   Exception() if request_id in failing_ids else None)
+      batch.execute.side_effect = execute
+      return batch
+    self.mock_api_client.new_batch_http_request.side_effect = (
+        new_batch_http_request)
+    return batch
+
+  def test_update_issues_batches(self):
+    batch = self._fake_batch()
+    issues = [monorail_client.Issue(i, []) for i in xrange(3)]
+    for issue in issues:
+      issue.set_comment('hello')
+    clean = monorail_client.Issue(4, [])
+
+    errors = self.client.update_issues(
+        [('foo', issues[0]), ('foo', clean), ('bar', issues[1]),
+         ('foo', issues[2])])
+
+    self.assertEqual([None] * 4, errors)
+    self.assertEqual(3, batch.add.call_count)
+    self.assertEqual(1, batch.execute.call_count)
+    self.assertFalse(self.insert.return_value.execute.called)
+    self.insert.assert_any_call(
+        projectId='bar', issueId=1, sendEmail=True,
+        body={'id': 1, 'updates': {}, 'content': 'hello'})
+    for issue in issues:
+      self.assertFalse(issue.dirty)
+      self.assertEqual('', issue.comment)
+
+  def test_update_issues_splits_batches(self):
+    batch = self._fake_batch()
+    self.client.MAX_BATCH_SIZE = 2
+    issues = [monorail_client.Issue(i, []) for i in xrange(5)]
+    for issue in issues:
+      issue.set_comment('hello')
+
+    errors = self.client.update_issues([('foo', issue) for issue in issues])
+
+    self.assertEqual([None] * 5, errors)
+    # Two batches of two, and a single update executed on its own.
+    self.assertEqual(2, batch.execute.call_count)
+    self.assertEqual(1, self.insert.return_value.execute.call_count)
+
+  def test_update_issues_retries_failures(self):
+    self._fake_batch(failing_ids=('1',))
+    issues = [monorail_client.Issue(i, []) for i in xrange(2)]
+    for issue in issues:
+      issue.set_comment('hello')
+    error = Exception('boom')
+    self.insert.return_value.execute.side_effect = error
+
+    errors = self.client.update_issues([('foo', issue) for issue in issues])
+
+    self.assertEqual([None, error], errors)
+    self.assertEqual(1, self.insert.return_value.execute.call_count)
+    self.assertFalse(issues[0].dirty)
+    self.assertTrue(issues[1].dirty)
+
+  @mock.patch('logging.exception')
+  def test_update_issues_batch_raises(self, _mock_exception):
+    batch = self.mock_api_client.new_batch_http_request.return_value
+    batch.execute.side_effect = Exception('boom')
+    issues = [monorail_client.Issue(i, []) for i in xrange(2)]
+    for issue in issues:
+      issue.set_comment('hello')
+
+    errors = self.client.update_issues([('foo', issue) for issue in issues])
+
+    self.assertEqual([None, None], errors)
+    self.assertEqual(2, self.insert.return_value.execute.call_count)
+    self.assertFalse(any(issue.dirty for issue in issues))
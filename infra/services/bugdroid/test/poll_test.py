@@ -0,0 +1,97 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import mock
+import threading
+import time
+import unittest
+
+from infra.services.bugdroid import poll
+
+from infra_libs import ts_mon
+
+
+class FakePoller(poll.Poller):
+  def __init__(self, name, run_once=False, setup_ok=True, stop_after=None,
+               scheduler=None):
+    poll.Poller.__init__(self, interval_in_minutes=0, run_once=run_once)
+    self.poller_id = name
+    self.setup_ok = setup_ok
+    self.stop_after = stop_after
+    self.scheduler = scheduler
+    self.polls = 0
+    self.concurrent = 0
+    self.max_concurrent = 0
+    self.lock = threading.Lock()
+
+  def setup(self):
+    return self.setup_ok
+
+  def execute(self):
+    with self.lock:
+      self.polls += 1
+      self.concurrent += 1
+      self.max_concurrent = max(self.max_concurrent, self.concurrent)
+    time.sleep(0.001)
+    with self.lock:
+      self.concurrent -= 1
+    if self.stop_after and self.polls >= self.stop_after:
+      self.scheduler.stop()
+
+
+class PollSchedulerTest(unittest.TestCase):
+  def setUp(self):
+    ts_mon.reset_for_unittest()
+
+  def test_run_once(self):
+    pollers = [FakePoller('p%d' % i, run_once=True) for i in xrange(10)]
+    poll.PollScheduler(pollers, workers=3).run()
+
+    self.assertEqual([1] * 10, [p.polls for p in pollers])
+    for p in pollers:
+      self.assertEqual(1, poll.PollScheduler.poll_lag_metric.get(
+          {'poller': p.poller_id}).count)
+
+  def test_skips_failed_setup(self):
+    ok = FakePoller('ok', run_once=True)
+    broken = FakePoller('broken', run_once=True, setup_ok=False)
+    poll.PollScheduler([ok, broken]).run()
+
+    self.assertEqual(1, ok.polls)
+    self.assertEqual(0, broken.polls)
+
+  @mock.patch('infra.services.bugdroid.poll.LOGGER')
+  def test_poll_raises(self, mock_logger):
+    poller = FakePoller('p', run_once=True)
+    poller.execute = mock.Mock(side_effect=Exception('boom'))
+    other = FakePoller('other', run_once=True)
+    poll.PollScheduler([poller, other], workers=1).run()
+
+    self.assertTrue(mock_logger.exception.called)
+    self.assertEqual(1, other.polls)
+
+  def test_repolls_until_stopped(self):
+    scheduler = poll.PollScheduler([], workers=4)
+    stopper = FakePoller('stopper', stop_after=20, scheduler=scheduler)
+    other = FakePoller('other')
+    scheduler.pollers = [stopper, other]
+    scheduler.run()
+
+    self.assertGreaterEqual(stopper.polls, 20)
+    self.assertGreater(other.polls, 0)
+    # A poller is never polled concurrently with itself, even with spare
+    # workers.
+    self.assertEqual(1, stopper.max_concurrent)
+    self.assertEqual(1, other.max_concurrent)
+
+  def test_setup_refresh(self):
+    poller = FakePoller('p', run_once=True)
+    poller.refresh_interval = 5
+    poller.setup_refresh = (
+        poll.datetime.datetime.now() - poll.datetime.timedelta(minutes=1))
+    poller.setup = mock.Mock(return_value=True)
+    poll.PollScheduler([poller]).run()
+
+    self.assertEqual(2, poller.setup.call_count)
+    self.assertGreater(poller.setup_refresh, poll.datetime.datetime.now())
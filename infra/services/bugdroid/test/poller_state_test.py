@@ -0,0 +1,120 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import json
+import mock
+import os
+import tempfile
+import unittest
+
+from infra.services.bugdroid import poller_state
+import infra_libs
+
+
+class StateStoreTest(unittest.TestCase):
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    poller_state.CloseStores()
+    infra_libs.rmtree(self.temp_dir)
+
+  def _ReadLog(self):
+    with open(os.path.join(self.temp_dir, poller_state.LOG_FILE)) as fp:
+      return [json.loads(line) for line in fp]
+
+  def test_persists(self):
+    store = poller_state.StateStore(self.temp_dir)
+    state = poller_state.StateDict(store, 'foo')
+    state['refs/heads/master'] = 'abcdef'
+    state.BatchUpdate({'refs/heads/a': '1', 'refs/heads/b': '2'})
+    del state['refs/heads/a']
+
+    store = poller_state.StateStore(self.temp_dir)
+    state = poller_state.StateDict(store, 'foo')
+    self.assertEqual(dict(state), {
+        'refs/heads/master': 'abcdef', 'refs/heads/b': '2'})
+    self.assertEqual(len(state), 2)
+
+  def test_appends_records(self):
+    store = poller_state.StateStore(self.temp_dir)
+    state = poller_state.StateDict(store, 'foo')
+    state['refs/heads/master'] = 'abcdef'
+    # Unchanged values aren't written again.
+    state['refs/heads/master'] = 'abcdef'
+    state.BatchUpdate({'refs/heads/master': 'abcdef'})
+    state.BatchUpdate({'refs/heads/a': '1', 'refs/heads/master': 'abcdef'})
+    del state['refs/heads/a']
+    with self.assertRaises(KeyError):
+      del state['refs/heads/a']
+    self.assertEqual(self._ReadLog(), [
+        ['foo', {}, []],
+        ['foo', {'refs/heads/master': 'abcdef'}, []],
+        ['foo', {'refs/heads/a': '1'}, []],
+        ['foo', {}, ['refs/heads/a']],
+    ])
+
+  def test_compacts(self):
+    store = poller_state.StateStore(self.temp_dir, compact_records=3)
+    foo = poller_state.StateDict(store, 'foo')
+    bar = poller_state.StateDict(store, 'bar')
+    foo['a'] = '1'
+    self.assertEqual(self._ReadLog(), [])
+    bar['b'] = '2'
+    self.assertEqual(self._ReadLog(), [['bar', {'b': '2'}, []]])
+    with open(os.path.join(self.temp_dir, poller_state.SNAPSHOT_FILE)) as fp:
+      self.assertEqual(json.load(fp), {'foo': {'a': '1'}, 'bar': {}})
+
+    store = poller_state.StateStore(self.temp_dir)
+    self.assertEqual(store.Get('foo'), {'a': '1'})
+    self.assertEqual(store.Get('bar'), {'b': '2'})
+
+  def test_ignores_torn_record(self):
+    store = poller_state.StateStore(self.temp_dir)
+    poller_state.StateDict(store, 'foo')['a'] = '1'
+    with open(os.path.join(self.temp_dir, poller_state.LOG_FILE), 'a') as fp:
+      fp.write('["foo", {"a": "')
+
+    store = poller_state.StateStore(self.temp_dir)
+    self.assertEqual(store.Get('foo'), {'a': '1'})
+    self.assertEqual(self._ReadLog(), [])
+
+  @mock.patch('os.fsync')
+  def test_batches_fsyncs(self, mock_fsync):
+    store = poller_state.StateStore(self.temp_dir, fsync_interval=3600)
+    mock_fsync.reset_mock()
+    state = poller_state.StateDict(store, 'foo')
+    for i in xrange(10):
+      state['a'] = str(i)
+    self.assertFalse(mock_fsync.called)
+    store.Sync()
+    self.assertEqual(mock_fsync.call_count, 1)
+    store.Sync()
+    self.assertEqual(mock_fsync.call_count, 1)
+
+    store.fsync_interval = 0
+    state['a'] = 'b'
+    self.assertEqual(mock_fsync.call_count, 2)
+
+  def test_imports_legacy_file(self):
+    legacy_file = os.path.join(self.temp_dir, 'foo.json')
+    with open(legacy_file, 'w') as fp:
+      json.dump({'refs/heads/master': 'abcdef'}, fp)
+    store = poller_state.StateStore(self.temp_dir)
+    state = poller_state.StateDict(store, 'foo', legacy_file=legacy_file)
+    self.assertEqual(dict(state), {'refs/heads/master': 'abcdef'})
+    state['refs/heads/master'] = '123456'
+
+    # The legacy file is only imported once.
+    state = poller_state.StateDict(store, 'foo', legacy_file=legacy_file)
+    self.assertEqual(dict(state), {'refs/heads/master': '123456'})
+
+  def test_shares_stores(self):
+    store = poller_state.GetStore(self.temp_dir)
+    self.assertIs(poller_state.GetStore(self.temp_dir + '/'), store)
+    poller_state.StateDict(store, 'foo')['a'] = '1'
+    poller_state.CloseStores()
+    self.assertIsNot(poller_state.GetStore(self.temp_dir), store)
+    self.assertEqual(poller_state.GetStore(self.temp_dir).Get('foo'),
+                     {'a': '1'})
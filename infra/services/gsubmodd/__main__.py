@@ -68,11 +68,14 @@ def main(args):  # pragma: no cover
   opts = parse_args(args)
   opts.repo.reify()
 
-  loop_results = outer_loop.loop(
-      task=lambda: gsubmodd.reify_submodules(opts.repo, opts.target,
-          opts.dry_run, opts.limit, opts.extras, opts.epoch),
-      sleep_timeout=lambda: opts.interval,
-      **opts.loop_opts)
+  try:
+    loop_results = outer_loop.loop(
+        task=lambda: gsubmodd.reify_submodules(opts.repo, opts.target,
+            opts.dry_run, opts.limit, opts.extras, opts.epoch),
+        sleep_timeout=lambda: opts.interval,
+        **opts.loop_opts)
+  finally:
+    opts.repo.close()
 
   return 0 if loop_results.success else 1
 
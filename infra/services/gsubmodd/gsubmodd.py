@@ -5,6 +5,7 @@
 import collections
 import itertools
 import logging
+import os
 import re
 
 from infra.libs.deps2submodules import deps2submodules
@@ -22,6 +23,9 @@ LOGGER = logging.getLogger(__name__)
 # We only care about the master branch.
 REF_NAME = 'refs/heads/master'
 
+# Where the DEPS evaluation cache is kept, in the local clone of the target.
+DEPS_CACHE_FILE = 'gsubmodd_deps_cache.json'
+
 # The last commit in chromium/src that was copied from Subversion.
 # Only commits after this can be relied upon to have a suitable DEPS
 # file, so we start here.  (In other repos we can simply start at the
@@ -47,10 +51,18 @@ def reify_submodules(origin_repo, target, dry_run=False,
   origin_repo.fetch()
 
   shadow = repo.Repo(target)
-  shadow.dry_run = dry_run
-  shadow.repos_dir = origin_repo.repos_dir
-  shadow.reify(share_from=origin_repo)
-
+  try:
+    shadow.dry_run = dry_run
+    shadow.repos_dir = origin_repo.repos_dir
+    shadow.reify(share_from=origin_repo)
+    return _reify_submodules(
+        origin_repo, shadow, limit, extra_submodules, epoch)
+  finally:
+    # Stop the git processes reading objects of the shadow repo.
+    shadow.close()
+
+
+def _reify_submodules(origin_repo, shadow, limit, extra_submodules, epoch):
   synth_parent = shadow["refs/heads/master"].commit
   if synth_parent is INVALID:
     # If the shadow repo doesn't have any commits yet (we're just
@@ -91,17 +103,19 @@ def reify_submodules(origin_repo, target, dry_run=False,
   submods = None
   path_prefix = '%s/' % _Humanish(origin_repo.url)
   resolver = deps2submodules.GitRefResolver(shadow)
+  deps_cache = deps2submodules.DepsCache(
+      os.path.join(shadow.repo_path, DEPS_CACHE_FILE),
+      fingerprint=[path_prefix, sorted(extra_submodules or [])])
   commits = origin_repo[processed.hsh].to(origin_repo[REF_NAME],
                                           '', first_parent=True)
   for commit in itertools.islice(commits, limit):
     LOGGER.info("at commit %s" % commit.hsh)
     original_tree = commit.data.to_dict()['tree']
 
-    deps_info = origin_repo.run('ls-tree', commit.hsh, '--', 'DEPS').split()
-    if len(deps_info):
-      # ls-tree output looks something like this:
-      #     100644 blob 726d435df65288b740ea55d38a5070c9870b8172        DEPS
-      deps_hash = deps_info[2]
+    deps_info = origin_repo.object_info('%s:DEPS' % commit.hsh)
+    if deps_info:
+      # (hash, type, size) of the DEPS blob.
+      deps_hash = deps_info[0]
       assert SHA1_RE.match(deps_hash)
       if deps_hash == known_hash:
         # DEPS file has not changed in this commit: no need to repeat
@@ -113,15 +127,14 @@ def reify_submodules(origin_repo, target, dry_run=False,
         pass
       else:
         # new version of DEPS file
-        deps_object_path = '%s:DEPS' % commit.hsh
-        deps_content = origin_repo.run('cat-file', 'blob', deps_object_path)
+        deps_content = origin_repo.read_object(deps_hash)[2]
         if known_hash:
           LOGGER.debug('commit %s has modified DEPS file' % commit.hsh)
           submods = submods.withUpdatedDeps(deps_content)
         else:
           submods = deps2submodules.Deps2Submodules(deps_content,
-              resolver, path_prefix, extra_submodules)
-        submods.Evaluate()
+              resolver, path_prefix, extra_submodules, cache=deps_cache)
+        submods.Evaluate(deps_hash)
         known_hash = deps_hash
 
       try:
@@ -148,6 +161,7 @@ def reify_submodules(origin_repo, target, dry_run=False,
     synth_parent = shadow.get_commit(shadow.intern(data, 'commit'))
     count += 1
 
+  deps_cache.Save()
   if count:
     output = shadow.fast_forward_push({shadow[REF_NAME]:synth_parent},
                                       include_err=True, timeout=PUSH_TIMEOUT)
@@ -18,7 +18,8 @@ from infra_libs import ts_mon
 
 # Return value of parse_args.
 Options = collections.namedtuple('Options',
-                                 'repo loop_opts json_output dry_run')
+                                 'repo loop_opts json_output dry_run '
+                                 'path_workers')
 
 commits_counter = ts_mon.CounterMetric('gsubtreed/commit_count',
     'Number of commits processed by gsubtreed',
@@ -43,6 +44,10 @@ def parse_args(args):  # pragma: no cover
                             '(default: %(default)s)'))
   parser.add_argument('--json_output', metavar='PATH',
                       help='Path to write JSON with results of the run to')
+  parser.add_argument('--path_workers', metavar='N', type=int,
+                      default=gsubtreed.PATH_WORKERS,
+                      help=('How many paths to process in parallel '
+                            '(default: %(default)s)'))
   parser.add_argument('repo', nargs=1, help='The url of the repo to act on.',
                       type=check_url)
   logs.add_argparse_options(parser)
@@ -68,7 +73,8 @@ def parse_args(args):  # pragma: no cover
   ts_mon.process_argparse_options(opts)
   loop_opts = outer_loop.process_argparse_options(opts)
 
-  return Options(repo, loop_opts, opts.json_output, opts.dry_run)
+  return Options(repo, loop_opts, opts.json_output, opts.dry_run,
+                 opts.path_workers)
 
 
 def main(args):  # pragma: no cover
@@ -91,16 +97,20 @@ def run(opts):
 
   summary = collections.defaultdict(int)
   def outer_loop_iteration():
-    success, paths_counts = gsubtreed.inner_loop(opts.repo, cref, opts.dry_run)
+    success, paths_counts = gsubtreed.inner_loop(
+        opts.repo, cref, opts.dry_run, path_workers=opts.path_workers)
     for path, count in paths_counts.iteritems():
       summary[path] += count
       commits_counter.increment_by(count, fields={'path': path})
     return success
 
-  loop_results = outer_loop.loop(
-      task=outer_loop_iteration,
-      sleep_timeout=lambda: cref['interval'],
-      **opts.loop_opts)
+  try:
+    loop_results = outer_loop.loop(
+        task=outer_loop_iteration,
+        sleep_timeout=lambda: cref['interval'],
+        **opts.loop_opts)
+  finally:
+    opts.repo.close()
 
   if opts.json_output:
     with open(opts.json_output, 'w') as f:
@@ -7,22 +7,38 @@ import logging
 import posixpath
 import sys
 import threading
+import time
+
+from multiprocessing.pool import ThreadPool
 
 from infra.libs.git2 import CalledProcessError
 from infra.libs.git2 import EMPTY_TREE
 from infra.libs.git2 import INVALID
 from infra.libs.git2 import config_ref
 from infra.libs.git2 import repo
+from infra_libs import ts_mon
 
 FOOTER_PREFIX = 'Cr-'
 # How long to wait for 'git push' to complete before forcefully killing it.
 PUSH_TIMEOUT = 18 * 60
+# How many paths are processed in parallel.
+PATH_WORKERS = 8
 
 LOGGER = logging.getLogger(__name__)
 
 MIRRORED_FROM = FOOTER_PREFIX + 'Mirrored-From'
 MIRRORED_COMMIT = FOOTER_PREFIX + 'Mirrored-Commit'
 
+path_duration_metric = ts_mon.CumulativeDistributionMetric(
+    'gsubtreed/path_durations',
+    'Times (in seconds) taken to process a path in one iteration',
+    [ts_mon.StringField('path')])
+path_throughput_metric = ts_mon.FloatMetric(
+    'gsubtreed/path_throughput',
+    'Commits synthesized per second for a path in the last iteration which '
+    'synthesized any',
+    [ts_mon.StringField('path')])
+
 ################################################################################
 # ConfigRef
 ################################################################################
@@ -76,6 +92,126 @@ class GsubtreedConfigRef(config_ref.ConfigRef):
 ################################################################################
 
 
+class MultiPathWalker(object):
+  """Finds the commits changing each of many paths in the history of refs.
+
+  The first-parent history of a ref is listed once, and the root tree of each
+  of its commits read once, to resolve all paths together. Each path then just
+  looks up which commits changed it. Trees are cached, so unchanged
+  directories are not read again either. Both caches are bounded, so that
+  walking a long history (e.g. when bootstrapping a mirror) doesn't hold all
+  of it in memory.
+
+  Thread-safe, so that paths may be processed in parallel.
+  """
+
+  # How many parsed trees to keep.
+  MAX_TREES = 4096
+  # How many commits to keep the entries of all paths for.
+  MAX_COMMITS = 16384
+
+  def __init__(self, origin_repo, paths):
+    self._repo = origin_repo
+    self._paths = list(paths)
+    self._lock = threading.Lock()
+    # {ref: (tip hash, [commit hashes], oldest first)}
+    self._histories = {}
+    # {commit hash: {path: (type, hash) or None}}
+    self._entries = collections.OrderedDict()
+    # {tree hash: {name: (type, hash)}}
+    self._trees = collections.OrderedDict()
+
+  def _tree(self, hsh):
+    tree = self._trees.pop(hsh, None)
+    if tree is None:
+      raw = self._repo.read_object(hsh)[2]
+      tree = {}
+      pos = 0
+      while pos < len(raw):
+        space = raw.index(' ', pos)
+        nul = raw.index('\0', space)
+        mode = raw[pos:space]
+        if mode == '40000':
+          typ = 'tree'
+        elif mode == '160000':
+          typ = 'commit'
+        else:
+          typ = 'blob'
+        tree[raw[space+1:nul]] = (typ, raw[nul+1:nul+21].encode('hex'))
+        pos = nul + 21
+      if len(self._trees) >= self.MAX_TREES:
+        self._trees.popitem(last=False)
+    self._trees[hsh] = tree
+    return tree
+
+  def _commit_entries(self, hsh):
+    """Returns {path: (type, hash) or None} for the commit ``hsh``."""
+    entries = self._entries.pop(hsh, None)
+    if entries is None:
+      root = self._repo.get_commit(hsh).data.tree
+      entries = {}
+      for path in self._paths:
+        entry = ('tree', root)
+        for name in path.split('/'):
+          if entry[0] != 'tree':
+            entry = None
+            break
+          entry = self._tree(entry[1]).get(name)
+          if entry is None:
+            break
+        entries[path] = entry
+      if len(self._entries) >= self.MAX_COMMITS:
+        self._entries.popitem(last=False)
+    self._entries[hsh] = entries
+    return entries
+
+  def _history(self, start, ref):
+    """Returns the hashes of the first-parent history `start..ref`.
+
+    Returns the whole first-parent history of ref if start is INVALID.
+    """
+    # The commits of start..ref along the first-parent chain of ref are always
+    # the tail of that chain (the parent of an ancestor of start is one as
+    # well), so the longest history listed so far can be reused for any start.
+    exclude = ['^' + start.hsh] if start is not INVALID else []
+    tip, history = self._histories.get(ref.ref, (None, None))
+    if tip is None:
+      tip = ref.commit.hsh
+    count = int(self._repo.run(
+        'rev-list', '--first-parent', '--count', tip, *exclude))
+    if history is None or count > len(history):
+      history = self._repo.run(
+          'rev-list', '--first-parent', '--reverse', tip, *exclude).split()
+      self._histories[ref.ref] = (tip, history)
+    return history[len(history) - count:], history
+
+  def changes(self, start, ref, path):
+    """Yields the Commits of `start..ref` which change ``path``, oldest first.
+
+    Like ``origin_repo[start.hsh].to(ref, path, first_parent=True)``, but also
+    yields the (type, hash) of path in each commit, or None if it is missing.
+    """
+    with self._lock:
+      commits, history = self._history(start, ref)
+      if not commits:
+        return
+      first = len(history) - len(commits)
+      if first:
+        prev = self._commit_entries(history[first - 1])[path]
+      else:
+        parents = self._repo.get_commit(commits[0]).data.parents
+        prev = self._commit_entries(parents[0])[path] if parents else None
+      changed = []
+      for hsh in commits:
+        entry = self._commit_entries(hsh)[path]
+        if entry != prev:
+          changed.append((hsh, entry))
+        prev = entry
+    for hsh, entry in changed:
+      yield self._repo.get_commit(hsh), entry
+
+
+
 class Pusher(threading.Thread):
   # Modified by testing code. Makes this object do all the work in 'get_result'
   # (instead of a separate thread). That way the order of tasks is deterministic
@@ -108,6 +244,13 @@ class Pusher(threading.Thread):
     return self._success
 
   def _push(self):
+    try:
+      self._push_refs()
+    finally:
+      # Updating the local refs restarts the cat-file processes of the repo.
+      self._repo.close()
+
+  def _push_refs(self):
     try:
       self._output = self._repo.fast_forward_push(
           self._pushspec, include_err=True, timeout=PUSH_TIMEOUT)
@@ -132,7 +275,9 @@ class Pusher(threading.Thread):
         raise
 
 
-def process_path(path, origin_repo, config, dry_run):
+def process_path(path, origin_repo, config, dry_run, walker=None):
+  if walker is None:
+    walker = MultiPathWalker(origin_repo, [path])
   base_url = config['base_url']
   mirror_url = '[FILE-URL]' if base_url.startswith('file:') else origin_repo.url
 
@@ -140,108 +285,140 @@ def process_path(path, origin_repo, config, dry_run):
   if path in config['path_map_exceptions']:
     subtree_repo_path = config['path_map_exceptions'][path]
   subtree_repo = repo.Repo(posixpath.join(base_url, subtree_repo_path))
-  subtree_repo.dry_run = dry_run
-  subtree_repo.repos_dir = origin_repo.repos_dir
-  subtree_repo.reify(share_from=origin_repo)
-  subtree_repo_push = {}
-
-  synthed_count = 0
-
-  success = True
-
-  for glob in config['enabled_refglobs']:
-    for ref in origin_repo.refglob(glob):
-      LOGGER.info('processing %s', ref)
-
-      # The last thing that was pushed to the subtree_repo
-      last_push = subtree_repo[ref.ref].commit
-      synth_parent = last_push
-
-      processed = INVALID
-      if synth_parent is not INVALID:
-        f = synth_parent.data.footers
-        if MIRRORED_COMMIT not in f:
-          LOGGER.warn('Getting data from extra_footers. This information is'
-                       'only as trustworthy as the ACLs.')
-          f = synth_parent.extra_footers()
-        if MIRRORED_COMMIT not in f:
-          success = False
-          LOGGER.error('Could not find footers for synthesized commit %r',
-                        synth_parent.hsh)
-          continue
-        processed_commit = f[MIRRORED_COMMIT][0]
-        processed = origin_repo.get_commit(processed_commit)
-        LOGGER.info('got processed commit %s: %r', processed_commit, processed)
-
-        if processed is INVALID:
-          success = False
-          LOGGER.error('Subtree mirror commit %r claims to mirror commit %r, '
-                        'which doesn\'t exist in the origin repo. Halting.',
-                        synth_parent.hsh, processed_commit)
-          continue
-
-      LOGGER.info('starting with tree %r', synth_parent.data.tree)
-
-      for commit in origin_repo[processed.hsh].to(ref, path, first_parent=True):
-        LOGGER.info('processing %s', commit)
-        obj_name = '{.hsh}:{}'.format(commit, path)
-        dir_tree = None
-        try:
-          typ = origin_repo.run('cat-file', '-t', obj_name).strip()
-          if typ != 'tree':
-            LOGGER.warn('path %r is not a tree in commit %s', path, commit)
+  try:
+    subtree_repo.dry_run = dry_run
+    subtree_repo.repos_dir = origin_repo.repos_dir
+    subtree_repo.reify(share_from=origin_repo)
+    subtree_repo_push = {}
+
+    synthed_count = 0
+
+    success = True
+
+    for glob in config['enabled_refglobs']:
+      for ref in origin_repo.refglob(glob):
+        LOGGER.info('processing %s', ref)
+
+        # The last thing that was pushed to the subtree_repo
+        last_push = subtree_repo[ref.ref].commit
+        synth_parent = last_push
+
+        processed = INVALID
+        if synth_parent is not INVALID:
+          f = synth_parent.data.footers
+          if MIRRORED_COMMIT not in f:
+            LOGGER.warn('Getting data from extra_footers. This information is'
+                         'only as trustworthy as the ACLs.')
+            f = synth_parent.extra_footers()
+          if MIRRORED_COMMIT not in f:
+            success = False
+            LOGGER.error('Could not find footers for synthesized commit %r',
+                          synth_parent.hsh)
             continue
-          else:
-            dir_tree = origin_repo.run('rev-parse', obj_name).strip()
-        except CalledProcessError as ex:
-          if ex.returncode == 128 and 'Not a valid object name' in ex.stderr:
+          processed_commit = f[MIRRORED_COMMIT][0]
+          processed = origin_repo.get_commit(processed_commit)
+          LOGGER.info('got processed commit %s: %r', processed_commit, processed)
+
+          if processed is INVALID:
+            success = False
+            LOGGER.error('Subtree mirror commit %r claims to mirror commit %r, '
+                          'which doesn\'t exist in the origin repo. Halting.',
+                          synth_parent.hsh, processed_commit)
+            continue
+
+        LOGGER.info('starting with tree %r', synth_parent.data.tree)
+
+        # Synthesized commits are hashed as they are made, and written to
+        # subtree_repo all at once at the end.
+        synth_parent_hsh = None
+        if synth_parent is not INVALID:
+          synth_parent_hsh = synth_parent.hsh
+        synthed = []
+        for commit, entry in walker.changes(processed, ref, path):
+          LOGGER.info('processing %s', commit)
+          if entry is None:
             LOGGER.warn('path %r was deleted in commit %s', path, commit)
             dir_tree = EMPTY_TREE
+          elif entry[0] != 'tree':
+            LOGGER.warn('path %r is not a tree in commit %s', path, commit)
+            continue
           else:
-            raise  # pragma: no cover
-
-        LOGGER.info('found new tree %r', dir_tree)
-
-        # Remove git-svn-id, Cr-Commit-Position and Cr-Branched-From
-        # Replace original Cr- footers
-        # to indicate them as the /original/ values.
-        footers = [
-          ('git-svn-id', None),
-        ]
-        for key, val in commit.data.footers.iteritems():
-          if key.startswith(FOOTER_PREFIX):
-            footers += [
-              (key, None),
-              (key.replace(FOOTER_PREFIX, FOOTER_PREFIX + 'Original-', 1), val),
-            ]
-
-        footers += [
-          (MIRRORED_FROM, [mirror_url]),
-          (MIRRORED_COMMIT, [commit.hsh]),
-        ]
-
-        synthed_count += 1
-        synth_parent_data = commit.data.alter(
-          parents=[synth_parent.hsh] if synth_parent is not INVALID else [],
-          tree=dir_tree,
-          footers=collections.OrderedDict(footers),
-        )
-        synth_parent = subtree_repo.get_commit(
-            subtree_repo.intern(synth_parent_data, 'commit'))
-
-      if synth_parent is not INVALID and synth_parent != last_push:
-        subtree_repo_push[subtree_repo[ref.ref]] = synth_parent
-
-  t = Pusher(path, subtree_repo, subtree_repo_push,
-             config['path_extra_push'].get(path, []))
-  t.start()
-
-  return success, synthed_count, t
-
-
-def inner_loop(origin_repo, config, dry_run):
+            dir_tree = entry[1]
+
+          LOGGER.info('found new tree %r', dir_tree)
+
+          # Remove git-svn-id, Cr-Commit-Position and Cr-Branched-From
+          # Replace original Cr- footers
+          # to indicate them as the /original/ values.
+          footers = [
+            ('git-svn-id', None),
+          ]
+          for key, val in commit.data.footers.iteritems():
+            if key.startswith(FOOTER_PREFIX):
+              footers += [
+                (key, None),
+                (key.replace(FOOTER_PREFIX, FOOTER_PREFIX + 'Original-', 1), val),
+              ]
+
+          footers += [
+            (MIRRORED_FROM, [mirror_url]),
+            (MIRRORED_COMMIT, [commit.hsh]),
+          ]
+
+          synthed_count += 1
+          synth_parent_data = commit.data.alter(
+            parents=[synth_parent_hsh] if synth_parent_hsh else [],
+            tree=dir_tree,
+            footers=collections.OrderedDict(footers),
+          )
+          synthed.append((synth_parent_data, 'commit'))
+          synth_parent_hsh = subtree_repo.hash_object(synth_parent_data, 'commit')
+
+        if synthed:
+          subtree_repo.intern_many(synthed)
+          synth_parent = subtree_repo.get_commit(synth_parent_hsh)
+
+        if synth_parent is not INVALID and synth_parent != last_push:
+          subtree_repo_push[subtree_repo[ref.ref]] = synth_parent
+
+    t = Pusher(path, subtree_repo, subtree_repo_push,
+               config['path_extra_push'].get(path, []))
+    t.start()
+
+    return success, synthed_count, t
+  finally:
+    # Stop the cat-file processes of the repo.  If they are needed again, the
+    # pusher closes them once it is done.
+    subtree_repo.close()
+
+
+def _process_path_timed(path, origin_repo, config, dry_run, walker):
+  """Runs process_path, records its metrics and catches its exceptions.
+
+  Returns:
+    The result of process_path, or None if it raised.
+  """
+  LOGGER.info('processing path %r', path)
+  started = time.time()
+  try:
+    ret = process_path(path, origin_repo, config, dry_run, walker)
+  except Exception:  # pragma: no cover
+    LOGGER.exception('Caught in inner_loop')
+    return None
+  duration = time.time() - started
+  path_duration_metric.add(duration, fields={'path': path})
+  if ret[1] and duration > 0:
+    path_throughput_metric.set(ret[1] / duration, fields={'path': path})
+  return ret
+
+
+def inner_loop(origin_repo, config, dry_run, path_workers=PATH_WORKERS):
   """Runs one iteration of the gsubtreed algorithm.
 
+  Args:
+    path_workers - how many paths to process in parallel. With 1, paths are
+      processed sequentially in the order of the config.
+
   Returns:
     (success, {path: #commits_synthesized})
   """
@@ -249,20 +426,31 @@ def inner_loop(origin_repo, config, dry_run):
   origin_repo.fetch()
   config.evaluate()
 
+  paths = config['enabled_paths']
+  walker = MultiPathWalker(origin_repo, paths)
+  process = lambda path: _process_path_timed(
+      path, origin_repo, config, dry_run, walker)
+  if path_workers > 1 and len(paths) > 1:
+    pool = ThreadPool(min(path_workers, len(paths)))
+    try:
+      results = pool.map(process, paths)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    results = map(process, paths)
+
   threads = []
   success = True
   processed = {}
-  for path in config['enabled_paths']:
-    LOGGER.info('processing path %r', path)
-    try:
-      path_success, num_synthed, t = process_path(path, origin_repo,
-                                                  config, dry_run)
-      threads.append(t)
-      success = path_success and success
-      processed[path] = num_synthed
-    except Exception:  # pragma: no cover
-      LOGGER.exception('Caught in inner_loop')
+  for path, ret in zip(paths, results):
+    if ret is None:  # pragma: no cover
       success = False
+      continue
+    path_success, num_synthed, t = ret
+    threads.append(t)
+    success = path_success and success
+    processed[path] = num_synthed
 
   for t in threads:
     rslt = t.get_result()
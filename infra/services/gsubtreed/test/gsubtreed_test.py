@@ -9,10 +9,12 @@ import os
 import sys
 import tempfile
 import traceback
+import unittest
 
 from cStringIO import StringIO
 
 import expect_tests
+import mock
 
 from infra.libs.git2.testing_support import TestClock
 from infra.libs.git2.testing_support import TestRepo
@@ -32,9 +34,8 @@ class TestConfigRef(gsubtreed.GsubtreedConfigRef):
         {'config.json': json.dumps(new_config)})
 
 
-def RunTest(test_name):
-  ret = []
-  clock = TestClock()
+def SetUpRepos(clock):
+  """Returns (origin, local, cref, mirrors, base_repo_path) for a test."""
   origin = TestRepo('origin', clock)
   local = TestRepo('local', clock, origin.repo_path)
 
@@ -58,6 +59,13 @@ def RunTest(test_name):
                                        'fake')
     mirrors[path_in_mirror]._repo_path = full_path
     mirrors[path_in_mirror].run('init', '--bare')
+  return origin, local, cref, mirrors, base_repo_path
+
+
+def RunTest(test_name):
+  ret = []
+  clock = TestClock()
+  origin, local, cref, mirrors, base_repo_path = SetUpRepos(clock)
 
   class LogFormatter(logging.Formatter):
     def format(self, record):
@@ -107,7 +115,8 @@ def RunTest(test_name):
         sys.stderr = sys.stdout = dn
         local.reify()
         dry_run = False
-        success, processed = gsubtreed.inner_loop(local, cref, dry_run)
+        success, processed = gsubtreed.inner_loop(
+            local, cref, dry_run, path_workers=1)
     except Exception:  # pragma: no cover
       ret.append(traceback.format_exc().splitlines())
     finally:
@@ -143,3 +152,125 @@ def GenTests():
             expect_tests.Test.covers_obj(RunTest) +
             expect_tests.Test.covers_obj(gsubtreed_test_definitions)
         ))
+
+
+class ParallelPathsTest(unittest.TestCase):
+  @staticmethod
+  def _run(path_workers):
+    """Mirrors the same history with path_workers.
+
+    Returns (snapshots of the mirrors, processed, subtree repos still running
+    git cat-file).
+    """
+    clock = TestClock()
+    origin, local, cref, mirrors, base_repo_path = SetUpRepos(clock)
+    master = origin['refs/heads/master']
+    master.make_commit('first commit', {
+        'mirrored_path': {'subpath': {'file': 'a'}, 'file': 'b'},
+        'exception': {'path': {'file': 'c'}},
+    })
+    master.make_commit('second commit', {
+        'mirrored_path': {'subpath': {'file': 'd'}},
+        'exception': {'path': {'file': 'c'}},
+    })
+    local.reify()
+
+    created = []
+    class RecordingRepo(gsubtreed.repo.Repo):
+      def __init__(self, *args, **kwargs):
+        super(RecordingRepo, self).__init__(*args, **kwargs)
+        created.append(self)
+
+    with open(os.devnull, 'w') as dn:
+      with mock.patch.object(sys, 'stdout', dn):
+        with mock.patch.object(
+            gsubtreed, 'repo', mock.Mock(Repo=RecordingRepo)):
+          success, processed = gsubtreed.inner_loop(
+              local, cref, False, path_workers=path_workers)
+    assert success
+    snaps = {
+        name: mirror.snap(include_committer=True)
+        for name, mirror in mirrors.iteritems()
+    }
+    running = [
+        r for r in created
+        if any(c is not None and c._proc is not None
+               for c in (r._cat_file, r._cat_file_check))
+    ]
+    assert len(created) == 3, created
+    return snaps, processed, running
+
+  def test_parallel_matches_sequential(self):
+    self.maxDiff = None
+    sequential = self._run(path_workers=1)
+    parallel = self._run(path_workers=3)
+    self.assertEqual(sequential, parallel)
+    self.assertEqual(
+        {'mirrored_path': 2, 'mirrored_path/subpath': 2, 'exception/path': 1},
+        parallel[1])
+    # Every subtree repo was closed.
+    self.assertEqual([], parallel[2])
+
+
+class MultiPathWalkerTest(unittest.TestCase):
+  PATHS = ['a/b', 'a', 'x', 'a/b/f', 'missing', 'missing/deeper']
+
+  def setUp(self):
+    self.origin = TestRepo('origin', TestClock())
+    master = self.origin['refs/heads/master']
+    self.master = master
+    base = master.make_commit('base', {
+        'a': {'b': {'f': '1'}, 'g': '1'}, 'x': {'f': '1'}})
+    side = self.origin.make_commit(base, 'side', {'a': {'b': {'f': '2'}}})
+    side = self.origin.make_commit(side, 'side x', {'x': {'f': '2'}})
+    master.make_commit('change x', {'x': {'f': '3'}})
+    # A merge taking a/b from the second parent, and x from the first one.
+    merge = self.origin.make_commit(
+        master.commit, 'merge', {'a': {'b': {'f': '2'}}})
+    master.fast_forward(self.origin.get_commit(self.origin.intern(
+        merge.data.alter(parents=[master.commit.hsh, side.hsh]), 'commit')))
+    master.make_commit('delete a/b', {'a': {'b': None}})
+    master.make_commit('a/b is a file', {'a': {'b': 'file'}})
+    master.make_commit('a/b is a tree again', {'a': {'b': {'f': '3'}}})
+    master.make_commit('delete a', {'a': None})
+    master.make_commit('add a back', {'a': {'b': {'f': '3'}}})
+
+  def per_path_changes(self, start, path):
+    """What gsubtreed used to do: one 'git rev-list -- path' per path."""
+    ret = []
+    for commit in self.origin[start.hsh].to(self.master, path,
+                                            first_parent=True):
+      info = self.origin.object_info('%s:%s' % (commit.hsh, path))
+      ret.append((commit.hsh, info and (info[1], info[0])))
+    return ret
+
+  def check_all(self, walker):
+    starts = [gsubtreed.INVALID] + [
+        self.origin.get_commit(hsh) for hsh in self.origin.run(
+            'rev-list', '--first-parent', self.master.ref).split()]
+    for start in starts:
+      for path in self.PATHS:
+        got = [(commit.hsh, entry)
+               for commit, entry in walker.changes(start, self.master, path)]
+        self.assertEqual(self.per_path_changes(start, path), got,
+                         'path %r from %r' % (path, start))
+
+  def test_matches_per_path_history(self):
+    walker = gsubtreed.MultiPathWalker(self.origin, self.PATHS)
+    self.check_all(walker)
+    # The whole history is listed and walked, including the merge, the
+    # deletions and the file/directory swaps.
+    changes = [
+        commit.data.message_lines[0]
+        for commit, _ in walker.changes(gsubtreed.INVALID, self.master, 'a/b')]
+    self.assertEqual(
+        ['base', 'merge', 'delete a/b', 'a/b is a file', 'a/b is a tree again',
+         'delete a', 'add a back'], changes)
+
+  def test_bounded_caches(self):
+    walker = gsubtreed.MultiPathWalker(self.origin, self.PATHS)
+    walker.MAX_COMMITS = 2
+    walker.MAX_TREES = 2
+    self.check_all(walker)
+    self.assertLessEqual(len(walker._entries), 2)  # pylint: disable=W0212
+    self.assertLessEqual(len(walker._trees), 2)  # pylint: disable=W0212
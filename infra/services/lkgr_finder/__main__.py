@@ -179,7 +179,9 @@ def main(argv):
 
   repo = lkgr_lib.GitWrapper(
       config['source_url'],
-      os.path.join(args.workdir, args.project))
+      os.path.join(args.workdir, args.project),
+      index_path=os.path.join(
+          args.workdir, '%s.positions.json' % args.project))
 
   monkeypatch_rev_map = config.get('monkeypatch_rev_map')
   if monkeypatch_rev_map:
@@ -206,8 +208,11 @@ def main(argv):
       builds = {}
       buildbucket_builders = config.get('buckets', [])
       if buildbucket_builders:
-        buildbucket_builds, failures = lkgr_lib.FetchBuildbucketBuilds(
-            buildbucket_builders, args.max_threads, args.service_account)
+        buildbucket_builds, failures = (
+            lkgr_lib.FetchBuildbucketBuildsIncrementally(
+                buildbucket_builders,
+                os.path.join(args.workdir, '%s.builds' % args.project),
+                args.max_threads, args.service_account))
         if failures > 0:
           return 1
         builds.update(buildbucket_builds)
@@ -223,7 +228,7 @@ def main(argv):
     (build_history, revisions) = lkgr_lib.CollateRevisionHistory(
         builds, repo)
 
-    status_gen = status_generator.StatusGeneratorStub()
+    status_gen = None
     if args.html:
       viewvc = config.get('viewvc_url', config['source_url'] + '/+/%s')
       status_gen = status_generator.HTMLStatusGenerator(
@@ -231,6 +236,7 @@ def main(argv):
 
     candidate = lkgr_lib.FindLKGRCandidate(
         build_history, revisions, repo.keyfunc, status_gen)
+    repo.save_index()
 
     if args.html:
       lkgr_lib.WriteHTML(status_gen, args.html, args.dry_run)
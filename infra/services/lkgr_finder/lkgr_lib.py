@@ -23,6 +23,7 @@ import subprocess
 import sys
 import threading
 import time
+import urllib
 import xml.etree.ElementTree as xml
 
 import google.protobuf.message
@@ -71,14 +72,102 @@ NOREV = NOREV()
 ##################################################
 # VCS Wrappers
 ##################################################
+class CommitPositionIndex(object):
+  """A persistent map of commit hash -> (commit position, ref).
+
+  A commit's position never changes, so positions resolved in one run are
+  saved and reused by the next; only commits which weren't seen before have to
+  be looked up in git. Commits without a position are remembered as None.
+  """
+
+  # Oldest positions are dropped past this many entries; builds only ever
+  # reference recent commits.
+  MAX_ENTRIES = 200000
+
+  def __init__(self, path, url):
+    """
+    Args:
+      path (str): the file backing the index.
+      url (str): the url of the repository; the index is discarded if it was
+        written for another one.
+    """
+    self._path = path
+    self._url = url
+    self._positions = {}
+    self._dirty = False
+    self._load()
+
+  def _load(self):
+    try:
+      with open(self._path) as f:
+        data = json.load(f)
+    except (IOError, ValueError) as e:
+      if os.path.exists(self._path):
+        LOGGER.warning('Ignoring unreadable commit position index %s: %s',
+                       self._path, e)
+      return
+    if not isinstance(data, dict) or data.get('url') != self._url:
+      LOGGER.info('Commit position index %s is for another repository, '
+                  'ignoring it', self._path)
+      return
+    for rev, key in data.get('positions', {}).iteritems():
+      self._positions[str(rev)] = (
+          (key[0], str(key[1])) if key is not None else None)
+    LOGGER.debug('Loaded %d commit positions from %s',
+                 len(self._positions), self._path)
+
+  def __len__(self):
+    return len(self._positions)
+
+  def __contains__(self, rev):
+    return rev in self._positions
+
+  def get(self, rev):
+    return self._positions.get(rev)
+
+  def update(self, positions):
+    """Adds a dict of revision -> (position, ref) or None."""
+    for rev, key in positions.iteritems():
+      if self._positions.get(rev, False) != key:
+        self._positions[rev] = key
+        self._dirty = True
+
+  def save(self):
+    """Writes the index back to disk if it changed, atomically."""
+    if not self._dirty:
+      return
+    if len(self._positions) > self.MAX_ENTRIES:
+      newest = sorted(self._positions.iteritems(),
+                      key=lambda item: item[1] or (-1, ''),
+                      reverse=True)[:self.MAX_ENTRIES]
+      self._positions = dict(newest)
+    tmp_path = '%s.tmp' % self._path
+    with open(tmp_path, 'w') as f:
+      json.dump({'url': self._url, 'positions': self._positions}, f)
+    os.rename(tmp_path, self._path)
+    self._dirty = False
+    LOGGER.debug('Saved %d commit positions to %s',
+                 len(self._positions), self._path)
+
+
 class GitWrapper(object):
   _status_path = '/git-lkgr'
   _GIT_HASH_RE = re.compile('^[a-fA-F0-9]{40}$')
   _GIT_POS_RE = re.compile('(\S+)@{#(\d+)}')
 
-  def __init__(self, url, path):  # pragma: no cover
+  def __init__(self, url, path, index_path=None):  # pragma: no cover
+    """
+    Args:
+      url (str): the url of the repository.
+      path (str): where to keep a checkout of the repository.
+      index_path (str): a file in which to persist resolved commit positions
+        across runs. Positions are only kept in memory if None.
+    """
     self._git = git.NewGit(url, path)
     self._position_cache = {}
+    self._index = None
+    if index_path:
+      self._index = CommitPositionIndex(index_path, url)
     LOGGER.debug('Local git repository located at %s', self._git.path)
 
   @property
@@ -91,7 +180,14 @@ class GitWrapper(object):
     return bool(self._GIT_HASH_RE.match(r))
 
   def _cache(self, *revs):  # pragma: no cover
-    unknown_revs = [r for r in revs if r not in self._position_cache]
+    unknown_revs = sorted(set(r for r in revs if r not in self._position_cache))
+    if self._index is not None:
+      indexed = [r for r in unknown_revs if r in self._index]
+      self._position_cache.update((r, self._index.get(r)) for r in indexed)
+      unknown_revs = [r for r in unknown_revs if r not in self._index]
+    if not unknown_revs:
+      return
+    LOGGER.debug('Resolving %d commit positions', len(unknown_revs))
     positions = self._git.number(*unknown_revs)
     # We know we only care about revisions along a single branch.
     keys = []
@@ -102,7 +198,15 @@ class GitWrapper(object):
       else:
         key = None
       keys.append(key)
-    self._position_cache.update(dict(zip(unknown_revs, keys)))
+    resolved = dict(zip(unknown_revs, keys))
+    self._position_cache.update(resolved)
+    if self._index is not None:
+      self._index.update(resolved)
+
+  def save_index(self):  # pragma: no cover
+    """Persists commit positions resolved so far, if there is an index."""
+    if self._index is not None:
+      self._index.save()
 
   def keyfunc(self, r):  # pragma: no cover
     # Returns a tuple (commit-position-number, commit-position-ref).
@@ -145,8 +249,28 @@ OAUTH_SCOPES = ['https://www.googleapis.com/auth/userinfo.email']
 
 _BUILDBUCKET_SEARCH_ENDPOINT_V2 = (
     'https://{buildbucket_instance}/prpc/buildbucket.v2.Builds/SearchBuilds')
+_BUILDBUCKET_BATCH_ENDPOINT_V2 = (
+    'https://{buildbucket_instance}/prpc/buildbucket.v2.Builds/Batch')
 _DEFAULT_BUILDBUCKET_INSTANCE = 'cr-buildbucket.appspot.com'
 
+_PRPC_HEADERS = {
+  'Accept': 'application/prpc; encoding=binary',
+  'Content-Type': 'application/prpc; encoding=binary',
+}
+
+
+def _BuildbucketHttp(service_account_file=None):
+  http = httplib2.Http(timeout=300)
+  creds = None
+  if service_account_file:  # pragma: no cover
+    creds = infra_libs.get_signed_jwt_assertion_credentials(
+        service_account_file, scope=OAUTH_SCOPES)
+  elif luci_auth.available():  # pragma: no cover
+    creds = luci_auth.LUCICredentials(scopes=OAUTH_SCOPES)
+  if creds:  # pragma: no cover
+    creds.authorize(http)
+  return http
+
 
 def _FetchFromBuildbucketImpl(
     project, bucket_name, builder,
@@ -162,26 +286,12 @@ def _FetchFromBuildbucketImpl(
     'builds.*.input.gitiles_commit.id',
   ])
 
-  headers = {
-    'Accept': 'application/prpc; encoding=binary',
-    'Content-Type': 'application/prpc; encoding=binary',
-  }
-
-  http = httplib2.Http(timeout=300)
-  creds = None
-  if service_account_file:
-    creds = infra_libs.get_signed_jwt_assertion_credentials(
-        service_account_file, scope=OAUTH_SCOPES)
-  elif luci_auth.available():
-    creds = luci_auth.LUCICredentials(scopes=OAUTH_SCOPES)
-  if creds:
-    creds.authorize(http)
-
+  http = _BuildbucketHttp(service_account_file)
   resp, content = http.request(
       _BUILDBUCKET_SEARCH_ENDPOINT_V2.format(
           buildbucket_instance=_DEFAULT_BUILDBUCKET_INSTANCE),
       method='POST',
-      headers=headers,
+      headers=_PRPC_HEADERS,
       body=request_pb.SerializeToString())
   grpc_code = resp.get('X-Prpc-Grpc-Code'.lower())
   if grpc_code != '0':
@@ -231,14 +341,22 @@ def FetchBuildbucketBuildsForBuilder(
 
   builds = []
   for build_pb in response_pb.builds:
-    number = build_pb.number
-    result = _BUILDBUCKET_STATUS.get(build_pb.status)
-    revision = build_pb.input.gitiles_commit.id
-    if bool(number) and bool(revision) and result is not None:
-      builds.append(Build(number, result, revision))
+    build = _BuildFromProto(build_pb)
+    if build:
+      builds.append(build)
   return builds
 
 
+def _BuildFromProto(build_pb):
+  """Returns the Build for a buildbucket.v2.Build, None if it is unusable."""
+  number = build_pb.number
+  result = _BUILDBUCKET_STATUS.get(build_pb.status)
+  revision = build_pb.input.gitiles_commit.id
+  if bool(number) and bool(revision) and result is not None:
+    return Build(number, result, revision)
+  return None
+
+
 def FetchBuildsWorker(fetch_q, fetch_fn):  # pragma: no cover
   """Pull build json from builders.
 
@@ -307,6 +425,276 @@ def _FetchBuilds(
   return build_data, failures
 
 
+class BuildCache(object):
+  """An on-disk cache of the recent builds of each builder.
+
+  Every builder has its own file, so builders can be fetched and saved
+  concurrently. Along with the builds, it holds the build id from which to
+  resume: Buildbucket build ids decrease over time, so everything newer than
+  what is cached has an id lower or equal to it.
+  """
+
+  VERSION = 2
+
+  def __init__(self, path):
+    self._path = path
+
+  def _BuilderPath(self, bucket, builder):
+    return os.path.join(
+        self._path, urllib.quote(bucket, safe=''),
+        '%s.json' % urllib.quote(builder, safe=''))
+
+  def Get(self, bucket, builder):
+    """Returns (start_build_id, [Build, ...]), or (None, []) if not cached."""
+    path = self._BuilderPath(bucket, builder)
+    try:
+      with open(path) as f:
+        data = json.load(f)
+    except (IOError, ValueError) as e:
+      if os.path.exists(path):
+        LOGGER.warning('Ignoring unreadable build cache %s: %s', path, e)
+      return None, []
+    if not isinstance(data, dict) or data.get('version') != self.VERSION:
+      return None, []
+    return (data['start_build_id'],
+            [Build(number, result, str(revision))
+             for number, result, revision in data['builds']])
+
+  def Put(self, bucket, builder, start_build_id, builds):
+    path = self._BuilderPath(bucket, builder)
+    if not os.path.isdir(os.path.dirname(path)):
+      try:
+        os.makedirs(os.path.dirname(path))
+      except OSError:  # pragma: no cover
+        # Another worker created it in the meantime.
+        if not os.path.isdir(os.path.dirname(path)):
+          raise
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'w') as f:
+      json.dump({
+        'version': self.VERSION,
+        'start_build_id': start_build_id,
+        'builds': builds,
+      }, f)
+    os.rename(tmp_path, path)
+
+
+# How many builders are searched in one Batch request.
+_SEARCH_BATCH_SIZE = 25
+
+# How many of the most recent builds of a builder are kept.
+_MAX_BUILDS_PER_BUILDER = 100
+
+
+def _SearchBuildsRequest(bucket, builder, start_build_id):
+  project, bucket_name = bucket.split('/', 1)
+  request_pb = rpc_pb2.SearchBuildsRequest()
+  request_pb.predicate.builder.project = project
+  request_pb.predicate.builder.bucket = bucket_name
+  request_pb.predicate.builder.builder = builder
+  if start_build_id:
+    # Builds are listed newest first, i.e. by increasing id, so the range
+    # starts at the highest id to return.
+    request_pb.predicate.build.start_build_id = start_build_id
+  request_pb.page_size = _MAX_BUILDS_PER_BUILDER
+  # Unfinished builds are fetched too, so that we know to search for them
+  # again next time.
+  request_pb.fields.paths.extend([
+    'builds.*.id',
+    'builds.*.number',
+    'builds.*.status',
+    'builds.*.input.gitiles_commit.id',
+  ])
+  return request_pb
+
+
+def _SearchBuildsBatch(http, request_pbs):
+  """Sends SearchBuilds requests in one Batch request.
+
+  Returns:
+    A list with the rpc_pb2.BatchResponse.Response of every request.
+  """
+  batch_pb = rpc_pb2.BatchRequest()
+  for request_pb in request_pbs:
+    batch_pb.requests.add(search_builds=request_pb)
+  resp, content = http.request(
+      _BUILDBUCKET_BATCH_ENDPOINT_V2.format(
+          buildbucket_instance=_DEFAULT_BUILDBUCKET_INSTANCE),
+      method='POST',
+      headers=_PRPC_HEADERS,
+      body=batch_pb.SerializeToString())
+  grpc_code = resp.get('X-Prpc-Grpc-Code'.lower())
+  if grpc_code != '0':
+    raise httplib2.HttpLib2Error('Invalid GRPC exit code: %s\n%s' % (
+        grpc_code, content))
+  response_pb = rpc_pb2.BatchResponse()
+  response_pb.ParseFromString(content)
+  if len(response_pb.responses) != len(request_pbs):
+    raise httplib2.HttpLib2Error(
+        'Got %d responses to %d requests' % (
+            len(response_pb.responses), len(request_pbs)))
+  return response_pb.responses
+
+
+def _MergeBuilds(start_build_id, cached_builds, search_pb):
+  """Adds the builds of a SearchBuildsResponse to the cached ones.
+
+  Returns:
+    A 3-tuple of (start_build_id, builds, fetched) where start_build_id is the
+    highest build id to search from next time, builds are the most recent
+    builds of the builder, newest first, and fetched is how many of them are
+    new.
+  """
+  builds = {build.number: build for build in cached_builds}
+  ids = []
+  unfinished_ids = []
+  fetched = 0
+  for build_pb in search_pb.builds:
+    ids.append(build_pb.id)
+    if not build_pb.status & common_pb2.ENDED_MASK:
+      unfinished_ids.append(build_pb.id)
+      continue
+    build = _BuildFromProto(build_pb)
+    if build:
+      fetched += build.number not in builds
+      builds[build.number] = build
+
+  if unfinished_ids:
+    # Search from the oldest unfinished build next time.
+    start_build_id = max(unfinished_ids)
+  elif ids:
+    # Search for builds newer than the newest one next time.
+    start_build_id = min(ids) - 1
+  builds = sorted(builds.itervalues(), reverse=True)[:_MAX_BUILDS_PER_BUILDER]
+  return start_build_id, builds, fetched
+
+
+def FetchBuildsIncrementallyWorker(
+    fetch_q, cache, service_account, results):
+  """Searches for the new builds of batches of builders.
+
+  Args:
+    fetch_q (Queue.Queue): pre-populated with lists of (bucket, builder).
+    cache (BuildCache): the builds fetched by previous runs.
+    service_account (str): service account file to authenticate with.
+    results (dict): output dict of (bucket, builder) to a tuple of
+      ([Build, ...], fetched, cached), or None if fetching failed.
+  """
+  http = _BuildbucketHttp(service_account)
+  while True:
+    try:
+      batch = fetch_q.get(False)
+    except Queue.Empty:
+      return
+    _FetchBatch(http, batch, cache, results)
+
+
+def _FetchBatch(http, batch, cache, results):
+  searches = []
+  for bucket, builder in batch:
+    if not '/' in bucket:
+      LOGGER.error(
+          'Unexpected bucket "%s". '
+          + 'Buckets should be specified as $PROJECT/$BUCKET_NAME.',
+          bucket)
+      results[bucket, builder] = None
+      continue
+    start_build_id, cached_builds = cache.Get(bucket, builder)
+    searches.append((bucket, builder, start_build_id, cached_builds))
+  if not searches:
+    return
+
+  try:
+    response_pbs = _SearchBuildsBatch(
+        http, [_SearchBuildsRequest(bucket, builder, start_build_id)
+               for bucket, builder, start_build_id, _ in searches])
+  except httplib2.HttpLib2Error as e:
+    LOGGER.error('RequestException while fetching builds of %s:\n%s',
+                 ', '.join('%s/%s' % (b[0], b[1]) for b in searches), repr(e))
+    for bucket, builder, _, _ in searches:
+      results[bucket, builder] = None
+    return
+  except google.protobuf.message.Error as e:
+    LOGGER.error('Unknown protobuf error while fetching builds of %s:\n%s',
+                 ', '.join('%s/%s' % (b[0], b[1]) for b in searches), repr(e))
+    for bucket, builder, _, _ in searches:
+      results[bucket, builder] = None
+    return
+
+  for (bucket, builder, start_build_id, cached_builds), response_pb in zip(
+      searches, response_pbs):
+    if response_pb.HasField('error'):
+      LOGGER.error('Error while fetching %s/%s: %s', bucket, builder,
+                   response_pb.error.message)
+      results[bucket, builder] = None
+      continue
+    start_build_id, builds, fetched = _MergeBuilds(
+        start_build_id, cached_builds, response_pb.search_builds)
+    cache.Put(bucket, builder, start_build_id, builds)
+    LOGGER.debug('Fetched %d new builds for %s/%s, %d builds total',
+                 fetched, bucket, builder, len(builds))
+    results[bucket, builder] = (builds, fetched, len(builds) - fetched)
+
+
+def FetchBuildbucketBuildsIncrementally(
+    buckets, cache_dir, max_threads=0, service_account=None):
+  """Fetch build data about the builders from the given buckets.
+
+  Only builds newer than those cached in cache_dir by previous runs are
+  fetched from Buildbucket. Builders are searched in batches by a pool of
+  at most max_threads workers.
+
+  Args:
+    @param buckets: Dictionary of the form
+    { bucket: {
+        builders: [list of strings]
+    } }
+    This dictionary is a subset of the project configuration json.
+    @type buckets: dict
+    @param cache_dir: Directory in which to cache builds across runs.
+    @type cache_dir: str
+    @param max_threads: Maximum number of parallel requests.
+    @type max_threads: int
+
+  Returns:
+    A 2-tuple of (build_data, failures), like FetchBuildbucketBuilds.
+  """
+  cache = BuildCache(cache_dir)
+  builders = [(bucket, builder)
+              for bucket, config_data in sorted(buckets.iteritems())
+              for builder in config_data['builders']]
+  fetch_q = Queue.Queue()
+  for i in xrange(0, len(builders), _SEARCH_BATCH_SIZE):
+    fetch_q.put(builders[i:i + _SEARCH_BATCH_SIZE])
+  if not max_threads:
+    max_threads = fetch_q.qsize()
+  results = {}
+  fetch_threads = set()
+  for _ in xrange(min(max_threads, fetch_q.qsize())):
+    th = threading.Thread(target=FetchBuildsIncrementallyWorker,
+                          args=(fetch_q, cache, service_account, results))
+    th.start()
+    fetch_threads.add(th)
+  for th in fetch_threads:
+    th.join()
+
+  build_data = {bucket: {} for bucket in buckets}
+  failures = fetched = cached = 0
+  for (bucket, builder), result in sorted(results.iteritems()):
+    if result is None:
+      failures += 1
+      LOGGER.error('Failed to fetch builds for %s:%s' % (bucket, builder))
+      build_data[bucket][builder] = None
+      continue
+    build_data[bucket][builder] = result[0]
+    fetched += result[1]
+    cached += result[2]
+  LOGGER.info('Fetched %d new builds and reused %d cached builds of %d '
+              'builders', fetched, cached, len(builders))
+
+  return build_data, failures
+
+
 _BUILD_DATA_VERSION = 2
 
 
@@ -380,25 +768,94 @@ def CollateRevisionHistory(builds, repo):
   """
   build_history = {}
   revisions = set()
+  for category_data in builds.itervalues():
+    for builder_data in category_data.itervalues():
+      for build in builder_data:
+        revisions.add(str(build.revision))
+  # Sorting every revision at once resolves all of their positions in a single
+  # batch, so sorting the builders below doesn't have to.
+  revisions = repo.sort(revisions)
   for category, category_data in builds.iteritems():
     LOGGER.debug('Collating category %s', category)
     category_history = build_history.setdefault(category, {})
     for builder, builder_data in category_data.iteritems():
       LOGGER.debug('Collating builder %s', builder)
-      for build in builder_data:
-        revisions.add(str(build.revision))
       category_history[builder] = repo.sort(
           builder_data, keyfunc=lambda b: b.revision)
-  revisions = repo.sort(revisions)
   return (build_history, revisions)
 
 
+def _BuilderStatuses(builder_history, revision_keys, revkey):
+  """Computes one builder's row of the status matrix.
+
+  Each revision gets the status of the build at that revision if there is one;
+  statuses of the revisions in between builds are filled forward from the
+  builds which surround them.
+
+  Args:
+    builder_history: A list of Builds, oldest first.
+    revision_keys: Keys of the revisions to compute statuses for, newest first.
+    revkey: Keyfunc to map each revision to a sortable key.
+
+  Returns:
+    A 2-tuple of (statuses, build_nums) where statuses is a bytearray of the
+    STATUS at each revision and build_nums maps the index of each revision which
+    was built to its build number.
+  """
+  statuses = bytearray(len(revision_keys))
+  build_nums = {}
+  if not revision_keys:
+    return statuses, build_nums
+  gen = reversed(builder_history)
+  previous = None
+  seen = 1
+  if builder_history:
+    last = gen.next()
+  else:
+    last = Build(-1, STATUS.UNKNOWN, NOREV)
+  last_key = revkey(last.revision)
+
+  for i, key in enumerate(revision_keys):
+    try:
+      while key < last_key:
+        previous, last = last, gen.next()
+        last_key = revkey(last.revision)
+        seen += 1
+    except StopIteration:  # pragma: no cover
+      previous, last = last, Build(-1, STATUS.UNKNOWN, NOREV)
+      last_key = revkey(last.revision)
+      seen += 1
+
+    if key == last_key:
+      # current build matches revision
+      status = last.result
+      build_nums[i] = last.number
+    elif seen == 1:
+      assert key > last_key
+      # most recent build is behind revision
+      status = STATUS.UNKNOWN
+    elif last.result == STATUS.UNKNOWN:  # pragma: no cover
+      status = STATUS.UNKNOWN
+    # We color space between FAILED and INPROGRESS builds as FAILED,
+    # since that is what it will eventually become.
+    elif (last.result == STATUS.SUCCESS
+          and previous.result == STATUS.RUNNING):  # pragma: no cover
+      status = STATUS.RUNNING
+    elif last.result == previous.result == STATUS.SUCCESS:
+      status = STATUS.SUCCESS
+    else:
+      status = STATUS.FAILURE
+    statuses[i] = status
+  return statuses, build_nums
+
+
 def FindLKGRCandidate(build_history, revisions, revkey, status_gen=None):
   """Find an lkgr candidate.
 
   This function performs the meat of the algorithm described in the module
-  docstring. It walks backwards through the revisions, searching for a
-  revision which has the SUCCESS status on every builder.
+  docstring. It builds a builder x revision matrix of statuses, then walks
+  backwards through the revisions, searching for a revision which has the
+  SUCCESS status on every builder.
 
   Returns:
     A single revision (string) chosen as the new LKGR candidate.
@@ -407,65 +864,42 @@ def FindLKGRCandidate(build_history, revisions, revkey, status_gen=None):
     build_history: A dict of build data, as from CollateRevisionHistory
     revisions: A list of revisions/commits that were built
     revkey: Keyfunc to map each revision to a sortable key
-    revcmp: A comparator to sort revisions/commits
-    status_gen: An instance of StatusGenerator to output status information
+    status_gen: An instance of StatusGenerator to output status information,
+      or None
   """
   def lowercase_key(item_pair):
     return item_pair[0].lower()
 
-  lkgr = None
   builders = []
   for category, category_history in sorted(build_history.items(),
                                            key=lowercase_key):
-    status_gen.category_cb(category)
+    if status_gen is not None:
+      status_gen.category_cb(category)
     for builder, builder_history in sorted(category_history.items(),
                                            key=lowercase_key):
-      status_gen.builder_cb(builder)
-      gen = reversed(builder_history)
-      prev = []
-      try:
-        prev.append(gen.next())
-      except StopIteration:
-        prev.append(Build(-1, STATUS.UNKNOWN, NOREV))
-      builders.append((category, builder, gen, prev))
-  for revision in reversed(revisions):
-    status_gen.revision_cb(revision)
-    good_revision = True
-    for category, builder, gen, prev in builders:
-      try:
-        while revkey(revision) < revkey(prev[-1].revision):
-          prev.append(gen.next())
-      except StopIteration:  # pragma: no cover
-        prev.append(Build(-1, STATUS.UNKNOWN, NOREV))
-
-      # current build matches revision
-      if revkey(revision) == revkey(prev[-1].revision):
-        status = prev[-1].result
-      elif len(prev) == 1:
-        assert revkey(revision) > revkey(prev[-1].revision)
-        # most recent build is behind revision
-        status = STATUS.UNKNOWN
-      elif prev[-1].result == STATUS.UNKNOWN:  # pragma: no cover
-        status = STATUS.UNKNOWN
-      else:
-        # We color space between FAILED and INPROGRESS builds as FAILED,
-        # since that is what it will eventually become.
-        if (prev[-1].result == STATUS.SUCCESS
-            and prev[-2].result == STATUS.RUNNING):  # pragma: no cover
-          status = STATUS.RUNNING
-        elif prev[-1].result == prev[-2].result == STATUS.SUCCESS:
-          status = STATUS.SUCCESS
-        else:
-          status = STATUS.FAILURE
-      build_num = None
-      if revkey(revision) == revkey(prev[-1].revision):
-        build_num = prev[-1].number
-      status_gen.build_cb(category, builder, status, build_num)
-      if status != STATUS.SUCCESS:
-        good_revision = False
-    if not lkgr and good_revision:
-      lkgr = revision
-      status_gen.lkgr_cb(revision)
+      if status_gen is not None:
+        status_gen.builder_cb(builder)
+      builders.append((category, builder, builder_history))
+
+  revisions = list(reversed(revisions))
+  revision_keys = [revkey(revision) for revision in revisions]
+  rows = [_BuilderStatuses(builder_history, revision_keys, revkey)
+          for _, _, builder_history in builders]
+
+  lkgr_index = None
+  for i in xrange(len(revisions)):
+    if all(statuses[i] == STATUS.SUCCESS for statuses, _ in rows):
+      lkgr_index = i
+      break
+  lkgr = revisions[lkgr_index] if lkgr_index is not None else None
+
+  if status_gen is not None:
+    for i, revision in enumerate(revisions):
+      status_gen.revision_cb(revision)
+      for (category, builder, _), (statuses, build_nums) in zip(builders, rows):
+        status_gen.build_cb(category, builder, statuses[i], build_nums.get(i))
+      if i == lkgr_index:
+        status_gen.lkgr_cb(revision)
   return lkgr
 
 
@@ -6,13 +6,16 @@
 """Source file for lkgr_lib testcases."""
 
 
+import BaseHTTPServer
 import datetime
 import httplib2
 import json
 import mock
 import os
+import shutil
 import sys
 import tempfile
+import threading
 import unittest
 
 import google.protobuf.message
@@ -104,6 +107,233 @@ class FetchBuildbucketBuildsForBuilderTest(unittest.TestCase):
     self.assertEquals(builds, [])
 
 
+class _FakeBuildbucketHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_POST(self):
+    batch_pb = rpc_pb2.BatchRequest()
+    batch_pb.ParseFromString(
+        self.rfile.read(int(self.headers['Content-Length'])))
+    self.server.batches.append(batch_pb)
+    response_pb = rpc_pb2.BatchResponse()
+    for request_pb in batch_pb.requests:
+      search_pb = request_pb.search_builds
+      builder = search_pb.predicate.builder
+      key = '%s/%s/%s' % (builder.project, builder.bucket, builder.builder)
+      res = response_pb.responses.add()
+      if key not in self.server.builds:
+        res.error.code = 5  # NOT_FOUND
+        res.error.message = 'unknown builder %s' % key
+        continue
+      # Like Buildbucket, start_build_id is an inclusive upper bound and
+      # end_build_id is a lower bound, as build_high and build_low.
+      build_range = search_pb.predicate.build
+      build_high = build_range.start_build_id and build_range.start_build_id + 1
+      build_low = build_range.end_build_id and build_range.end_build_id - 1
+      # Builds are listed newest (i.e. lowest id) first.
+      for build_id, number, status, revision in sorted(
+          self.server.builds[key]):
+        if build_high and build_id >= build_high:
+          continue
+        if build_low and build_id < build_low:
+          continue
+        if len(res.search_builds.builds) == search_pb.page_size:
+          break
+        build_pb = res.search_builds.builds.add()
+        build_pb.id = build_id
+        build_pb.number = number
+        build_pb.status = status
+        build_pb.input.gitiles_commit.id = revision
+    self.server.responses.append(response_pb)
+    content = response_pb.SerializeToString()
+    self.send_response(200)
+    self.send_header('X-Prpc-Grpc-Code', '0')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, *_args):
+    pass
+
+
+class FakeBuildbucket(BaseHTTPServer.HTTPServer):
+  """A local Buildbucket serving SearchBuilds requests in Batch requests."""
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(
+        self, ('127.0.0.1', 0), _FakeBuildbucketHandler)
+    # 'project/bucket/builder' -> [(id, number, status, revision), ...]
+    self.builds = {}
+    self.batches = []
+    self.responses = []
+    self.thread = threading.Thread(
+        target=self.serve_forever, kwargs={'poll_interval': 0.01})
+    self.thread.daemon = True
+
+  @property
+  def endpoint(self):
+    return 'http://127.0.0.1:%d/prpc/buildbucket.v2.Builds/Batch' % (
+        self.server_port)
+
+  def add_build(self, builder, number, status=common_pb2.SUCCESS):
+    # Ids decrease as builds get newer.
+    self.builds.setdefault(builder, []).append(
+        (10000 - number, number, status, '%040x' % number))
+
+
+class FetchBuildbucketBuildsIncrementallyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.buildbucket = FakeBuildbucket()
+    self.buildbucket.thread.start()
+    self.tempdir = tempfile.mkdtemp()
+    for patcher in (
+        mock.patch.object(lkgr_lib, '_BUILDBUCKET_BATCH_ENDPOINT_V2',
+                          self.buildbucket.endpoint),
+        mock.patch.object(lkgr_lib, '_SEARCH_BATCH_SIZE', 2),
+        mock.patch('infra_libs.luci_auth.available', return_value=False)):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def tearDown(self):
+    self.buildbucket.shutdown()
+    self.buildbucket.server_close()
+    shutil.rmtree(self.tempdir)
+
+  def fetch(self, buckets, max_threads=2):
+    return lkgr_lib.FetchBuildbucketBuildsIncrementally(
+        buckets, self.tempdir, max_threads=max_threads)
+
+  @staticmethod
+  def build(number, result=lkgr_lib.STATUS.SUCCESS):
+    return lkgr_lib.Build(number, result, '%040x' % number)
+
+  def testFetchesOnlyNewBuilds(self):
+    for number in (1, 2, 3):
+      self.buildbucket.add_build('p/b/builder1', number)
+    self.buildbucket.add_build('p/b/builder2', 1, common_pb2.FAILURE)
+    buckets = {'p/b': {'builders': ['builder1', 'builder2']}}
+
+    builds, failures = self.fetch(buckets)
+    self.assertEquals(failures, 0)
+    self.assertEquals(builds, {'p/b': {
+        'builder1': [self.build(3), self.build(2), self.build(1)],
+        'builder2': [self.build(1, lkgr_lib.STATUS.FAILURE)],
+    }})
+
+    self.buildbucket.add_build('p/b/builder1', 4)
+    builds, failures = self.fetch(buckets)
+    self.assertEquals(failures, 0)
+    self.assertEquals(builds['p/b']['builder1'], [
+        self.build(4), self.build(3), self.build(2), self.build(1)])
+    self.assertEquals(builds['p/b']['builder2'],
+                      [self.build(1, lkgr_lib.STATUS.FAILURE)])
+
+    # Both builders were searched in one batch, starting after the builds
+    # which were already cached.
+    self.assertEquals(len(self.buildbucket.batches), 2)
+    searches = [r.search_builds for r in self.buildbucket.batches[1].requests]
+    self.assertEquals(
+        [s.predicate.build.start_build_id for s in searches],
+        [10000 - 3 - 1, 10000 - 1 - 1])
+
+  def testReturnsOnlyBuildsNewerThanCursor(self):
+    for number in (1, 2):
+      self.buildbucket.add_build('p/b/builder1', number)
+    buckets = {'p/b': {'builders': ['builder1']}}
+    self.fetch(buckets)
+
+    self.buildbucket.add_build('p/b/builder1', 3)
+    builds, _ = self.fetch(buckets)
+    self.assertEquals(builds['p/b']['builder1'], [
+        self.build(3), self.build(2), self.build(1)])
+    # Only the new build was returned by the second search.
+    response_pb = self.buildbucket.responses[1].responses[0]
+    self.assertEquals([b.number for b in response_pb.search_builds.builds], [3])
+
+  def testRefetchesUnfinishedBuilds(self):
+    self.buildbucket.add_build('p/b/builder1', 1)
+    self.buildbucket.add_build('p/b/builder1', 2, common_pb2.STARTED)
+    self.buildbucket.add_build('p/b/builder1', 3)
+    buckets = {'p/b': {'builders': ['builder1']}}
+
+    builds, _ = self.fetch(buckets)
+    self.assertEquals(builds['p/b']['builder1'],
+                      [self.build(3), self.build(1)])
+
+    self.buildbucket.builds['p/b/builder1'][1] = (
+        10000 - 2, 2, common_pb2.FAILURE, '%040x' % 2)
+    builds, _ = self.fetch(buckets)
+    self.assertEquals(builds['p/b']['builder1'], [
+        self.build(3), self.build(2, lkgr_lib.STATUS.FAILURE), self.build(1)])
+
+  def testKeepsMostRecentBuilds(self):
+    for number in xrange(1, 6):
+      self.buildbucket.add_build('p/b/builder1', number)
+    buckets = {'p/b': {'builders': ['builder1']}}
+    with mock.patch.object(lkgr_lib, '_MAX_BUILDS_PER_BUILDER', 3):
+      builds, _ = self.fetch(buckets)
+      self.assertEquals(builds['p/b']['builder1'], [
+          self.build(5), self.build(4), self.build(3)])
+      self.buildbucket.add_build('p/b/builder1', 6)
+      builds, _ = self.fetch(buckets)
+    self.assertEquals(builds['p/b']['builder1'], [
+        self.build(6), self.build(5), self.build(4)])
+
+  def testManyBatches(self):
+    builders = ['builder%d' % i for i in xrange(7)]
+    for builder in builders:
+      self.buildbucket.add_build('p/b/%s' % builder, 1)
+    builds, failures = self.fetch({'p/b': {'builders': builders}},
+                                  max_threads=0)
+    self.assertEquals(failures, 0)
+    self.assertEquals(builds['p/b'],
+                      {builder: [self.build(1)] for builder in builders})
+    self.assertEquals(len(self.buildbucket.batches), 4)
+
+  def testFailures(self):
+    self.buildbucket.add_build('p/b/builder1', 1)
+    builds, failures = self.fetch({
+        'p/b': {'builders': ['builder1', 'missing']},
+        'malformed': {'builders': ['builder1', 'builder2']},
+    })
+    self.assertEquals(failures, 3)
+    self.assertEquals(builds, {
+        'p/b': {'builder1': [self.build(1)], 'missing': None},
+        'malformed': {'builder1': None, 'builder2': None},
+    })
+
+  def testRequestFails(self):
+    self.buildbucket.add_build('p/b/builder1', 1)
+    with mock.patch.object(_FakeBuildbucketHandler, 'do_POST',
+                           lambda handler: handler.send_error(500)):
+      builds, failures = self.fetch({'p/b': {'builders': ['builder1']}})
+    self.assertEquals(failures, 1)
+    self.assertEquals(builds, {'p/b': {'builder1': None}})
+
+  def testBadResponse(self):
+    def bad_response(handler):
+      handler.send_response(200)
+      handler.send_header('X-Prpc-Grpc-Code', '0')
+      handler.send_header('Content-Length', '3')
+      handler.end_headers()
+      handler.wfile.write('bad')
+
+    self.buildbucket.add_build('p/b/builder1', 1)
+    with mock.patch.object(_FakeBuildbucketHandler, 'do_POST', bad_response):
+      builds, failures = self.fetch({'p/b': {'builders': ['builder1']}})
+    self.assertEquals(failures, 1)
+    self.assertEquals(builds, {'p/b': {'builder1': None}})
+
+  def testIgnoresCorruptCache(self):
+    self.buildbucket.add_build('p/b/builder1', 1)
+    os.makedirs(os.path.join(self.tempdir, 'p%2Fb'))
+    with open(os.path.join(self.tempdir, 'p%2Fb', 'builder1.json'), 'w') as f:
+      f.write('{')
+    builds, failures = self.fetch({'p/b': {'builders': ['builder1']}})
+    self.assertEquals(failures, 0)
+    self.assertEquals(builds, {'p/b': {'builder1': [self.build(1)]}})
+
+
 class CollateRevisionHistoryTest(unittest.TestCase):
 
   def testSortsBuildHistories(self):
@@ -300,6 +530,108 @@ class FindLKGRCandidateTest(unittest.TestCase):
     self.assertEquals(candidate, None)
 
 
+  def testNoStatusGenerator(self):
+    build_history = {
+        'm1': {'b1': [lkgr_lib.Build(1, self.good, 1),
+                      lkgr_lib.Build(2, self.good, 2)]},
+        'm2': {'b2': [lkgr_lib.Build(1, self.good, 1),
+                      lkgr_lib.Build(3, self.fail, 3)]}}
+    revisions = [1, 2, 3]
+    candidate = lkgr_lib.FindLKGRCandidate(
+        build_history, revisions, self.keyfunc)
+    self.assertEquals(candidate, 1)
+
+  def testReportsStatusMatrix(self):
+    calls = []
+    status_gen = mock.Mock()
+    for cb in ('category_cb', 'builder_cb', 'revision_cb', 'build_cb',
+               'lkgr_cb'):
+      getattr(status_gen, cb).side_effect = (
+          lambda *args, **_kwargs: calls.append(args))
+    build_history = {
+        'm2': {'b2': [lkgr_lib.Build(10, self.good, 1),
+                      lkgr_lib.Build(11, self.good, 3)]},
+        'M1': {'b1': [lkgr_lib.Build(20, self.good, 2)]}}
+    revisions = [1, 2, 3]
+
+    def allow_norev_keyfunc(val):
+      if val is lkgr_lib.NOREV:
+        return -1
+      return int(val)
+
+    candidate = lkgr_lib.FindLKGRCandidate(
+        build_history, revisions, allow_norev_keyfunc, status_gen)
+    self.assertEquals(candidate, 2)
+    unknown = lkgr_lib.STATUS.UNKNOWN
+    self.assertEquals(calls, [
+        ('M1',), ('b1',), ('m2',), ('b2',),
+        (3,), ('M1', 'b1', unknown, None), ('m2', 'b2', self.good, 11),
+        (2,), ('M1', 'b1', self.good, 20), ('m2', 'b2', self.good, None),
+        (2,),
+        (1,), ('M1', 'b1', unknown, None), ('m2', 'b2', self.good, 10),
+    ])
+
+
+class CommitPositionIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tempdir, 'positions.json')
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testPersists(self):
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    self.assertEquals(len(index), 0)
+    index.update({'a' * 40: (1, 'refs/heads/master'), 'b' * 40: None})
+    index.save()
+
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    self.assertEquals(len(index), 2)
+    self.assertEquals(index.get('a' * 40), (1, 'refs/heads/master'))
+    self.assertIn('b' * 40, index)
+    self.assertIsNone(index.get('b' * 40))
+    self.assertNotIn('c' * 40, index)
+
+  def testOnlySavesChanges(self):
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    index.save()
+    self.assertFalse(os.path.exists(self.path))
+    index.update({'a' * 40: (1, 'refs/heads/master')})
+    index.save()
+    os.unlink(self.path)
+    index.update({'a' * 40: (1, 'refs/heads/master')})
+    index.save()
+    self.assertFalse(os.path.exists(self.path))
+
+  def testIgnoresOtherRepository(self):
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    index.update({'a' * 40: (1, 'refs/heads/master')})
+    index.save()
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://other')
+    self.assertEquals(len(index), 0)
+
+  def testIgnoresCorruptFile(self):
+    with open(self.path, 'w') as f:
+      f.write('{not json')
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    self.assertEquals(len(index), 0)
+
+  def testDropsOldestPositions(self):
+    with mock.patch.object(lkgr_lib.CommitPositionIndex, 'MAX_ENTRIES', 2):
+      index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+      index.update({
+          'a' * 40: (3, 'refs/heads/master'),
+          'b' * 40: (1, 'refs/heads/master'),
+          'c' * 40: None,
+          'd' * 40: (2, 'refs/heads/master'),
+      })
+      index.save()
+    index = lkgr_lib.CommitPositionIndex(self.path, 'https://repo')
+    self.assertEquals(sorted(index._positions), ['a' * 40, 'd' * 40])
+
+
 class CheckLKGRLagTest(unittest.TestCase):
   allowed_lag = 2  # Default allowed lag is 2 hours
   allowed_gap = 150  # Default allowed gap is 150 revisions
@@ -51,7 +51,8 @@ class ServiceManager(app.BaseApplication):
     parser.add_argument(
         '--config-poll-interval',
         default=10,
-        help='how frequently (in seconds) to poll the config directory')
+        help='how frequently (in seconds) to poll the config directory if '
+             'it can\'t be watched with inotify')
     parser.add_argument(
         '--service-poll-interval',
         default=10,
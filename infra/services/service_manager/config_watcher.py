@@ -10,6 +10,7 @@ import os.path
 import sys
 import time
 
+from infra.services.service_manager import inotify
 from infra.services.service_manager import service
 from infra.services.service_manager import service_thread
 
@@ -78,22 +79,35 @@ class _Metadata(object):
 
 
 class ConfigWatcher(object):
-  """Polls a directory for .json files describing services to be run.
+  """Watches a directory for .json files describing services to be run.
 
   Tries to keep the running services in sync with the config files - services
   are started immediately when valid configs are added, restarted when their
   configs change (adding or removing args for example), and stopped when the
   configs are deleted.
+
+  Where inotify is available the directory is rescanned as soon as something in
+  it changes, and otherwise only every RESCAN_INTERVAL.  Elsewhere it is polled
+  every config_poll_interval.  Our own version is always checked every
+  config_poll_interval: with CIPD's symlink install mode an upgrade changes a
+  link below the directory of the version file, which inotify doesn't see.
   """
 
+  # How often (in seconds) to rescan the config directory when inotify tells us
+  # about changes.  This is only a safety net for missed events.
+  RESCAN_INTERVAL = 300
+
+  # How many services may be restarted at the same time.
+  MAX_RESTARTS = 4
+
   def __init__(self, config_directory, config_poll_interval,
                service_poll_interval, state_directory, cipd_version_file,
-               cloudtail, _sleep_fn=time.sleep):
+               cloudtail, _sleep_fn=time.sleep, _inotify_fn=inotify.Inotify):
     """
     Args:
       config_directory(str): Directory containing .json config files to monitor.
       config_poll_interval(int): How often (in seconds) to poll config_directory
-          for changes.
+          for changes if inotify isn't available.
       service_poll_interval(int): How often (in seconds) to restart failed
           services.
       state_directory(str): A file will be created in this directory (with the
@@ -102,6 +116,7 @@ class ConfigWatcher(object):
       cloudtail (CloudtailFactory): An object that knows how to start cloudtail.
     """
 
+    self._config_directory = config_directory
     self._config_glob = os.path.join(config_directory, '*.json')
     self._config_poll_interval = config_poll_interval
     self._service_poll_interval = service_poll_interval
@@ -113,9 +128,15 @@ class ConfigWatcher(object):
     self._stop = False
 
     self._sleep_fn = _sleep_fn
+    self._inotify_fn = _inotify_fn
 
     self._own_service = service.OwnService(state_directory, cipd_version_file)
 
+    # Checks on all the services, so that their threads can sleep until their
+    # service needs to be restarted.
+    self._sampler = service_thread.ProcessStateSampler(
+        service_poll_interval, max_restarts=self.MAX_RESTARTS)
+
   def run(self):
     """Runs continuously in this thread until stop() is called."""
 
@@ -124,13 +145,57 @@ class ConfigWatcher(object):
       # ts_mon.close() in BaseApplication from being called.
       os._exit(0)
 
-    while not self._stop:
-      self._iteration()
-      if not self._stop:  # pragma: no cover
-        self._sleep_fn(self._config_poll_interval)
+    notifier = self._watch()
+    self._sampler.start()
+    try:
+      scan_configs = True
+      while not self._stop:
+        if scan_configs:
+          next_rescan = time.time() + self.RESCAN_INTERVAL
+        self._iteration(scan_configs)
+        if not self._stop:  # pragma: no cover
+          if notifier is None:
+            self._sleep_fn(self._config_poll_interval)
+          else:
+            changed = notifier.wait(self._config_poll_interval)
+            scan_configs = changed or time.time() >= next_rescan
+    finally:
+      if notifier is not None:
+        notifier.close()
+
+  def _watch(self):
+    """Starts watching the config directory.
+
+    Returns:
+      The Inotify to wait on, or None to sleep instead.
+    """
+
+    if self._inotify_fn is None:
+      return None
+
+    try:
+      notifier = self._inotify_fn()
+    except inotify.InotifyError as ex:
+      LOGGER.info('Polling %s every %ss: %s', self._config_directory,
+                  self._config_poll_interval, ex)
+      return None
 
-  def _iteration(self):
-    """Runs one iteration of the loop.  Useful for testing."""
+    try:
+      notifier.add_watch(self._config_directory)
+    except inotify.InotifyError as ex:
+      LOGGER.warning('Polling %s every %ss: %s', self._config_directory,
+                     self._config_poll_interval, ex)
+      notifier.close()
+      return None
+    return notifier
+
+  def _iteration(self, scan_configs=True):
+    """Runs one iteration of the loop.  Useful for testing.
+
+    Args:
+      scan_configs(bool): whether to look for changed config files, or only
+          check our own version.
+    """
 
     own_state = self._own_service.get_running_process_state()
     if self._own_service.has_version_changed(own_state):
@@ -138,6 +203,9 @@ class ConfigWatcher(object):
       self.stop()
       return
 
+    if not scan_configs:
+      return
+
     files = set(glob.glob(self._config_glob))
     for filename in files:
       mtime = os.path.getmtime(filename)
@@ -162,6 +230,7 @@ class ConfigWatcher(object):
     for metadata in self._metadata.values():
       if metadata.thread is not None:
         metadata.thread.stop()
+    self._sampler.stop(join=self._sampler.is_alive())
 
   def _config_added(self, filename, mtime):
     config = load_config(filename)
@@ -183,7 +252,8 @@ class ConfigWatcher(object):
         self._service_poll_interval,
         self._state_directory,
         config,
-        self._cloudtail)
+        self._cloudtail,
+        sampler=self._sampler)
     thread.start()
     thread.start_service()
     self._metadata[filename] = _Metadata(mtime, config, thread)
@@ -216,7 +286,8 @@ class ConfigWatcher(object):
           self._service_poll_interval,
           self._state_directory,
           metadata.config,
-          self._cloudtail)
+          self._cloudtail,
+          sampler=self._sampler)
       metadata.thread.start()
       metadata.thread.start_service()
     else:
@@ -0,0 +1,113 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""Minimal inotify bindings, to wait for changes to directories.
+
+Only Linux has inotify.  Elsewhere, and if the kernel refuses to give us an
+inotify instance, Inotify() raises InotifyError and callers are expected to
+fall back to polling.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import sys
+
+LOGGER = logging.getLogger(__name__)
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# Everything which can change the list of files in a directory, or the content
+# of one of them once it has been written.
+DIRECTORY_CHANGES = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                     IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+
+class InotifyError(Exception):
+  """Raised if inotify is unavailable or a watch couldn't be added."""
+
+
+def _load_libc():  # pragma: no cover
+  if not sys.platform.startswith('linux'):
+    return None
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+  except OSError:
+    return None
+  if not hasattr(libc, 'inotify_init1'):
+    return None
+  return libc
+
+
+class Inotify(object):
+  """An inotify instance, watching some directories for changes."""
+
+  def __init__(self, _libc_fn=_load_libc):
+    self._libc = _libc_fn()
+    if self._libc is None:
+      raise InotifyError('inotify is not available on %s' % sys.platform)
+    self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if self._fd < 0:
+      raise InotifyError('inotify_init1: %s' % os.strerror(ctypes.get_errno()))
+
+  def add_watch(self, path, mask=DIRECTORY_CHANGES):
+    """Watches path for the events in mask."""
+
+    wd = self._libc.inotify_add_watch(self._fd, path, mask)
+    if wd < 0:
+      raise InotifyError('inotify_add_watch(%s): %s' % (
+          path, os.strerror(ctypes.get_errno())))
+    LOGGER.debug('Watching %s for changes', path)
+
+  def wait(self, timeout):
+    """Waits until something changed in a watched directory.
+
+    All the pending events are consumed, so that a burst of changes (e.g. a
+    package roll rewriting many files) only wakes the caller once.
+
+    Args:
+      timeout: Seconds to wait for changes.
+
+    Returns:
+      True if something changed, or we were interrupted by a signal. False if
+      the timeout expired.
+    """
+
+    try:
+      readable, _, _ = select.select([self._fd], [], [], timeout)
+    except select.error as ex:  # pragma: no cover
+      if ex.args[0] == errno.EINTR:
+        return True
+      raise
+    if not readable:
+      return False
+
+    while True:
+      try:
+        if not os.read(self._fd, 64 * 1024):  # pragma: no cover
+          break
+      except OSError as ex:
+        if ex.errno == errno.EAGAIN:
+          break
+        raise  # pragma: no cover
+    return True
+
+  def close(self):
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
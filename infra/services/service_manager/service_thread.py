@@ -51,7 +51,7 @@ class ServiceThread(threading.Thread):
 
   def __init__(self, poll_interval, state_directory, service_config,
                cloudtail,
-               wait_condition=None):
+               wait_condition=None, sampler=None):
     """
     Args:
       poll_interval: How often (in seconds) to restart failed services.
@@ -61,6 +61,9 @@ class ServiceThread(threading.Thread):
       service_config: A dictionary containing the service's config.  See README
           for a description of the fields.
       cloudtail: An object that knows how to start cloudtail.
+      sampler: A ProcessStateSampler which checks on the service, and wakes
+          this thread only when the service needs to be (re)started.  If None
+          the thread wakes up every poll_interval to check on it itself.
     """
 
     super(ServiceThread, self).__init__()
@@ -81,10 +84,19 @@ class ServiceThread(threading.Thread):
 
     self._started = False  # Whether we started the service already.
 
+    self._sampler = sampler
+    if sampler is not None:
+      sampler.add(self)
+
+  @property
+  def service_name(self):
+    return self._service.name
+
   def _wait(self):
     with self._condition:
       if not self._state_changed:  # pragma: no cover
-        self._condition.wait(self._poll_interval)
+        self._condition.wait(
+            None if self._sampler is not None else self._poll_interval)
 
       # Clone the state object so we can release the lock.
       ret = self._state.clone()
@@ -99,7 +111,20 @@ class ServiceThread(threading.Thread):
       self._state_changed = True
       self._condition.notify()
 
+  def _restart_slot(self):
+    """Returns a context manager to hold while restarting the service."""
+    if self._sampler is None:
+      return _NullContext()
+    return self._sampler.restart_slot()
+
   def run(self):
+    try:
+      self._run()
+    finally:
+      if self._sampler is not None:
+        self._sampler.remove(self)
+
+  def _run(self):
     while True:
       try:
         state = self._wait()
@@ -107,21 +132,23 @@ class ServiceThread(threading.Thread):
         if state.exit:
           return
         elif state.new_config is not None:
-          # Stop the service if it's currently running.
-          self._service.stop()
+          with self._restart_slot():
+            # Stop the service if it's currently running.
+            self._service.stop()
 
-          # Recreate it with the new config and start it.
-          self.reconfigs.increment(fields={'service': self._service.name})
-          self._service = service.Service(self._state_directory,
-                                          state.new_config,
-                                          self._cloudtail)
-          self._service.start()
+            # Recreate it with the new config and start it.
+            self.reconfigs.increment(fields={'service': self._service.name})
+            self._service = service.Service(self._state_directory,
+                                            state.new_config,
+                                            self._cloudtail)
+            self._service.start()
           self._started = True
         elif state.should_run == False:
           # Ensure the service is stopped.
           self._service.stop()
           self._started = False
         elif state.should_run == True:
+          restart = False
           try:
             proc_state = self._service.get_running_process_state()
           except service.UnexpectedProcessStateError:
@@ -143,16 +170,21 @@ class ServiceThread(threading.Thread):
               self.upgrades.increment(fields={'service': self._service.name})
               LOGGER.info('Service %s has a new package version, restarting',
                           self._service.name)
-              self._service.stop()
+              restart = True
             elif self._service.has_cmd_changed(proc_state):
               self.reconfigs.increment(fields={'service': self._service.name})
               LOGGER.info(
                 'Service %s has new command: was %s, restarting with %s',
                 self._service.name, proc_state.cmd, self._service.cmd)
-              self._service.stop()
+              restart = True
 
-          # Ensure the service is running.
-          self._service.start()
+          if restart:
+            with self._restart_slot():
+              self._service.stop()
+              self._service.start()
+          else:
+            # Ensure the service is running.
+            self._service.start()
           self._started = True
 
       except Exception:
@@ -178,3 +210,121 @@ class ServiceThread(threading.Thread):
     with self._change_state():
       self._state.new_config = new_config
       self._state.should_run = True
+
+  def needs_attention(self):
+    """Returns whether the service should be, but isn't running as configured.
+
+    Called by the ProcessStateSampler, from its own thread.
+    """
+
+    with self._condition:
+      if self._state.should_run is not True or self._state_changed:
+        # Stopped, or this thread is about to act on its service anyway.
+        return False
+      svc = self._service
+
+    try:
+      proc_state = svc.get_running_process_state()
+    except service.ProcessStateError:
+      return True
+    return (svc.has_version_changed(proc_state) or
+            svc.has_cmd_changed(proc_state))
+
+  def poke(self):
+    """Wakes the thread up to check on its service."""
+
+    with self._change_state():
+      pass
+
+
+class _NullContext(object):
+  def __enter__(self):
+    pass
+
+  def __exit__(self, _exc_type, _exc_value, _traceback):
+    pass
+
+
+class ProcessStateSampler(threading.Thread):
+  """Checks on the processes of all the services in a single thread.
+
+  Rather than each ServiceThread waking up every poll interval to read the state
+  of its process, the sampler reads the state of every service in one pass, and
+  only wakes the threads whose service isn't running as configured.  Those
+  threads then restart their services in parallel, but no more than
+  max_restarts at a time, so that a package roll doesn't restart every service
+  on the machine at once.
+  """
+
+  wakeups = ts_mon.CounterMetric('service_manager/sampler_wakeups',
+      'Number of times the process state sampler woke up the thread of each '
+      'service because it wasn\'t running as configured',
+      [ts_mon.StringField('service')])
+
+  def __init__(self, poll_interval, max_restarts=4, wait_condition=None):
+    """
+    Args:
+      poll_interval: How often (in seconds) to check on the services.
+      max_restarts: How many services may be restarting at the same time.
+    """
+
+    super(ProcessStateSampler, self).__init__(name='process-state-sampler')
+    self.daemon = True
+
+    if wait_condition is None:  # pragma: no cover
+      wait_condition = threading.Condition()
+
+    self._poll_interval = poll_interval
+    self._condition = wait_condition  # Protects _threads and _exit.
+    self._threads = []
+    self._exit = False
+    self._restarts = threading.BoundedSemaphore(max_restarts)
+
+  def add(self, thread):
+    with self._condition:
+      self._threads.append(thread)
+
+  def remove(self, thread):
+    with self._condition:
+      if thread in self._threads:
+        self._threads.remove(thread)
+
+  @contextlib.contextmanager
+  def restart_slot(self):
+    """Blocks while max_restarts services are already restarting."""
+
+    with self._restarts:
+      yield
+
+  def sample(self):
+    """Checks on every service once, and wakes up the ones that need it."""
+
+    with self._condition:
+      threads = list(self._threads)
+
+    for thread in threads:
+      try:
+        if thread.needs_attention():
+          self.wakeups.increment(fields={'service': thread.service_name})
+          thread.poke()
+      except Exception:
+        LOGGER.exception('Failed to sample the process state of %s',
+                         thread.service_name)
+
+  def run(self):
+    while True:
+      with self._condition:
+        if self._exit:
+          return
+      self.sample()
+      with self._condition:
+        if not self._exit:  # pragma: no cover
+          self._condition.wait(self._poll_interval)
+
+  def stop(self, join=True):
+    with self._condition:
+      self._exit = True
+      self._condition.notify()
+
+    if join:  # pragma: no cover
+      self.join()
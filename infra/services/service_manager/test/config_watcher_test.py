@@ -13,6 +13,7 @@ import mock
 
 from infra.services.service_manager import cloudtail_factory
 from infra.services.service_manager import config_watcher
+from infra.services.service_manager import inotify
 from infra.services.service_manager import service
 from infra.services.service_manager import service_thread
 
@@ -50,6 +51,9 @@ class ConfigWatcherTest(unittest.TestCase):
         'infra.services.service_manager.service_thread.ServiceThread',
         autospec=True).start()
     self.mock_thread = self.mock_thread_ctor.return_value
+    self.mock_sampler = mock.patch(
+        'infra.services.service_manager.service_thread.ProcessStateSampler',
+        autospec=True).start().return_value
     self.mock_ownservice = self.mock_ownservice_ctor.return_value
     self.mock_ownservice.start.return_value = True
     self.mock_ownservice.has_version_changed.return_value = False
@@ -62,7 +66,8 @@ class ConfigWatcherTest(unittest.TestCase):
         '/state',
         '/rootdir',
         self.mock_cloudtail,
-        _sleep_fn=self.mock_sleep)
+        _sleep_fn=self.mock_sleep,
+        _inotify_fn=None)
 
   def tearDown(self):
     mock.patch.stopall()
@@ -107,7 +112,8 @@ class ConfigWatcherTest(unittest.TestCase):
         43,
         '/state',
         {'name': 'foo', 'cmd': ['baz']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -140,7 +146,8 @@ class ConfigWatcherTest(unittest.TestCase):
         43,
         '/state',
         {'name': 'bar', 'cmd': ['baz']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -172,7 +179,8 @@ class ConfigWatcherTest(unittest.TestCase):
         '/state',
         {'name': 'foo',
          'cmd': ['whatever.tool']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
 
     self._set_config(
       'foo.json',
@@ -232,7 +240,8 @@ class ConfigWatcherTest(unittest.TestCase):
         43,
         '/state',
         {'name': 'foo', 'cmd': ['baz']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -258,7 +267,8 @@ class ConfigWatcherTest(unittest.TestCase):
         43,
         '/state',
         {'name': 'foo', 'cmd': ['baz']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -291,7 +301,8 @@ class ConfigWatcherTest(unittest.TestCase):
         {'name': 'foo',
          'cmd': ['baz']
         },
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -312,7 +323,8 @@ class ConfigWatcherTest(unittest.TestCase):
         {'name': 'foo',
          'cmd': ['baz']
         },
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
     self.mock_thread.start.assert_called_once_with()
     self.mock_thread.start_service.assert_called_once_with()
 
@@ -345,7 +357,8 @@ class ConfigWatcherTest(unittest.TestCase):
         43,
         '/state',
         {'name': 'foo', 'cmd': ['baz']},
-        self.mock_cloudtail)
+        self.mock_cloudtail,
+        sampler=self.mock_sampler)
 
     def sleep_impl(_duration):
       self.cw.stop()
@@ -371,3 +384,83 @@ class ConfigWatcherTest(unittest.TestCase):
 
     self.mock_sleep.assert_called_once_with(42)
     self.assertFalse(self.mock_thread_ctor.called)
+
+  def _run_with_notifier(self, add_watch_errors=(), wait_fn=None):
+    notifier = mock.create_autospec(inotify.Inotify, instance=True)
+    notifier.add_watch.side_effect = add_watch_errors or None
+    notifier.wait.side_effect = wait_fn or (lambda _timeout: self.cw.stop())
+    self.mock_sleep.side_effect = lambda _duration: self.cw.stop()
+    self.cw._inotify_fn = lambda: notifier
+    self.cw.run()
+    return notifier
+
+  def test_run_with_inotify(self):
+    notifier = self._run_with_notifier()
+
+    notifier.add_watch.assert_called_once_with(self.config_directory)
+    # Our own version is still checked every config_poll_interval.
+    notifier.wait.assert_called_once_with(42)
+    notifier.close.assert_called_once_with()
+    self.assertFalse(self.mock_sleep.called)
+    self.mock_sampler.start.assert_called_once_with()
+    self.mock_sampler.stop.assert_called_once_with(join=mock.ANY)
+
+  def test_run_inotify_scans_configs_on_change(self):
+    def wait_fn(_timeout):
+      if notifier.wait.call_count == 1:
+        # Unnoticed, until the next event.
+        self._set_config('foo.json', '{"name": "foo", "cmd": ["baz"]}')
+        return False
+      if notifier.wait.call_count == 2:
+        self.assertFalse(self.mock_thread_ctor.called)
+        return True
+      self.cw.stop()
+
+    notifier = mock.create_autospec(inotify.Inotify, instance=True)
+    notifier.wait.side_effect = wait_fn
+    self.cw._inotify_fn = lambda: notifier
+    self.cw.run()
+
+    self.assertEqual(3, self.mock_ownservice.has_version_changed.call_count)
+    self.assertEqual(1, self.mock_thread_ctor.call_count)
+
+  def test_run_inotify_version_changed(self):
+    def wait_fn(_timeout):
+      self.mock_ownservice.has_version_changed.return_value = True
+      return False
+    notifier = self._run_with_notifier(wait_fn=wait_fn)
+
+    notifier.wait.assert_called_once_with(42)
+    self.mock_sampler.stop.assert_called_once_with(join=mock.ANY)
+
+  def test_run_inotify_rescan(self):
+    self.cw.RESCAN_INTERVAL = 0
+    def wait_fn(_timeout):
+      if notifier.wait.call_count == 1:
+        self._set_config('foo.json', '{"name": "foo", "cmd": ["baz"]}')
+        return False
+      self.cw.stop()
+
+    notifier = mock.create_autospec(inotify.Inotify, instance=True)
+    notifier.wait.side_effect = wait_fn
+    self.cw._inotify_fn = lambda: notifier
+    self.cw.run()
+
+    self.assertEqual(1, self.mock_thread_ctor.call_count)
+
+  def test_run_inotify_unavailable(self):
+    def inotify_fn():
+      raise inotify.InotifyError('nope')
+    self.mock_sleep.side_effect = lambda _duration: self.cw.stop()
+    self.cw._inotify_fn = inotify_fn
+    self.cw.run()
+
+    self.mock_sleep.assert_called_once_with(42)
+
+  def test_run_cannot_watch_config_directory(self):
+    notifier = self._run_with_notifier(
+        add_watch_errors=[inotify.InotifyError('nope')])
+
+    self.mock_sleep.assert_called_once_with(42)
+    self.assertFalse(notifier.wait.called)
+    notifier.close.assert_called_once_with()
@@ -0,0 +1,59 @@
+# Copyright 2019 The Chromium Authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from infra.services.service_manager import inotify
+
+
+class InotifyTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    try:
+      self.notifier = inotify.Inotify()
+    except inotify.InotifyError:  # pragma: no cover
+      self.notifier = None
+
+  def tearDown(self):
+    if self.notifier is not None:
+      self.notifier.close()
+    shutil.rmtree(self.directory)
+
+  def test_unavailable(self):
+    with self.assertRaises(inotify.InotifyError):
+      inotify.Inotify(_libc_fn=lambda: None)
+
+  def test_wait(self):
+    if self.notifier is None:  # pragma: no cover
+      self.skipTest('inotify is not available')
+
+    self.notifier.add_watch(self.directory)
+    self.assertFalse(self.notifier.wait(0))
+
+    for name in ('foo.json', 'bar.json'):
+      with open(os.path.join(self.directory, name), 'w') as fh:
+        fh.write('{}')
+    self.assertTrue(self.notifier.wait(1))
+    # Both changes were consumed at once.
+    self.assertFalse(self.notifier.wait(0))
+
+    os.unlink(os.path.join(self.directory, 'foo.json'))
+    self.assertTrue(self.notifier.wait(1))
+
+  def test_add_watch_missing_directory(self):
+    if self.notifier is None:  # pragma: no cover
+      self.skipTest('inotify is not available')
+
+    with self.assertRaises(inotify.InotifyError):
+      self.notifier.add_watch(os.path.join(self.directory, 'missing'))
+
+  def test_close(self):
+    if self.notifier is None:  # pragma: no cover
+      self.skipTest('inotify is not available')
+
+    self.notifier.close()
+    self.notifier.close()
@@ -3,6 +3,7 @@
 # found in the LICENSE file.
 
 import threading
+import time
 import unittest
 
 import mock
@@ -233,3 +234,153 @@ class ServiceThreadTest(unittest.TestCase):
 
     # The loop should continue.
     self.condition.next()
+
+
+class ServiceThreadWithSamplerTest(unittest.TestCase):
+  def setUp(self):
+    service_thread.ServiceThread.upgrades.reset()
+
+    self.mock_service_ctor = mock.patch(
+        'infra.services.service_manager.service.Service',
+        autospec=True).start()
+    self.mock_service = self.mock_service_ctor.return_value
+    self.mock_service.name = 'foo'
+
+    self.sampler = mock.create_autospec(
+        service_thread.ProcessStateSampler, instance=True)
+    self.sampler.restart_slot.return_value = mock.MagicMock()
+    self.condition = FakeCondition()
+    self.t = service_thread.ServiceThread(
+        10, '/foo', {'name': 'foo'}, None, wait_condition=self.condition,
+        sampler=self.sampler)
+
+  def tearDown(self):
+    if self.t.is_alive():
+      self.t.stop(join=False)
+      self.condition.next(blocking=False)
+      self.t.join()
+
+    mock.patch.stopall()
+
+  def test_waits_for_sampler(self):
+    self.sampler.add.assert_called_once_with(self.t)
+    self.t.start()
+    self.condition.start()
+
+    # The thread doesn't wake up by itself, the sampler pokes it.
+    self.assertIsNone(self.condition.wait_timeout)
+    self.t.poke()
+    self.assertTrue(self.condition.notify_called)
+    self.condition.next()
+    self.assertFalse(self.mock_service.start.called)
+
+    self.t.stop(join=False)
+    self.condition.next(blocking=False)
+    self.t.join()
+    self.sampler.remove.assert_called_once_with(self.t)
+
+  def test_restarts_in_slot(self):
+    self.t.start()
+    self.condition.start()
+
+    self.mock_service.get_running_process_state.return_value = (
+        service.ProcessState(pid=1, starttime=2))
+    self.mock_service.has_version_changed.return_value = True
+    self.t.start_service()
+    self.condition.next()
+
+    self.sampler.restart_slot.assert_called_once_with()
+    self.mock_service.stop.assert_called_once_with()
+    self.mock_service.start.assert_called_once_with()
+    self.assertEqual(1, self.t.upgrades.get({'service': 'foo'}))
+
+  def test_needs_attention(self):
+    # Not asked to run the service.
+    self.assertFalse(self.t.needs_attention())
+
+    self.t.start_service()
+    # The thread hasn't acted on start_service() yet.
+    self.assertFalse(self.t.needs_attention())
+    self.t._state_changed = False
+
+    self.mock_service.get_running_process_state.side_effect = (
+        service.StateFileNotFound)
+    self.assertTrue(self.t.needs_attention())
+
+    self.mock_service.get_running_process_state.side_effect = None
+    self.mock_service.get_running_process_state.return_value = (
+        service.ProcessState(pid=1, starttime=2))
+    self.mock_service.has_version_changed.return_value = False
+    self.mock_service.has_cmd_changed.return_value = False
+    self.assertFalse(self.t.needs_attention())
+
+    self.mock_service.has_cmd_changed.return_value = True
+    self.assertTrue(self.t.needs_attention())
+
+
+class ProcessStateSamplerTest(unittest.TestCase):
+  def setUp(self):
+    service_thread.ProcessStateSampler.wakeups.reset()
+
+    self.condition = FakeCondition()
+    self.sampler = service_thread.ProcessStateSampler(
+        10, max_restarts=2, wait_condition=self.condition)
+
+  def _mock_thread(self, name, needs_attention):
+    thread = mock.create_autospec(
+        service_thread.ServiceThread, instance=True)
+    thread.service_name = name
+    thread.needs_attention.return_value = needs_attention
+    self.sampler.add(thread)
+    return thread
+
+  def test_sample(self):
+    ok = self._mock_thread('ok', False)
+    broken = self._mock_thread('broken', True)
+    failing = self._mock_thread('failing', True)
+    failing.needs_attention.side_effect = Exception()
+    removed = self._mock_thread('removed', True)
+    self.sampler.remove(removed)
+    self.sampler.remove(removed)
+
+    self.sampler.sample()
+
+    self.assertFalse(ok.poke.called)
+    broken.poke.assert_called_once_with()
+    self.assertFalse(failing.poke.called)
+    self.assertFalse(removed.needs_attention.called)
+    self.assertEqual(1, self.sampler.wakeups.get({'service': 'broken'}))
+    self.assertIsNone(self.sampler.wakeups.get({'service': 'ok'}))
+
+  def test_run_and_exit(self):
+    thread = self._mock_thread('foo', True)
+    self.sampler.start()
+    self.condition.start()
+    self.assertEqual(10, self.condition.wait_timeout)
+    self.assertEqual(1, thread.poke.call_count)
+
+    self.condition.next()
+    self.assertEqual(2, thread.poke.call_count)
+
+    self.sampler.stop(join=False)
+    self.condition.next(blocking=False)
+    self.sampler.join()
+
+  def test_restart_slots(self):
+    running = []
+    max_running = []
+    lock = threading.Lock()
+    def restart():
+      with self.sampler.restart_slot():
+        with lock:
+          running.append(1)
+          max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+          running.pop()
+    threads = [threading.Thread(target=restart) for _ in xrange(6)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertLessEqual(max(max_running), 2)
@@ -8,6 +8,7 @@ from infra_libs.httplib2_utils import AuthError
 from infra_libs.httplib2_utils import get_authenticated_http
 from infra_libs.httplib2_utils import get_signed_jwt_assertion_credentials
 from infra_libs.httplib2_utils import RetriableHttp, InstrumentedHttp, HttpMock
+from infra_libs.httplib2_utils import ConnectionPool, PooledHttp
 from infra_libs.httplib2_utils import SERVICE_ACCOUNTS_CREDS_ROOT
 from infra_libs.utils import read_json_as_utf8
 from infra_libs.utils import parse_rfc3339_epoch
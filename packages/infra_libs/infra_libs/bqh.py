@@ -2,10 +2,13 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import Queue
+import json
 import logging
 import os
 import threading
 import time
+import uuid
 
 from google.protobuf import duration_pb2
 from google.protobuf import json_format
@@ -17,6 +20,10 @@ from google.protobuf import timestamp_pb2
 
 _BATCH_DEFAULT = 500
 _BATCH_LIMIT = 10000
+# BigQuery limits streaming insert requests to 10MB. Leave room for the
+# envelope.
+_REQUEST_BYTES_DEFAULT = 5 * 1024 * 1024
+_RETRIES_DEFAULT = 3
 
 # OAuth 2.0 scope to insert rows.
 INSERT_ROWS_SCOPE = 'https://www.googleapis.com/auth/bigquery.insertdata'
@@ -79,11 +86,17 @@ def _to_bq_value(value, field_desc):
     return value
 
 
-def send_rows(bq_client, dataset_id, table_id, rows, batch_size=_BATCH_DEFAULT):
+def send_rows(bq_client, dataset_id, table_id, rows, batch_size=_BATCH_DEFAULT,
+              max_request_bytes=_REQUEST_BYTES_DEFAULT, concurrency=1,
+              retries=_RETRIES_DEFAULT):
   """Sends rows to BigQuery.
 
+  Rows are converted and sent as they are read, so rows can be a generator
+  that produces more rows than fit in memory. Each row gets an insertId, so
+  BigQuery can deduplicate rows that are sent twice.
+
   Args:
-    rows: a list of any of the following
+    rows: an iterable of any of the following
       * tuples: each tuple should contain data of the correct type for each
       schema field on the current table and in the same order as the schema
       fields.
@@ -94,6 +107,16 @@ def send_rows(bq_client, dataset_id, table_id, rows, batch_size=_BATCH_DEFAULT):
     batch_size (int): the max number of rows to send to BigQuery in a single
       request. Values exceeding the limit will use the limit. Values less than 1
       will use _BATCH_DEFAULT.
+    max_request_bytes (int): the max approximate size of rows, serialized as
+      JSON, to send in a single request. A row larger than that is sent alone.
+    concurrency (int): the max number of requests to send concurrently.
+    retries (int): how many times to retry sending a row that failed to insert.
+      The failed rows of a request are retried together, except invalid rows
+      which are not retried.
+
+  Raises:
+    BigQueryInsertError if some rows failed to insert after all retries.
+    All other rows are sent before raising.
 
   Please use google.protobuf.message.Message instances moving forward.
   Tuples are deprecated.
@@ -102,24 +125,121 @@ def send_rows(bq_client, dataset_id, table_id, rows, batch_size=_BATCH_DEFAULT):
     batch_size = _BATCH_LIMIT
   elif batch_size <= 0:
     batch_size = _BATCH_DEFAULT
+  table = bq_client.get_table(bq_client.dataset(dataset_id).table(table_id))
+  sender = _RowSender(bq_client, table, retries)
+  requests = _pack(_convert_rows(rows), batch_size, max_request_bytes)
+  if concurrency <= 1:
+    for request in requests:
+      sender.send(request)
+  else:
+    _send_concurrently(sender, requests, concurrency)
+  if sender.errors:
+    logging.error('Failed to send event to bigquery: %s', sender.errors)
+    raise BigQueryInsertError(sender.errors)
+
+
+def _convert_rows(rows):
+  """Yields tuples (index, insert_id, row) with rows ready to be sent."""
+  id_prefix = uuid.uuid4().hex
   for i, row in enumerate(rows):
-    if isinstance(row, tuple):
-      continue
-    elif isinstance(row, message_pb.Message):
-      rows[i] = message_to_dict(row)
-    else:
+    if isinstance(row, message_pb.Message):
+      row = message_to_dict(row)
+    elif not isinstance(row, tuple):
       raise UnsupportedTypeError(type(row).__name__)
-  table = bq_client.get_table(bq_client.dataset(dataset_id).table(table_id))
-  for row_set in _batch(rows, batch_size):
-    insert_errors = bq_client.create_rows(table, row_set)
-    if insert_errors:
-      logging.error('Failed to send event to bigquery: %s', insert_errors)
-      raise BigQueryInsertError(insert_errors)
+    yield i, '%s-%d' % (id_prefix, i), row
+
+
+def _pack(rows, batch_size, max_request_bytes):
+  """Groups rows into lists, by count and approximate size."""
+  request = []
+  request_bytes = 0
+  for row in rows:
+    row_bytes = len(json.dumps(row[2], default=str))
+    if request and (len(request) >= batch_size or
+                    request_bytes + row_bytes > max_request_bytes):
+      yield request
+      request = []
+      request_bytes = 0
+    request.append(row)
+    request_bytes += row_bytes
+  if request:
+    yield request
 
 
-def _batch(rows, batch_size):
-  for i in xrange(0, len(rows), batch_size):
-    yield rows[i:i + batch_size]
+class _RowSender(object):
+  """Sends lists of (index, insert_id, row) tuples and retries failed rows."""
+
+  def __init__(self, bq_client, table, retries):
+    self._bq_client = bq_client
+    self._table = table
+    self._retries = retries
+    self._lock = threading.Lock()
+    # Errors of rows that failed after all retries, in create_rows format,
+    # with indexes of rows in the input.
+    self.errors = []
+
+  def _create_rows(self, request):
+    """Returns a list of (row, errors) tuples for rows that failed."""
+    insert_errors = self._bq_client.create_rows(
+        self._table, [r[2] for r in request], row_ids=[r[1] for r in request])
+    return [
+        (request[e['index']], e.get('errors')) for e in insert_errors or []]
+
+  def send(self, request):
+    for attempt in xrange(self._retries + 1):
+      retry = []
+      for row, errors in self._create_rows(request):
+        # With insertAll, an invalid row fails the whole request: it has an
+        # 'invalid' error, and the other rows 'stopped' ones. Invalid rows
+        # would fail again.
+        if attempt < self._retries and not _is_invalid(errors):
+          retry.append(row)
+        else:
+          with self._lock:
+            self.errors.append({'index': row[0], 'errors': errors})
+      if not retry:
+        return
+      request = retry
+
+
+def _is_invalid(errors):
+  return any(e.get('reason') == 'invalid' for e in errors or [])
+
+
+def _send_concurrently(sender, requests, concurrency):
+  """Sends requests in `concurrency` threads."""
+  # Bounded, so that requests are read from the iterator as they are sent.
+  queue = Queue.Queue(maxsize=concurrency)
+  exceptions = []
+
+  def worker():
+    while True:
+      request = queue.get()
+      if request is None:
+        return
+      if exceptions:
+        # Drain the queue so that the producer does not block.
+        continue
+      try:
+        sender.send(request)
+      except Exception as ex:
+        exceptions.append(ex)
+
+  threads = [threading.Thread(target=worker) for _ in xrange(concurrency)]
+  for t in threads:
+    t.start()
+  try:
+    for request in requests:
+      if exceptions:
+        break
+      queue.put(request)
+  finally:
+    for _ in threads:
+      queue.put(None)
+    for t in threads:
+      t.join()
+  if exceptions:
+    raise exceptions[0]
 
 
 class UnsupportedTypeError(Exception):
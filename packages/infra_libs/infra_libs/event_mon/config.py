@@ -56,6 +56,11 @@ def add_argparse_options(parser):
                      help='Time in seconds before retrying POSTing to the HTTP '
                      'endpoint. Randomized exponential backoff is applied on '
                      'subsequent retries.')
+  group.add_argument('--event-mon-spill-dir',
+                     help='If set, events sent to the "test" or "prod"\n'
+                     'endpoints are batched and sent by a background thread.\n'
+                     'Events that cannot be sent are written to this\n'
+                     'directory and sent again on next startup.')
 
 
 def process_argparse_options(args):  # pragma: no cover
@@ -72,7 +77,8 @@ def process_argparse_options(args):  # pragma: no cover
     output_file=args.event_mon_output_file,
     dry_run=args.dry_run,
     http_timeout=args.event_mon_http_timeout,
-    http_retry_backoff=args.event_mon_http_retry_backoff
+    http_retry_backoff=args.event_mon_http_retry_backoff,
+    spill_dir=args.event_mon_spill_dir,
   )
 
 
@@ -83,7 +89,8 @@ def setup_monitoring(run_type='dry',
                      output_file=None,
                      dry_run=False,
                      http_timeout=10,
-                     http_retry_backoff=2.):
+                     http_retry_backoff=2.,
+                     spill_dir=None):
   """Initializes event monitoring.
 
   This function is mainly used to provide default global values which are
@@ -115,6 +122,11 @@ def setup_monitoring(run_type='dry',
     http_retry_backoff (float): time in seconds before retrying POSTing to the
          HTTP endpoint. Randomized exponential backoff is applied on subsequent
          retries.
+
+    spill_dir (str): if set, events sent to the HTTP endpoint are batched and
+      sent by a background thread, so that sending events does not block.
+      Events that cannot be sent are written to this directory and sent on
+      next startup. Call close() before exiting the program.
   """
   global _router
   logging.debug('event_mon: setting up monitoring.')
@@ -159,6 +171,8 @@ def setup_monitoring(run_type='dry',
                                     dry_run=dry_run,
                                     timeout=http_timeout,
                                     retry_backoff=http_retry_backoff)
+    if spill_dir:
+      _router = ev_router._AsyncRouter(_router, spill_dir)
 
 
 def get_default_event():
@@ -196,6 +210,8 @@ def close():
     success (bool): False if an error occured
   """
   global _router, _cache
+  if _router:
+    _router.close()
   _router = None
   _cache = {}
   return True
@@ -2,10 +2,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import Queue
+import errno
+import itertools
 import logging
 import os
 import random
 import sys
+import threading
 import time
 
 import httplib2
@@ -92,6 +96,12 @@ class _Router(object):
     """
     raise NotImplementedError('Please implement _send_to_endpoint().')
 
+  def close(self):
+    """Releases resources held by the router.
+
+    Events pushed after close() may be lost.
+    """
+
 
 class _LocalFileRouter(_Router):
   def __init__(self, output_file, dry_run=False):
@@ -252,3 +262,197 @@ class _HttpRouter(_Router):
     logging.error('failed to POST data after %d attempts, giving up.',
                   attempt+1)
     return False
+
+
+class _AsyncRouter(_Router):
+  # Spill files are named <prefix><time_ms>-<pid>-<n><suffix>.
+  SPILL_FILE_PREFIX = 'event_mon-'
+  SPILL_FILE_SUFFIX = '.spill'
+  # Sentinel put in the queue by close().
+  _STOP = object()
+
+  def __init__(self, router, spill_dir, max_queue_size=10000,
+               max_batch_events=500, max_batch_bytes=1024*1024,
+               max_batch_age_secs=5., close_timeout_secs=5.):
+    """Initialize the router.
+
+    Events are pushed into a bounded in-memory queue and sent in batches by a
+    background thread, using another router.  A batch is sent when it has
+    max_batch_events events, max_batch_bytes bytes or when its first event is
+    max_batch_age_secs old, whichever comes first.
+
+    Events that cannot be sent are spilled to files in spill_dir, in the
+    _LocalFileRouter format: one serialized LogRequestLite per file.
+    This happens when the queue is full, when sending a batch fails and on
+    close().  Spilled files are sent by the background thread when it starts,
+    and deleted once sent.
+
+    Args:
+      router(_Router): router used to send batches, typically an _HttpRouter.
+      spill_dir(str): directory where to spill events. Must exist.
+
+    Keyword Args:
+      max_queue_size(int): maximum number of events in the queue.
+      max_batch_events(int): maximum number of events in a batch.
+      max_batch_bytes(int): maximum size of serialized events in a batch.
+      max_batch_age_secs(float): maximum time an event waits for its batch.
+      close_timeout_secs(float): how long close() waits for the background
+        thread.
+    """
+    _Router.__init__(self)
+    self._router = router
+    self.spill_dir = spill_dir
+    self.max_queue_size = max_queue_size
+    self.max_batch_events = max_batch_events
+    self.max_batch_bytes = max_batch_bytes
+    self.max_batch_age_secs = max_batch_age_secs
+    self.close_timeout_secs = close_timeout_secs
+
+    # The queue is not bounded by Queue itself, so that close() can always
+    # enqueue _STOP.
+    self._queue = Queue.Queue()
+    self._spill_counter = itertools.count()
+    self._closed = False
+    self._thread = threading.Thread(target=self._run, name='event_mon')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _send_to_endpoint(self, events):
+    if self._closed:
+      return self._spill(events.log_event)
+    if self._queue.qsize() + len(events.log_event) > self.max_queue_size:
+      logging.warning('event_mon: queue is full, spilling %d events to disk',
+                      len(events.log_event))
+      return self._spill(events.log_event)
+    for event in events.log_event:
+      self._queue.put(event)
+    return True
+
+  def close(self):
+    """Stops the background thread and spills events that were not sent."""
+    if self._closed:
+      return
+    self._closed = True
+    self._queue.put(self._STOP)
+    self._thread.join(self.close_timeout_secs)
+    if self._thread.is_alive():
+      logging.warning('event_mon: background thread did not stop in %.1fs',
+                      self.close_timeout_secs)
+
+  def _run(self):
+    try:
+      self._replay_spilled()
+    except Exception:
+      # Never stop sending new events because of old ones.
+      logging.exception('event_mon: failed to replay spilled events')
+    while True:
+      batch, stop = self._next_batch()
+      if stop:
+        # Do not wait for the endpoint when exiting.
+        batch.extend(self._drain())
+        if batch:
+          self._spill(batch)
+        return
+      self._send_batch(batch)
+
+  def _next_batch(self):
+    """Returns a tuple (events, stop) with a batch of events to send."""
+    batch = []
+    size = 0
+    deadline = None
+    while len(batch) < self.max_batch_events and size < self.max_batch_bytes:
+      if deadline is None:
+        timeout = None
+      else:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+      try:
+        event = self._queue.get(timeout=timeout)
+      except Queue.Empty:
+        break
+      if event is self._STOP:
+        return batch, True
+      if deadline is None:
+        deadline = time.time() + self.max_batch_age_secs
+      batch.append(event)
+      size += event.ByteSize()
+    return batch, False
+
+  def _drain(self):
+    events = []
+    while True:
+      try:
+        event = self._queue.get_nowait()
+      except Queue.Empty:
+        return events
+      if event is not self._STOP:  # pragma: no branch
+        events.append(event)
+
+  @staticmethod
+  def _make_request(events):
+    request_p = LogRequestLite()
+    request_p.log_source_name = 'CHROME_INFRA'
+    request_p.log_event.extend(events)
+    request_p.request_time_ms = time_ms()
+    return request_p
+
+  def _send_batch(self, events):
+    try:
+      success = self._router._send_to_endpoint(self._make_request(events))
+    except Exception:
+      logging.exception('event_mon: failed to send events')
+      success = False
+    if not success:
+      self._spill(events)
+
+  def _spill(self, events):
+    """Writes events to a new file in spill_dir. Returns True on success."""
+    name = '%s%d-%d-%d%s' % (
+        self.SPILL_FILE_PREFIX, time_ms(), os.getpid(),
+        next(self._spill_counter), self.SPILL_FILE_SUFFIX)
+    path = os.path.join(self.spill_dir, name)
+    # Write to a temporary file first, so that _replay_spilled never reads a
+    # partially written file.
+    tmp_path = path + '.tmp'
+    if not _LocalFileRouter(tmp_path)._send_to_endpoint(
+        self._make_request(events)):
+      return False
+    try:
+      os.rename(tmp_path, path)
+    except OSError:
+      logging.exception('event_mon: failed to spill events to %s', path)
+      return False
+    return True
+
+  def _replay_spilled(self):
+    try:
+      names = sorted(os.listdir(self.spill_dir))
+    except OSError:
+      logging.exception('event_mon: failed to list %s', self.spill_dir)
+      return
+    for name in names:
+      if not (name.startswith(self.SPILL_FILE_PREFIX) and
+              name.endswith(self.SPILL_FILE_SUFFIX)):
+        continue
+      path = os.path.join(self.spill_dir, name)
+      try:
+        with open(path, 'rb') as f:
+          request_p = LogRequestLite.FromString(f.read())
+      except Exception:
+        logging.exception('event_mon: deleting unreadable file %s', path)
+        self._remove_spilled(path)
+        continue
+      if not self._router._send_to_endpoint(request_p):
+        # The endpoint is likely down, try again on next startup.
+        return
+      self._remove_spilled(path)
+
+  @staticmethod
+  def _remove_spilled(path):
+    try:
+      os.remove(path)
+    except OSError as e:
+      # Another process sharing spill_dir may have replayed it already.
+      if e.errno != errno.ENOENT:
+        logging.exception('event_mon: failed to delete %s', path)
@@ -142,3 +142,11 @@ class ConfigTest(unittest.TestCase):
   def test_run_type_test(self):
     event_mon.setup_monitoring(run_type='test')
     self.assertIsInstance(config._router, router._HttpRouter)
+
+  def test_run_type_test_spill_dir(self):
+    with infra_libs.temporary_directory(prefix='config_test-') as tempdir:
+      event_mon.setup_monitoring(
+          run_type='test', dry_run=True, spill_dir=tempdir)
+      self.assertIsInstance(config._router, router._AsyncRouter)
+      self.assertIsInstance(config._router._router, router._HttpRouter)
+      self._close()
@@ -2,10 +2,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import errno
 import logging
 import os
 import random
+import shutil
 import StringIO
+import tempfile
+import threading
 import time
 import unittest
 
@@ -248,3 +252,207 @@ class LoggingStreamRouterTests(unittest.TestCase):
     event.source_extension = 'not-a-message'
     self.assertFalse(logger.push_event(event))
     self.assertEqual(exception_mock.call_args[0], ('Unable to log the events',))
+
+
+class _FakeRouter(router._Router):
+  def __init__(self, success=True):
+    router._Router.__init__(self)
+    self.success = success
+    self.requests = []
+    self.sent = threading.Event()
+
+  def _send_to_endpoint(self, events):
+    self.requests.append(events)
+    self.sent.set()
+    return self.success
+
+
+class AsyncRouterTests(unittest.TestCase):
+  def setUp(self):
+    self.spill_dir = tempfile.mkdtemp(prefix='router_test-')
+
+  def tearDown(self):
+    shutil.rmtree(self.spill_dir)
+
+  def _event(self, code):
+    event = LogRequestLite.LogEventLite()
+    event.event_time_ms = 1
+    event.event_code = code
+    return event
+
+  def _spilled(self):
+    """Returns event codes in spill files, sorted by file name."""
+    ret = []
+    for name in sorted(os.listdir(self.spill_dir)):
+      with open(os.path.join(self.spill_dir, name), 'rb') as f:
+        request = LogRequestLite.FromString(f.read())
+      self.assertEqual('CHROME_INFRA', request.log_source_name)
+      ret.append([ev.event_code for ev in request.log_event])
+    return ret
+
+  @staticmethod
+  def _codes(requests):
+    return [[ev.event_code for ev in r.log_event] for r in requests]
+
+  def test_batches_by_count(self):
+    fake = _FakeRouter()
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_events=2,
+                            max_batch_age_secs=60)
+    self.assertTrue(r.push_event([self._event(i) for i in xrange(5)]))
+    deadline = time.time() + 10
+    while len(fake.requests) < 2 and time.time() < deadline:
+      time.sleep(0.01)
+    r.close()
+    self.assertEqual([[0, 1], [2, 3]], self._codes(fake.requests))
+    # The last event did not fill a batch in time.
+    self.assertEqual([[4]], self._spilled())
+
+  def test_batches_by_age(self):
+    fake = _FakeRouter()
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_age_secs=0.01)
+    self.assertTrue(r.push_event(self._event(1)))
+    self.assertTrue(fake.sent.wait(10))
+    r.close()
+    self.assertEqual([[1]], self._codes(fake.requests))
+    self.assertEqual([], self._spilled())
+
+  def test_batches_by_size(self):
+    fake = _FakeRouter()
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_bytes=1,
+                            max_batch_age_secs=60)
+    self.assertTrue(r.push_event([self._event(1), self._event(2)]))
+    deadline = time.time() + 10
+    while len(fake.requests) < 2 and time.time() < deadline:
+      time.sleep(0.01)
+    r.close()
+    self.assertEqual([[1], [2]], self._codes(fake.requests))
+
+  def test_failed_send_spills(self):
+    fake = _FakeRouter(success=False)
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_age_secs=0.01)
+    self.assertTrue(r.push_event(self._event(1)))
+    self.assertTrue(fake.sent.wait(10))
+    r.close()
+    self.assertEqual([[1]], self._spilled())
+
+  def test_send_exception_spills(self):
+    fake = _FakeRouter()
+    fake._send_to_endpoint = mock.Mock(side_effect=Exception('boom'))
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_events=1)
+    self.assertTrue(r.push_event(self._event(1)))
+    r.close()
+    self.assertEqual([[1]], self._spilled())
+
+  def test_queue_full_spills(self):
+    fake = _FakeRouter()
+    r = router._AsyncRouter(fake, self.spill_dir, max_queue_size=1,
+                            max_batch_age_secs=60)
+    with mock.patch.object(r._queue, 'qsize', return_value=1):
+      self.assertTrue(r.push_event(self._event(1)))
+    self.assertEqual([[1]], self._spilled())
+    r.close()
+
+  def test_push_after_close_spills(self):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    r.close()
+    self.assertTrue(r.push_event(self._event(1)))
+    self.assertEqual([[1]], self._spilled())
+
+  def test_spill_fails(self):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    r.spill_dir = os.path.join(self.spill_dir, 'missing')
+    self.assertFalse(r.push_event(self._event(1)))
+
+  @mock.patch('os.rename', side_effect=OSError())
+  def test_spill_rename_fails(self, _rename):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    self.assertFalse(r.push_event(self._event(1)))
+
+  def test_close_timeout(self):
+    blocked = threading.Event()
+    release = threading.Event()
+    fake = _FakeRouter()
+    def send(events):
+      blocked.set()
+      release.wait()
+      return True
+    fake._send_to_endpoint = send
+    r = router._AsyncRouter(fake, self.spill_dir, max_batch_events=1,
+                            close_timeout_secs=0.01)
+    r.push_event(self._event(1))
+    self.assertTrue(blocked.wait(10))
+    r.close()
+    release.set()
+    r._thread.join()
+
+  def test_replay(self):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    r.push_event([self._event(1), self._event(2)])
+    r.push_event(self._event(3))
+    with open(os.path.join(self.spill_dir, 'unrelated'), 'w') as f:
+      f.write('x')
+    corrupt = router._AsyncRouter.SPILL_FILE_PREFIX + '0-corrupt.spill'
+    with open(os.path.join(self.spill_dir, corrupt), 'w') as f:
+      f.write('x')
+
+    fake = _FakeRouter()
+    r = router._AsyncRouter(fake, self.spill_dir)
+    r.close()
+    self.assertEqual([[1, 2], [3]], self._codes(fake.requests))
+    self.assertEqual(['unrelated'], os.listdir(self.spill_dir))
+
+  def test_replay_fails(self):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    r.push_event(self._event(1))
+    r.push_event(self._event(2))
+
+    fake = _FakeRouter(success=False)
+    r = router._AsyncRouter(fake, self.spill_dir)
+    r.close()
+    # Replay stops after the first failure and keeps the files.
+    self.assertEqual([[1]], self._codes(fake.requests))
+    self.assertEqual([[1], [2]], self._spilled())
+
+  def test_replay_missing_dir(self):
+    fake = _FakeRouter()
+    r = router._AsyncRouter(
+        fake, os.path.join(self.spill_dir, 'missing'))
+    r.close()
+    self.assertEqual([], fake.requests)
+
+  def test_replay_remove_fails(self):
+    r = router._AsyncRouter(_FakeRouter(), self.spill_dir)
+    r.close()
+    r.push_event(self._event(1))
+    r.push_event(self._event(2))
+    corrupt = router._AsyncRouter.SPILL_FILE_PREFIX + '0-corrupt.spill'
+    with open(os.path.join(self.spill_dir, corrupt), 'w') as f:
+      f.write('x')
+
+    fake = _FakeRouter()
+    errors = [OSError(errno.ENOENT, 'gone'), OSError(errno.EACCES, 'denied'),
+              OSError(errno.EROFS, 'read-only')]
+    with mock.patch('os.remove', side_effect=errors):
+      r = router._AsyncRouter(fake, self.spill_dir, max_batch_events=1)
+      # The background thread still sends new events.
+      self.assertTrue(r.push_event(self._event(3)))
+      deadline = time.time() + 10
+      while len(fake.requests) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+      r.close()
+    self.assertEqual([[1], [2], [3]], self._codes(fake.requests))
+
+  def test_replay_exception(self):
+    fake = _FakeRouter()
+    with mock.patch.object(router._AsyncRouter, '_replay_spilled',
+                           side_effect=Exception('boom')):
+      r = router._AsyncRouter(fake, self.spill_dir, max_batch_events=1)
+      self.assertTrue(r.push_event(self._event(1)))
+      self.assertTrue(fake.sent.wait(10))
+      r.close()
+    self.assertEqual([[1]], self._codes(fake.requests))
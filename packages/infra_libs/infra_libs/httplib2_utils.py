@@ -11,8 +11,10 @@ import os
 import re
 import socket
 import sys
+import threading
 import time
 import urllib
+import weakref
 
 import httplib2
 import oauth2client.client
@@ -162,7 +164,7 @@ def get_authenticated_http(credentials_filename,
   if http_identifier:
     http = InstrumentedHttp(http_identifier, timeout=timeout)
   else:
-    http = httplib2.Http(timeout=timeout)
+    http = PooledHttp(timeout=timeout)
   return creds.authorize(http)
 
 
@@ -290,7 +292,169 @@ class RetriableHttp(object):
       setattr(self._http, name, value)
 
 
-class InstrumentedHttp(httplib2.Http):
+class ConnectionPool(object):
+  """A thread-safe pool of keep-alive connections for PooledHttp objects.
+
+  Connections are keyed by the settings of the PooledHttp (timeout, certificates
+  and so on) and by scheme and host.  A request takes a connection from the
+  pool, and gives it back, still open, once it completes.  It is then reused
+  by the next request to the same host.
+
+  By default, the number of connections is not limited, like with one
+  httplib2.Http per thread.  If max_per_host is not None, at most that many
+  connections are open per key, and requests wait for a free connection.
+  """
+
+  def __init__(self, max_per_host=None):
+    self._max_per_host = max_per_host
+    self._cond = threading.Condition()
+    # {key: [idle connection]}
+    self._idle = collections.defaultdict(list)
+    # {key: number of connections in use, idle or being created}
+    self._counts = collections.defaultdict(int)
+
+  def checkout(self, key, fields=None):
+    """Returns an idle connection or None if the caller must create one.
+
+    Either way, the caller must then pass the connection to checkin() or
+    discard().
+    """
+    with self._cond:
+      while True:
+        idle = self._idle[key]
+        if idle:
+          conn = idle.pop()
+          break
+        if (self._max_per_host is None or
+            self._counts[key] < self._max_per_host):
+          self._counts[key] += 1
+          conn = None
+          break
+        self._cond.wait()
+
+    if fields is not None:
+      reused = conn is not None and getattr(conn, 'sock', None) is not None
+      conn_fields = {'reused': reused}
+      conn_fields.update(fields)
+      http_metrics.connections.increment(fields=conn_fields)
+      if not reused and key[1].startswith('https:'):
+        http_metrics.tls_handshakes.increment(fields=fields)
+    return conn
+
+  def checkin(self, key, conn):
+    """Gives back a connection, to be reused by the next checkout()."""
+    with self._cond:
+      self._idle[key].append(conn)
+      self._cond.notify()
+
+  def discard(self, key):
+    """Frees the slot of a connection that was closed or never created."""
+    with self._cond:
+      self._counts[key] -= 1
+      self._cond.notify()
+
+  def close_idle(self, connections=None):
+    """Closes idle connections, only those in connections if not None."""
+    with self._cond:
+      for key, idle in self._idle.iteritems():
+        kept = []
+        for conn in idle:
+          if connections is not None and conn not in connections:
+            kept.append(conn)
+            continue
+          conn.close()
+          self._counts[key] -= 1
+        idle[:] = kept
+      self._cond.notify_all()
+
+
+# Shared by all PooledHttp objects that do not specify a pool.
+_default_pool = ConnectionPool()
+
+
+class PooledHttp(httplib2.Http):
+  """A thread-safe httplib2.Http that reuses connections from a pool.
+
+  A plain httplib2.Http keeps one connection per host and must not be used by
+  several threads at once.  PooledHttp objects can, and they share keep-alive
+  connections with the other PooledHttp objects using the same pool, which
+  saves TCP and TLS handshakes.
+  """
+
+  def __init__(self, timeout=DEFAULT_TIMEOUT, pool=None, **kwargs):
+    """
+    Args:
+      pool: a ConnectionPool, the default shared pool if None.
+    """
+    self._local = threading.local()
+    super(PooledHttp, self).__init__(timeout=timeout, **kwargs)
+    self._pool = pool or _default_pool
+    # Connections this object took from the pool, closed by close().
+    self._used_connections = weakref.WeakSet()
+    self._used_connections_lock = threading.Lock()
+
+  @property
+  def connections(self):
+    """{scheme:authority: connection} used by the requests of this thread."""
+    connections = getattr(self._local, 'connections', None)
+    if connections is None:
+      connections = self._local.connections = {}
+    return connections
+
+  @connections.setter
+  def connections(self, value):
+    self._local.connections = value
+
+  def _connection_settings(self):
+    """Returns a hashable key of the settings used to create connections."""
+    return (self.timeout, self.ca_certs, self.disable_ssl_certificate_validation,
+            getattr(self, 'ssl_version', None), id(self.proxy_info),
+            tuple(tuple(c) for c in self.certificates.credentials))
+
+  def _pool_metric_fields(self):
+    """Returns the fields of the connection metrics, or None to not record."""
+    return None
+
+  def request(self, uri, *args, **kwargs):
+    """Makes the request with a connection taken from the pool.
+
+    httplib2 finds the connection in self.connections, or creates one and
+    stores it there.  It is given back to the pool when the request completes,
+    unless httplib2 closed and removed it.
+    """
+    scheme, authority, _, _ = httplib2.urlnorm(httplib2.iri2uri(uri))
+    conn_key = scheme + ':' + authority
+    connections = self.connections
+    if conn_key in connections:
+      # A redirect to the same host, which reuses the connection.
+      return super(PooledHttp, self).request(uri, *args, **kwargs)
+
+    key = (self._connection_settings(), conn_key)
+    conn = self._pool.checkout(key, self._pool_metric_fields())
+    if conn is not None:
+      connections[conn_key] = conn
+    try:
+      return super(PooledHttp, self).request(uri, *args, **kwargs)
+    finally:
+      conn = connections.pop(conn_key, None)
+      if conn is None:
+        self._pool.discard(key)
+      else:
+        with self._used_connections_lock:
+          self._used_connections.add(conn)
+        self._pool.checkin(key, conn)
+
+  def close(self):
+    """Closes idle connections used by this object, clears sensitive data."""
+    with self._used_connections_lock:
+      used = set(self._used_connections)
+      self._used_connections.clear()
+    self._pool.close_idle(used)
+    self.certificates.clear()
+    self.clear_credentials()
+
+
+class InstrumentedHttp(PooledHttp):
   """A httplib2.Http object that reports ts_mon metrics about its requests."""
 
   def __init__(self, name, time_fn=time.time, timeout=DEFAULT_TIMEOUT,
@@ -302,10 +466,13 @@ class InstrumentedHttp(httplib2.Http):
         purposes only.
     """
 
-    super(InstrumentedHttp, self).__init__(timeout=timeout, **kwargs)
     self.fields = {'name': name, 'client': 'httplib2'}
+    super(InstrumentedHttp, self).__init__(timeout=timeout, **kwargs)
     self.time_fn = time_fn
 
+  def _pool_metric_fields(self):
+    return self.fields
+
   def _update_metrics(self, status, start_time):
     status_fields = {'status': status}
     status_fields.update(self.fields)
@@ -10,20 +10,35 @@ Return values are (by default) keyed off of the function's parameters.
 Consequently, any parameters that are used in memoization must be hashable.
 
 This library offers two styles of memoization:
-1) Absolute memoization (memo) uses the full set of parameters against a
-   per-function memo dictionary. If this is used on an instance method, the
-   'self' parameter is included in the key.
-2) Instance memoization (memo_i) uses a per-instance memoization dictionary.
-   The dictionary is stored as a member ('_memo__dict') of of the instance.
-   Consequently, the 'self' parameter is no longer needed/used in the
-   memoization key, removing the need to have the instance itself support being
-   hashed.
+1) Absolute memoization uses the full set of parameters against a
+   per-function memo dictionary. This is what functions, class methods and
+   static methods decorated with 'memo' use.
+2) Instance memoization is used when 'memo' decorates an instance method.
+   Results are stored in a per-instance memoization dictionary, which is
+   stored as a member ('_memo__dict') of the instance.  Consequently, the
+   'self' parameter is no longer needed/used in the memoization key, removing
+   the need to have the instance itself support being hashed.
+
+By default, memoized values are kept forever.  'max_size' bounds the number of
+values kept per function (or per instance), evicting the least recently used
+ones, and 'ttl_secs' expires values after the given number of seconds.
+
+Memoized functions are thread-safe.  If several threads call a memoized
+function with the same arguments at the same time, the function is executed
+once and all threads get its result (or its exception).  If the function calls
+itself with the same arguments, the inner call executes it again instead of
+waiting for the outer one.
 
 Memoized function state can be cleared by calling the memoized function's
-'memo_clear' method.
+'memo_clear' method.  The number of calls that were served from the memo and
+that executed the function are in its 'hits' and 'misses' attributes.
 """
 
+import collections
 import inspect
+import sys
+import threading
+import time
 
 
 # Instance variable added to class instances that use memoization to
@@ -31,28 +46,145 @@ import inspect
 MEMO_INSTANCE_VARIABLE = '_memo__dict'
 
 
+# Memoization constant to represent 'un-memoized' (b/c 'None' is a valid
+# result)
+class _EMPTY(object):
+  pass
+_EMPTY_VALUE = _EMPTY()
+
+
+class _Memo(object):
+  """Memoized values of a function, or of a method of one instance.
+
+  Must only be used while holding the lock of the MemoizedFunction.
+  """
+
+  def __init__(self, values=None, max_size=None, ttl_secs=None):
+    self.values = values if values is not None else {}
+    self._max_size = max_size
+    self._ttl_secs = ttl_secs
+    # Keys ordered from the least to the most recently used.
+    self._lru = collections.OrderedDict() if max_size else None
+    # {key: time when the value expires}.
+    self._expires = {} if ttl_secs is not None else None
+
+  def get(self, key, now):
+    value = self.values.get(key, _EMPTY_VALUE)
+    if value is _EMPTY_VALUE:
+      return value
+    if self._expires is not None and self._expires[key] <= now:
+      self.pop(key)
+      return _EMPTY_VALUE
+    if self._lru is not None:
+      del self._lru[key]
+      self._lru[key] = None
+    return value
+
+  def put(self, key, value, now):
+    self.values[key] = value
+    if self._expires is not None:
+      self._expires[key] = now + self._ttl_secs
+    if self._lru is not None:
+      self._lru.pop(key, None)
+      self._lru[key] = None
+      while len(self._lru) > self._max_size:
+        self.pop(self._lru.popitem(last=False)[0])
+
+  def pop(self, key):
+    self.values.pop(key, None)
+    if self._expires is not None:
+      self._expires.pop(key, None)
+    if self._lru is not None:
+      self._lru.pop(key, None)
+
+  def clear(self):
+    self.values.clear()
+    if self._expires is not None:
+      self._expires.clear()
+    if self._lru is not None:
+      self._lru.clear()
+
+
+class _InFlight(object):
+  """A call of a memoized function that other threads wait for."""
+
+  def __init__(self):
+    # The thread executing the function.
+    self.thread = threading.current_thread()
+    self._done = threading.Event()
+    self._result = None
+    self._exc_info = None
+
+  def set_result(self, result):
+    self._result = result
+    self._done.set()
+
+  def set_exc_info(self, exc_info):
+    self._exc_info = exc_info
+    self._done.set()
+
+  def wait(self):
+    self._done.wait()
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
 class MemoizedFunction(object):
   """Handles the memoization state of a given memoized function."""
 
-  # Memoization constant to represent 'un-memoized' (b/c 'None' is a valid
-  # result)
-  class _EMPTY(object):
-    pass
-  EMPTY = _EMPTY()
+  EMPTY = _EMPTY_VALUE
 
-  def __init__(self, func, ignore=None, memo_dict=None):
+  def __init__(self, func, ignore=None, memo_dict=None, max_size=None,
+               ttl_secs=None, time_fn=None):
     """
     Args:
       func: (function) The function to memoize
       ignore: (container) The names of 'func' parameters to ignore when
           generating its memo key. Only parameters that have no effect on the
           output of the function should be included.
+      memo_dict: (dict) The dictionary to store absolute memoization values in.
+      max_size: (int) If not None, the max number of values to keep per
+          function or instance. The least recently used values are evicted.
+      ttl_secs: (number) If not None, values expire after this many seconds.
+      time_fn: (function) Returns the current time. Defaults to time.time.
     """
     self.func = func
     self.ignore = frozenset(ignore or ())
     self.memo_dict = memo_dict
+    self.max_size = max_size
+    self.ttl_secs = ttl_secs
     self.im_self = None
     self.im_class = None
+    self.hits = 0
+    self.misses = 0
+    self._time_fn = time_fn or time.time
+    self._lock = threading.Lock()
+    self._memo = None
+    # {(id(memo), key): _InFlight}
+    self._in_flight = {}
+    self._init_fast_key()
+
+  def _init_fast_key(self):
+    """Precomputes what _key needs to avoid inspect on each call.
+
+    The fast path handles functions with a fixed list of parameters.
+    """
+    self._arg_names = None
+    try:
+      spec = inspect.getargspec(self.func)
+    except TypeError:
+      return
+    if spec.varargs or spec.keywords or any(
+        not isinstance(a, str) for a in spec.args):
+      # *args, **kwargs or tuple parameters.
+      return
+    self._arg_names = spec.args
+    self._arg_index = {name: i for i, name in enumerate(spec.args)}
+    self._defaults = spec.defaults or ()
+    self._key_order = [
+        (name, self._arg_index[name]) for name in sorted(spec.args)
+        if name not in self.ignore]
 
   def __repr__(self):
     properties = [str(self.func)]
@@ -64,70 +196,144 @@ class MemoizedFunction(object):
 
   def __get__(self, obj, klass=None):
     # Make this callable class a bindable Descriptor
+    if obj is None:
+      return self
     if klass is None:
       klass = type(obj)
-    self.im_self = obj
-    self.im_class = klass
-    return self
+    return _BoundMemoizedFunction(self, obj, klass)
 
-  def _get_call_args(self, args):
-    """Returns the call arguments, factoring in 'self' if this method is bound.
-    """
-    if self.im_self is not None:
-      return (self.im_self,) + args
-    return args
+  def _get_memo(self, obj):
+    """Returns: (_Memo) the memo to store return values in.
 
-  def _get_memo_dict(self):
-    """Returns: (dict) the memoization dictionary to store return values in."""
-    memo_dict = None
-    if self.im_self is not None:
+    Must be called while holding self._lock.
+    """
+    if obj is not None:
       # Is the instance dictionary defined?
-      memo_dict = getattr(self.im_self, MEMO_INSTANCE_VARIABLE, None)
-      if memo_dict is None:
-        memo_dict = {}
-        setattr(self.im_self, MEMO_INSTANCE_VARIABLE, memo_dict)
-      return memo_dict
-
-    # No instance dict; use our local 'memo_dict'.
-    if self.memo_dict is None:
-      self.memo_dict = {}
-    return self.memo_dict
-
-  def _key(self, args, kwargs):
+      memos = getattr(obj, MEMO_INSTANCE_VARIABLE, None)
+      if memos is None:
+        memos = {}
+        setattr(obj, MEMO_INSTANCE_VARIABLE, memos)
+      memo = memos.get(self)
+      if memo is None:
+        memo = memos[self] = _Memo(
+            max_size=self.max_size, ttl_secs=self.ttl_secs)
+      return memo
+
+    # No instance dict; use our local memo.
+    if self._memo is None:
+      if self.memo_dict is None:
+        self.memo_dict = {}
+      self._memo = _Memo(
+          self.memo_dict, max_size=self.max_size, ttl_secs=self.ttl_secs)
+    return self._memo
+
+  def _key(self, obj, args, kwargs):
     """Returns: the memoization key for a set of function arguments.
 
     This 'ignored' parameters are removed prior to generating the key.
     """
-    if self.im_self is not None:
+    if obj is not None:
       # We are bound to an instance; use None for args[0] ("self").
       args = (None,) + tuple(args)
 
+    key = self._fast_key(args, kwargs)
+    if key is not None:
+      return key
     call_params = inspect.getcallargs(self.func, *args, **kwargs)
     return tuple((k, v)
                  for k, v in sorted(call_params.iteritems())
                  if k not in self.ignore)
 
-  def __call__(self, *args, **kwargs):
+  def _fast_key(self, args, kwargs):
+    """Returns the same key as _key without inspect, or None if it can't."""
+    names = self._arg_names
+    if names is None or len(args) > len(names):
+      return None
+    values = list(args)
+    missing = len(names) - len(values)
+    if missing:
+      values.extend([_EMPTY_VALUE] * missing)
+    for name, value in kwargs.iteritems():
+      i = self._arg_index.get(name)
+      if i is None or values[i] is not _EMPTY_VALUE:
+        return None
+      values[i] = value
+    if missing:
+      first_default = len(names) - len(self._defaults)
+      for i in xrange(len(args), len(names)):
+        if values[i] is _EMPTY_VALUE:
+          if i < first_default:
+            return None
+          values[i] = self._defaults[i - first_default]
+    return tuple((name, values[i]) for name, i in self._key_order)
+
+  def _call(self, obj, args, kwargs):
     """Retrieves the memoized function result.
 
     If the memoized function has not been memoized, it will be invoked;
     otherwise, the memoized value will be returned.
 
     Args:
-      memo_key: The generated memoization key for this invocation.
+      obj: The instance the function is bound to, or None.
       args, kwargs: Function parameters (only used if not memoized yet)
     Returns:
       The memoized function's return value.
     """
-
-    memo_dict = self._get_memo_dict()
-    memo_key = self._key(args, kwargs)
-    result = memo_dict.get(memo_key, self.EMPTY)
-    if result is self.EMPTY:
-      args = self._get_call_args(args)
-      result = memo_dict[memo_key] = self.func(*args, **kwargs)
+    memo_key = self._key(obj, args, kwargs)
+    with self._lock:
+      memo = self._get_memo(obj)
+      result = memo.get(memo_key, self._time_fn())
+      if result is not self.EMPTY:
+        self.hits += 1
+        return result
+      flight_key = (id(memo), memo_key)
+      flight = self._in_flight.get(flight_key)
+      if flight is None:
+        self.misses += 1
+        flight = self._in_flight[flight_key] = _InFlight()
+        running = False
+      elif flight.thread is threading.current_thread():
+        # The function calls itself with the same arguments.  Waiting for the
+        # outer call would deadlock, so execute it again.
+        self.misses += 1
+        flight = None
+        running = False
+      else:
+        self.hits += 1
+        running = True
+
+    if running:
+      return flight.wait()
+
+    if obj is not None:
+      args = (obj,) + args
+    try:
+      result = self.func(*args, **kwargs)
+    except BaseException:
+      if flight is not None:
+        with self._lock:
+          del self._in_flight[flight_key]
+        flight.set_exc_info(sys.exc_info())
+      raise
+    with self._lock:
+      memo.put(memo_key, result, self._time_fn())
+      if flight is not None:
+        del self._in_flight[flight_key]
+    if flight is not None:
+      flight.set_result(result)
     return result
 
+  def _clear(self, obj, args, kwargs):
+    with self._lock:
+      memo = self._get_memo(obj)
+      if args or kwargs:
+        memo.pop(self._key(obj, args, kwargs))
+      else:
+        memo.clear()
+
+  def __call__(self, *args, **kwargs):
+    return self._call(None, args, kwargs)
+
   def memo_clear(self, *args, **kwargs):
     """Clears memoization results for a given set of arguments.
 
@@ -141,17 +347,44 @@ class MemoizedFunction(object):
       args, kwargs: Memoization function parameters whose memoized value should
           be cleared.
     """
-    memo_dict = self._get_memo_dict()
+    self._clear(None, args, kwargs)
+
+
+class _BoundMemoizedFunction(object):
+  """A MemoizedFunction bound to an instance.
+
+  A new one is returned on each attribute access, so that threads using
+  different instances do not share the binding.
+  """
+
+  def __init__(self, memoized, obj, klass):
+    self._memoized = memoized
+    self.im_self = obj
+    self.im_class = klass
 
-    if args or kwargs:
-      memo_key = self._key(args, kwargs)
-      memo_dict.pop(memo_key, None)
-    else:
-      memo_dict.clear()
+  def __getattr__(self, name):
+    return getattr(self._memoized, name)
 
+  def __repr__(self):
+    properties = [str(self._memoized.func), 'bound=%s' % (self.im_self,)]
+    if len(self._memoized.ignore) > 0:
+      properties.append('ignore=%s' % (
+          ','.join(sorted(self._memoized.ignore))))
+    return '%s(%s)' % (
+        type(self._memoized).__name__, ', '.join(properties))
 
+  def __get__(self, obj, klass=None):
+    return self._memoized.__get__(obj, klass)
 
-def memo(ignore=None, memo_dict=None):
+  def __call__(self, *args, **kwargs):
+    return self._memoized._call(self.im_self, args, kwargs)
+
+  def memo_clear(self, *args, **kwargs):
+    """See MemoizedFunction.memo_clear."""
+    self._memoized._clear(self.im_self, args, kwargs)
+
+
+def memo(ignore=None, memo_dict=None, max_size=None, ttl_secs=None):
   """Generic function memoization decorator.
 
   This memoizes a specific function using a function key.
@@ -177,13 +410,23 @@ def memo(ignore=None, memo_dict=None):
             (param1, param2, result)
     return result
 
+  The following example keeps at most 100 results, for at most a minute:
+
+  @memo.memo(max_size=100, ttl_secs=60)
+  def get_config(project):
+    return fetch_config(project)
+
   Args:
     ignore: (list) The names of parameters to ignore when memoizing.
+    max_size: (int) The max number of results to keep, or None for no limit.
+    ttl_secs: (number) How long results are kept, or None to keep them forever.
   """
   def wrap(func):
     return MemoizedFunction(
         func,
         ignore=ignore,
         memo_dict=memo_dict,
+        max_size=max_size,
+        ttl_secs=ttl_secs,
     )
   return wrap
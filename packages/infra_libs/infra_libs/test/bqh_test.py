@@ -4,7 +4,11 @@
 
 import datetime
 import json
+import logging
 import mock
+import re
+import threading
+import time
 import unittest
 from mock import patch
 
@@ -29,22 +33,57 @@ class TestBigQueryHelper(unittest.TestCase):
     self.mock_create_rows = self.bq_client.create_rows
     self.mock_create_rows.return_value = None
 
+  def sent_rows(self):
+    """Returns a list of rows sent in each create_rows call."""
+    for c in self.mock_create_rows.call_args_list:
+      self.assertEqual(c[0][0], self.table)
+    return [c[0][1] for c in self.mock_create_rows.call_args_list]
+
   def test_send_rows_tuple(self):
     rows = [('a',), ('b',), ('c',)]
     bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
-    self.mock_create_rows.assert_any_call(self.table, rows)
+    self.assertEqual(self.sent_rows(), [rows])
+
+  def test_send_rows_generator(self):
+    rows = (('a%d' % i,) for i in xrange(5))
+    bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows, 2)
+    self.assertEqual(self.sent_rows(), [
+        [('a0',), ('a1',)],
+        [('a2',), ('a3',)],
+        [('a4',)],
+    ])
+
+  def test_send_rows_insert_ids(self):
+    rows = [('a',), ('b',)]
+    bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
+    bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
+    ids = [c[1]['row_ids'] for c in self.mock_create_rows.call_args_list]
+    self.assertEqual(len(ids), 2)
+    self.assertEqual(len(set(ids[0] + ids[1])), 4)
 
   def test_batch_sizes(self):
     rows = [('a',), ('b',), ('c',)]
     bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows, 0)
-    self.mock_create_rows.assert_any_call(self.table, rows)
+    self.assertEqual(self.sent_rows(), [rows])
+    self.mock_create_rows.reset_mock()
     bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows, 1)
-    self.mock_create_rows.assert_any_call(self.table, [('a',)])
-    self.mock_create_rows.assert_any_call(self.table, [('b',)])
-    self.mock_create_rows.assert_any_call(self.table, [('c',)])
+    self.assertEqual(self.sent_rows(), [[('a',)], [('b',)], [('c',)]])
+    self.mock_create_rows.reset_mock()
     bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows,
                   bqh._BATCH_LIMIT+1)
-    self.mock_create_rows.assert_any_call(self.table, rows)
+    self.assertEqual(self.sent_rows(), [rows])
+
+  def test_request_bytes(self):
+    # ('b',) is 5 bytes of JSON.
+    rows = [('aaa',), ('b',), ('c',), ('ddddddddddddd',), ('e',)]
+    bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows,
+                  max_request_bytes=12)
+    self.assertEqual(self.sent_rows(), [
+        [('aaa',), ('b',)],
+        [('c',)],
+        [('ddddddddddddd',)],
+        [('e',)],
+    ])
 
   def test_send_rows_unsupported_type(self):
     with self.assertRaises(bqh.UnsupportedTypeError):
@@ -54,18 +93,99 @@ class TestBigQueryHelper(unittest.TestCase):
     rows = [testmessage_pb2.TestMessage(str='a')]
     bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
     expected_rows_arg = [{'num': 0, 'e': 'E0', 'str': u'a'}]
-    self.mock_create_rows.assert_any_call(self.table, expected_rows_arg)
+    self.assertEqual(self.sent_rows(), [expected_rows_arg])
 
   def test_send_rows_with_errors(self):
     rows = [('a',), ('b',), ('c',)]
     self.mock_create_rows.return_value = [
         {
             'index': 0,
-            'errors': ['some err'],
+            'errors': [{'reason': 'backendError'}],
         },
     ]
     with self.assertRaises(bqh.BigQueryInsertError):
       bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
+    self.assertEqual(self.sent_rows(), [rows] + [[('a',)]] * 3)
+
+  def test_send_rows_retries_failed_rows(self):
+    rows = [('a',), ('b',), ('c',), ('d',)]
+    stopped = [{'reason': 'stopped'}]
+    self.mock_create_rows.side_effect = [
+        [{'index': 1, 'errors': stopped}, {'index': 3, 'errors': stopped}],
+        [{'index': 1, 'errors': [{'reason': 'backendError'}]}],
+        None,
+    ]
+    bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
+    # Failed rows are retried together, with their insert ids.
+    self.assertEqual(
+        self.sent_rows(), [rows, [('b',), ('d',)], [('d',)]])
+    calls = self.mock_create_rows.call_args_list
+    ids = calls[0][1]['row_ids']
+    self.assertEqual(calls[1][1]['row_ids'], [ids[1], ids[3]])
+    self.assertEqual(calls[2][1]['row_ids'], [ids[3]])
+
+  def test_send_rows_invalid_row(self):
+    rows = [('a',), ('b',), ('c',)]
+    invalid = [{'reason': 'invalid', 'message': 'no such field'}]
+    self.mock_create_rows.side_effect = [
+        [
+            {'index': 0, 'errors': [{'reason': 'stopped'}]},
+            {'index': 1, 'errors': invalid},
+            {'index': 2, 'errors': [{'reason': 'stopped'}]},
+        ],
+        None,
+    ]
+    with self.assertRaises(bqh.BigQueryInsertError) as cm:
+      bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows)
+    # The invalid row is not retried, the other ones are, in one request.
+    self.assertEqual(self.sent_rows(), [rows, [('a',), ('c',)]])
+    self.assertIn('Error inserting row 1: ', str(cm.exception))
+    self.assertNotIn('row 0', str(cm.exception))
+
+  def test_send_rows_error_index(self):
+    rows = [('a',), ('b',), ('c',)]
+    err = {'reason': 'backendError'}
+    self.mock_create_rows.side_effect = lambda table, rows, row_ids: (
+        [{'index': 0, 'errors': [err]}] if rows == [('c',)] else None)
+    with self.assertRaisesRegexp(
+        bqh.BigQueryInsertError,
+        '^Error inserting row 2: %s\n$' % re.escape(str(err))):
+      bqh.send_rows(self.bq_client, self.dataset_id, self.table_id, rows, 2,
+                    retries=1)
+
+  def test_send_rows_concurrently(self):
+    client = FakeClient(latency=0.01)
+    rows = (('a%d' % i,) for i in xrange(100))
+    bqh.send_rows(client, self.dataset_id, self.table_id, rows, 10,
+                  concurrency=4)
+    self.assertEqual(
+        sorted(client.rows), sorted(('a%d' % i,) for i in xrange(100)))
+    self.assertEqual(client.requests, 10)
+    self.assertLessEqual(client.max_in_flight, 4)
+    self.assertGreater(client.max_in_flight, 1)
+
+  def test_send_rows_concurrently_exception(self):
+    client = FakeClient(fail=True)
+    rows = (('a%d' % i,) for i in xrange(100))
+    with self.assertRaises(ValueError):
+      bqh.send_rows(client, self.dataset_id, self.table_id, rows, 1,
+                    concurrency=4)
+    # Stops reading rows soon after the failure.
+    self.assertLess(client.requests, 100)
+
+  def test_benchmark(self):
+    rows = [testmessage_pb2.TestMessage(str='a', num=i) for i in xrange(5000)]
+    durations = []
+    for concurrency in (1, 8):
+      client = FakeClient(latency=0.005)
+      start = time.time()
+      bqh.send_rows(client, self.dataset_id, self.table_id, iter(rows), 100,
+                    concurrency=concurrency)
+      durations.append(time.time() - start)
+      self.assertEqual(len(client.rows), len(rows))
+    logging.info(
+        'send_rows of %d rows: sequential %.3fs, concurrent %.3fs',
+        len(rows), durations[0], durations[1])
 
   def test_message_to_dict(self):
     struct0 = struct_pb2.Struct()
@@ -170,5 +290,40 @@ class TestBigQueryHelper(unittest.TestCase):
       bqh.message_to_dict(testmessage_pb2.TestMessage(e=-1))
 
 
+class FakeClient(object):
+  """A BigQuery client that stores rows in memory after a delay."""
+
+  def __init__(self, latency=0, fail=False):
+    self.latency = latency
+    self.fail = fail
+    self.rows = []
+    self.requests = 0
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.lock = threading.Lock()
+
+  def dataset(self, dataset_id):
+    return mock.Mock()
+
+  def get_table(self, table_ref):
+    return table_ref
+
+  def create_rows(self, table, rows, row_ids):
+    assert len(rows) == len(row_ids)
+    with self.lock:
+      self.requests += 1
+      self.in_flight += 1
+      self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    try:
+      if self.fail:
+        raise ValueError('failed')
+      time.sleep(self.latency)
+      with self.lock:
+        self.rows.extend(rows)
+    finally:
+      with self.lock:
+        self.in_flight -= 1
+
+
 if __name__ == '__main__':
   unittest.main()
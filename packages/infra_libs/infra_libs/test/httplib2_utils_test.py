@@ -2,10 +2,14 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import BaseHTTPServer
 import httplib
 import json
+import logging
 import os
 import socket
+import SocketServer
+import threading
 import time
 import urllib
 import unittest
@@ -333,6 +337,250 @@ class InstrumentedHttplib2Test(unittest.TestCase):
         {'name': 'test', 'client': 'httplib2'}).sum)
 
 
+class _KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # Buffer writes, so that small responses are sent in a single segment.
+  wbufsize = -1
+
+  def setup(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connection_count += 1
+
+  def do_GET(self):
+    self.send_response(200)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write('ok')
+
+  def log_message(self, *_args):
+    pass
+
+
+class _KeepAliveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self):
+    BaseHTTPServer.HTTPServer.__init__(
+        self, ('127.0.0.1', 0), _KeepAliveHandler)
+    self.lock = threading.Lock()
+    self.connection_count = 0
+
+
+def _redirect_once(redirect_url):
+  """Returns a do_GET which redirects redirect_url to the root once."""
+  def do_GET(handler):
+    if handler.path == '/redirect':
+      handler.send_response(302)
+      handler.send_header('Location', redirect_url.replace('redirect', ''))
+      handler.send_header('Content-Length', '0')
+      handler.end_headers()
+      return
+    handler.send_response(200)
+    handler.send_header('Content-Length', '2')
+    handler.end_headers()
+    handler.wfile.write('ok')
+  return do_GET
+
+
+class FakeConnection(object):
+  def __init__(self):
+    self.sock = object()
+    self.closed = False
+
+  def close(self):
+    self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+  def setUp(self):
+    super(ConnectionPoolTest, self).setUp()
+    ts_mon.reset_for_unittest()
+    self.pool = httplib2_utils.ConnectionPool(max_per_host=1)
+    self.key = ('settings', 'https:foo')
+
+  def test_reuse(self):
+    conn = FakeConnection()
+    self.assertIsNone(self.pool.checkout(self.key))
+    self.pool.checkin(self.key, conn)
+    self.assertIs(conn, self.pool.checkout(self.key))
+
+  def test_waits_for_free_connection(self):
+    conn = FakeConnection()
+    self.pool.checkout(self.key)
+
+    got = []
+    def other():
+      got.append(self.pool.checkout(self.key))
+    t = threading.Thread(target=other)
+    t.start()
+    t.join(0.1)
+    self.assertTrue(t.is_alive())
+    self.assertEqual([], got)
+
+    self.pool.checkin(self.key, conn)
+    t.join()
+    self.assertEqual([conn], got)
+
+  def test_unlimited_by_default(self):
+    pool = httplib2_utils.ConnectionPool()
+    for _ in xrange(100):
+      self.assertIsNone(pool.checkout(self.key))
+
+  def test_discard_frees_slot(self):
+    self.pool.checkout(self.key)
+    self.pool.discard(self.key)
+    self.assertEqual(0, self.pool._counts[self.key])
+    self.assertIsNone(self.pool.checkout(self.key))
+
+  def test_close_idle(self):
+    conn = FakeConnection()
+    other_key = ('other', 'https:foo')
+    other_conn = FakeConnection()
+    self.pool.checkout(self.key)
+    self.pool.checkin(self.key, conn)
+    self.pool.checkout(other_key)
+    self.pool.checkin(other_key, other_conn)
+
+    self.pool.close_idle({conn})
+    self.assertTrue(conn.closed)
+    self.assertFalse(other_conn.closed)
+    self.assertEqual(0, self.pool._counts[self.key])
+    self.assertEqual([other_conn], self.pool._idle[other_key])
+    self.pool.close_idle()
+    self.assertTrue(other_conn.closed)
+
+  def test_metrics(self):
+    fields = {'name': 'test', 'client': 'httplib2'}
+    self.pool.checkout(self.key, fields)
+    self.pool.checkin(self.key, FakeConnection())
+    self.pool.checkout(self.key, fields)
+
+    self.assertEqual(1, http_metrics.connections.get(
+        {'name': 'test', 'client': 'httplib2', 'reused': True}))
+    self.assertEqual(1, http_metrics.connections.get(
+        {'name': 'test', 'client': 'httplib2', 'reused': False}))
+    self.assertEqual(1, http_metrics.tls_handshakes.get(fields))
+
+  def test_closed_connection_is_not_reused(self):
+    fields = {'name': 'test', 'client': 'httplib2'}
+    conn = FakeConnection()
+    conn.sock = None
+    self.pool.checkout(self.key, fields)
+    self.pool.checkin(self.key, conn)
+    self.assertIs(conn, self.pool.checkout(self.key, fields))
+
+    self.assertEqual(2, http_metrics.connections.get(
+        {'name': 'test', 'client': 'httplib2', 'reused': False}))
+    self.assertEqual(2, http_metrics.tls_handshakes.get(fields))
+
+
+class PooledHttpTest(unittest.TestCase):
+  def setUp(self):
+    super(PooledHttpTest, self).setUp()
+    ts_mon.reset_for_unittest()
+    self.server = _KeepAliveServer()
+    self.server_thread = threading.Thread(target=self.server.serve_forever)
+    self.server_thread.daemon = True
+    self.server_thread.start()
+    self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+    self.pool = httplib2_utils.ConnectionPool(max_per_host=2)
+
+  def tearDown(self):
+    self.pool.close_idle()
+    self.server.shutdown()
+    self.server.server_close()
+    super(PooledHttpTest, self).tearDown()
+
+  def test_reuses_connection_across_objects(self):
+    for _ in xrange(3):
+      http = infra_libs.InstrumentedHttp('test', pool=self.pool)
+      response, content = http.request(self.url)
+      self.assertEqual(200, response.status)
+      self.assertEqual('ok', content)
+
+    self.assertEqual(1, self.server.connection_count)
+    self.assertEqual(2, http_metrics.connections.get(
+        {'name': 'test', 'client': 'httplib2', 'reused': True}))
+    self.assertEqual(1, http_metrics.connections.get(
+        {'name': 'test', 'client': 'httplib2', 'reused': False}))
+    self.assertIsNone(http_metrics.tls_handshakes.get(
+        {'name': 'test', 'client': 'httplib2'}))
+
+  def test_different_settings_do_not_share(self):
+    httplib2_utils.PooledHttp(timeout=10, pool=self.pool).request(self.url)
+    httplib2_utils.PooledHttp(timeout=20, pool=self.pool).request(self.url)
+    self.assertEqual(2, self.server.connection_count)
+
+  def test_close(self):
+    http = httplib2_utils.PooledHttp(pool=self.pool)
+    http.add_credentials('user', 'password')
+    http.request(self.url)
+    http.close()
+    self.assertEqual([], http.credentials.credentials)
+    self.assertFalse(any(self.pool._idle.itervalues()))
+
+  def test_close_keeps_connections_of_other_objects(self):
+    http = httplib2_utils.PooledHttp(timeout=10, pool=self.pool)
+    other = httplib2_utils.PooledHttp(timeout=20, pool=self.pool)
+    http.request(self.url)
+    other.request(self.url)
+    http.close()
+    idle = [c for conns in self.pool._idle.itervalues() for c in conns]
+    self.assertEqual(1, len(idle))
+    self.assertIsNotNone(idle[0].sock)
+
+  def test_redirect_to_same_host(self):
+    redirect_url = self.url + 'redirect'
+    pool = httplib2_utils.ConnectionPool(max_per_host=1)
+    http = httplib2_utils.PooledHttp(pool=pool)
+    with mock.patch.object(
+        _KeepAliveHandler, 'do_GET', autospec=True,
+        side_effect=_redirect_once(redirect_url)):
+      response, content = http.request(redirect_url)
+    self.assertEqual(200, response.status)
+    self.assertEqual('ok', content)
+    self.assertEqual(1, self.server.connection_count)
+    pool.close_idle()
+
+  def test_timeout_frees_slot(self):
+    http = httplib2_utils.PooledHttp(pool=self.pool)
+    with mock.patch('httplib2.Http._request', side_effect=socket.timeout):
+      with self.assertRaises(socket.timeout):
+        http.request(self.url)
+    self.assertEqual(0, sum(self.pool._counts.itervalues()))
+
+  def test_concurrent_requests(self):
+    http = httplib2_utils.PooledHttp(pool=self.pool)
+    statuses = []
+    def worker():
+      for _ in xrange(10):
+        response, _ = http.request(self.url)
+        statuses.append(response.status)
+    threads = [threading.Thread(target=worker) for _ in xrange(8)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+
+    self.assertEqual([200] * 80, statuses)
+    self.assertLessEqual(self.server.connection_count, 2)
+
+  def test_benchmark(self):
+    n = 200
+    start = time.time()
+    for _ in xrange(n):
+      httplib2.Http().request(self.url)
+    unpooled = time.time() - start
+    start = time.time()
+    for _ in xrange(n):
+      httplib2_utils.PooledHttp(pool=self.pool).request(self.url)
+    pooled = time.time() - start
+    logging.info('%d requests: %.3fs with new connections, %.3fs pooled',
+                 n, unpooled, pooled)
+    self.assertEqual(n + 1, self.server.connection_count)
+
+
 class HttpMockTest(unittest.TestCase):
   def test_empty(self):
     http = infra_libs.HttpMock([])
@@ -7,6 +7,7 @@
 Collection of unit tests for 'infra.libs.memoize' library.
 """
 
+import threading
 import unittest
 
 from infra_libs import memoize
@@ -471,5 +472,224 @@ class MemoClassMethodTestCase(MemoTestCase):
     )
 
 
+class MemoBoundsTestCase(MemoTestCase):
+
+  def testMaxSize(self):
+    @memoize.memo(max_size=2)
+    def func(a):
+      self.tag(a)
+      return a
+
+    func(1)
+    func(2)
+    func(1)
+    # Evicts 2, the least recently used.
+    func(3)
+    self.assertEqual(len(func.memo_dict), 2)
+    func(1)
+    func(3)
+    self.assertTagged(1, 2, 3)
+    self.clearTagged()
+    func(2)
+    self.assertTagged(2)
+
+  def testMaxSizeInstance(self):
+    class Test(object):
+      @memoize.memo(max_size=1)
+      def func(inner_self, a):
+        self.tag((id(inner_self), a))
+        return a
+
+    t0 = Test()
+    t1 = Test()
+    t0.func(1)
+    t1.func(1)
+    t0.func(1)
+    t0.func(2)
+    t1.func(1)
+    self.assertTagged((id(t0), 1), (id(t1), 1), (id(t0), 2))
+
+  def testTtl(self):
+    now = [1000]
+    func = memoize.MemoizedFunction(
+        lambda a: self.tag((now[0], a)), ttl_secs=10, time_fn=lambda: now[0])
+    func(1)
+    now[0] = 1009
+    func(1)
+    self.assertTagged((1000, 1))
+    now[0] = 1010
+    func(1)
+    self.assertTagged((1000, 1), (1010, 1))
+    self.assertEqual(func.hits, 1)
+    self.assertEqual(func.misses, 2)
+
+  def testCounters(self):
+    @memoize.memo()
+    def func(a):
+      return a
+
+    for _ in xrange(3):
+      func(1)
+    func(2)
+    self.assertEqual(func.hits, 2)
+    self.assertEqual(func.misses, 2)
+
+  def testFastKey(self):
+    def func(a, b, c=3, d=4):  # pragma: no cover
+      pass
+    memoized = memoize.MemoizedFunction(func, ignore=('d',))
+    for args, kwargs in (
+        ((1, 2), {}),
+        ((1, 2, 5), {}),
+        ((1,), {'b': 2}),
+        ((), {'b': 2, 'a': 1, 'd': 0}),
+        ((1, 2, 3, 4), {}),
+    ):
+      self.assertEqual(
+          memoized._fast_key(args, kwargs),
+          memoized._key(None, args, kwargs))
+      self.assertIsNotNone(memoized._fast_key(args, kwargs))
+
+    # Invalid calls are left to inspect.
+    for args, kwargs in (
+        ((1,), {}),
+        ((1, 2, 3, 4, 5), {}),
+        ((1,), {'a': 1}),
+        ((1, 2), {'e': 1}),
+    ):
+      self.assertIsNone(memoized._fast_key(args, kwargs))
+      with self.assertRaises(TypeError):
+        memoized._key(None, args, kwargs)
+
+  def testVarArgs(self):
+    @memoize.memo()
+    def func(a, *args):
+      self.tag((a, args))
+      return a
+
+    func(1, 2)
+    func(1, 2)
+    func(1, 3)
+    self.assertTagged((1, (2,)), (1, (3,)))
+
+  def testMethodsOfOneInstance(self):
+    class Test(object):
+      @memoize.memo()
+      def func1(inner_self, a):
+        return ('func1', a)
+
+      @memoize.memo()
+      def func2(inner_self, a):
+        return ('func2', a)
+
+    t = Test()
+    self.assertEqual(t.func1(1), ('func1', 1))
+    self.assertEqual(t.func2(1), ('func2', 1))
+
+  def testOneCallInFlight(self):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    @memoize.memo()
+    def func(a):
+      calls.append(a)
+      started.set()
+      release.wait()
+      return a * 2
+
+    results = []
+    def run():
+      results.append(func(21))
+    threads = [threading.Thread(target=run) for _ in xrange(5)]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+      t.start()
+    while func.hits < 4:
+      release.wait(0.001)
+    release.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(calls, [21])
+    self.assertEqual(results, [42] * 5)
+    self.assertEqual(func.misses, 1)
+
+  def testInFlightException(self):
+    started = threading.Event()
+    release = threading.Event()
+
+    @memoize.memo()
+    def func(a):
+      started.set()
+      release.wait()
+      raise ValueError(a)
+
+    errors = []
+    def run():
+      try:
+        func(1)
+      except ValueError as e:
+        errors.append(e)
+    threads = [threading.Thread(target=run) for _ in xrange(2)]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    while func.hits < 1:
+      release.wait(0.001)
+    release.set()
+    for t in threads:
+      t.join()
+    self.assertEqual(len(errors), 2)
+    self.assertIs(errors[0], errors[1])
+
+    # Failures are not memoized.
+    with self.assertRaises(ValueError):
+      func(1)
+    self.assertEqual(func.misses, 2)
+
+  def testRecursiveCallWithSameKey(self):
+    # 'depth' is ignored, so the recursive calls have the same key.
+    @memoize.memo(ignore=('depth',))
+    def func(a, depth=0):
+      if depth < 2:
+        return func(a, depth=depth + 1) + 1
+      return a
+
+    self.assertEqual(func(1), 3)
+    self.assertEqual(func.misses, 3)
+    self.assertEqual(func(1), 3)
+    self.assertEqual(func.hits, 1)
+
+  def testRecursiveCallWithSameKeyException(self):
+    @memoize.memo(ignore=('depth',))
+    def func(a, depth=0):
+      if depth < 1:
+        return func(a, depth=depth + 1)
+      raise ValueError(a)
+
+    with self.assertRaises(ValueError):
+      func(1)
+    # Nothing is left in flight.
+    with self.assertRaises(ValueError):
+      func(1)
+    self.assertEqual(func.misses, 4)
+
+  def testRepr(self):
+    class Test(object):
+      @memoize.memo(ignore=('b',))
+      def func(inner_self, a, b):  # pragma: no cover
+        pass
+
+      def __repr__(inner_self):
+        return 'Test'
+
+    self.assertRegexpMatches(
+        repr(Test.func), r'^MemoizedFunction\(<function func .*>, ignore=b\)$')
+    self.assertRegexpMatches(
+        repr(Test().func),
+        r'^MemoizedFunction\(<function func .*>, bound=Test, ignore=b\)$')
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -3,7 +3,6 @@
 # found in the LICENSE file.
 
 import bisect
-import collections
 
 
 class _Bucketer(object):
@@ -94,6 +93,17 @@ class _Bucketer(object):
     # bisect.bisect_left is wrong because the buckets are of [lower, upper) form
     return bisect.bisect(self._lower_bounds, value) - 1
 
+  def bucket_counts_for_values(self, values):
+    """Returns a list of counts of values in each bucket."""
+    # Counts are shifted by one because bisect returns bucket+1.  The list has
+    # an extra leading zero, for values less than -Inf, which do not exist.
+    counts = [0] * (self.total_buckets + 1)
+    lower_bounds = self._lower_bounds
+    bisect_right = bisect.bisect
+    for value in values:
+      counts[bisect_right(lower_bounds, value)] += 1
+    return counts[1:]
+
   def bucket_boundaries(self, bucket):
     """Returns a tuple that is the [lower, upper) bounds of this bucket.
 
@@ -125,15 +135,31 @@ class Distribution(object):
   """Holds a histogram distribution.
 
   Buckets are chosen for values by the provided Bucketer.
+  bucket_counts is a list of counts of values in each bucket, including the
+  underflow and overflow buckets.
   """
 
   def __init__(self, bucketer):
     self.bucketer = bucketer
     self.sum = 0
     self.count = 0
-    self.buckets = collections.defaultdict(int)
+    self.bucket_counts = [0] * bucketer.total_buckets
+
+  @property
+  def buckets(self):
+    """Returns a dict {bucket_index: count} of non-empty buckets."""
+    return {i: c for i, c in enumerate(self.bucket_counts) if c}
 
   def add(self, value):
-    self.buckets[self.bucketer.bucket_for_value(value)] += 1
+    self.bucket_counts[self.bucketer.bucket_for_value(value)] += 1
     self.sum += value
     self.count += 1
+
+  def add_many(self, values, weight=1):
+    """Adds all values from an iterable, each `weight` times."""
+    values = list(values)
+    counts = self.bucketer.bucket_counts_for_values(values)
+    self.bucket_counts = [
+        a + b * weight for a, b in zip(self.bucket_counts, counts)]
+    self.sum += sum(values) * weight
+    self.count += len(values) * weight
@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
+import threading
+
 from infra_libs.ts_mon.common import distribution
 from infra_libs.ts_mon.common import metrics
 
@@ -47,6 +50,18 @@ response_status = metrics.CounterMetric('http/response_status',
         metrics.StringField('name'),
         metrics.StringField('client'),
     ])
+connections = metrics.CounterMetric('http/connections',
+    'Number of connections taken from a pool for http requests, by whether an'
+    ' open keep-alive connection was reused.', [
+        metrics.StringField('name'),
+        metrics.StringField('client'),
+        metrics.BooleanField('reused'),
+    ])
+tls_handshakes = metrics.CounterMetric('http/tls_handshakes',
+    'Number of https connections (re)opened for http requests.', [
+        metrics.StringField('name'),
+        metrics.StringField('client'),
+    ])
 
 
 server_request_bytes = metrics.CumulativeDistributionMetric(
@@ -92,22 +107,128 @@ def update_http_metrics(client, name, response_status_code, elapsed_ms,
     response_bytes.add(response_size, fields={'client':client, 'name':name})
 
 
+def _is_robot(user_agent):
+  # We must not log user agents, but we can store whether or not the
+  # user agent string indicates that the requester was a Google bot.
+  return user_agent is not None and (
+      'GoogleBot' in user_agent or
+      'GoogleSecurityScanner' in user_agent or
+      user_agent == 'B3M/prober')
+
+
 def update_http_server_metrics(endpoint_name, response_status_code, elapsed_ms,
                                request_size=None, response_size=None,
-                               user_agent=None):
+                               user_agent=None, weight=1):
+  """Records a handled request.
+
+  weight is the number of requests this one stands for, if requests are
+  sampled.
+  """
   fields = {'status': response_status_code, 'name': endpoint_name,
-            'is_robot': False}
-  if user_agent is not None:
-    # We must not log user agents, but we can store whether or not the
-    # user agent string indicates that the requester was a Google bot.
-    fields['is_robot'] = (
-        'GoogleBot' in user_agent or
-        'GoogleSecurityScanner' in user_agent or
-        user_agent == 'B3M/prober')
-
-  server_durations.add(elapsed_ms, fields=fields)
-  server_response_status.increment(fields=fields)
+            'is_robot': _is_robot(user_agent)}
+
+  if weight == 1:
+    server_durations.add(elapsed_ms, fields=fields)
+    server_response_status.increment(fields=fields)
+    if request_size is not None:
+      server_request_bytes.add(request_size, fields=fields)
+    if response_size is not None:
+      server_response_bytes.add(response_size, fields=fields)
+    return
+
+  server_durations.add_many([elapsed_ms], fields=fields, weight=weight)
+  server_response_status.increment_by(weight, fields=fields)
   if request_size is not None:
-    server_request_bytes.add(request_size, fields=fields)
+    server_request_bytes.add_many([request_size], fields=fields, weight=weight)
   if response_size is not None:
-    server_response_bytes.add(response_size, fields=fields)
+    server_response_bytes.add_many(
+        [response_size], fields=fields, weight=weight)
+
+
+class _ServerMetricsBuffer(object):
+  """Requests recorded by one thread, not merged into the metrics yet."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.thread = threading.current_thread()
+    self.requests = 0
+    # {(endpoint_name, status, is_robot, weight):
+    #  (durations, request_sizes, response_sizes)}
+    self.values = collections.defaultdict(lambda: ([], [], []))
+
+  def take(self):
+    """Returns the values and empties the buffer.
+
+    Must be called while holding self.lock.
+    """
+    values = self.values
+    self.values = collections.defaultdict(lambda: ([], [], []))
+    self.requests = 0
+    return values
+
+
+class ServerMetricsBatcher(object):
+  """Records handled requests in batches.
+
+  update() takes the same arguments as update_http_server_metrics(), but only
+  appends the values to a buffer of the current thread, which is cheaper than
+  updating four metrics.  A buffer is merged into the metrics when it holds
+  batch_size requests.  merge() merges all buffers, call it before flushing the
+  metrics.
+  """
+
+  def __init__(self, batch_size=100):
+    self._batch_size = batch_size
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._buffers = []
+
+  def _buffer(self):
+    buf = getattr(self._local, 'buffer', None)
+    if buf is None:
+      buf = _ServerMetricsBuffer()
+      self._local.buffer = buf
+      with self._lock:
+        self._buffers.append(buf)
+    return buf
+
+  def update(self, endpoint_name, response_status_code, elapsed_ms,
+             request_size=None, response_size=None, user_agent=None,
+             weight=1):
+    buf = self._buffer()
+    key = (endpoint_name, response_status_code, _is_robot(user_agent), weight)
+    with buf.lock:
+      durations, request_sizes, response_sizes = buf.values[key]
+      durations.append(elapsed_ms)
+      if request_size is not None:
+        request_sizes.append(request_size)
+      if response_size is not None:
+        response_sizes.append(response_size)
+      buf.requests += 1
+      if buf.requests < self._batch_size:
+        return
+      values = buf.take()
+    self._merge_values(values)
+
+  def merge(self):
+    """Merges the values of all threads into the metrics."""
+    with self._lock:
+      buffers = list(self._buffers)
+      # Buffers of finished threads are merged below for the last time.
+      self._buffers = [b for b in buffers if b.thread.is_alive()]
+    for buf in buffers:
+      with buf.lock:
+        values = buf.take()
+      self._merge_values(values)
+
+  @staticmethod
+  def _merge_values(values):
+    for (endpoint_name, status, is_robot, weight), (
+        durations, request_sizes, response_sizes) in values.iteritems():
+      fields = {'status': status, 'name': endpoint_name, 'is_robot': is_robot}
+      server_durations.add_many(durations, fields=fields, weight=weight)
+      server_response_status.increment_by(
+          len(durations) * weight, fields=fields)
+      server_request_bytes.add_many(request_sizes, fields=fields, weight=weight)
+      server_response_bytes.add_many(
+          response_sizes, fields=fields, weight=weight)
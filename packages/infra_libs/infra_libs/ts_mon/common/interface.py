@@ -81,10 +81,21 @@ class State(object):
     self.store = store_ctor(self)
     # Cached time of the last flush. Useful mostly in AppEngine apps.
     self.last_flushed = datetime.datetime.utcfromtimestamp(0)
+    # If not None, flush() sends only the values modified since the last
+    # successful flush, and sends all values if the last successful full flush
+    # was at least this many seconds ago.
+    self.delta_flush_full_interval_secs = None
+    # store.modification_count() as of the last successful flush, or None.
+    self.last_flushed_modification = None
+    # time.time() of the last successful flush of all values.
+    self.last_full_flush_time = 0
     # Metric name prefix
     self.metric_name_prefix = '/chrome/infra/'
     # Metrics registered with register_global_metrics.  Keyed by metric name.
     self.global_metrics = {}
+    # Metrics registered with register_aggregated_metrics.  Keyed by metric
+    # name.
+    self.aggregated_metrics = {}
     # Callbacks registered with register_global_metrics_callback.  Keyed by the
     # arbitrary string provided by the user.  Called before each flush.
     self.global_metrics_callbacks = {}
@@ -102,9 +113,13 @@ class State(object):
   def reset_for_unittest(self):
     self.metrics = {}
     self.global_metrics = {}
+    self.aggregated_metrics = {}
     self.global_metrics_callbacks = {}
     self.invoke_global_callbacks_on_flush = True
     self.last_flushed = datetime.datetime.utcfromtimestamp(0)
+    self.delta_flush_full_interval_secs = None
+    self.last_flushed_modification = None
+    self.last_full_flush_time = 0
     self.store.reset_for_unittest()
 
 state = State()
@@ -139,19 +154,61 @@ def flush():
   if state.invoke_global_callbacks_on_flush:
     invoke_global_callbacks()
 
+  # Imported here because standard_metrics depends on this module.
+  from infra_libs.ts_mon.common import standard_metrics
+
+  start = time.time()
+  modified_since = None
+  if (state.delta_flush_full_interval_secs is not None and
+      state.last_flushed_modification is not None and
+      start - state.last_full_flush_time <
+      state.delta_flush_full_interval_secs):
+    modified_since = state.last_flushed_modification
+  # Values modified while flushing are sent again by the next delta flush.
+  modification = state.store.modification_count()
+
+  payload_sizes = []
+  streams = 0
   rpcs = []
-  for proto in _generate_proto():
-    rpcs.append(state.global_monitor.send(proto))
+  # The flush failed if any of its payloads wasn't sent.
+  failed = False
+  state.global_monitor.start_flush()
+  # Asynchronous monitors send payloads while the next ones are generated.
+  for proto in _generate_proto(modified_since=modified_since):
+    payload_sizes.append(proto.ByteSize())
+    streams += _count_streams(proto)
+    rpc = state.global_monitor.send(proto)
+    if rpc is None:
+      failed = state.global_monitor.failed() or failed
+    else:
+      rpcs.append(rpc)
   for rpc in rpcs:
-    if rpc is not None:
-      state.global_monitor.wait(rpc)
-  if state.global_monitor.failed():
+    state.global_monitor.wait(rpc)
+    failed = state.global_monitor.failed() or failed
+
+  standard_metrics.flush_durations.add(
+      (time.time() - start) * 1000, {'success': not failed})
+  standard_metrics.flush_payload_bytes.add_many(payload_sizes)
+  standard_metrics.flush_streams.set(streams)
+
+  if failed:
     return False
-  # Only update last_flushed on successful flush.
+  # Only update last_flushed when every payload was sent.
   state.last_flushed = datetime.datetime.utcnow()
+  state.last_flushed_modification = modification
+  if modified_since is None:
+    state.last_full_flush_time = start
   return True
 
 
+def _count_streams(payload):
+  """Returns the number of MetricsData messages in a MetricsPayload."""
+  return sum(
+      len(data_set.data)
+      for collection in payload.metrics_collection
+      for data_set in collection.metrics_data_set)
+
+
 def _populate_root_labels(root_labels, target):
   """Populate root_labels for the given target."""
   for field, value in zip(target[0].DESCRIPTOR.fields, target[1:]):
@@ -165,8 +222,12 @@ def _populate_root_labels(root_labels, target):
       raise NotImplementedError()
 
 
-def _generate_proto():
-  """Generate MetricsPayload for global_monitor.send()."""
+def _generate_proto(modified_since=None):
+  """Generate MetricsPayload for global_monitor.send().
+
+  If modified_since is not None, includes only the values modified after it.
+  See MetricStore.get_all.
+  """
   proto = metrics_pb2.MetricsPayload()
 
   # Key: Target, value: MetricsCollection.
@@ -177,7 +238,11 @@ def _generate_proto():
 
   count = 0
   for (target, metric, start_times, end_time, fields_values
-       ) in state.store.get_all():
+       ) in state.store.get_all(modified_since=modified_since):
+    if target is state.target and metric.name in state.aggregated_metrics:
+      # Values of the default target are sent summed across all tasks.  See
+      # register_aggregated_metrics.
+      continue
     for fields, value in fields_values.iteritems():
       # In default, the start time of all data points for a single stream
       # should be set with the first time of a value change in the stream,
@@ -208,6 +273,10 @@ def _generate_proto():
       # with the metric-level start_time.
       #
       # Otherwise, report data points with the first value change time.
+      #
+      # Delta flushes skip the data points that did not change, but the start
+      # time of a stream does not depend on which flushes included it, so
+      # the data points that are sent keep the start time described above.
       start_time = metric.start_time or start_times.get(fields, end_time)
       if count >= METRICS_DATA_LENGTH_LIMIT:
         yield proto
@@ -224,21 +293,16 @@ def _generate_proto():
           target.populate_target_pb(collections[target])
       collection = collections[target]
 
+      # Populate the protos in place.  If populating fails, the exception
+      # propagates and the partially populated payload is never sent.
       key = (target, metric.name)
-      new_data_set = None
-      if key not in data_sets:
-        new_data_set = metrics_pb2.MetricsDataSet()
-        metric.populate_data_set(new_data_set)
-
-      data = metrics_pb2.MetricsData()
-      metric.populate_data(data, start_time, end_time, fields, value)
-
-      # All required data protos have been successfully populated. Now we can
-      # insert them in serialized proto and bookeeping data structures.
-      if new_data_set is not None:
-        collection.metrics_data_set.add().CopyFrom(new_data_set)
-        data_sets[key] = collection.metrics_data_set[-1]
-      data_sets[key].data.add().CopyFrom(data)
+      data_set = data_sets.get(key)
+      if data_set is None:
+        data_set = collection.metrics_data_set.add()
+        metric.populate_data_set(data_set)
+        data_sets[key] = data_set
+      metric.populate_data(
+          data_set.data.add(), start_time, end_time, fields, value)
       count += 1
 
   if count > 0:
@@ -297,6 +361,35 @@ def register_global_metrics(metrics):
   state.global_metrics.update({m.name: m for m in metrics})
 
 
+def register_aggregated_metrics(metrics):
+  """Declare metrics as aggregated across tasks.
+
+  Only supported on Appengine.
+
+  The values a task records for an aggregated metric with the default target
+  fields are never sent by the task itself.  On Appengine, each instance adds
+  them to a shared accumulator instead, and the sums across all instances of a
+  module are sent once per minute with task_num 0 and an empty hostname.  This
+  reduces the number of streams of counters that only make sense globally.
+
+  Only CounterMetric, CumulativeMetric and CumulativeDistributionMetric can be
+  aggregated.  There is no "unregister". Multiple calls add up.
+
+  Args:
+    metrics (iterable): a collection of Metric objects.
+  """
+  # Imported here because metrics depends on this module.
+  from infra_libs.ts_mon.common import metrics as metrics_lib
+
+  metrics = list(metrics)
+  for m in metrics:
+    if not isinstance(m, (metrics_lib.CounterMetric,
+                          metrics_lib.CumulativeMetric,
+                          metrics_lib.CumulativeDistributionMetric)):
+      raise TypeError('Metric %s cannot be aggregated' % m.name)
+  state.aggregated_metrics.update({m.name: m for m in metrics})
+
+
 def register_global_metrics_callback(name, callback):
   """Register a named function to compute global metrics values.
 
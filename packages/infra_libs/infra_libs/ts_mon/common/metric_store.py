@@ -64,15 +64,28 @@ class MetricStore(object):
     """
     raise NotImplementedError
 
-  def get_all(self):
+  def get_all(self, modified_since=None):
     """Returns an iterator over all the metrics present in the store.
 
     The iterator yields 5-tuples:
       (target, metric, start_time, end_time, field_values)
+
+    Args:
+      modified_since: if not None, a value returned by modification_count().
+          Only values modified after that call are yielded.
+    """
+    raise NotImplementedError
+
+  def modification_count(self):
+    """Returns an opaque marker of all modifications made so far.
+
+    Pass it to get_all(modified_since=...) to get only values modified after
+    this call.
     """
     raise NotImplementedError
 
-  def set(self, name, fields, target_fields, value, enforce_ge=False):
+  def set(self, name, fields, target_fields, value, enforce_ge=False,
+          start_time=None):
     """Sets the metric's value.
 
     Args:
@@ -82,6 +95,8 @@ class MetricStore(object):
       value: the new value for the metric.
       enforce_ge: if this is True, raise an exception if the new value is
           less than the old value.
+      start_time: if not None, the start time of this value's stream, instead
+          of the time of its first change.
 
     Raises:
       MonitoringDecreasingValueError: if enforce_ge is True and the new value is
@@ -103,6 +118,19 @@ class MetricStore(object):
     """
     raise NotImplementedError
 
+  def take(self, name, target_fields):
+    """Atomically removes and returns the metric's values for one target.
+
+    Args:
+      name: the metric's name.
+      target_fields (dict or None): target fields to override, None for the
+          default target.
+
+    Returns:
+      A dict {normalized field tuple: value}, empty if there are no values.
+    """
+    raise NotImplementedError
+
   def reset_for_unittest(self, name=None):
     """Clears the values metrics.  Useful in unittests.
 
@@ -118,12 +146,32 @@ class _TargetFieldsValues(object):
 
   Values are keyed by metric fields and target fields (which override the
   default target fields configured globally for the process).
+
+  Modifications must be done while holding self.lock.  Each cell remembers the
+  store's modification count of its last change, and the cells of a target are
+  kept in order of modification, so that snapshot(modified_since) only visits
+  the cells modified after it.
   """
 
   def __init__(self):
+    self.lock = threading.Lock()
     # {normalized_target_fields: {normalized_metric_fields: value}}
     self._values = collections.defaultdict(dict)
+    # Start times are never changed in place once set, so snapshots share these
+    # dicts.
     self._start_times = collections.defaultdict(dict)
+    # {normalized_target_fields:
+    #     OrderedDict(normalized_metric_fields: modification)}, least recently
+    # modified first.
+    self._modifications = collections.defaultdict(collections.OrderedDict)
+    # The modification count of the last change of any cell.
+    self.last_modification = 0
+    # {normalized_target_fields: set(normalized_metric_fields)} modified since
+    # the last full snapshot.
+    self._dirty = collections.defaultdict(set)
+    # {normalized_target_fields: {normalized_metric_fields: value}} copies of
+    # the values as of the last full snapshot.
+    self._copies = {}
 
   def gen_key(self, target_fields):
     if not isinstance(target_fields, message.Message):
@@ -139,100 +187,179 @@ class _TargetFieldsValues(object):
       values.append(value)
     return tuple(values)
 
-  def _get_target_values(self, target_fields):
-    # Normalize the target fields by converting them into a hashable tuple.
-    if not target_fields:
-      target_fields = {}
-    return self._values[self.gen_key(target_fields)]
-
-  def _get_target_start_times(self, target_fields):
+  def _target_key(self, target_fields):
     # Normalize the target fields by converting them into a hashable tuple.
     if not target_fields:
       target_fields = {}
-    return self._start_times[self.gen_key(target_fields)]
+    return self.gen_key(target_fields)
 
   def get_value(self, fields, target_fields, default=None):
-    return self._get_target_values(target_fields).get(
-        fields, default)
-
-  def set_value(self, fields, target_fields, value, time_fn=None):
-    self._get_target_values(target_fields)[fields] = value
-    start_time = time_fn() if time_fn else time.time()
-    self._get_target_start_times(target_fields).setdefault(fields, start_time)
+    values = self._values.get(self._target_key(target_fields))
+    if not values:
+      return default
+    return values.get(fields, default)
+
+  def set_value(self, fields, target_fields, value, time_fn=None,
+                modification=0, start_time=None):
+    key = self._target_key(target_fields)
+    self._values[key][fields] = value
+    start_times = self._start_times[key]
+    if start_time is not None:
+      if start_times.get(fields) != start_time:
+        # Snapshots share the dict, so it is never changed in place.
+        start_times = self._start_times[key] = start_times.copy()
+        start_times[fields] = start_time
+    elif fields not in start_times:
+      start_times[fields] = time_fn() if time_fn else time.time()
+    # Move the cell to the end, so that cells stay in order of modification.
+    modifications = self._modifications[key]
+    modifications.pop(fields, None)
+    modifications[fields] = modification
+    self._dirty[key].add(fields)
+    self.last_modification = modification
+
+  def pop_values(self, target_fields, modification=0):
+    """Removes and returns the values for one target.
+
+    Must be called while holding self.lock.
+    """
+    key = self._target_key(target_fields)
+    values = self._values.pop(key, {})
+    self._start_times.pop(key, None)
+    self._modifications.pop(key, None)
+    self._dirty.pop(key, None)
+    self._copies.pop(key, None)
+    if values:
+      self.last_modification = modification
+    return values
 
   def iter_targets(self, default_target):
-    targets = self.iter_targets_with_start_times(default_target)
-    for target, fields_values, _ in targets:
-      yield target, fields_values
-
-  def iter_targets_with_start_times(self, default_target):
-    for target_fields, fields_values in self._values.iteritems():
-      if target_fields:
-        if inspect.isclass(target_fields[0]):
-          # It's a target type plus serialised values.
-          # Output the tuple as is.
-          target = target_fields
-        else:
-          target = copy.copy(default_target)
-          target.update({k: v for k, v in target_fields})
-      else:
-        target = default_target
-      yield target, fields_values, self._start_times[target_fields]
+    """Returns a list of (target, fields_values) tuples.
+
+    fields_values are copies.  Must be called while holding self.lock.
+    """
+    return [(self._target(target_fields, default_target), fields_values.copy())
+            for target_fields, fields_values in self._values.iteritems()]
+
+  def snapshot(self, modified_since=None):
+    """Returns a copy of the values.
+
+    Returns a list of (normalized_target_fields, values, start_times) tuples.
+    If modified_since is not None, values include only the cells modified after
+    it, and targets without such cells are skipped: only those cells are
+    visited.  Otherwise values include all the cells, and only the cells
+    modified since the previous full snapshot are copied again.
 
-  def __deepcopy__(self, memo_dict):
-    ret = _TargetFieldsValues()
-    ret._start_times = copy.deepcopy(self._start_times, memo_dict)
-    ret._values = copy.deepcopy(self._values, memo_dict)
-    return ret
+    Must be called while holding self.lock.
+    """
+    if modified_since is not None:
+      return self._snapshot_modified(modified_since)
+
+    for key, dirty_fields in self._dirty.iteritems():
+      values = self._values[key]
+      copies = self._copies.setdefault(key, {})
+      for fields in dirty_fields:
+        # Values, such as distributions, may be modified in place.
+        copies[fields] = copy.deepcopy(values[fields])
+    self._dirty.clear()
+    return [(key, copies.copy(), self._start_times[key])
+            for key, copies in self._copies.iteritems()]
+
+  def _snapshot_modified(self, modified_since):
+    snapshot = []
+    for key, modifications in self._modifications.iteritems():
+      values = self._values[key]
+      modified = {}
+      for fields in reversed(modifications):
+        if modifications[fields] <= modified_since:
+          break
+        modified[fields] = copy.deepcopy(values[fields])
+      if modified:
+        snapshot.append((key, modified, self._start_times[key]))
+    return snapshot
+
+  @staticmethod
+  def _target(target_fields, default_target):
+    if target_fields:
+      if inspect.isclass(target_fields[0]):
+        # It's a target type plus serialised values.
+        # Output the tuple as is.
+        return target_fields
+      target = copy.copy(default_target)
+      target.update({k: v for k, v in target_fields})
+      return target
+    return default_target
 
 
 class InProcessMetricStore(MetricStore):
-  """A thread-safe metric store that keeps values in memory."""
+  """A thread-safe metric store that keeps values in memory.
+
+  Each metric has its own lock, so threads modifying different metrics do not
+  contend.  get_all() copies again only the values modified since the previous
+  call, and get_all(modified_since) visits only the values modified after it.
+  """
 
   def __init__(self, state, time_fn=None):
     super(InProcessMetricStore, self).__init__(state, time_fn=time_fn)
 
     self._values = {}
+    # Guards creation of entries in self._values.
     self._thread_lock = threading.Lock()
+    # next() is atomic, so it is safe to call without holding a lock.
+    self._modification_counter = itertools.count(1)
 
   def _entry(self, name):
-    if name not in self._values:
-      self._reset(name)
-
-    return self._values[name]
+    entry = self._values.get(name)
+    if entry is None:
+      with self._thread_lock:
+        entry = self._values.get(name)
+        if entry is None:  # pragma: no branch
+          entry = self._reset(name)
+    return entry
 
   def get(self, name, fields, target_fields, default=None):
     return self._entry(name).get_value(fields, target_fields, default)
 
   def iter_field_values(self, name):
-    return itertools.chain.from_iterable(
-        x.iteritems() for _, x
-        in self._entry(name).iter_targets(self._state.target))
+    entry = self._entry(name)
+    with entry.lock:
+      targets = entry.iter_targets(self._state.target)
+    return itertools.chain.from_iterable(x.iteritems() for _, x in targets)
 
-  def get_all(self):
-    # Make a copy of the metric values in case another thread (or this
-    # generator's consumer) modifies them while we're iterating.
-    with self._thread_lock:
-      values = copy.deepcopy(self._values)
-    end_time = self._time_fn()
+  def modification_count(self):
+    return next(self._modification_counter)
 
-    for name, metric_values in values.iteritems():
+  def get_all(self, modified_since=None):
+    # Take a snapshot of the metric values in case another thread (or this
+    # generator's consumer) modifies them while we're iterating.
+    snapshots = []
+    for name, entry in self._values.items():
       if name not in self._state.metrics:
         continue
-      targets = metric_values.iter_targets_with_start_times(
-          self._state.target)
-      for target, fields_values, start_times in targets:
+      with entry.lock:
+        if (modified_since is not None and
+            entry.last_modification <= modified_since):
+          continue
+        snapshots.append((name, entry.snapshot(modified_since)))
+    end_time = self._time_fn()
+
+    for name, snapshot in snapshots:
+      for target_fields, fields_values, start_times in snapshot:
+        target = _TargetFieldsValues._target(target_fields, self._state.target)
         yield (target, self._state.metrics[name], start_times, end_time,
                fields_values)
 
-  def set(self, name, fields, target_fields, value, enforce_ge=False):
-    with self._thread_lock:
+  def set(self, name, fields, target_fields, value, enforce_ge=False,
+          start_time=None):
+    entry = self._entry(name)
+    with entry.lock:
       if enforce_ge:
-        old_value = self._entry(name).get_value(fields, target_fields, 0)
+        old_value = entry.get_value(fields, target_fields, 0)
         if value < old_value:
           raise errors.MonitoringDecreasingValueError(name, old_value, value)
 
-      self._entry(name).set_value(fields, target_fields, value, self._time_fn)
+      entry.set_value(fields, target_fields, value, self._time_fn,
+                      self.modification_count(), start_time)
 
   def incr(self, name, fields, target_fields, delta, modify_fn=None):
     if delta < 0:
@@ -241,16 +368,26 @@ class InProcessMetricStore(MetricStore):
     if modify_fn is None:
       modify_fn = default_modify_fn(name)
 
-    with self._thread_lock:
-      self._entry(name).set_value(fields, target_fields, modify_fn(
-          self.get(name, fields, target_fields, 0), delta), self._time_fn)
+    entry = self._entry(name)
+    with entry.lock:
+      entry.set_value(fields, target_fields, modify_fn(
+          entry.get_value(fields, target_fields, 0), delta), self._time_fn,
+          self.modification_count())
+
+  def take(self, name, target_fields):
+    entry = self._entry(name)
+    with entry.lock:
+      return entry.pop_values(target_fields, self.modification_count())
 
   def reset_for_unittest(self, name=None):
-    if name is not None:
-      self._reset(name)
-    else:
-      for name in self._values.keys():
+    with self._thread_lock:
+      if name is not None:
         self._reset(name)
+      else:
+        for name in self._values.keys():
+          self._reset(name)
 
   def _reset(self, name):
-    self._values[name] = _TargetFieldsValues()
+    entry = _TargetFieldsValues()
+    self._values[name] = entry
+    return entry
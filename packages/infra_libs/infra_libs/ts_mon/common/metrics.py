@@ -530,9 +530,7 @@ class _DistributionMetricBase(Metric):
 
     # Copy the distribution bucket values.  Include the overflow buckets on
     # either end.
-    pb.bucket_count.extend(
-        value.buckets.get(i, 0) for i in
-        xrange(0, value.bucketer.total_buckets))
+    pb.bucket_count.extend(value.bucket_counts)
 
     pb.count = value.count
     pb.mean = float(value.sum) / max(value.count, 1)
@@ -549,6 +547,23 @@ class _DistributionMetricBase(Metric):
 
     self._incr(fields, target_fields, value, modify_fn=modify_fn)
 
+  def add_many(self, values, fields=None, target_fields=None, weight=1):
+    """Adds all values from an iterable to the distribution at once.
+
+    Each value is added `weight` times, e.g. to scale sampled values.
+    """
+    values = list(values)
+    if not values:
+      return
+
+    def modify_fn(dist, _delta):
+      if dist == 0:
+        dist = distribution.Distribution(self.bucketer)
+      dist.add_many(values, weight=weight)
+      return dist
+
+    self._incr(fields, target_fields, 0, modify_fn=modify_fn)
+
   def set(self, value, fields=None, target_fields=None):
     """Replaces the distribution with the given fields with another one.
 
@@ -5,11 +5,13 @@
 """Classes representing the monitoring interface for tasks or devices."""
 
 
+import Queue
 import base64
 import httplib2
 import json
 import logging
 import socket
+import threading
 import traceback
 
 from googleapiclient import discovery
@@ -109,11 +111,15 @@ class Monitor(object):
   If asynchronous, send() should start the request and immediately return some
   object which is later passed to wait() once all requests have been started.
 
-  failed() will return a bool indicating whether the last send failed.
+  start_flush() is called before the first send() of a flush.  failed() will
+  return a bool indicating whether any send since then failed.
   """
 
   _SCOPES = []
 
+  def start_flush(self):
+    pass
+
   def send(self, metric_pb):
     raise NotImplementedError()
 
@@ -125,46 +131,129 @@ class Monitor(object):
 
 
 class HttpsMonitor(Monitor):
+  """Sends metrics to an HTTPS endpoint.
+
+  With parallelism > 1, send() is asynchronous: payloads are encoded and sent
+  by a pool of worker threads, each with its own keep-alive connection.  At
+  most `parallelism` payloads are queued, so generating more payloads blocks
+  until a worker is free.
+  """
 
   _SCOPES = ['https://www.googleapis.com/auth/prodxmon']
 
-  def __init__(self, endpoint, credential_factory, http=None, ca_certs=None):
+  ENCODING_JSON = 'json'
+  ENCODING_BINARY = 'binary'
+
+  def __init__(self, endpoint, credential_factory, http=None, ca_certs=None,
+               encoding=ENCODING_JSON, parallelism=1):
+    if encoding not in (self.ENCODING_JSON, self.ENCODING_BINARY):
+      raise ValueError('unknown encoding %r' % (encoding,))
+    if parallelism < 1:
+      raise ValueError('parallelism must be >= 1 (was %d)' % parallelism)
+    if http is not None and parallelism > 1:
+      raise ValueError('http cannot be shared by parallel senders')
+
     self._endpoint = endpoint
+    self._encoding = encoding
     self._failed = False
-    credentials = credential_factory.create(self._SCOPES)
-    if http is None:
-      http = httplib2_utils.RetriableHttp(
-          httplib2_utils.InstrumentedHttp('acq-mon-api', ca_certs=ca_certs),
-          max_tries=2)
-    self._http = credentials.authorize(http)
+    self._credentials = credential_factory.create(self._SCOPES)
+    self._ca_certs = ca_certs
+    self._http = self._credentials.authorize(http or self._create_http())
+
+    self._parallelism = parallelism
+    self._queue = Queue.Queue(maxsize=parallelism)
+    self._workers = []
+    self._workers_lock = threading.Lock()
+
+  def _create_http(self):
+    return httplib2_utils.RetriableHttp(
+        httplib2_utils.InstrumentedHttp('acq-mon-api', ca_certs=self._ca_certs),
+        max_tries=2)
 
   def encode_to_json(self, metric_pb):
     return json.dumps({'payload': pb_to_popo.convert(metric_pb)})
 
+  def encode(self, metric_pb):
+    """Returns a tuple (body, content_type) for a MetricsPayload."""
+    if self._encoding == self.ENCODING_BINARY:
+      return metric_pb.SerializeToString(), 'application/x-protobuf'
+    return self.encode_to_json(metric_pb), 'application/json'
+
+  def start_flush(self):
+    self._failed = False
+
   def send(self, metric_pb):
-    body = self.encode_to_json(metric_pb)
+    if self._parallelism == 1:
+      self._failed = self._send(self._http, metric_pb) or self._failed
+      return None
+
+    self._ensure_workers()
+    pending = _PendingSend()
+    self._queue.put((metric_pb, pending))
+    return pending
+
+  def wait(self, state):
+    state.done.wait()
+    # Payloads of one flush are sent in parallel, so remember any failure.
+    self._failed = state.failed or self._failed
+
+  def _send(self, http, metric_pb):
+    """Sends the payload synchronously.  Returns True if it failed."""
+    body, content_type = self.encode(metric_pb)
 
     try:
-      resp, content = self._http.request(self._endpoint,
+      resp, content = http.request(self._endpoint,
           method='POST',
           body=body,
-          headers={'Content-Type': 'application/json'})
+          headers={'Content-Type': content_type})
       if resp.status == 200:
-        self._failed = False
-      else:
-        logging.warning('HttpsMonitor.send received status %d: %s', resp.status,
-                        content)
-        self._failed = True
+        return False
+      logging.warning('HttpsMonitor.send received status %d: %s', resp.status,
+                      content)
+      return True
     except (ValueError, errors.Error,
             socket.timeout, socket.error, socket.herror, socket.gaierror,
             httplib2.HttpLib2Error):
       logging.exception('HttpsMonitor.send failed')
-      self._failed = True
+      return True
+
+  def _ensure_workers(self):
+    with self._workers_lock:
+      while len(self._workers) < self._parallelism:
+        # The first worker reuses the connection of the synchronous mode.
+        http = self._http
+        if self._workers:
+          http = self._credentials.authorize(self._create_http())
+        worker = threading.Thread(
+            target=self._worker, args=(http,),
+            name='ts_mon_send_%d' % len(self._workers))
+        worker.daemon = True
+        worker.start()
+        self._workers.append(worker)
+
+  def _worker(self, http):
+    while True:
+      metric_pb, pending = self._queue.get()
+      try:
+        pending.failed = self._send(http, metric_pb)
+      except Exception:  # pragma: no cover
+        logging.exception('HttpsMonitor.send failed')
+        pending.failed = True
+      finally:
+        pending.done.set()
 
   def failed(self):
     return self._failed
 
 
+class _PendingSend(object):
+  """State of a payload sent by an HttpsMonitor worker."""
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.failed = False
+
+
 class DebugMonitor(Monitor):
   """Class which writes metrics to logs or a local file for debugging."""
   def __init__(self, filepath=None):
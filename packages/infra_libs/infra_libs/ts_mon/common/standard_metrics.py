@@ -4,6 +4,7 @@
 
 """Metrics common to all tasks and devices."""
 
+from infra_libs.ts_mon.common import distribution
 from infra_libs.ts_mon.common import metrics
 
 
@@ -12,6 +13,23 @@ up = metrics.BooleanMetric(
     'Set to True when the program is running, missing otherwise.',
     None)
 
+flush_durations = metrics.CumulativeDistributionMetric(
+    'ts_mon/flush/durations',
+    'Time taken to generate and send all metrics in a flush, in milliseconds.',
+    [metrics.BooleanField('success')],
+    bucketer=distribution.GeometricBucketer(10**0.06),
+    units=metrics.MetricsDataUnits.MILLISECONDS)
+flush_payload_bytes = metrics.CumulativeDistributionMetric(
+    'ts_mon/flush/payload_bytes',
+    'Size of each serialized MetricsPayload sent by a flush.',
+    None,
+    bucketer=distribution.GeometricBucketer(10**0.1),
+    units=metrics.MetricsDataUnits.BYTES)
+flush_streams = metrics.GaugeMetric(
+    'ts_mon/flush/streams',
+    'Number of streams sent by the last flush.',
+    None)
+
 
 def init():
   # TODO(dsansome): Add more metrics for git revision, cipd package version,
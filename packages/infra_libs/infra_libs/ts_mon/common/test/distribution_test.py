@@ -195,3 +195,46 @@ class DistributionTest(unittest.TestCase):
     self.assertEqual(1000100, d.sum)
     self.assertEqual(2, d.count)
     self.assertEqual({11: 2}, d.buckets)
+
+  def test_bucket_counts(self):
+    d = distribution.Distribution(
+        distribution.FixedWidthBucketer(width=10, num_finite_buckets=3))
+    self.assertEqual([0, 0, 0, 0, 0], d.bucket_counts)
+
+    d.add(-1)
+    d.add(15)
+    d.add(15)
+    d.add(100)
+
+    self.assertEqual([1, 0, 2, 0, 1], d.bucket_counts)
+    self.assertEqual({0: 1, 2: 2, 4: 1}, d.buckets)
+
+  def test_add_many(self):
+    values = [-1, 0, 1, 10, 50, 100, 1e10, float('Inf')]
+    d = distribution.Distribution(distribution.GeometricBucketer())
+    for value in values:
+      d.add(value)
+
+    d2 = distribution.Distribution(distribution.GeometricBucketer())
+    d2.add(1)
+    d2.add_many(iter(values))
+    d2.bucket_counts[1] -= 1
+    d2.sum -= 1
+    d2.count -= 1
+
+    self.assertEqual(d.bucket_counts, d2.bucket_counts)
+    self.assertEqual(d.sum, d2.sum)
+    self.assertEqual(d.count, d2.count)
+
+  def test_add_many_weight(self):
+    d = distribution.Distribution(distribution.FixedWidthBucketer(10, 2))
+    d.add_many([1, 15], weight=3)
+    self.assertEqual({1: 3, 2: 3}, d.buckets)
+    self.assertEqual(48, d.sum)
+    self.assertEqual(6, d.count)
+
+  def test_add_many_empty(self):
+    d = distribution.Distribution(distribution.GeometricBucketer())
+    d.add_many([])
+    self.assertEqual(0, d.count)
+    self.assertEqual({}, d.buckets)
@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import logging
+import threading
+import time
 import unittest
 
 import mock
@@ -62,3 +65,105 @@ class TestHttpMetrics(unittest.TestCase):
     self.assertEqual(125.4, http_metrics.server_durations.get(fields).sum)
     self.assertIsNone(http_metrics.server_request_bytes.get(fields))
     self.assertIsNone(http_metrics.server_response_bytes.get(fields))
+
+  def test_update_http_server_metrics_robot(self):
+    http_metrics.update_http_server_metrics(
+        '/', 200, 125.4, user_agent='Mozilla GoogleBot')
+    fields = {'status': 200, 'name': '/', 'is_robot': True}
+    self.assertEqual(1, http_metrics.server_response_status.get(fields))
+
+  def test_update_http_server_metrics_weight(self):
+    http_metrics.update_http_server_metrics(
+        '/', 200, 125.4, request_size=100, response_size=200, weight=10)
+    http_metrics.update_http_server_metrics('/', 200, 10, weight=10)
+    fields = {'status': 200, 'name': '/', 'is_robot': False}
+    self.assertEqual(20, http_metrics.server_response_status.get(fields))
+    self.assertEqual(1354, http_metrics.server_durations.get(fields).sum)
+    self.assertEqual(20, http_metrics.server_durations.get(fields).count)
+    self.assertEqual(10, http_metrics.server_request_bytes.get(fields).count)
+    self.assertEqual(2000, http_metrics.server_response_bytes.get(fields).sum)
+
+
+class TestServerMetricsBatcher(unittest.TestCase):
+  def setUp(self):
+    super(TestServerMetricsBatcher, self).setUp()
+    target = targets.TaskTarget('test_service', 'test_job',
+                                'test_region', 'test_host')
+    self.mock_state = interface.State(target=target)
+    mock.patch('infra_libs.ts_mon.common.interface.state',
+               new=self.mock_state).start()
+    self.fields = {'status': 200, 'name': '/', 'is_robot': False}
+
+  def tearDown(self):
+    mock.patch.stopall()
+    super(TestServerMetricsBatcher, self).tearDown()
+
+  def test_merge(self):
+    batcher = http_metrics.ServerMetricsBatcher()
+    batcher.update('/', 200, 10, request_size=100, response_size=200,
+                   user_agent='Chrome')
+    batcher.update('/', 200, 20, weight=5)
+    batcher.update('/', 404, 30, user_agent='B3M/prober')
+    self.assertIsNone(http_metrics.server_response_status.get(self.fields))
+
+    batcher.merge()
+    self.assertEqual(6, http_metrics.server_response_status.get(self.fields))
+    self.assertEqual(110, http_metrics.server_durations.get(self.fields).sum)
+    self.assertEqual(6, http_metrics.server_durations.get(self.fields).count)
+    self.assertEqual(
+        1, http_metrics.server_request_bytes.get(self.fields).count)
+    self.assertEqual(
+        200, http_metrics.server_response_bytes.get(self.fields).sum)
+    robot_fields = {'status': 404, 'name': '/', 'is_robot': True}
+    self.assertEqual(
+        1, http_metrics.server_response_status.get(robot_fields))
+    self.assertIsNone(http_metrics.server_request_bytes.get(robot_fields))
+
+    batcher.merge()
+    self.assertEqual(6, http_metrics.server_response_status.get(self.fields))
+
+  def test_batch_size(self):
+    batcher = http_metrics.ServerMetricsBatcher(batch_size=3)
+    batcher.update('/', 200, 10)
+    batcher.update('/', 200, 10)
+    self.assertIsNone(http_metrics.server_response_status.get(self.fields))
+    batcher.update('/', 200, 10)
+    self.assertEqual(3, http_metrics.server_response_status.get(self.fields))
+
+  def test_threads(self):
+    batcher = http_metrics.ServerMetricsBatcher(batch_size=7)
+    def run():
+      for _ in xrange(100):
+        batcher.update('/', 200, 10)
+    threads = [threading.Thread(target=run) for _ in xrange(4)]
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    self.assertEqual(4, len(batcher._buffers))
+
+    batcher.merge()
+    self.assertEqual(
+        400, http_metrics.server_response_status.get(self.fields))
+    # Buffers of finished threads are dropped.
+    self.assertEqual(0, len(batcher._buffers))
+
+  def test_benchmark(self):
+    requests = 20000
+    batcher = http_metrics.ServerMetricsBatcher()
+    durations = {}
+    for name, update in (
+        ('direct', http_metrics.update_http_server_metrics),
+        ('batched', batcher.update)):
+      start = time.time()
+      for i in xrange(requests):
+        update('/', 200, i % 1000, request_size=100, response_size=i,
+               user_agent='Chrome')
+      batcher.merge()
+      durations[name] = time.time() - start
+    self.assertEqual(
+        2 * requests, http_metrics.server_response_status.get(self.fields))
+    logging.info(
+        'update_http_server_metrics: %.1fus per request, batched: %.1fus',
+        durations['direct'] * 1e6 / requests,
+        durations['batched'] * 1e6 / requests)
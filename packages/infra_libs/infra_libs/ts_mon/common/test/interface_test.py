@@ -15,6 +15,7 @@ from infra_libs.ts_mon.common import interface
 from infra_libs.ts_mon.common import metric_store
 from infra_libs.ts_mon.common import metrics
 from infra_libs.ts_mon.common import monitors
+from infra_libs.ts_mon.common import standard_metrics
 from infra_libs.ts_mon.common import targets
 from infra_libs.ts_mon.common.test import my_target_pb2
 from infra_libs.ts_mon.protos import metrics_pb2
@@ -261,6 +262,126 @@ class GlobalsTest(unittest.TestCase):
     self.assertEquals(2, interface.state.global_monitor.send.call_count)
     self.assertListEqual([500, 1], data_lengths)
 
+  def test_flush_records_metrics(self):
+    interface.state.global_monitor = mock.create_autospec(monitors.Monitor)
+    interface.state.global_monitor.send.return_value = None
+    interface.state.global_monitor.failed.return_value = False
+    interface.state.target = targets.TaskTarget('a', 'b', 'c', 'd', 1)
+
+    counter = metrics.CounterMetric('counter', 'desc',
+        [metrics.IntegerField('field')])
+    for i in xrange(interface.METRICS_DATA_LENGTH_LIMIT + 1):
+      counter.increment_by(i, {'field': i})
+
+    self.assertTrue(interface.flush())
+    self.assertEqual(
+        interface.METRICS_DATA_LENGTH_LIMIT + 1,
+        standard_metrics.flush_streams.get())
+    self.assertEqual(2, standard_metrics.flush_payload_bytes.get().count)
+    self.assertEqual(
+        1, standard_metrics.flush_durations.get({'success': True}).count)
+
+  def test_flush_async_monitor(self):
+    interface.state.global_monitor = mock.create_autospec(monitors.Monitor)
+    interface.state.global_monitor.send.side_effect = lambda proto: proto
+    interface.state.global_monitor.failed.return_value = True
+    interface.state.target = targets.TaskTarget('a', 'b', 'c', 'd', 1)
+
+    metrics.GaugeMetric('m', 'desc', None).set(1)
+
+    self.assertFalse(interface.flush())
+    self.assertEqual(1, interface.state.global_monitor.wait.call_count)
+    self.assertEqual(
+        1, standard_metrics.flush_durations.get({'success': False}).count)
+
+  def test_flush_delta(self):
+    interface.state.global_monitor = mock.create_autospec(monitors.Monitor)
+    interface.state.global_monitor.send.return_value = None
+    interface.state.global_monitor.failed.return_value = False
+    interface.state.target = targets.TaskTarget('a', 'b', 'c', 'd', 1)
+    interface.state.delta_flush_full_interval_secs = 300
+
+    def sent_values():
+      ret = {}
+      for call in interface.state.global_monitor.send.call_args_list:
+        for coll in call[0][0].metrics_collection:
+          for data_set in coll.metrics_data_set:
+            for data in data_set.data:
+              key = data.field[0].int64_value if data.field else 0
+              ret[key] = data.int64_value
+      interface.state.global_monitor.send.reset_mock()
+      return ret
+
+    counter = metrics.CounterMetric('counter', 'desc',
+        [metrics.IntegerField('field')])
+    gauge = metrics.GaugeMetric('gauge', 'desc', None)
+    counter.increment({'field': 1})
+    counter.increment({'field': 2})
+    gauge.set(5)
+
+    with mock.patch('time.time', return_value=1000):
+      self.assertTrue(interface.flush())
+    self.assertEqual({1: 1, 2: 1, 0: 5}, sent_values())
+
+    # Only the modified stream is sent.
+    counter.increment({'field': 2})
+    with mock.patch('time.time', return_value=1060):
+      self.assertTrue(interface.flush())
+    self.assertEqual({2: 2}, sent_values())
+
+    # A failed flush does not advance the last flushed modification.
+    counter.increment({'field': 1})
+    interface.state.global_monitor.failed.return_value = True
+    with mock.patch('time.time', return_value=1120):
+      self.assertFalse(interface.flush())
+    self.assertEqual({1: 2}, sent_values())
+    interface.state.global_monitor.failed.return_value = False
+    with mock.patch('time.time', return_value=1180):
+      self.assertTrue(interface.flush())
+    self.assertEqual({1: 2}, sent_values())
+
+    # Nothing changed.
+    with mock.patch('time.time', return_value=1240):
+      self.assertTrue(interface.flush())
+    self.assertEqual({}, sent_values())
+
+    # Everything is sent again after the full flush interval.
+    with mock.patch('time.time', return_value=1300):
+      self.assertTrue(interface.flush())
+    self.assertEqual({1: 2, 2: 2, 0: 5}, sent_values())
+
+  def test_flush_delta_one_chunk_failed(self):
+    interface.state.global_monitor = mock.create_autospec(monitors.Monitor)
+    interface.state.global_monitor.send.return_value = None
+    interface.state.global_monitor.failed.return_value = False
+    interface.state.target = targets.TaskTarget('a', 'b', 'c', 'd', 1)
+    interface.state.delta_flush_full_interval_secs = 300
+
+    counter = metrics.CounterMetric('counter', 'desc',
+        [metrics.IntegerField('field')])
+    for i in xrange(501):
+      counter.increment({'field': i})
+    with mock.patch('time.time', return_value=1000):
+      self.assertTrue(interface.flush())
+    self.assertEqual(2, interface.state.global_monitor.send.call_count)
+
+    # The first of two chunks is sent, the second one fails.
+    for i in xrange(501):
+      counter.increment({'field': i})
+    interface.state.global_monitor.send.reset_mock()
+    interface.state.global_monitor.failed.side_effect = [False, True]
+    with mock.patch('time.time', return_value=1060):
+      self.assertFalse(interface.flush())
+    self.assertEqual(2, interface.state.global_monitor.send.call_count)
+
+    # The last flushed modification was not advanced, so both chunks are sent
+    # again.
+    interface.state.global_monitor.send.reset_mock()
+    interface.state.global_monitor.failed.side_effect = None
+    with mock.patch('time.time', return_value=1120):
+      self.assertTrue(interface.flush())
+    self.assertEqual(2, interface.state.global_monitor.send.call_count)
+
   def test_flush_different_target_fields(self):
     interface.state.global_monitor = mock.create_autospec(monitors.Monitor)
     interface.state.target = targets.TaskTarget('s', 'j', 'r', 'h')
@@ -630,6 +751,20 @@ class GenerateNewProtoTest(unittest.TestCase):
     self.assertEqual('s', root_labels[2].key)
     self.assertEqual('x', root_labels[2].string_value)
 
+  def test_generate_proto_skips_aggregated_default_target(self):
+    counter = metrics.CounterMetric('counter', 'desc', None)
+    interface.register(counter)
+    interface.register_aggregated_metrics([counter])
+    counter.increment()
+    self.assertEqual([], list(interface._generate_proto()))
+
+    counter.increment_by(5, target_fields={'task_num': 0})
+    proto = next(interface._generate_proto())
+    self.assertEqual(1, len(proto.metrics_collection))
+    data = proto.metrics_collection[0].metrics_data_set[0].data
+    self.assertEqual(1, len(data))
+    self.assertEqual(5, data[0].int64_value)
+
   def test_generate_proto_with_dangerously_set_start_time(self):
     counter0 = metrics.CounterMetric('counter0', 'desc0',
         [metrics.IntegerField('test')])
@@ -665,6 +800,19 @@ class GlobalCallbacksTest(unittest.TestCase):
     interface.register_global_metrics([])
     self.assertEqual(['test'], list(interface.state.global_metrics))
 
+  def test_register_aggregated_metrics(self):
+    counter = metrics.CounterMetric('counter', 'foo', None)
+    dist = metrics.CumulativeDistributionMetric('dist', 'foo', None)
+    interface.register_aggregated_metrics([counter, dist])
+    self.assertEqual(
+        ['counter', 'dist'], sorted(interface.state.aggregated_metrics))
+
+  def test_register_aggregated_metrics_gauge(self):
+    gauge = metrics.GaugeMetric('gauge', 'foo', None)
+    with self.assertRaises(TypeError):
+      interface.register_aggregated_metrics([gauge])
+    self.assertEqual({}, interface.state.aggregated_metrics)
+
   def test_register_global_metrics_callback(self):
     interface.register_global_metrics_callback('test', 'callback')
     self.assertEqual(['test'], list(interface.state.global_metrics_callbacks))
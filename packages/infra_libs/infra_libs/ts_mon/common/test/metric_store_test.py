@@ -2,7 +2,10 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import collections
+import copy
 import functools
+import logging
 import operator
 import random
 import threading
@@ -193,6 +196,43 @@ class MetricStoreTestBase(object):
         },
     }, {t[0]: t[4] for t in self.store.get_all()})
 
+  def test_set_start_time(self):
+    self.store.set('foo', ('a',), None, 1, start_time=100)
+    self.store.set('foo', ('b',), None, 2)
+    all_metrics = list(self.store.get_all())
+    start_times = all_metrics[0][2]
+    self.assertEqual(100, start_times[('a',)])
+    self.assertEqual(1234, start_times[('b',)])
+
+    self.store.set('foo', ('a',), None, 3, start_time=200)
+    self.assertEqual(200, list(self.store.get_all())[0][2][('a',)])
+    # The previous snapshot is not modified.
+    self.assertEqual(100, start_times[('a',)])
+
+  def test_get_all_modified_since(self):
+    typ = my_target_pb2.MyTarget
+    metrics.Metric('bar', 'desc', None)
+    self.store.set('foo', ('a',), None, 1)
+    self.store.set('foo', ('b',), typ(s='x'), 2)
+    self.store.set('bar', ('c',), None, 3)
+    marker = self.store.modification_count()
+    self.assertEqual([], list(self.store.get_all(modified_since=marker)))
+
+    self.mock_time.return_value = 5678
+    self.store.incr('foo', ('a',), None, 1)
+    all_metrics = list(self.store.get_all(modified_since=marker))
+    self.assertEqual(1, len(all_metrics))
+    target, metric, start_times, _, fields_values = all_metrics[0]
+    self.assertEqual(self.state.target, target)
+    self.assertEqual('foo', metric.name)
+    self.assertEqual({('a',): 2}, fields_values)
+    # The start time is not affected by filtering.
+    self.assertEqual(1234, start_times[('a',)])
+
+    self.assertEqual(
+        2, len(list(self.store.get_all(modified_since=marker - 2))))
+    self.assertEqual(3, len(list(self.store.get_all())))
+
   def test_set(self):
     typ = my_target_pb2.MyTarget
     self.store.set('foo', ('value',), None, 12)
@@ -230,6 +270,28 @@ class MetricStoreTestBase(object):
     self.assertEquals(7, self.store.get('foo', ('value',), None))
     modify_fn.assert_called_once_with(42, 3)
 
+  def test_take(self):
+    typ = my_target_pb2.MyTarget
+    self.store.set('foo', ('a',), None, 1)
+    self.store.set('foo', ('b',), None, 2)
+    self.store.set('foo', ('a',), typ(s='x'), 3)
+    list(self.store.get_all())
+
+    self.assertEqual({('a',): 1, ('b',): 2}, self.store.take('foo', None))
+    self.assertEqual({}, self.store.take('foo', None))
+    self.assertIsNone(self.store.get('foo', ('a',), None))
+    self.assertEqual(3, self.store.get('foo', ('a',), typ(s='x')))
+    all_metrics = list(self.store.get_all())
+    self.assertEqual(1, len(all_metrics))
+    self.assertEqual({('a',): 3}, all_metrics[0][4])
+
+    self.mock_time.return_value = 5678
+    self.store.incr('foo', ('a',), None, 4)
+    all_metrics = [m for m in self.store.get_all() if m[0] == self.state.target]
+    self.assertEqual({('a',): 4}, all_metrics[0][4])
+    # The start time is reset.
+    self.assertEqual(5678, all_metrics[0][2][('a',)])
+
   def test_reset_for_unittest(self):
     self.store.set('foo', ('value',), None, 42)
     self.store.reset_for_unittest()
@@ -316,3 +378,98 @@ class MetricStoreTestBase(object):
 
 class InProcessMetricStoreTest(MetricStoreTestBase, unittest.TestCase):
   METRIC_STORE_CLASS = metric_store.InProcessMetricStore
+
+  def test_get_all_copies_only_changed_cells(self):
+    for i in xrange(100):
+      self.store.set('foo', (('field', i),), None, i)
+    first = {t[0]: t[4] for t in self.store.get_all()}[self.state.target]
+
+    with mock.patch('copy.deepcopy', side_effect=copy.deepcopy) as deepcopy:
+      self.store.set('foo', (('field', 3),), None, 42)
+      second = {t[0]: t[4] for t in self.store.get_all()}[self.state.target]
+      self.assertEqual(1, deepcopy.call_count)
+
+      # Nothing changed since the last snapshot.
+      list(self.store.get_all())
+      self.assertEqual(1, deepcopy.call_count)
+
+    # The first snapshot is not modified.
+    self.assertEqual(3, first[(('field', 3),)])
+    self.assertEqual(42, second[(('field', 3),)])
+    self.assertEqual(100, len(second))
+
+  def test_get_all_modified_since_copies_only_modified_cells(self):
+    for i in xrange(100):
+      self.store.set('foo', (('field', i),), None, i)
+    modification = self.store.modification_count()
+
+    with mock.patch('copy.deepcopy', side_effect=copy.deepcopy) as deepcopy:
+      self.store.set('foo', (('field', 3),), None, 42)
+      self.store.set('foo', (('field', 5),), None, 43)
+      fields_values = {
+          t[0]: t[4] for t in self.store.get_all(modified_since=modification)
+      }[self.state.target]
+      self.assertEqual(2, deepcopy.call_count)
+
+    self.assertEqual({(('field', 3),): 42, (('field', 5),): 43}, fields_values)
+
+  def test_iter_field_values_is_a_copy(self):
+    self.store.set('foo', ('value',), None, 42)
+    field_values = self.store.iter_field_values('foo')
+    self.store.set('foo', ('value2',), None, 43)
+    self.assertEqual([(('value',), 42)], list(field_values))
+
+  def test_benchmark(self):
+    for i in xrange(10000):
+      self.store.set('foo', (('field', i),), None, i)
+    list(self.store.get_all())
+    modification = self.store.modification_count()
+    self.store.set('foo', (('field', 3),), None, 42)
+
+    start = time.time()
+    list(self.store.get_all())
+    full = time.time() - start
+
+    start = time.time()
+    list(self.store.get_all(modified_since=modification))
+    delta = time.time() - start
+
+    logging.info('get_all of 10000 cells, 1 modified: full %.6fs, delta %.6fs',
+                 full, delta)
+
+  def test_contention(self):
+    """Increments many metrics from many threads while flushing."""
+    names = ['m%d' % i for i in xrange(10)]
+    for name in names:
+      metrics.Metric(name, 'desc', None)
+
+    increments = 1000
+    start = threading.Event()
+    done = threading.Event()
+
+    def incr_worker(name):
+      start.wait()
+      for i in xrange(increments):
+        self.store.incr(name, (('field', i % 10),), None, 1)
+
+    def get_all_worker():
+      start.wait()
+      while not done.is_set():
+        list(self.store.get_all())
+
+    incr_threads = [
+        threading.Thread(target=incr_worker, args=(name,))
+        for name in names * 2]
+    flush_thread = threading.Thread(target=get_all_worker)
+    for thread in incr_threads + [flush_thread]:
+      thread.start()
+    start.set()
+    for thread in incr_threads:
+      thread.join()
+    done.set()
+    flush_thread.join()
+
+    totals = collections.defaultdict(int)
+    for _, metric, _, _, fields_values in self.store.get_all():
+      totals[metric.name] += sum(fields_values.itervalues())
+    self.assertEqual({name: 2 * increments for name in names}, totals)
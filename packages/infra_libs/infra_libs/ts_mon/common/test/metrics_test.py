@@ -572,6 +572,19 @@ class DistributionMetricTest(TestBase):
     self.assertEqual(111, m.get().sum)
     self.assertEqual(3, m.get().count)
 
+  def test_add_many(self):
+    m = metrics.CumulativeDistributionMetric('test', 'test', None)
+    m.add_many([])
+    self.assertIsNone(m.get())
+    m.add_many(iter([1, 10]))
+    m.add_many([100])
+    self.assertEqual({1: 1, 5: 1, 10: 1}, m.get().buckets)
+    self.assertEqual(111, m.get().sum)
+    self.assertEqual(3, m.get().count)
+    m.add_many([100], weight=2)
+    self.assertEqual({1: 1, 5: 1, 10: 3}, m.get().buckets)
+    self.assertEqual(311, m.get().sum)
+
   def test_add_custom_bucketer(self):
     m = metrics.CumulativeDistributionMetric('test', 'test', None,
         bucketer=distribution.FixedWidthBucketer(10))
@@ -7,6 +7,7 @@ import httplib2
 import json
 import os
 import tempfile
+import threading
 import unittest
 
 from googleapiclient import errors
@@ -103,6 +104,108 @@ class HttpsMonitorTest(unittest.TestCase):
     self.assertTrue(mon.failed())
 
 
+  @mock.patch('infra_libs.ts_mon.common.monitors.CredentialFactory.'
+              'from_string')
+  def test_send_binary(self, _load_creds):
+    mon = monitors.HttpsMonitor('endpoint',
+        monitors.CredentialFactory.from_string('/path/to/creds.p8.json'),
+        encoding=monitors.HttpsMonitor.ENCODING_BINARY)
+    resp = mock.MagicMock(spec=httplib2.Response, status=200)
+    mon._http.request = mock.MagicMock(return_value=[resp, ""])
+
+    metric1 = metrics_pb2.MetricsPayload()
+    metric1.metrics_collection.add().metrics_data_set.add().metric_name = 'a'
+    mon.send(metric1)
+
+    mon._http.request.assert_called_once_with(
+        'endpoint',
+        method='POST',
+        body=metric1.SerializeToString(),
+        headers={'Content-Type': 'application/x-protobuf'})
+    self.assertFalse(mon.failed())
+
+  def test_invalid_args(self):
+    creds = monitors.CredentialFactory.from_string(':gce')
+    with self.assertRaises(ValueError):
+      monitors.HttpsMonitor('endpoint', creds, encoding='xml')
+    with self.assertRaises(ValueError):
+      monitors.HttpsMonitor('endpoint', creds, parallelism=0)
+    with self.assertRaises(ValueError):
+      monitors.HttpsMonitor(
+          'endpoint', creds, http=httplib2.Http(), parallelism=2)
+
+  @mock.patch('infra_libs.ts_mon.common.monitors.CredentialFactory.'
+              'from_string')
+  def test_send_parallel(self, _load_creds):
+    mon = monitors.HttpsMonitor('endpoint',
+        monitors.CredentialFactory.from_string('/path/to/creds.p8.json'),
+        parallelism=3)
+
+    lock = threading.Lock()
+    bodies = []
+    def request(_endpoint, method, body, headers):
+      self.assertEqual('POST', method)
+      self.assertEqual({'Content-Type': 'application/json'}, headers)
+      with lock:
+        bodies.append(body)
+      status = 500 if 'fail' in body else 200
+      return mock.MagicMock(spec=httplib2.Response, status=status), ''
+    mon._create_http = mock.Mock(
+        side_effect=lambda: mock.Mock(request=request))
+    mon._credentials.authorize.side_effect = lambda http: http
+    mon._http = mock.Mock(request=request)
+
+    payloads = []
+    for name in ('a', 'b', 'c', 'd', 'fail'):
+      payload = metrics_pb2.MetricsPayload()
+      payload.metrics_collection.add().metrics_data_set.add().metric_name = (
+          name)
+      payloads.append(payload)
+
+    rpcs = [mon.send(p) for p in payloads[:4]]
+    for rpc in rpcs:
+      mon.wait(rpc)
+    self.assertFalse(mon.failed())
+    self.assertEqual(
+        sorted(self.message(p) for p in payloads[:4]), sorted(bodies))
+    # One connection per worker.
+    self.assertEqual(2, mon._create_http.call_count)
+
+    mon.wait(mon.send(payloads[4]))
+    self.assertTrue(mon.failed())
+
+    # A failure is remembered until the next flush, even if other payloads of
+    # the flush are sent after it.
+    rpcs = [mon.send(p) for p in payloads[3:]]
+    mon.wait(rpcs[1])
+    mon.wait(rpcs[0])
+    self.assertTrue(mon.failed())
+
+    mon.start_flush()
+    self.assertFalse(mon.failed())
+
+  @mock.patch('infra_libs.ts_mon.common.monitors.CredentialFactory.'
+              'from_string')
+  def test_send_failure_remembered_until_next_flush(self, _load_creds):
+    mon = monitors.HttpsMonitor('endpoint',
+        monitors.CredentialFactory.from_string('/path/to/creds.p8.json'))
+    ok = mock.MagicMock(spec=httplib2.Response, status=200)
+    failure = mock.MagicMock(spec=httplib2.Response, status=500)
+    mon._http.request = mock.MagicMock(
+        side_effect=[[failure, ''], [ok, ''], [ok, '']])
+
+    payload = metrics_pb2.MetricsPayload()
+    payload.metrics_collection.add().metrics_data_set.add().metric_name = 'a'
+    mon.start_flush()
+    mon.send(payload)
+    mon.send(payload)
+    self.assertTrue(mon.failed())
+
+    mon.start_flush()
+    mon.send(payload)
+    self.assertFalse(mon.failed())
+
+
 class DebugMonitorTest(unittest.TestCase):
 
   def test_send_file(self):
@@ -106,6 +106,25 @@ def add_argparse_options(parser):
       default=60,
       help=('automatically push metrics on this interval if '
             '--ts-mon-flush=auto.'))
+  parser.add_argument(
+      '--ts-mon-delta-flush-full-interval-secs',
+      type=int,
+      default=None,
+      help=('if set, each flush sends only the values modified since the last '
+            'successful flush, and all values are sent again at least this '
+            'often. (default: send all values on every flush)'))
+  parser.add_argument(
+      '--ts-mon-flush-parallelism',
+      type=int,
+      default=1,
+      help=('number of payloads to send concurrently when flushing to an '
+            'https:// endpoint. (default: %(default)s)'))
+  parser.add_argument(
+      '--ts-mon-encoding',
+      choices=('json', 'binary'), default='json',
+      help=('how to encode payloads sent to an https:// endpoint. Use binary '
+            'only if the endpoint accepts application/x-protobuf. '
+            '(default: %(default)s)'))
   parser.add_argument(
       '--ts-mon-autogen-hostname',
       action="store_true",
@@ -236,7 +255,9 @@ def process_argparse_options(args):
   elif endpoint.startswith('https://'):
     interface.state.global_monitor = monitors.HttpsMonitor(
         endpoint, monitors.CredentialFactory.from_string(credentials),
-        ca_certs=args.ts_mon_ca_certs)
+        ca_certs=args.ts_mon_ca_certs,
+        encoding=args.ts_mon_encoding,
+        parallelism=args.ts_mon_flush_parallelism)
   elif endpoint.lower() == 'none':
     logging.info('ts_mon monitoring has been explicitly disabled')
   else:
@@ -244,6 +265,8 @@ def process_argparse_options(args):
                   ' is invalid or not supported: %s', endpoint)
 
   interface.state.flush_mode = args.ts_mon_flush
+  interface.state.delta_flush_full_interval_secs = (
+      args.ts_mon_delta_flush_full_interval_secs)
 
   if args.ts_mon_flush == 'auto':
     interface.state.flush_thread = interface._FlushThread(